@@ -17,6 +17,10 @@ REQUIREMENTS_TEST_PATH = ROOT_PATH / 'requirement' / 'test.txt'
 
 REQUIREMENTS_RQ_PATH = ROOT_PATH / 'requirement' / 'extras-rq.txt'
 
+REQUIREMENTS_DUCKDB_PATH = ROOT_PATH / 'requirement' / 'extras-duckdb.txt'
+
+REQUIREMENTS_ARROW_PATH = ROOT_PATH / 'requirement' / 'extras-arrow.txt'
+
 
 def stream_requirements(fd):
     """For a given requirements file descriptor, generate lines of
@@ -41,6 +45,12 @@ with REQUIREMENTS_TEST_PATH.open() as test_requirements_file:
 with REQUIREMENTS_RQ_PATH.open() as rq_requirements_file:
     RQ_REQUIREMENTS = list(stream_requirements(rq_requirements_file))
 
+with REQUIREMENTS_DUCKDB_PATH.open() as duckdb_requirements_file:
+    DUCKDB_REQUIREMENTS = list(stream_requirements(duckdb_requirements_file))
+
+with REQUIREMENTS_ARROW_PATH.open() as arrow_requirements_file:
+    ARROW_REQUIREMENTS = list(stream_requirements(arrow_requirements_file))
+
 
 setup(
     name='triage',
@@ -57,7 +67,11 @@ setup(
     entry_points={
         'console_scripts': ['triage = triage.cli:execute'],
     },
-    extras_require={'rq': RQ_REQUIREMENTS},
+    extras_require={
+        'rq': RQ_REQUIREMENTS,
+        'duckdb': DUCKDB_REQUIREMENTS,
+        'arrow': ARROW_REQUIREMENTS,
+    },
     license=LICENSE_PATH.read_text(),
     zip_safe=False,
     keywords='triage',
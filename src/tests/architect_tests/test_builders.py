@@ -1,9 +1,11 @@
 import datetime
+import os
 from unittest import TestCase
 
+import numpy
 import pandas as pd
 import testing.postgresql
-from mock import Mock
+from mock import Mock, patch
 from sqlalchemy import create_engine
 from contextlib import contextmanager
 
@@ -477,6 +479,46 @@ def test_load_features_data():
                 test = result == df
                 assert test.all().all()
 
+            # the tables extracted concurrently are the same, in the same order
+            builder.extraction_connections = 2
+            concurrent_features_dfs = builder.load_features_data(
+                as_of_times=dates,
+                feature_dictionary=feature_dictionary,
+                entity_date_table_name=entity_date_table_name,
+                matrix_uuid="my_uuid",
+            )
+            for result, df in zip(concurrent_features_dfs, features_dfs):
+                assert (result == df).all().all()
+
+            # joined as they arrive, the features keep the dictionary's order
+            joined_features_df = builder.join_features_data(
+                as_of_times=dates,
+                feature_dictionary=feature_dictionary,
+                entity_date_table_name=entity_date_table_name,
+                matrix_uuid="my_uuid",
+            )
+            assert list(joined_features_df.columns) == ["f1", "f2", "f3", "f4"]
+            assert (
+                (joined_features_df == features_dfs[0].join(features_dfs[1]))
+                .all()
+                .all()
+            )
+
+
+def test_extraction_workers_capped_at_pool_size():
+    with get_matrix_storage_engine() as matrix_storage_engine:
+        builder = MatrixBuilder(
+            db_config=db_config,
+            matrix_storage_engine=matrix_storage_engine,
+            experiment_hash=experiment_hash,
+            engine=create_engine(
+                "postgresql://localhost/triage", pool_size=2, max_overflow=1
+            ),
+            extraction_connections=8,
+        )
+        assert builder._extraction_workers(10) == 3
+        assert builder._extraction_workers(2) == 2
+
 
 def test_load_labels_data():
     """ Test the load_labels_data function by checking whether the query
@@ -779,6 +821,197 @@ class TestBuildMatrix(TestCase):
 
                 assert len(matrix_storage_engine.get_store(uuid).matrix) == 5
 
+    def test_wide_extraction(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            ensure_db(engine)
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states,
+            )
+
+            with get_matrix_storage_engine() as matrix_storage_engine:
+                outputs = []
+                for extraction in ("tables", "wide"):
+                    builder = MatrixBuilder(
+                        db_config=db_config,
+                        matrix_storage_engine=matrix_storage_engine,
+                        experiment_hash=experiment_hash,
+                        engine=engine,
+                        extraction=extraction,
+                        # an entity's rows at a time
+                        wide_chunk_values=1,
+                    )
+                    outputs.append(
+                        builder.matrix_data(
+                            self.good_dates,
+                            "booking",
+                            "binary",
+                            self.good_feature_dictionary,
+                            self.good_metadata,
+                            metta.generate_uuid(self.good_metadata),
+                            "test",
+                        )
+                    )
+
+            tables, wide = outputs
+            assert (wide.dtypes == numpy.float32).all()
+            pd.testing.assert_frame_equal(wide, tables.astype(numpy.float32))
+
+    def test_wide_extraction_column_batches(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            ensure_db(engine)
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states,
+            )
+
+            with get_matrix_storage_engine() as matrix_storage_engine:
+                outputs = []
+                # a query for each column, as for a matrix wider than Postgres
+                # can return from one query
+                for max_columns in (1600, 1):
+                    builder = MatrixBuilder(
+                        db_config=db_config,
+                        matrix_storage_engine=matrix_storage_engine,
+                        experiment_hash=experiment_hash,
+                        engine=engine,
+                        extraction="wide",
+                    )
+                    with patch(
+                        "triage.component.architect.builders."
+                        "WIDE_EXTRACTION_MAX_COLUMNS",
+                        max_columns,
+                    ):
+                        outputs.append(
+                            builder.matrix_data(
+                                self.good_dates,
+                                "booking",
+                                "binary",
+                                self.good_feature_dictionary,
+                                self.good_metadata,
+                                metta.generate_uuid(self.good_metadata),
+                                "test",
+                            )
+                        )
+
+            single, batched = outputs
+            pd.testing.assert_frame_equal(batched, single)
+
+    def test_wide_extraction_streamed(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            ensure_db(engine)
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states,
+            )
+
+            with get_matrix_storage_engine() as matrix_storage_engine:
+                builder = MatrixBuilder(
+                    db_config=db_config,
+                    matrix_storage_engine=matrix_storage_engine,
+                    experiment_hash=experiment_hash,
+                    engine=engine,
+                    extraction="wide",
+                    wide_chunk_values=1,
+                )
+                uuid = metta.generate_uuid(self.good_metadata)
+                args = (
+                    self.good_dates,
+                    "booking",
+                    "binary",
+                    self.good_feature_dictionary,
+                    self.good_metadata,
+                    uuid,
+                    "test",
+                )
+                expected = builder.matrix_data(*args)
+                builder.build_matrix(*args)
+
+                matrix_store = matrix_storage_engine.get_store(uuid)
+                assert matrix_store.exists
+                pd.testing.assert_frame_equal(
+                    matrix_store.matrix.astype(numpy.float32), expected
+                )
+                assert (
+                    engine.execute(
+                        "select num_observations from model_metadata.matrices"
+                    ).scalar()
+                    == len(expected)
+                )
+
+    def test_block_extraction(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            ensure_db(engine)
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states,
+            )
+
+            with get_matrix_storage_engine() as matrix_storage_engine:
+
+                def extract(extraction):
+                    builder = MatrixBuilder(
+                        db_config=db_config,
+                        matrix_storage_engine=matrix_storage_engine,
+                        experiment_hash=experiment_hash,
+                        engine=engine,
+                        extraction=extraction,
+                    )
+                    return builder.matrix_data(
+                        self.good_dates,
+                        "booking",
+                        "binary",
+                        self.good_feature_dictionary,
+                        self.good_metadata,
+                        metta.generate_uuid(self.good_metadata),
+                        "test",
+                    )
+
+                def cached_blocks():
+                    return sum(
+                        len(filenames)
+                        for _, _, filenames in os.walk(
+                            os.path.join(
+                                matrix_storage_engine.project_storage.project_path,
+                                "feature_blocks",
+                            )
+                        )
+                    )
+
+                blocks = extract("blocks")
+                assert (blocks.dtypes == numpy.float32).all()
+                pd.testing.assert_frame_equal(
+                    blocks, extract("tables").astype(numpy.float32)
+                )
+                n_blocks = cached_blocks()
+                assert n_blocks > 0
+
+                # another matrix reuses the cached blocks
+                pd.testing.assert_frame_equal(extract("blocks"), blocks)
+                assert cached_blocks() == n_blocks
+
+                # a block is extracted again once its rows change
+                engine.execute(
+                    "update features.features0 set f1 = f1 + 1 "
+                    "where as_of_date = '2016-02-01'"
+                )
+                pd.testing.assert_frame_equal(
+                    extract("blocks"), extract("tables").astype(numpy.float32)
+                )
+                assert cached_blocks() == n_blocks + 1
+
     def test_nullcheck(self):
         f0_dict = {(r[0], r[1]): r for r in features0_pre}
         f1_dict = {(r[0], r[1]): r for r in features1_pre}
@@ -0,0 +1,75 @@
+import testing.postgresql
+from sqlalchemy import create_engine
+
+from triage.component.architect.choice_cache import ChoiceCache
+from triage.component.results_schema import Base
+
+from .utils import settle_table_statistics
+
+
+def setup_db(engine):
+    Base.metadata.create_all(engine)
+    engine.execute("create table data (entity_id int, cat_one varchar)")
+    engine.execute("insert into data values (1, 'good'), (2, 'bad'), (3, null)")
+
+
+def test_choice_cache_shared():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        setup_db(engine)
+        settle_table_statistics(engine)
+        choice_query = "select distinct cat_one from data order by cat_one"
+
+        cache = ChoiceCache(engine)
+        assert cache.choices(choice_query) == ["bad", "good", None]
+        assert (cache.hits, cache.misses) == (0, 1)
+
+        # a new cache, as in another process or experiment, reuses the result
+        other_cache = ChoiceCache(engine)
+        assert other_cache.choices(choice_query) == ["bad", "good", None]
+        assert (other_cache.hits, other_cache.misses) == (1, 0)
+
+
+def test_choice_cache_invalidated():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        setup_db(engine)
+        choice_query = "select distinct cat_one from data order by cat_one"
+
+        cache = ChoiceCache(engine)
+        cache.choices(choice_query)
+        engine.execute("truncate data")
+        engine.execute("insert into data values (1, 'inbetween')")
+
+        assert cache.choices(choice_query) == ["inbetween"]
+        assert (cache.hits, cache.misses) == (0, 2)
+        # stale results are removed
+        assert [
+            row[0]
+            for row in engine.execute(
+                "select choices from model_metadata.categorical_choices"
+            )
+        ] == [["inbetween"]]
+
+
+def test_choice_cache_untracked_sources():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        setup_db(engine)
+        choice_query = "select * from unnest(array['good', 'bad'])"
+
+        cache = ChoiceCache(engine)
+        assert cache.choices(choice_query) == ["good", "bad"]
+        assert cache.choices(choice_query) == ["good", "bad"]
+        assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_choice_cache_without_results_schema():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        engine.execute("create table data (entity_id int, cat_one varchar)")
+        engine.execute("insert into data values (1, 'good')")
+
+        cache = ChoiceCache(engine)
+        assert cache.choices("select distinct cat_one from data") == ["good"]
+        assert not cache.enabled
@@ -0,0 +1,86 @@
+import pytest
+import testing.postgresql
+from sqlalchemy import create_engine
+
+from triage.component.architect.entity_shards import EntityShards
+from triage.component.collate import Aggregate, Aggregation
+
+
+@pytest.fixture
+def shard_engines():
+    with testing.postgresql.Postgresql() as first:
+        with testing.postgresql.Postgresql() as second:
+            yield [create_engine(first.url()), create_engine(second.url())]
+
+
+def test_shards_partition_entities(shard_engines):
+    shards = EntityShards(shard_engines)
+    for db_engine in shard_engines:
+        db_engine.execute("create table cohort (entity_id int, as_of_date date)")
+        db_engine.execute(
+            "insert into cohort select entity_id, '2016-01-01' "
+            "from generate_series(1, 100) entity_id"
+        )
+
+    entity_ids = [
+        set(
+            row[0]
+            for row in db_engine.execute(
+                "select entity_id from cohort where {}".format(shards.predicate(shard))
+            )
+        )
+        for shard, db_engine in enumerate(shard_engines)
+    ]
+    assert entity_ids[0] and entity_ids[1]
+    assert not entity_ids[0] & entity_ids[1]
+    assert entity_ids[0] | entity_ids[1] == set(range(1, 101))
+
+
+def test_shards_run_in_order(shard_engines):
+    shards = EntityShards(shard_engines)
+    assert shards.run(lambda shard, db_engine: shard) == [0, 1]
+
+
+def test_merge_column_stats(shard_engines):
+    shards = EntityShards(shard_engines)
+    aggregation = Aggregation(
+        [Aggregate("x", ["sum"], {"all": {"type": "mean"}})],
+        groups=["entity_id"],
+        from_obj="data",
+        state_table="states",
+    )
+    stats_table = "column_stats"
+    name = aggregation.get_column_stats_name()
+    shard_rows = [
+        # table_name, as_of_date, column_name, rows, nulls, mean, min, max
+        "('{}', null, 'data_entity_id_x_sum', 4, 1, 2.0, 1, 3)".format(name),
+        "('{}', null, 'data_entity_id_x_sum', 2, 0, 5.0, 4, 6)".format(name),
+    ]
+    for db_engine, row in zip(shard_engines, shard_rows):
+        db_engine.execute(aggregation.get_column_stats_create(stats_table))
+        db_engine.execute("insert into column_stats values {}".format(row))
+        db_engine.execute(
+            "insert into column_stats values "
+            "('other_table', null, 'other_column', 1, 0, 1.0, 1, 1)"
+        )
+
+    shards.merge_column_stats(stats_table, [name])
+
+    for db_engine in shard_engines:
+        merged = db_engine.execute(
+            aggregation.get_column_stats_summary(stats_table)
+        ).first()
+        assert merged["row_count"] == 6
+        assert merged["null_count"] == 1
+        assert merged["min_value"] == 1
+        assert merged["max_value"] == 6
+        ((mean,),) = db_engine.execute(
+            "select mean_value from column_stats where table_name = '{}'".format(name)
+        )
+        # weighted by the non-null values of each shard
+        assert mean == pytest.approx((2.0 * 3 + 5.0 * 2) / 5)
+        # other aggregations' statistics are untouched
+        ((other,),) = db_engine.execute(
+            "select count(*) from column_stats where table_name = 'other_table'"
+        )
+        assert other == 1
@@ -10,6 +10,9 @@ from sqlalchemy import create_engine
 
 from triage.component.architect.feature_generators import FeatureGenerator
 from triage.component.collate import Aggregate, Categorical, SpacetimeAggregation
+from triage.component.results_schema import Base
+
+from .utils import settle_table_statistics
 
 
 INPUT_DATA = [
@@ -602,6 +605,251 @@ def test_generate_table_tasks():
             assert isinstance(task["inserts"], list)
 
 
+def test_generate_table_tasks_debug():
+    aggregation = SpacetimeAggregation(
+        prefix="prefix2",
+        aggregates=[
+            Aggregate(
+                quantity="quantity_one",
+                function="count",
+                impute_rules={"coltype": "aggregate", "all": {"type": "mean"}},
+            )
+        ],
+        groups=["entity_id", "zip_code"],
+        intervals=["all"],
+        date_column="knowledge_date",
+        output_date_column="as_of_date",
+        dates=["2013-09-30", "2014-09-30"],
+        state_table="states",
+        state_group="entity_id",
+        schema="features",
+        from_obj="data",
+    )
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        setup_db(engine)
+
+        imputed_records = {}
+        for debug in (False, True):
+            feature_generator = FeatureGenerator(
+                db_engine=engine, features_schema_name="features", debug=debug
+            )
+            table_tasks = feature_generator.generate_all_table_tasks(
+                [aggregation], task_type="aggregation"
+            )
+            # the pre-imputation aggregation table is only written when debugging
+            assert ("prefix2_aggregation" in table_tasks) == debug
+            feature_generator.process_table_tasks(table_tasks)
+
+            imp_tasks = feature_generator.generate_all_table_tasks(
+                [aggregation], task_type="imputation"
+            )
+            feature_generator.process_table_tasks(imp_tasks)
+
+            remaining_tables = [
+                row[0]
+                for row in engine.execute(
+                    "select table_name from information_schema.tables "
+                    "where table_schema = 'features' order by table_name"
+                )
+            ]
+            if debug:
+                assert remaining_tables == [
+                    "column_stats",
+                    "prefix2_aggregation",
+                    "prefix2_aggregation_imputed",
+                    "prefix2_entity_id",
+                    "prefix2_zip_code",
+                ]
+            else:
+                assert remaining_tables == [
+                    "column_stats",
+                    "prefix2_aggregation_imputed",
+                ]
+
+            imputed_records[debug] = pandas.read_sql(
+                "select * from features.prefix2_aggregation_imputed "
+                "order by entity_id, as_of_date",
+                engine,
+            ).to_dict("records")
+
+        # both paths produce the same imputed table
+        assert imputed_records[False] == imputed_records[True]
+
+
+def test_generate_table_tasks_statistics():
+    aggregation = SpacetimeAggregation(
+        prefix="prefix2",
+        aggregates=[
+            Aggregate(
+                quantity="quantity_one",
+                function="max",
+                impute_rules={"coltype": "aggregate", "all": {"type": "mean"}},
+            ),
+            Aggregate(
+                quantity="quantity_one",
+                function="count",
+                impute_rules={"coltype": "aggregate", "all": {"type": "zero"}},
+            ),
+        ],
+        groups=["entity_id"],
+        intervals=["all"],
+        date_column="knowledge_date",
+        output_date_column="as_of_date",
+        dates=["2013-09-30", "2014-09-30"],
+        state_table="states",
+        state_group="entity_id",
+        schema="features",
+        from_obj="data",
+    )
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        setup_db(engine)
+
+        imputed_records = {}
+        for with_stats in (False, True):
+            feature_generator = FeatureGenerator(
+                db_engine=engine, features_schema_name="features"
+            )
+            feature_generator.process_table_tasks(
+                feature_generator.generate_all_table_tasks(
+                    [aggregation], task_type="aggregation"
+                )
+            )
+            # rebuilding the aggregation invalidates any earlier statistics
+            assert feature_generator.column_stats(aggregation) is None
+
+            if with_stats:
+                stats_tasks = feature_generator.generate_all_table_tasks(
+                    [aggregation], task_type="statistics"
+                )
+                # one insert per as_of_date, to be run in parallel
+                assert len(stats_tasks["prefix2_aggregation"]["inserts"]) == 2
+                feature_generator.process_table_tasks(stats_tasks)
+
+                stats = feature_generator.column_stats(aggregation)
+                assert set(stats.keys()) == set(
+                    aggregation.get_imputation_rules().keys()
+                )
+                # every entity/date pair in the state table is counted
+                assert all(
+                    column_stats["row_count"] == 5 for column_stats in stats.values()
+                )
+                # entity 1 has no data before 2013-09-30
+                assert stats["prefix2_entity_id_all_quantity_one_max"]["null_count"] == 1
+
+            imp_tasks = feature_generator.generate_all_table_tasks(
+                [aggregation], task_type="imputation"
+            )
+            # the means are read from the statistics rather than a window function
+            impute_create = str(imp_tasks["prefix2_aggregation_imputed"]["prepare"][1])
+            assert ("column_stats" in impute_create) == with_stats
+            feature_generator.process_table_tasks(imp_tasks)
+
+            imputed_records[with_stats] = pandas.read_sql(
+                "select * from features.prefix2_aggregation_imputed "
+                "order by entity_id, as_of_date",
+                engine,
+            ).to_dict("records")
+
+        # imputing from the statistics produces the same table as scanning
+        assert imputed_records[False] == imputed_records[True]
+
+
+def test_generate_table_tasks_sharded():
+    aggregation = SpacetimeAggregation(
+        prefix="prefix2",
+        aggregates=[
+            Aggregate(
+                quantity="quantity_one",
+                function=["max", "count"],
+                impute_rules={"coltype": "aggregate", "all": {"type": "mean"}},
+            ),
+            Categorical(
+                col="cat_one",
+                function="sum",
+                choices=["good", "bad", "inbetween"],
+                impute_rules={"coltype": "categorical", "all": {"type": "zero"}},
+            ),
+        ],
+        groups=["entity_id"],
+        intervals=["all"],
+        date_column="knowledge_date",
+        output_date_column="as_of_date",
+        dates=["2013-09-30", "2014-09-30"],
+        state_table="states",
+        state_group="entity_id",
+        schema="features",
+        from_obj="data",
+    )
+    # two key columns leave room for two columns and their imputation flags
+    sharded_aggregation = copy.copy(aggregation)
+    sharded_aggregation.max_table_columns = 6
+    assert len(aggregation.get_shards()) == 1
+    assert len(sharded_aggregation.get_shards()) == 3
+
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        setup_db(engine)
+
+        imputed_records = {}
+        for agg in (aggregation, sharded_aggregation):
+            feature_generator = FeatureGenerator(
+                db_engine=engine, features_schema_name="features"
+            )
+            for task_type in ("aggregation", "statistics", "imputation"):
+                feature_generator.process_table_tasks(
+                    feature_generator.generate_all_table_tasks(
+                        [agg], task_type=task_type
+                    )
+                )
+            imputed_tables = [
+                feature_generator._clean_table_name(table_name)
+                for table_name in agg.get_table_names(imputed=True)
+            ]
+            assert list(feature_generator.index_column_lookup([agg]).keys()) == (
+                imputed_tables
+            )
+
+            # join the shards back together on their key columns
+            query = "select * from features.{}".format(imputed_tables[0])
+            for table_name in imputed_tables[1:]:
+                query += " join features.{} using (entity_id, as_of_date)".format(
+                    table_name
+                )
+            imputed_records[len(imputed_tables)] = pandas.read_sql(
+                query + " order by entity_id, as_of_date", engine
+            ).to_dict("records")
+
+        assert imputed_records.keys() == {1, 3}
+        assert imputed_records[1] == imputed_records[3]
+        for table_name in (
+            "prefix2_aggregation_imputed_2",
+            "prefix2_aggregation_imputed_3",
+        ):
+            assert len(
+                pandas.read_sql("select * from features.%s" % table_name, engine)
+                .columns
+            ) <= 6
+
+
+def test_invalid_backend():
+    with pytest.raises(ValueError):
+        FeatureGenerator(
+            db_engine=None, features_schema_name="features", backend="spark"
+        )
+
+
+def test_duckdb_backend_with_entity_filter():
+    with pytest.raises(ValueError):
+        FeatureGenerator(
+            db_engine=None,
+            features_schema_name="features",
+            backend="duckdb",
+            entity_filter="entity_id = 1",
+        )
+
+
 def test_aggregations():
     aggregate_config = [
         {
@@ -706,6 +954,65 @@ def test_replace():
         engine.dispose()
 
 
+def test_replace_changed_sources():
+    aggregate_config = [
+        {
+            "prefix": "aprefix",
+            "aggregates_imputation": {"all": {"type": "mean"}},
+            "aggregates": [{"quantity": "quantity_one", "metrics": ["sum", "count"]}],
+            "groups": ["entity_id"],
+            "intervals": ["all"],
+            "knowledge_date_column": "knowledge_date",
+            "from_obj": "data",
+        }
+    ]
+
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        Base.metadata.create_all(engine)
+        setup_db(engine)
+        settle_table_statistics(engine)
+
+        def table_tasks():
+            feature_generator = FeatureGenerator(
+                db_engine=engine, features_schema_name="features", replace=False
+            )
+            aggregations = feature_generator.aggregations(
+                feature_dates=["2013-09-30", "2014-09-30"],
+                feature_aggregation_config=aggregate_config,
+                state_table="states",
+            )
+            return (
+                feature_generator.generate_all_table_tasks(
+                    aggregations, task_type="aggregation"
+                ),
+                feature_generator.generate_all_table_tasks(
+                    aggregations, task_type="imputation"
+                ),
+            )
+
+        FeatureGenerator(
+            db_engine=engine, features_schema_name="features", replace=False
+        ).create_all_tables(
+            feature_dates=["2013-09-30", "2014-09-30"],
+            feature_aggregation_config=aggregate_config,
+            state_table="states",
+        )
+
+        # nothing is rebuilt while the source data is unchanged
+        agg_tasks, imp_tasks = table_tasks()
+        assert agg_tasks["aprefix_entity_id"] == {}
+        assert imp_tasks["aprefix_aggregation_imputed"] == {}
+
+        engine.execute("truncate data")
+        engine.execute(
+            "insert into data values (1, '2014-01-01', '60120', 'good', 10)"
+        )
+        agg_tasks, imp_tasks = table_tasks()
+        assert len(agg_tasks["aprefix_entity_id"]["inserts"]) > 0
+        assert len(imp_tasks["aprefix_aggregation_imputed"]["prepare"]) > 0
+
+
 def test_transaction_error():
     """Database connections are cleaned up regardless of in-transaction
     query errors.
@@ -20,6 +20,21 @@ def test_table_group():
     assert subsets[1].names == ["tables: three"]
 
 
+def test_table_group_shards():
+    group = FeatureGroupCreator(definition={"tables": ["one"]})
+
+    subsets = group.subsets(
+        {
+            "one": ["col_a"],
+            "one_2": ["col_b"],
+            "one_two": ["col_c"],
+            "two": ["col_a"],
+        }
+    )
+    assert subsets == [{"one": ["col_a"], "one_2": ["col_b"]}]
+    assert subsets[0].names == ["tables: one"]
+
+
 def test_prefix_group():
     # ensure we test prefixes with underscores
     group = FeatureGroupCreator(definition={"prefix": ["major_viol", "severe_viol"]})
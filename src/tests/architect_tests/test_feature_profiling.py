@@ -0,0 +1,109 @@
+from datetime import date
+
+import testing.postgresql
+from sqlalchemy import create_engine
+
+from triage.component.architect.feature_generators import FeatureGenerator
+from triage.component.architect.feature_profiling import (
+    FeatureProfiler,
+    format_report,
+    sample_dates,
+)
+from triage.component.collate import Aggregate, SpacetimeAggregation
+from triage.database_reflection import table_exists
+
+from .test_feature_generators import setup_db
+
+
+def test_sample_dates():
+    dates = ["2014-01-01", "2014-02-01", "2014-03-01", "2014-04-01", "2014-05-01"]
+    assert sample_dates(dates) == dates
+    assert sample_dates(dates, 10) == dates
+    assert sample_dates(dates, 3) == ["2014-01-01", "2014-03-01", "2014-05-01"]
+    assert sample_dates(dates, 1) == ["2014-05-01"]
+
+
+def test_feature_profiler():
+    aggregation = SpacetimeAggregation(
+        prefix="aprefix",
+        aggregates=[
+            Aggregate(
+                quantity="quantity_one",
+                function="sum",
+                impute_rules={"coltype": "aggregate", "all": {"type": "zero"}},
+            )
+        ],
+        groups=["entity_id", "zip_code"],
+        intervals=["all"],
+        date_column="knowledge_date",
+        output_date_column="as_of_date",
+        dates=["2013-09-30", "2014-09-30", "2015-01-01"],
+        state_table=None,
+        schema="features",
+        from_obj="data",
+    )
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        setup_db(engine)
+
+        profiler = FeatureProfiler(engine, "features", large_scan_rows=1)
+        profiles = profiler.profile(aggregation, sample_size=2)
+        # two dates for each of the two groups
+        assert [(p["table_name"], p["as_of_date"]) for p in profiles] == [
+            ('"features"."aprefix_entity_id"', "2013-09-30"),
+            ('"features"."aprefix_entity_id"', "2015-01-01"),
+            ('"features"."aprefix_zip_code"', "2013-09-30"),
+            ('"features"."aprefix_zip_code"', "2015-01-01"),
+        ]
+        assert all("Execution Time" in profile["plan"] for profile in profiles)
+        # the prepared statements run when features are generated are profiled
+        assert all(profile["query"].startswith("EXECUTE") for profile in profiles)
+        # profiling is rolled back
+        assert not table_exists("features.aprefix_entity_id", engine)
+
+        profiler.record(profiles)
+        assert [
+            row[0]
+            for row in engine.execute(
+                "select count(*) from features.feature_profiles "
+                "where execution_time is not null and plan->'Plan' is not null"
+            )
+        ] == [4]
+
+        report = profiler.report(profiles, [aggregation], top=1)
+        assert len(report["slowest"]) == 1
+        assert all(
+            scan["relation"] == '"public"."data"' for scan in report["sequential_scans"]
+        )
+        assert report["index_candidates"] == [
+            'CREATE INDEX ON "public"."data" (knowledge_date)'
+        ]
+        assert report["index_candidates"][0] in format_report(report)
+
+        # indexed columns are not suggested again
+        engine.execute("create index on data (knowledge_date)")
+        report = profiler.report(profiles, [aggregation])
+        assert report["index_candidates"] == []
+
+
+def test_feature_generator_profile():
+    aggregate_config = [
+        {
+            "prefix": "aprefix",
+            "aggregates": [{"quantity": "quantity_one", "metrics": ["sum"]}],
+            "groups": ["entity_id"],
+            "intervals": ["all"],
+            "knowledge_date_column": "knowledge_date",
+            "from_obj": "data",
+        }
+    ]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        setup_db(engine)
+
+        report = FeatureGenerator(engine, "features_test").profile(
+            feature_aggregation_config=aggregate_config,
+            feature_dates=[date(2014, 9, 30)],
+        )
+        assert len(report["slowest"]) == 1
+        assert not table_exists("features_test.aprefix_entity_id", engine)
@@ -0,0 +1,125 @@
+import datetime
+
+import testing.postgresql
+from sqlalchemy import create_engine
+
+from triage.component.architect import Planner
+from triage.component.architect.feature_group_creator import FeatureGroup
+from triage.component.architect.feature_pruning import FeaturePruner
+
+FEATURE_ROWS = [
+    # entity_id, as_of_date, varied, constant, all_null, copy_of_varied,
+    # constant_until_2016
+    (1, "2015-01-01", 1, 0, None, 1, 0),
+    (2, "2015-01-01", 2, 0, None, 2, 0),
+    (1, "2016-01-01", 3, 0, None, 3, 5),
+    (2, "2016-01-01", 4, 0, None, 4, 6),
+]
+COLUMNS = ["varied", "constant", "all_null", "copy_of_varied", "constant_until_2016"]
+
+
+def create_features(engine):
+    engine.execute("create schema features")
+    engine.execute(
+        """create table features.entity_features (entity_id int, as_of_date
+        timestamp, varied real, constant smallint, all_null real,
+        copy_of_varied real, constant_until_2016 real)"""
+    )
+    for row in FEATURE_ROWS:
+        engine.execute(
+            "insert into features.entity_features values (%s, %s, %s, %s, %s, %s, %s)",
+            row,
+        )
+
+
+def test_FeaturePruner():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_features(engine)
+        pruner = FeaturePruner([engine], "features")
+        feature_dictionary = FeatureGroup(
+            name="entity", features_by_table={"entity_features": COLUMNS}
+        )
+
+        pruned_dictionary, pruned_features = pruner.prune(
+            feature_dictionary, [datetime.datetime(2015, 1, 1)]
+        )
+        assert pruned_dictionary == {"entity_features": ["varied"]}
+        assert pruned_dictionary.names == ["entity"]
+        assert pruned_features == {
+            "constant": "constant",
+            "all_null": "all null",
+            "copy_of_varied": "duplicate of varied",
+            "constant_until_2016": "constant",
+        }
+
+        # only the rows of the given as of dates are looked at
+        pruned_dictionary, pruned_features = pruner.prune(
+            feature_dictionary,
+            [datetime.datetime(2015, 1, 1), datetime.datetime(2016, 1, 1)],
+        )
+        assert pruned_dictionary == {
+            "entity_features": ["varied", "constant_until_2016"]
+        }
+
+        # a column alike in its aggregates but not in every row is kept
+        engine.execute(
+            "update features.entity_features set copy_of_varied = 3 - copy_of_varied "
+            "where as_of_date = '2015-01-01'"
+        )
+        engine.execute(
+            "update features.entity_features set copy_of_varied = 7 - copy_of_varied "
+            "where as_of_date = '2016-01-01'"
+        )
+        fresh_pruner = FeaturePruner([engine], "features")
+        assert "copy_of_varied" not in fresh_pruner.table_pruning(
+            "entity_features", COLUMNS, [datetime.datetime(2015, 1, 1)]
+        )
+
+
+def test_Planner_prunes_train_and_test_matrices_alike():
+    matrix_set_definitions = [
+        {
+            "feature_start_time": datetime.datetime(2015, 1, 1, 0, 0),
+            "modeling_start_time": datetime.datetime(2015, 1, 1, 0, 0),
+            "modeling_end_time": datetime.datetime(2016, 6, 1, 0, 0),
+            "train_matrix": {
+                "first_as_of_time": datetime.datetime(2015, 1, 1, 0, 0),
+                "matrix_info_end_time": datetime.datetime(2016, 1, 1, 0, 0),
+                "as_of_times": [datetime.datetime(2015, 1, 1, 0, 0)],
+            },
+            "test_matrices": [
+                {
+                    "first_as_of_time": datetime.datetime(2016, 1, 1, 0, 0),
+                    "matrix_info_end_time": datetime.datetime(2016, 6, 1, 0, 0),
+                    "as_of_times": [datetime.datetime(2016, 1, 1, 0, 0)],
+                }
+            ],
+        }
+    ]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_features(engine)
+        planner = Planner(
+            feature_start_time=datetime.datetime(2015, 1, 1, 0, 0),
+            label_names=["booking"],
+            label_types=["binary"],
+            states=["state_one AND state_two"],
+            user_metadata={},
+            feature_pruner=FeaturePruner([engine], "features"),
+        )
+        _, build_tasks = planner.generate_plans(
+            matrix_set_definitions,
+            [
+                FeatureGroup(
+                    name="entity", features_by_table={"entity_features": COLUMNS}
+                )
+            ],
+        )
+        assert len(build_tasks) == 2
+        for build_task in build_tasks.values():
+            metadata = build_task["matrix_metadata"]
+            # the test matrix is pruned by the train matrix's rows
+            assert metadata["feature_names"] == ["varied"]
+            assert metadata["pruned_features"]["constant_until_2016"] == "constant"
+            assert build_task["feature_dictionary"] == {"entity_features": ["varied"]}
@@ -4,8 +4,9 @@ import testing.postgresql
 from sqlalchemy import create_engine
 
 from triage.component.architect.label_generators import LabelGenerator
+from triage.component.results_schema import Base
 
-from .utils import create_binary_outcome_events
+from .utils import create_binary_outcome_events, settle_table_statistics
 
 
 # Sample events data to use for all tests
@@ -169,3 +170,124 @@ def test_generate_all_labels_noreplace():
             (4, date(2014, 9, 30), timedelta(90), "outcome", "binary", False),
         ]
         assert records == expected
+
+
+def test_generate_all_labels_noreplace_changed_sources():
+    # with replace=False, labels are only regenerated if the events changed
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        Base.metadata.create_all(engine)
+        create_binary_outcome_events(engine, "events", events_data)
+        settle_table_statistics(engine)
+
+        label_generator = LabelGenerator(
+            db_engine=engine,
+            query=LABEL_GENERATE_QUERY,
+            replace=False
+        )
+
+        def generate_labels():
+            label_generator.generate_all_labels(
+                labels_table=LABELS_TABLE_NAME,
+                as_of_dates=["2014-09-30"],
+                label_timespans=["6month"],
+            )
+            return [
+                tuple(row)
+                for row in engine.execute(
+                    "select entity_id, label from {} order by entity_id".format(
+                        LABELS_TABLE_NAME
+                    )
+                )
+            ]
+
+        assert generate_labels() == [(1, 0), (3, 1), (4, 0)]
+
+        # existing labels are kept while the events are unchanged
+        engine.execute("update {} set label = 1".format(LABELS_TABLE_NAME))
+        assert generate_labels() == [(1, 1), (3, 1), (4, 1)]
+
+        engine.execute("truncate events")
+        engine.execute("insert into events values (2, '2014-10-01', true)")
+        assert generate_labels() == [(2, 1)]
+
+
+def test_lifted_query():
+    label_generator = LabelGenerator(db_engine=None, query=LABEL_GENERATE_QUERY)
+    lifted_query = label_generator.lifted_query()
+    assert "{" not in lifted_query
+    assert (
+        "(label_dates.as_of_date)::timestamp + (label_dates.label_timespan)"
+        in lifted_query
+    )
+
+    # parameters within longer strings can not be replaced by columns
+    label_generator = LabelGenerator(
+        db_engine=None,
+        query=LABEL_GENERATE_QUERY.replace("'{as_of_date}'", "'{as_of_date} 00:00'"),
+    )
+    assert label_generator.lifted_query() is None
+
+
+def test_generate_all_labels_set_based_matches_per_date():
+    as_of_dates = ["2014-09-30", "2015-03-30", "2015-06-30"]
+    label_timespans = ["6month", "3month"]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_binary_outcome_events(engine, "events", events_data)
+
+        def generate_labels(labels_table, **kwargs):
+            LabelGenerator(
+                db_engine=engine, query=LABEL_GENERATE_QUERY, **kwargs
+            ).generate_all_labels(labels_table, as_of_dates, label_timespans)
+            return [
+                tuple(row)
+                for row in engine.execute(
+                    "select * from {} "
+                    "order by entity_id, as_of_date, label_timespan".format(
+                        labels_table
+                    )
+                )
+            ]
+
+        per_date = generate_labels("labels_per_date", set_based=False)
+        assert len(per_date) == 12
+        assert generate_labels("labels_set_based", chunk_size=4) == per_date
+
+        # labels are indexed for joining to matrix rows
+        assert [
+            row[0]
+            for row in engine.execute(
+                "select indexname from pg_indexes "
+                "where tablename = 'labels_set_based' order by indexname"
+            )
+        ] == [
+            "labels_set_based_date_timespan_idx",
+            "labels_set_based_entity_date_idx",
+        ]
+
+
+def test_generate_all_labels_set_based_fallback():
+    # the as of date is compared to text, which fails once it is a column
+    query = LABEL_GENERATE_QUERY.replace(
+        "group by", "and to_char(outcome_date, 'YYYY') <= '{as_of_date}' group by"
+    )
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_binary_outcome_events(engine, "events", events_data)
+
+        label_generator = LabelGenerator(db_engine=engine, query=query)
+        assert label_generator.lifted_query() is not None
+        label_generator.generate_all_labels(
+            labels_table=LABELS_TABLE_NAME,
+            as_of_dates=["2014-09-30"],
+            label_timespans=["6month"],
+        )
+        assert [
+            tuple(row)
+            for row in engine.execute(
+                "select entity_id, label from {} order by entity_id".format(
+                    LABELS_TABLE_NAME
+                )
+            )
+        ] == [(1, 0), (3, 1), (4, 0)]
@@ -0,0 +1,99 @@
+from datetime import datetime
+
+import numpy
+import pandas as pd
+import testing.postgresql
+from sqlalchemy import create_engine
+
+from triage.component.architect.matrix_statistics import (
+    MatrixStatistics,
+    column_statistics,
+    label_base_rates,
+    label_value_count,
+    save_view_statistics,
+)
+from triage.component.catwalk.db import ensure_db
+
+
+def example_matrix():
+    return pd.DataFrame(
+        {
+            "entity_id": [1, 2, 3, 1, 2, 3],
+            "as_of_date": [datetime(2016, 1, 1)] * 3 + [datetime(2016, 2, 1)] * 3,
+            "f_constant": [1.0] * 6,
+            "f_varied": [0.0, 1.5, 3.0, numpy.nan, 4.5, 6.0],
+            "label": [0, 1, numpy.nan, 1, 1, 0],
+        },
+        columns=["entity_id", "as_of_date", "f_constant", "f_varied", "label"],
+    ).set_index(["entity_id", "as_of_date"])
+
+
+def test_matrix_statistics_chunks():
+    matrix = example_matrix()
+    whole = MatrixStatistics("label")
+    whole.update(matrix)
+    chunked = MatrixStatistics("label", distinct_values_cap=4)
+    # the chunks are only added as they are iterated over
+    chunks = chunked.track(matrix.iloc[start:start + 2] for start in (0, 2, 4))
+    assert chunked.columns is None
+    assert len(list(chunks)) == 3
+
+    for statistics in (whole, chunked):
+        rows = {row["column_name"]: row for row in statistics.column_rows("uuid")}
+        assert rows["f_constant"]["distinct_count"] == 1
+        assert rows["f_constant"]["std"] == 0
+        varied = rows["f_varied"]
+        assert varied["null_count"] == 1
+        assert varied["zero_count"] == 1
+        assert (varied["min_value"], varied["max_value"]) == (0.0, 6.0)
+        assert varied["mean"] == 3.0
+        numpy.testing.assert_almost_equal(
+            varied["std"], numpy.nanstd(matrix["f_varied"].values)
+        )
+        assert [
+            (row["as_of_date"], row["num_rows"], row["num_labeled"], row["base_rate"])
+            for row in statistics.label_rows("uuid")
+        ] == [(datetime(2016, 1, 1), 3, 2, 0.5), (datetime(2016, 2, 1), 3, 3, 2 / 3)]
+    # more distinct values than are counted
+    assert chunked.column_rows("uuid")[1]["distinct_count"] is None
+    assert whole.column_rows("uuid")[1]["distinct_count"] == 5
+
+
+def test_save_matrix_statistics():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        ensure_db(engine)
+        statistics = MatrixStatistics("label")
+        statistics.update(example_matrix())
+        statistics.save(engine, "source")
+        # saving again replaces the statistics
+        statistics.save(engine, "source")
+
+        saved = column_statistics(engine, "source")
+        assert saved.index.tolist() == ["f_constant", "f_varied", "label"]
+        assert saved.loc["f_varied", "null_count"] == 1
+        assert label_base_rates(engine, "source")["num_labeled"].tolist() == [2, 3]
+        assert label_value_count(label_base_rates(engine, "source")) == len(
+            example_matrix()["label"].unique()
+        )
+
+        # a view of all of the rows has the statistics of its columns
+        save_view_statistics(engine, "columns", "source", ["f_varied", "label"])
+        assert column_statistics(engine, "columns").index.tolist() == [
+            "f_varied",
+            "label",
+        ]
+        assert len(label_base_rates(engine, "columns")) == 2
+
+        # a view of some of the rows only has the base rates of its dates
+        save_view_statistics(
+            engine,
+            "rows",
+            "source",
+            ["f_constant", "f_varied", "label"],
+            (pd.Timestamp("2016-02-01"), pd.Timestamp("2016-02-01")),
+        )
+        assert column_statistics(engine, "rows").empty
+        assert label_base_rates(engine, "rows").index.tolist() == [
+            pd.Timestamp("2016-02-01")
+        ]
@@ -133,3 +133,133 @@ def test_Planner():
         )
         == 8
     )
+
+
+def test_Planner_matrix_views():
+    matrix_set_definitions = [
+        {
+            "feature_start_time": datetime.datetime(1990, 1, 1, 0, 0),
+            "modeling_start_time": datetime.datetime(2010, 1, 1, 0, 0),
+            "modeling_end_time": datetime.datetime(2010, 1, 11, 0, 0),
+            "train_matrix": {
+                "first_as_of_time": datetime.datetime(2010, 1, 1, 0, 0),
+                "matrix_info_end_time": datetime.datetime(2010, 1, 6, 0, 0),
+                "as_of_times": [datetime.datetime(2010, 1, 1, 0, 0)],
+            },
+            "test_matrices": [
+                {
+                    "first_as_of_time": datetime.datetime(2010, 1, 6, 0, 0),
+                    "matrix_info_end_time": datetime.datetime(2010, 1, 11, 0, 0),
+                    "as_of_times": [datetime.datetime(2010, 1, 6, 0, 0)],
+                }
+            ],
+        }
+    ]
+    feature_dicts = [
+        FeatureGroup(
+            name="first_features",
+            features_by_table={"features0": ["f1", "f2"], "features1": ["f3"]},
+        ),
+        FeatureGroup(
+            name="second_features", features_by_table={"features0": ["f2", "f4"]}
+        ),
+    ]
+    planner_kwargs = dict(
+        feature_start_time=datetime.datetime(2010, 1, 1, 0, 0),
+        label_names=["booking"],
+        label_types=["binary"],
+        cohort_name="prior_bookings",
+        states=["state_one AND state_two"],
+        user_metadata={},
+    )
+    definitions, build_tasks = Planner(**planner_kwargs).generate_plans(
+        matrix_set_definitions, feature_dicts
+    )
+    view_definitions, view_build_tasks = Planner(
+        matrix_views=True, **planner_kwargs
+    ).generate_plans(matrix_set_definitions, feature_dicts)
+
+    # the matrices keep their uuids, and a matrix with all of their features is
+    # planned for the train and the test matrices, to be built first
+    assert view_definitions == definitions
+    assert set(build_tasks.keys()) < set(view_build_tasks.keys())
+    tasks = list(view_build_tasks.values())
+    assert len(tasks) == 6
+    for source_task in tasks[:2]:
+        metadata = source_task["matrix_metadata"]
+        assert "source_matrix_uuid" not in metadata
+        assert metadata["feature_names"] == ["f1", "f2", "f3", "f4"]
+        assert metadata["feature_groups"] == ["first_features", "second_features"]
+        assert source_task["feature_dictionary"] == {
+            "features0": ["f1", "f2", "f4"],
+            "features1": ["f3"],
+        }
+    for view_task in tasks[2:]:
+        source_task = view_build_tasks[
+            view_task["matrix_metadata"]["source_matrix_uuid"]
+        ]
+        assert source_task["matrix_type"] == view_task["matrix_type"]
+
+    # a matrix that already has every feature is the one the others are views of
+    subset = FeatureGroup(name="subset", features_by_table={"features0": ["f1"]})
+    definitions, build_tasks = Planner(
+        matrix_views=True, **planner_kwargs
+    ).generate_plans(matrix_set_definitions, [feature_dicts[0], subset])
+    assert len(build_tasks) == 4
+    full_train_uuid, subset_train_uuid = [
+        definition["train_uuid"] for definition in definitions
+    ]
+    assert "source_matrix_uuid" not in build_tasks[full_train_uuid]["matrix_metadata"]
+    assert (
+        build_tasks[subset_train_uuid]["matrix_metadata"]["source_matrix_uuid"]
+        == full_train_uuid
+    )
+
+
+def test_Planner_training_history_views():
+    def matrix_set(max_training_history, as_of_days):
+        return {
+            "feature_start_time": datetime.datetime(1990, 1, 1, 0, 0),
+            "modeling_start_time": datetime.datetime(2010, 1, 1, 0, 0),
+            "modeling_end_time": datetime.datetime(2010, 1, 11, 0, 0),
+            "train_matrix": {
+                "first_as_of_time": datetime.datetime(2010, 1, as_of_days[0], 0, 0),
+                "last_as_of_time": datetime.datetime(2010, 1, 5, 0, 0),
+                "matrix_info_end_time": datetime.datetime(2010, 1, 6, 0, 0),
+                "as_of_times": [
+                    datetime.datetime(2010, 1, day, 0, 0) for day in as_of_days
+                ],
+                "max_training_history": max_training_history,
+            },
+            "test_matrices": [
+                {
+                    "first_as_of_time": datetime.datetime(2010, 1, 6, 0, 0),
+                    "matrix_info_end_time": datetime.datetime(2010, 1, 11, 0, 0),
+                    "as_of_times": [datetime.datetime(2010, 1, 6, 0, 0)],
+                }
+            ],
+        }
+
+    planner = Planner(
+        feature_start_time=datetime.datetime(2010, 1, 1, 0, 0),
+        label_names=["booking"],
+        label_types=["binary"],
+        states=["state_one AND state_two"],
+        user_metadata={},
+        matrix_views=True,
+    )
+    definitions, build_tasks = planner.generate_plans(
+        [matrix_set("2days", [4, 5]), matrix_set("5days", [1, 2, 3, 4, 5])],
+        [FeatureGroup(name="all", features_by_table={"features0": ["f1"]})],
+    )
+    short_train_uuid, long_train_uuid = [
+        definition["train_uuid"] for definition in definitions
+    ]
+    # one test matrix, and the train matrix with the longest history, are built
+    assert len(build_tasks) == 3
+    assert list(build_tasks.keys())[-1] == short_train_uuid
+    assert (
+        build_tasks[short_train_uuid]["matrix_metadata"]["source_matrix_uuid"]
+        == long_train_uuid
+    )
+    assert "source_matrix_uuid" not in build_tasks[long_train_uuid]["matrix_metadata"]
@@ -0,0 +1,172 @@
+from datetime import date, datetime
+
+import testing.postgresql
+from sqlalchemy import create_engine
+
+from triage.component.architect.label_generators import LabelGenerator
+from triage.component.architect.row_cache import RowCache, normalize_query
+from triage.component.architect.state_table_generators import (
+    StateTableGeneratorFromQuery,
+)
+from triage.component.results_schema import Base
+
+from .test_label_generators import LABEL_GENERATE_QUERY, events_data
+from .utils import create_binary_outcome_events, settle_table_statistics
+
+
+def rows(engine, table_name):
+    return [
+        tuple(row)
+        for row in engine.execute(
+            "select * from {} order by 1, 2, 3".format(table_name)
+        )
+    ]
+
+
+def catalog(engine):
+    return [
+        tuple(row)
+        for row in engine.execute(
+            "select as_of_date::date, source_table, row_count "
+            "from model_metadata.cached_rows order by 1"
+        )
+    ]
+
+
+def test_normalize_query():
+    assert normalize_query("  select 1\n  from   events;\n") == "select 1 from events"
+
+
+def test_labels_shared_between_experiments():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        Base.metadata.create_all(engine)
+        create_binary_outcome_events(engine, "events", events_data)
+        settle_table_statistics(engine)
+
+        LabelGenerator(
+            db_engine=engine, query=LABEL_GENERATE_QUERY
+        ).generate_all_labels("labels_one", ["2014-09-30", "2015-03-30"], ["6month"])
+        assert catalog(engine) == [
+            (date(2014, 9, 30), "labels_one", 3),
+            (date(2015, 3, 30), "labels_one", 2),
+        ]
+
+        # another experiment, writing the same query differently and naming its
+        # label, only generates the labels of the date not cached
+        label_generator = LabelGenerator(
+            db_engine=engine,
+            query=LABEL_GENERATE_QUERY.replace("\n", "\n  "),
+            label_name="inspections",
+        )
+        label_generator.generate_all_labels(
+            "labels_two", ["2015-03-30", "2015-06-30"], ["6month"]
+        )
+        assert [source_table for _, source_table, _ in catalog(engine)] == [
+            "labels_one",
+            "labels_one",
+            "labels_two",
+        ]
+
+        # the labels are those generated without the cache
+        LabelGenerator(
+            db_engine=engine,
+            query=LABEL_GENERATE_QUERY,
+            label_name="inspections",
+            shared_cache=False,
+        ).generate_all_labels("labels_fresh", ["2015-03-30", "2015-06-30"], ["6month"])
+        assert rows(engine, "labels_two") == rows(engine, "labels_fresh")
+
+        # cached labels are dropped once the events change
+        engine.execute("truncate events")
+        engine.execute("insert into events values (2, '2015-04-01', true)")
+        settle_table_statistics(engine)
+        label_generator.generate_all_labels(
+            "labels_two", ["2015-03-30", "2015-06-30"], ["6month"]
+        )
+        assert catalog(engine) == [
+            (date(2015, 3, 30), "labels_two", 1),
+            (date(2015, 6, 30), "labels_two", 0),
+        ]
+        assert [
+            row[0] for row in engine.execute("select entity_id from labels_two")
+        ] == [2]
+
+
+def test_cohort_shared_between_experiments():
+    input_data = [
+        (1, datetime(2016, 1, 1), True),
+        (2, datetime(2016, 2, 15), True),
+    ]
+    query = "select entity_id from events where outcome_date < '{as_of_date}'::date"
+    as_of_dates = [datetime(2016, 2, 1), datetime(2016, 3, 1)]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        Base.metadata.create_all(engine)
+        create_binary_outcome_events(engine, "events", input_data)
+        settle_table_statistics(engine)
+
+        generators = [
+            StateTableGeneratorFromQuery(
+                query=query, db_engine=engine, experiment_hash=experiment_hash
+            )
+            for experiment_hash in ("one", "two")
+        ]
+        generators[0].generate_sparse_table(as_of_dates)
+        # every date is cached, so the cohort is only copied
+        generators[1].generate_sparse_table(as_of_dates)
+
+        assert rows(engine, generators[1].sparse_table_name) == [
+            (1, datetime(2016, 2, 1), True),
+            (1, datetime(2016, 3, 1), True),
+            (2, datetime(2016, 3, 1), True),
+        ]
+        assert rows(engine, generators[0].sparse_table_name) == rows(
+            engine, generators[1].sparse_table_name
+        )
+        assert [source_table for _, source_table, _ in catalog(engine)] == [
+            generators[0].sparse_table_name
+        ] * 2
+
+
+def test_store_overlapping_keys():
+    query = "select entity_id from events"
+    as_of_dates = [datetime(2016, 1, 1), datetime(2016, 2, 1), datetime(2016, 3, 1)]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        Base.metadata.create_all(engine)
+        engine.execute(
+            "create table generated (entity_id int, as_of_date timestamp, active bool)"
+        )
+        for as_of_date in as_of_dates:
+            engine.execute(
+                "insert into generated values (1, %s, true), (2, %s, true)",
+                as_of_date,
+                as_of_date,
+            )
+        keys = [(as_of_date, None) for as_of_date in as_of_dates]
+
+        row_cache = RowCache(engine, "cohort")
+        row_cache.store(query, "watermark", keys[:2], "generated")
+        # the second as of date is already cached, so only the third is copied
+        row_cache.store(query, "watermark", keys[1:], "generated")
+
+        assert rows(engine, row_cache.cache_table(row_cache.query_hash(query))) == [
+            (entity_id, as_of_date, True)
+            for entity_id in (1, 2)
+            for as_of_date in as_of_dates
+        ]
+        assert catalog(engine) == [
+            (as_of_date.date(), "generated", 2) for as_of_date in as_of_dates
+        ]
+
+
+def test_row_cache_without_results_schema():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_binary_outcome_events(engine, "events", events_data)
+        row_cache = RowCache(engine, "labels", timespan_column="label_timespan")
+        assert not row_cache.enabled
+        assert not row_cache.cached(
+            "select 1", "watermark", [("2015-01-01", "6month")]
+        )
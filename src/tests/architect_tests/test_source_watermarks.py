@@ -0,0 +1,77 @@
+import testing.postgresql
+from sqlalchemy import create_engine
+
+from triage.component.architect.source_watermarks import SourceWatermarks
+from triage.component.results_schema import Base
+
+
+def setup_db(engine):
+    Base.metadata.create_all(engine)
+    engine.execute("create table data (entity_id int, outcome bool)")
+    engine.execute("insert into data values (1, true), (2, false)")
+
+
+def test_source_watermarks_changed():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        setup_db(engine)
+        source_query = "select * from data"
+
+        watermarks = SourceWatermarks(engine)
+        watermark = watermarks.current(source_query)
+        assert watermark is not None
+        # nothing is known about tables never recorded
+        assert not watermarks.changed("features.derived", watermark)
+
+        watermarks.record("features.derived", watermark, source_query)
+        assert watermarks.recorded("features.derived") == watermark
+        assert not watermarks.changed("features.derived", watermark)
+
+        engine.execute("truncate data")
+        engine.execute("insert into data values (1, false)")
+        new_watermark = watermarks.current(source_query)
+        assert new_watermark != watermark
+        assert watermarks.changed("features.derived", new_watermark)
+
+        # recording again replaces the earlier watermark
+        watermarks.record("features.derived", new_watermark, source_query)
+        assert not watermarks.changed("features.derived", new_watermark)
+
+
+def test_source_watermarks_untracked_sources():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        setup_db(engine)
+
+        watermarks = SourceWatermarks(engine)
+        assert watermarks.current("select * from generate_series(1, 3)") is None
+        assert not watermarks.changed("features.derived", None)
+
+
+def test_source_watermarks_without_results_schema():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        engine.execute("create table data (entity_id int, outcome bool)")
+
+        watermarks = SourceWatermarks(engine)
+        assert watermarks.current("select * from data") is None
+        watermarks.record("features.derived", "abc")
+        assert watermarks.recorded("features.derived") is None
+        assert not watermarks.enabled
+
+
+def test_source_watermarks_quoted_tables():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        setup_db(engine)
+        engine.execute('create table "Events" (entity_id int, outcome bool)')
+        engine.execute('insert into "Events" values (1, true)')
+        source_query = 'select * from "Events" join data using (entity_id)'
+
+        watermarks = SourceWatermarks(engine)
+        watermark = watermarks.current(source_query)
+        assert watermark is not None
+
+        engine.execute('insert into "Events" values (2, false)')
+        engine.execute('truncate "Events"')
+        assert watermarks.current(source_query) != watermark
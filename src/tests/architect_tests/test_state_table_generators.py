@@ -10,6 +10,8 @@ from triage.component.architect.state_table_generators import (
     StateTableGeneratorFromQuery,
 )
 
+from triage.component.results_schema import Base
+
 from . import utils
 
 
@@ -248,3 +250,106 @@ def test_sparse_states_from_query():
         assert results == expected_output
         utils.assert_index(engine, table_generator.sparse_table_name, "entity_id")
         utils.assert_index(engine, table_generator.sparse_table_name, "as_of_date")
+
+
+def test_sparse_states_from_query_noreplace():
+    input_data = [
+        (1, datetime(2016, 1, 1), True),
+        (2, datetime(2016, 1, 1), True),
+    ]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        Base.metadata.create_all(engine)
+        utils.create_binary_outcome_events(engine, "events", input_data)
+        utils.settle_table_statistics(engine)
+        table_generator = StateTableGeneratorFromQuery(
+            query="select entity_id from events where outcome_date < '{as_of_date}'::date",
+            db_engine=engine,
+            experiment_hash="exp_hash",
+            replace=False,
+        )
+        as_of_dates = [datetime(2016, 2, 1), datetime(2016, 3, 1)]
+
+        def cohort_entities():
+            table_generator.generate_sparse_table(as_of_dates)
+            return [
+                row[0]
+                for row in engine.execute(
+                    "select distinct entity_id from {} order by 1".format(
+                        table_generator.sparse_table_name
+                    )
+                )
+            ]
+
+        assert cohort_entities() == [1, 2]
+
+        # the existing table is kept while the events are unchanged
+        engine.execute(
+            "delete from {} where entity_id = 2".format(
+                table_generator.sparse_table_name
+            )
+        )
+        assert cohort_entities() == [1]
+
+        engine.execute("truncate events")
+        engine.execute("insert into events values (3, '2016-01-01', true)")
+        assert cohort_entities() == [3]
+
+
+def test_sparse_states_from_query_set_based():
+    input_data = [
+        (1, datetime(2016, 1, 1), True),
+        (1, datetime(2016, 3, 1), True),
+        (2, datetime(2016, 2, 15), True),
+        (3, datetime(2016, 4, 15), True),
+    ]
+    query = "select entity_id from events where outcome_date < '{as_of_date}'::date"
+    as_of_dates = [datetime(2016, month, 1) for month in range(1, 7)]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        utils.create_binary_outcome_events(engine, "events", input_data)
+
+        def sparse_states(experiment_hash, **kwargs):
+            table_generator = StateTableGeneratorFromQuery(
+                query=query,
+                db_engine=engine,
+                experiment_hash=experiment_hash,
+                **kwargs
+            )
+            table_generator.generate_sparse_table(as_of_dates)
+            return table_generator, [
+                tuple(row)
+                for row in engine.execute(
+                    "select * from {} order by entity_id, as_of_date".format(
+                        table_generator.sparse_table_name
+                    )
+                )
+            ]
+
+        table_generator, set_based = sparse_states(
+            "set_based", chunk_size=4, n_workers=2
+        )
+        assert table_generator.lifted_query() is not None
+        assert table_generator.entity_counts == dict(
+            zip(as_of_dates, [0, 1, 2, 2, 3, 3])
+        )
+        _, per_date = sparse_states("per_date", set_based=False)
+        assert set_based == per_date
+        assert len(set_based) == 11
+
+
+def test_sparse_states_from_query_not_lifted():
+    input_data = [(1, datetime(2016, 1, 1), True)]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        utils.create_binary_outcome_events(engine, "events", input_data)
+        # the as of date is part of a longer string, so it can't become a column
+        table_generator = StateTableGeneratorFromQuery(
+            query="select entity_id from events "
+            "where outcome_date < '{as_of_date} 00:00'::timestamp",
+            db_engine=engine,
+            experiment_hash="exp_hash",
+        )
+        assert table_generator.lifted_query() is None
+        table_generator.generate_sparse_table([datetime(2016, 2, 1)])
+        assert table_generator.entity_counts == {datetime(2016, 2, 1): 1}
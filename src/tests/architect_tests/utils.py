@@ -2,6 +2,7 @@ import datetime
 import shutil
 import sys
 import tempfile
+import time
 import random
 from contextlib import contextmanager
 
@@ -224,3 +225,12 @@ def create_binary_outcome_events(db_engine, table_name, events_data):
         db_engine.execute(
             "insert into {} values (%s, %s, %s::bool)".format(table_name), event
         )
+
+
+def settle_table_statistics(db_engine):
+    """Postgres' table statistics (read for source watermarks) only reflect
+    writes once the writing connections report them, so close those connections
+    and give their reports time to arrive
+    """
+    db_engine.dispose()
+    time.sleep(1)
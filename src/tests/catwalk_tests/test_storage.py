@@ -3,15 +3,23 @@ import tempfile
 import unittest
 import yaml
 from collections import OrderedDict
+from datetime import datetime
 
+import numpy as np
 import pandas as pd
+import pytest
 from moto import mock_s3
 from numpy.testing import assert_almost_equal
+from unittest.mock import patch
 
 from triage.component.catwalk.storage import (
     CSVMatrixStore,
+    FeatherMatrixStore,
+    FeatureBlockStorageEngine,
     FSStore,
     HDFMatrixStore,
+    NumpyMatrixStore,
+    ParquetMatrixStore,
     S3Store,
     ProjectStorage,
 )
@@ -51,6 +59,29 @@ def test_FSStore():
         assert not store.exists()
 
 
+def test_FeatureBlockStorageEngine():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine = ProjectStorage(tmpdir).feature_block_storage_engine()
+        assert not engine.exists("features.table", "key")
+        engine.write(
+            "features.table",
+            "key",
+            np.array([1, 2]),
+            ["f1", "f2"],
+            np.array([[0.5, 1], [1.5, 2]], dtype=np.float32),
+        )
+        assert engine.exists("features.table", "key")
+        entity_ids, columns, values = engine.load("features.table", "key")
+        assert entity_ids.tolist() == [1, 2]
+        assert columns == ["f1", "f2"]
+        assert values.dtype == np.float32
+        assert values.tolist() == [[0.5, 1], [1.5, 2]]
+        # only the block itself is left in storage
+        assert os.listdir(os.path.join(tmpdir, "feature_blocks", "features.table")) == [
+            "key.npz"
+        ]
+
+
 class MatrixStoreTest(unittest.TestCase):
     data_dict = OrderedDict(
         [
@@ -62,6 +93,7 @@ class MatrixStoreTest(unittest.TestCase):
     )
 
     metadata = {"label_name": "label", "indices": ["entity_id"]}
+    store_classes = (CSVMatrixStore, HDFMatrixStore)
 
     def matrix_stores(self):
         df = pd.DataFrame.from_dict(self.data_dict).set_index(["entity_id"])
@@ -143,6 +175,98 @@ class MatrixStoreTest(unittest.TestCase):
             matrix_store.matrix = None
             assert matrix_store.matrix.to_dict() == original_dict
 
+    def test_MatrixStore_save_chunks(self):
+        for matrix_store in self.matrix_stores():
+            original_dict = matrix_store.matrix.to_dict()
+            chunks = [matrix_store.matrix.iloc[:1], matrix_store.matrix.iloc[1:]]
+            matrix_store.matrix = None
+            matrix_store.save_chunks(chunks)
+            assert matrix_store.matrix.to_dict() == original_dict
+
+    def test_MatrixStore_save_chunks_failed(self):
+        def failing_chunks(matrix):
+            yield matrix.iloc[:1]
+            raise ValueError("extraction failed")
+
+        for matrix_store in self.matrix_stores():
+            with self.assertRaises(ValueError):
+                matrix_store.save_chunks(failing_chunks(matrix_store.matrix))
+            assert not matrix_store.matrix_base_store.exists()
+
+    def test_MatrixStore_view(self):
+        for matrix_store in self.matrix_stores():
+            # saved as the matrix store would write it
+            matrix_store.save()
+            view = matrix_store.__class__(matrix_store.project_storage, [], "view")
+            assert not view.exists
+            view.metadata = dict(
+                self.metadata, feature_names=["m_feature"], source_matrix_uuid="df"
+            )
+            view.save_metadata()
+
+            view = matrix_store.__class__(matrix_store.project_storage, [], "view")
+            assert view.exists
+            assert not view.empty
+            assert view.columns() == ["m_feature"]
+            assert view.matrix.columns.tolist() == ["m_feature", "label"]
+            assert view.matrix.index.tolist() == [1, 2]
+            assert_almost_equal(view.matrix.values.tolist(), [[0.4, 0], [0.5, 1]])
+            assert view.labels().tolist() == [0, 1]
+
+    def test_MatrixStore_row_view(self):
+        data = OrderedDict(
+            [
+                ("entity_id", [1, 2, 1, 2, 1]),
+                (
+                    "as_of_date",
+                    pd.to_datetime(
+                        ["2016-01-01"] * 2 + ["2017-01-01"] * 2 + ["2018-01-01"]
+                    ),
+                ),
+                ("feature_one", [0.1, 0.2, 0.3, 0.4, 0.5]),
+                ("label", [0, 1, 0, 1, 1]),
+            ]
+        )
+        source_metadata = {
+            "label_name": "label",
+            "indices": ["entity_id", "as_of_date"],
+            "feature_names": ["feature_one"],
+            "as_of_times": [
+                datetime(2016, 1, 1),
+                datetime(2017, 1, 1),
+                datetime(2018, 1, 1),
+            ],
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            project_storage = ProjectStorage(tmpdir)
+            for store_class in self.store_classes:
+                source = store_class(project_storage, [], "source")
+                source.matrix = pd.DataFrame.from_dict(data).set_index(
+                    ["entity_id", "as_of_date"]
+                )
+                source.metadata = source_metadata
+                source.save()
+
+                view = store_class(project_storage, [], "view")
+                view.metadata = dict(
+                    source_metadata,
+                    as_of_times=source_metadata["as_of_times"][1:],
+                    source_matrix_uuid="source",
+                )
+                view.save_metadata()
+
+                view = store_class(project_storage, [], "view")
+                assert view.view_as_of_date_range == (
+                    pd.Timestamp("2017-01-01"),
+                    pd.Timestamp("2018-01-01"),
+                )
+                assert view.num_rows == 3
+                assert view.as_of_dates == [
+                    pd.Timestamp("2017-01-01"),
+                    pd.Timestamp("2018-01-01"),
+                ]
+                assert view.labels().tolist() == [0, 1, 1]
+
     def test_as_of_dates_entity_index(self):
         data = {
             "entity_id": [1, 2],
@@ -191,3 +315,148 @@ class MatrixStoreTest(unittest.TestCase):
             tocheck = CSVMatrixStore(project_storage, [], "test")
             assert tocheck.metadata == example.metadata
             assert tocheck.matrix.to_dict() == example.matrix.to_dict()
+
+
+class SavedMatrixStoresMixin(object):
+    """Runs the tests of MatrixStoreTest on matrices saved by each of the
+    store_classes, which store features as float32"""
+
+    def matrix_stores(self):
+        df = pd.DataFrame.from_dict(self.data_dict).set_index(["entity_id"])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            project_storage = ProjectStorage(tmpdir)
+            for store_class in self.store_classes:
+                store_class(
+                    project_storage, [], "df", matrix=df, metadata=self.metadata
+                ).save()
+                yield store_class(project_storage, [], "df")
+
+    def test_MatrixStore_head_of_matrix(self):
+        for matrix_store in self.matrix_stores():
+            head_of_matrix = matrix_store.head_of_matrix
+            assert head_of_matrix.index.tolist() == [1]
+            # the features are stored as float32
+            assert head_of_matrix.dtypes.tolist() == [np.float32, np.float32, np.int64]
+            assert_almost_equal(head_of_matrix.values.tolist(), [[0.5, 0.4, 0]])
+
+
+class ArrowMatrixStoreTest(SavedMatrixStoresMixin, MatrixStoreTest):
+    store_classes = (ParquetMatrixStore, FeatherMatrixStore)
+
+    def setUp(self):
+        pytest.importorskip("pyarrow")
+
+    def test_ArrowMatrixStore_projection_reads(self):
+        for matrix_store in self.matrix_stores():
+            assert matrix_store.labels().tolist() == [0, 1]
+            assert matrix_store.index.tolist() == [1, 2]
+            result = matrix_store.matrix_with_sorted_columns(["m_feature", "k_feature"])
+            assert_almost_equal(result.values.tolist(), [[0.4, 0.5], [0.5, 0.4]])
+            # the labels already read are left out of the matrix once loaded
+            assert matrix_store.matrix.columns.tolist() == ["k_feature", "m_feature"]
+
+    def test_ArrowMatrixStore_embedded_metadata(self):
+        for matrix_store in self.matrix_stores():
+            os.remove(matrix_store.metadata_base_store.path)
+            matrix_store = matrix_store.__class__(
+                matrix_store.project_storage, [], "df"
+            )
+            assert matrix_store.metadata == self.metadata
+            assert matrix_store.columns() == ["k_feature", "m_feature"]
+
+    def test_ParquetMatrixStore_row_groups(self):
+        data = OrderedDict(
+            [
+                ("entity_id", [1, 2, 3, 1, 2, 3]),
+                ("as_of_date", pd.to_datetime(["2017-01-01", "2016-01-01"] * 3)),
+                ("feature_one", [0.1, 0.2, 0.3, 0.4, 0.5, 0.6]),
+                ("label", [0, 1, 0, 1, 1, 0]),
+            ]
+        )
+        metadata = {
+            "label_name": "label",
+            "indices": ["entity_id", "as_of_date"],
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            project_storage = ProjectStorage(tmpdir)
+            matrix_store = ParquetMatrixStore(
+                project_storage,
+                [],
+                "source",
+                matrix=pd.DataFrame.from_dict(data).set_index(
+                    ["entity_id", "as_of_date"]
+                ),
+                metadata=metadata,
+            )
+            with patch("triage.component.catwalk.storage.PARQUET_ROW_GROUP_ROWS", 2):
+                matrix_store.save()
+
+            import pyarrow.parquet
+
+            parquet_file = pyarrow.parquet.ParquetFile(
+                matrix_store.matrix_base_store.path
+            )
+            # sorted by as of date into row groups
+            assert parquet_file.num_row_groups == 3
+            assert parquet_file.read_row_group(0).to_pandas()[
+                "as_of_date"
+            ].tolist() == [pd.Timestamp("2016-01-01")] * 2
+
+            matrix_store = ParquetMatrixStore(project_storage, [], "source")
+            rows = matrix_store._load(
+                columns=["label"],
+                as_of_date_range=(
+                    pd.Timestamp("2017-01-01"),
+                    pd.Timestamp("2017-01-01"),
+                ),
+            )
+            assert rows.columns.tolist() == ["entity_id", "as_of_date", "label"]
+            assert rows["entity_id"].tolist() == [1, 3, 2]
+            assert rows["label"].tolist() == [0, 0, 1]
+
+
+class NumpyMatrixStoreTest(SavedMatrixStoresMixin, MatrixStoreTest):
+    store_classes = (NumpyMatrixStore,)
+
+    def test_NumpyMatrixStore_memory_mapped(self):
+        for matrix_store in self.matrix_stores():
+            assert matrix_store.labels().tolist() == [0, 1]
+            assert matrix_store.index.tolist() == [1, 2]
+            # a read-only view of the memory-mapped file, not a copy
+            result = matrix_store.matrix_with_sorted_columns(["k_feature", "m_feature"])
+            assert not result.values.flags.writeable
+            assert_almost_equal(result.values.tolist(), [[0.5, 0.4], [0.4, 0.5]])
+            # columns in another order are copied
+            result = matrix_store.matrix_with_sorted_columns(["m_feature", "k_feature"])
+            assert_almost_equal(result.values.tolist(), [[0.4, 0.5], [0.5, 0.4]])
+
+            loaded = matrix_store.matrix
+            assert loaded.columns.tolist() == ["k_feature", "m_feature"]
+            # saving again replaces the file, leaving the loaded matrix intact
+            matrix_store.save_chunks([loaded.assign(label=[1, 0])])
+            assert_almost_equal(loaded.values.tolist(), [[0.5, 0.4], [0.4, 0.5]])
+            assert NumpyMatrixStore(
+                matrix_store.project_storage, [], "df"
+            ).labels().tolist() == [1, 0]
+
+    def test_NumpyMatrixStore_failed_save(self):
+        for matrix_store in self.matrix_stores():
+            loaded = matrix_store.matrix
+
+            def failing_chunks():
+                yield loaded.assign(label=[1, 0])
+                raise ValueError("extraction failed")
+
+            with self.assertRaises(ValueError):
+                matrix_store.save_chunks(failing_chunks())
+            # the matrix saved before is left in place, without temporary files
+            saved = NumpyMatrixStore(matrix_store.project_storage, [], "df")
+            assert saved.exists
+            assert saved.labels().tolist() == [0, 1]
+            directory = os.path.dirname(matrix_store.matrix_base_store.path)
+            assert not [name for name in os.listdir(directory) if "partial" in name]
+
+            # a matrix missing its rows doesn't exist
+            os.remove(saved.rows_base_store.path)
+            assert not NumpyMatrixStore(matrix_store.project_storage, [], "df").exists
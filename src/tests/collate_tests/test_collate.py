@@ -4,6 +4,8 @@
 Unit tests for `collate` module.
 
 """
+import pytest
+
 from triage.component.collate import Aggregate, Aggregation
 
 
@@ -173,3 +175,54 @@ def test_distinct():
             ),
         )
     ) == ["count(distinct (x,y)) FILTER (WHERE date < '2012-01-01')"]
+
+
+def test_aggregation_shards():
+    aggregation = Aggregation(
+        [Aggregate("x", ["sum", "max", "min"], {"coltype": "aggregate"})],
+        from_obj="source",
+        groups=["entity_id"],
+        state_table="tbl",
+    )
+    assert aggregation.get_shards() == [
+        ["source_entity_id_x_max", "source_entity_id_x_min", "source_entity_id_x_sum"]
+    ]
+    assert "SELECT * FROM" in aggregation.get_create()
+
+    # one key column leaves room for two columns and their imputation flags
+    aggregation.max_table_columns = 5
+    assert aggregation.get_shards() == [
+        ["source_entity_id_x_max", "source_entity_id_x_min"],
+        ["source_entity_id_x_sum"],
+    ]
+    assert aggregation.get_table_names(imputed=True) == [
+        '"source_aggregation_imputed"',
+        '"source_aggregation_imputed_2"',
+    ]
+    assert aggregation.get_create(shard=1).startswith(
+        'CREATE TABLE "source_aggregation_2" AS '
+        '(SELECT entity_id, "source_entity_id_x_sum" FROM'
+    )
+    impute_create = aggregation.get_impute_create(
+        impute_cols=["source_entity_id_x_max"],
+        nonimpute_cols=["source_entity_id_x_min", "source_entity_id_x_sum"],
+        shard=1,
+    )
+    assert '"source_entity_id_x_sum"' in impute_create
+    assert "source_entity_id_x_max" not in impute_create
+
+
+def test_aggregation_group_over_column_limit():
+    # group tables aren't sharded, so one group wider than the limit fails
+    # before any table is created
+    aggregation = Aggregation(
+        [
+            Aggregate("x{}".format(i), ["sum", "max"], {"coltype": "aggregate"})
+            for i in range(801)
+        ],
+        from_obj="source",
+        groups=["entity_id"],
+        state_table="tbl",
+    )
+    with pytest.raises(ValueError, match="1600"):
+        aggregation.get_creates()
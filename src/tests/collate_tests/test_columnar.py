@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""test_columnar
+
+Tests that the `collate.columnar` backend produces the same group tables as
+running aggregations in Postgres.
+
+"""
+import os
+import tempfile
+from datetime import date
+from decimal import Decimal
+
+import pytest
+import sqlalchemy
+import testing.postgresql
+
+from triage.component.collate import Aggregate, Aggregation, SpacetimeAggregation
+from triage.component.collate.columnar import (
+    ColumnarCleanup,
+    ColumnarExport,
+    get_columnar_inserts,
+)
+
+pytest.importorskip("duckdb")
+
+
+events_data = [
+    # entity id, event_date, outcome, zip_code
+    [1, date(2014, 1, 1), True, "60120"],
+    [1, date(2014, 11, 10), False, "60120"],
+    [1, date(2015, 1, 1), False, "60120"],
+    [1, date(2015, 11, 10), True, "60120"],
+    [2, date(2013, 6, 8), True, "60653"],
+    [2, date(2014, 6, 8), False, "60653"],
+    [3, date(2014, 3, 3), False, "60653"],
+    [3, date(2014, 7, 24), None, "60653"],
+    [3, date(2015, 3, 3), True, "60653"],
+    [3, date(2015, 7, 24), False, "60653"],
+    [4, date(2015, 12, 13), False, "01002"],
+    [4, date(2016, 12, 13), True, "01002"],
+]
+
+
+def _normalize(row):
+    # Postgres averages integers as numeric while DuckDB uses doubles
+    return {
+        key: round(float(value), 10) if isinstance(value, Decimal) else value
+        for key, value in row.items()
+    }
+
+
+def _group_table_rows(engine, aggregation, columnar):
+    with engine.begin() as conn:
+        creates = aggregation.get_creates()
+        drops = aggregation.get_drops()
+        if columnar:
+            database_path = os.path.join(tempfile.mkdtemp(), "from_obj.duckdb")
+            inserts = get_columnar_inserts(aggregation, database_path)
+            ColumnarExport(aggregation.from_obj, database_path).execute(conn)
+        else:
+            inserts = aggregation.get_inserts()
+        for group in aggregation.groups:
+            conn.execute(drops[group])
+            conn.execute(creates[group])
+            for insert in inserts[group]:
+                if columnar:
+                    insert.execute(conn)
+                else:
+                    conn.execute(insert)
+        if columnar:
+            ColumnarCleanup(database_path).execute(conn)
+            assert not os.path.exists(os.path.dirname(database_path))
+
+    return {
+        group: [
+            _normalize(dict(row))
+            for row in engine.execute(
+                "select * from %s order by 1, 2" % aggregation.get_table_name(group)
+            )
+        ]
+        for group in aggregation.groups
+    }
+
+
+@pytest.fixture
+def engine():
+    with testing.postgresql.Postgresql() as psql:
+        engine = sqlalchemy.create_engine(psql.url())
+        engine.execute(
+            "create table events "
+            "(entity_id int, event_date date, outcome bool, zip_code text)"
+        )
+        for event in events_data:
+            engine.execute("insert into events values (%s, %s, %s::bool, %s)", event)
+        yield engine
+
+
+def test_columnar_spacetime_equivalence(engine):
+    aggregation = SpacetimeAggregation(
+        aggregates=[
+            Aggregate("outcome::int", ["sum", "avg", "max"], {"coltype": "aggregate"}),
+            Aggregate("1", ["count"], {"coltype": "aggregate"}),
+        ],
+        from_obj="events",
+        groups=["entity_id", "zip_code"],
+        intervals=["1 year", "2 years", "all"],
+        dates=["2016-01-01", "2015-01-01"],
+        state_table="states",
+        state_group="entity_id",
+        date_column="event_date",
+        output_date_column="as_of_date",
+    )
+    postgres_rows = _group_table_rows(engine, aggregation, columnar=False)
+    columnar_rows = _group_table_rows(engine, aggregation, columnar=True)
+
+    assert all(postgres_rows.values())
+    assert columnar_rows == postgres_rows
+
+
+def test_columnar_aggregation_equivalence(engine):
+    aggregation = Aggregation(
+        aggregates=[
+            Aggregate("outcome::int", ["sum", "avg"], {"coltype": "aggregate"}),
+        ],
+        from_obj="events",
+        groups=["entity_id", "zip_code"],
+        state_table="states",
+        state_group="entity_id",
+    )
+    postgres_rows = _group_table_rows(engine, aggregation, columnar=False)
+    columnar_rows = _group_table_rows(engine, aggregation, columnar=True)
+
+    assert all(postgres_rows.values())
+    assert columnar_rows == postgres_rows
@@ -45,6 +45,9 @@ def test_mean_imputation():
     imp = ImputeMean(column="a__NULL_mean", coltype="categorical")
     assert imp.to_sql() == 'COALESCE("a__NULL_mean", 1) AS "a__NULL_mean" '
 
+    imp = ImputeMean(column="a", coltype="aggregate", mean_sql="imp._imp_mean_0")
+    assert imp.to_sql() == 'COALESCE("a", imp._imp_mean_0, 0) AS "a" '
+
 
 def test_constant_imputation():
     imp = ImputeConstant(column="a", coltype="aggregate", value=3.14)
@@ -124,6 +127,12 @@ def test_impute_binary_mode():
         'THEN 1 ELSE 0 END, 0) AS "a" '
     )
 
+    imp = ImputeBinaryMode(column="a", coltype="aggregate", mean_sql="imp._imp_mean_0")
+    assert (
+        imp.to_sql()
+        == 'COALESCE("a", CASE WHEN imp._imp_mean_0 > 0.5 THEN 1 ELSE 0 END, 0) AS "a" '
+    )
+
     try:
         imp = ImputeBinaryMode(column="a", coltype="categorical")
         imp.to_sql()
@@ -250,3 +250,146 @@ def test_input_min_date():
             st.validate(engine.connect())
         with pytest.raises(ValueError):
             st.execute(engine.connect())
+
+
+def test_validate_missing_state_dates():
+    with testing.postgresql.Postgresql() as psql:
+        engine = sqlalchemy.create_engine(psql.url())
+        engine.execute("create table states (entity_id int, date date)")
+        for state in state_data:
+            engine.execute("insert into states values (%s, %s)", state)
+
+        st = SpacetimeAggregation(
+            aggregates=[Aggregate("outcome::int", ["sum"], {})],
+            from_obj="events",
+            groups=["entity_id"],
+            intervals=["1y", "all"],
+            dates=["2016-01-01", "2015-01-01"],
+            state_table="states",
+            state_group="entity_id",
+            date_column='"date"',
+            input_min_date="2013-01-01",
+        )
+        st.validate(engine.connect())
+
+        st.dates = ["2016-01-01", "2015-01-01", "2014-07-01"]
+        with pytest.raises(ValueError, match="2014-07-01"):
+            st.validate(engine.connect())
+
+
+def test_prepared_inserts():
+    agg = Aggregate("outcome::int", ["sum", "avg"], {"coltype": "aggregate"})
+    date_agg = Aggregate("'{collate_date}'::date - event_date", ["min"], {})
+    st = SpacetimeAggregation(
+        aggregates=[agg, date_agg],
+        from_obj="events",
+        groups=["entity_id"],
+        intervals=["1y", "2y", "all"],
+        dates=["2016-01-01", "2015-01-01"],
+        state_table="states",
+        state_group="entity_id",
+        date_column="event_date",
+        output_date_column="as_of_date",
+        input_min_date="2013-01-01",
+    )
+
+    # one statement for all dates, with the date as a parameter
+    template = st.get_select_templates()["entity_id"]
+    assert "$1" in template
+    assert "2016-01-01" not in template and "2015-01-01" not in template
+
+    with testing.postgresql.Postgresql() as psql:
+        engine = sqlalchemy.create_engine(psql.url())
+        engine.execute(
+            "create table events (entity_id int, event_date date, outcome bool)"
+        )
+        for event in events_data:
+            engine.execute("insert into events values (%s, %s, %s::bool)", event)
+
+        rows = {}
+        for prepared in (False, True):
+            inserts = st.get_prepared_inserts() if prepared else st.get_inserts()
+            with engine.begin() as conn:
+                conn.execute(st.get_drops()["entity_id"])
+                conn.execute(st.get_creates()["entity_id"])
+                for insert in inserts["entity_id"]:
+                    if prepared:
+                        insert.execute(conn)
+                    else:
+                        conn.execute(insert)
+            rows[prepared] = [
+                dict(row)
+                for row in engine.execute(
+                    "select * from events_entity_id order by entity_id, as_of_date"
+                )
+            ]
+
+        assert len(rows[False]) == 7
+        assert rows[True] == rows[False]
+
+
+def test_prepared_inserts_percent():
+    # a % in a quantity is not taken for a parameter by the driver
+    agg = Aggregate("entity_id % 2", ["max"], {})
+    st = SpacetimeAggregation(
+        aggregates=[agg],
+        from_obj="events",
+        groups=["entity_id"],
+        intervals=["all"],
+        dates=["2016-01-01"],
+        state_table="states",
+        state_group="entity_id",
+        date_column="event_date",
+        output_date_column="as_of_date",
+        input_min_date="2013-01-01",
+    )
+    with testing.postgresql.Postgresql() as psql:
+        engine = sqlalchemy.create_engine(psql.url())
+        engine.execute(
+            "create table events (entity_id int, event_date date, outcome bool)"
+        )
+        for event in events_data:
+            engine.execute("insert into events values (%s, %s, %s::bool)", event)
+
+        with engine.begin() as conn:
+            conn.execute(st.get_drops()["entity_id"])
+            conn.execute(st.get_creates()["entity_id"])
+            for insert in st.get_prepared_inserts()["entity_id"]:
+                insert.execute(conn)
+        rows = engine.execute(
+            "select * from events_entity_id order by entity_id"
+        ).fetchall()
+        assert [row[-1] for row in rows] == [1, 0, 1, 0]
+
+
+def test_restricted_entities():
+    agg = Aggregate("outcome::int", ["max"], {})
+    st = SpacetimeAggregation(
+        aggregates=[agg],
+        from_obj="events",
+        groups=["entity_id"],
+        intervals=["all"],
+        dates=["2016-01-01"],
+        state_table="states",
+        state_group="entity_id",
+        date_column="event_date",
+        output_date_column="as_of_date",
+    )
+    # the copy only aggregates the entities matching the filter
+    restricted = st.restricted("entity_id < 3")
+    assert st.entity_filter is None
+    with testing.postgresql.Postgresql() as psql:
+        engine = sqlalchemy.create_engine(psql.url())
+        engine.execute(
+            "create table events (entity_id int, event_date date, outcome bool)"
+        )
+        for event in events_data:
+            engine.execute("insert into events values (%s, %s, %s::bool)", event)
+
+        with engine.begin() as conn:
+            conn.execute(restricted.get_drops()["entity_id"])
+            conn.execute(restricted.get_creates()["entity_id"])
+            for insert in restricted.get_prepared_inserts()["entity_id"]:
+                insert.execute(conn)
+        rows = engine.execute("select entity_id from events_entity_id").fetchall()
+        assert sorted(row[0] for row in rows) == [1, 2]
@@ -235,6 +235,96 @@ def test_restart_experiment(experiment_class):
             assert not experiment.make_entity_date_table.called
 
 
+def test_rq_experiment_duckdb_backend():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        with TemporaryDirectory() as temp_dir:
+            with pytest.raises(ValueError):
+                RQExperiment(
+                    redis_connection=fakeredis.FakeStrictRedis(),
+                    config=sample_config(),
+                    db_engine=db_engine,
+                    project_path=os.path.join(temp_dir, "inspections"),
+                    feature_backend="duckdb",
+                )
+
+
+def test_entity_sharded_experiment():
+    matrices = {}
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        populate_source_data(db_engine)
+        temp_dir = TemporaryDirectory()
+        experiment = SingleThreadedExperiment(
+            config=sample_config(),
+            db_engine=db_engine,
+            project_path=os.path.join(temp_dir.name, "inspections"),
+        )
+        experiment.generate_matrices()
+        for matrix_uuid in experiment.matrix_build_tasks:
+            store = experiment.matrix_storage_engine.get_store(matrix_uuid)
+            matrices[matrix_uuid] = store.matrix
+        temp_dir.cleanup()
+
+    with testing.postgresql.Postgresql() as postgresql, TemporaryDirectory() as tmp:
+        with testing.postgresql.Postgresql() as first_shard:
+            with testing.postgresql.Postgresql() as second_shard:
+                db_engine = create_engine(postgresql.url())
+                shard_db_engines = [
+                    create_engine(first_shard.url()),
+                    create_engine(second_shard.url()),
+                ]
+                # the primary runs the choice queries, the shards build features
+                for engine in [db_engine] + shard_db_engines:
+                    populate_source_data(engine)
+                experiment = SingleThreadedExperiment(
+                    config=sample_config(),
+                    db_engine=db_engine,
+                    project_path=os.path.join(tmp, "inspections"),
+                    shard_db_engines=shard_db_engines,
+                )
+                experiment.generate_matrices()
+
+                # each shard keeps its own entities
+                cohorts = [
+                    set(
+                        row[0]
+                        for row in engine.execute(
+                            "select entity_id from {}".format(
+                                experiment.sparse_states_table_name
+                            )
+                        )
+                    )
+                    for engine in shard_db_engines
+                ]
+                assert cohorts[0] and cohorts[1]
+                assert not cohorts[0] & cohorts[1]
+                labelled = [
+                    set(
+                        row[0]
+                        for row in engine.execute(
+                            "select entity_id from {}".format(
+                                experiment.labels_table_name
+                            )
+                        )
+                    )
+                    for engine in shard_db_engines
+                ]
+                assert not labelled[0] & labelled[1]
+
+                # and the gathered matrices match the unsharded ones
+                assert set(experiment.matrix_build_tasks) == set(matrices)
+                for matrix_uuid, matrix in matrices.items():
+                    store = experiment.matrix_storage_engine.get_store(matrix_uuid)
+                    sharded_matrix = store.matrix
+                    assert list(sharded_matrix.columns) == list(matrix.columns)
+                    assert sharded_matrix.index.equals(matrix.index)
+                    assert (
+                        sharded_matrix.astype(float).values
+                        == pytest.approx(matrix.astype(float).values)
+                    )
+
+
 class TestConfigVersion(TestCase):
     def test_load_if_right_version(self):
         experiment_config = sample_config()
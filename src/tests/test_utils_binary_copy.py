@@ -0,0 +1,123 @@
+import struct
+from datetime import datetime
+
+import numpy
+import pandas
+import sqlalchemy
+import testing.postgresql
+
+from triage.util import binary_copy
+from triage.util.binary_copy import (
+    FLOAT8,
+    INT4,
+    SIGNATURE,
+    TIMESTAMP,
+    TRAILER,
+    RowDecoder,
+    copy_to_arrays,
+    read_sql,
+)
+
+
+def binary_copy_rows(rows):
+    """A binary COPY of rows of (int4, float8, timestamp) values and null flags"""
+    data = SIGNATURE + struct.pack(">ii", 0, 0)
+    for entity_id, score, microseconds in rows:
+        fields = [(">i", entity_id), (">d", score), (">q", microseconds)]
+        data += struct.pack(">h", 2 * len(fields))
+        for value_format, value in fields:
+            data += struct.pack(">i", struct.calcsize(value_format))
+            data += struct.pack(value_format, value or 0)
+            data += struct.pack(">iB", 1, value is None)
+    return data + TRAILER
+
+
+def test_row_decoder(monkeypatch):
+    monkeypatch.setattr(binary_copy, "DECODE_BUFFER_BYTES", 64)
+    rows = [(i, i / 2, i * 86400 * 10 ** 6) for i in range(10)]
+    rows[3] = (3, None, None)
+    data = binary_copy_rows(rows)
+    for n_rows in (None, 10):
+        decoder = RowDecoder([INT4, FLOAT8, TIMESTAMP], n_rows)
+        # written in pieces cutting across rows, as the COPY streams in
+        for start in range(0, len(data), 50):
+            decoder.write(data[start:start + 50])
+        entity_ids, scores, dates = decoder.finish()
+        assert entity_ids.dtype == numpy.int32
+        assert entity_ids.tolist() == list(range(10))
+        assert numpy.isnan(scores[3])
+        assert scores[4] == 2.0
+        assert numpy.isnat(dates[3])
+        assert dates[2] == numpy.datetime64("2000-01-03")
+
+
+def test_row_decoder_unexpected_row_count():
+    decoder = RowDecoder([INT4, FLOAT8, TIMESTAMP], n_rows=3)
+    decoder.write(binary_copy_rows([(1, 1.0, 0)]))
+    try:
+        decoder.finish()
+        assert False, "should have raised"
+    except ValueError:
+        pass
+
+
+def test_copy_to_arrays():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = sqlalchemy.create_engine(postgresql.url())
+        engine.execute(
+            """create table results (entity_id int, model_id bigint, rank smallint,
+            score numeric(6, 5), weight real, flag bool, as_of_date timestamp,
+            label_date date)"""
+        )
+        engine.execute(
+            """insert into results values
+            (1, 10, 1, 0.5, 1.5, true, '2016-01-01', '2016-02-01'),
+            (2, 10, null, null, null, null, null, null)"""
+        )
+        columns = dict(
+            copy_to_arrays(engine, "select * from results order by entity_id;")
+        )
+        assert columns["entity_id"].dtype == numpy.int32
+        assert columns["entity_id"].tolist() == [1, 2]
+        assert columns["model_id"].dtype == numpy.int64
+        assert columns["score"][0] == 0.5
+        assert columns["weight"].dtype == numpy.float32
+        for name in ("rank", "score", "weight", "flag"):
+            assert numpy.isnan(columns[name][1])
+        assert columns["flag"][0] == 1.0
+        assert columns["as_of_date"][0] == numpy.datetime64("2016-01-01")
+        assert columns["label_date"][0] == numpy.datetime64("2016-02-01")
+        assert numpy.isnat(columns["label_date"][1])
+
+        # larger results are decoded in chunks, into arrays allocated up front
+        (_, values), = copy_to_arrays(
+            engine, "select generate_series(1, 100000) as value", n_rows=100000
+        )
+        assert values.tolist() == list(range(1, 100001))
+
+
+def test_read_sql():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = sqlalchemy.create_engine(postgresql.url())
+        engine.execute(
+            "create table predictions (model_id int, as_of_date timestamp, "
+            "score numeric(6, 5), label text)"
+        )
+        engine.execute(
+            "insert into predictions values (1, '2016-01-01', 0.25, 'a'), "
+            "(2, '2016-01-01', 0.75, 'b')"
+        )
+        df = read_sql(
+            "select model_id, as_of_date, score from predictions "
+            "where model_id in %(model_ids)s order by model_id",
+            engine,
+            index_col="model_id",
+            params={"model_ids": (1, 2)},
+        )
+        assert df.index.tolist() == [1, 2]
+        assert df["as_of_date"].tolist() == [pandas.Timestamp(datetime(2016, 1, 1))] * 2
+        assert df["score"].tolist() == [0.25, 0.75]
+
+        # text can not be decoded, so is read with pandas
+        df = read_sql("select * from predictions order by model_id", engine)
+        assert df["label"].tolist() == ["a", "b"]
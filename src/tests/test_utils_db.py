@@ -0,0 +1,89 @@
+import pickle
+from unittest import mock
+
+import sqlalchemy
+import testing.postgresql
+
+from triage.util.db import create_engine, read_engine, SerializableDbEngine
+
+
+def marked_databases(primary, replica):
+    """Tag a primary and a replica database so reads can be traced"""
+    for postgresql, name in ((primary, "primary"), (replica, "replica")):
+        engine = sqlalchemy.create_engine(postgresql.url())
+        engine.execute("create table marker (name text)")
+        engine.execute("insert into marker values ('{}')".format(name))
+        engine.dispose()
+
+
+def read_marker(db_engine):
+    return db_engine.execute("select name from marker").scalar()
+
+
+def test_reads_routed_to_replica():
+    with testing.postgresql.Postgresql() as primary:
+        with testing.postgresql.Postgresql() as replica:
+            marked_databases(primary, replica)
+            db_engine = create_engine(primary.url(), replica_urls=[replica.url()])
+
+            assert read_marker(db_engine) == "primary"
+            assert read_marker(db_engine.for_reads()) == "replica"
+            assert read_marker(read_engine(db_engine)) == "replica"
+            # whether a database that is not a standby has what was just
+            # written can't be known, so those reads go to the primary
+            assert read_marker(db_engine.for_reads(after_writes=True)) == "primary"
+
+
+def test_reads_fall_back_to_primary():
+    with testing.postgresql.Postgresql() as primary:
+        with testing.postgresql.Postgresql() as replica:
+            marked_databases(primary, replica)
+            unreachable_url = replica.url().replace("/test", "/no_such_database")
+            db_engine = create_engine(
+                primary.url(), replica_urls=[unreachable_url, replica.url()]
+            )
+            # the next replica is used if one can't be reached
+            assert read_marker(db_engine.for_reads()) == "replica"
+
+            db_engine = create_engine(primary.url(), replica_urls=[unreachable_url])
+            assert read_marker(db_engine.for_reads()) == "primary"
+
+
+def test_stale_replica_not_read():
+    with testing.postgresql.Postgresql() as primary:
+        with testing.postgresql.Postgresql() as replica:
+            marked_databases(primary, replica)
+            db_engine = create_engine(
+                primary.url(), replica_urls=[replica.url()], max_replica_lag=30
+            )
+            with mock.patch.object(
+                SerializableDbEngine, "_replica_lag", return_value=120
+            ):
+                assert read_marker(db_engine.for_reads()) == "primary"
+            with mock.patch.object(
+                SerializableDbEngine, "_replica_lag", return_value=10
+            ):
+                assert read_marker(db_engine.for_reads()) == "replica"
+
+
+def test_replicas_survive_serialization():
+    with testing.postgresql.Postgresql() as primary:
+        with testing.postgresql.Postgresql() as replica:
+            marked_databases(primary, replica)
+            db_engine = pickle.loads(
+                pickle.dumps(
+                    create_engine(
+                        primary.url(), replica_urls=[replica.url()], max_replica_lag=5
+                    )
+                )
+            )
+            assert db_engine.max_replica_lag == 5
+            assert read_marker(db_engine.for_reads()) == "replica"
+
+
+def test_read_engine_without_replicas():
+    with testing.postgresql.Postgresql() as primary:
+        db_engine = sqlalchemy.create_engine(primary.url())
+        assert read_engine(db_engine) is db_engine
+        triage_engine = create_engine(primary.url())
+        assert read_engine(triage_engine) is triage_engine
@@ -1,10 +1,14 @@
+import pytest
 from sqlalchemy import create_engine
 import testing.postgresql
 
 from triage.component.catwalk.db import ensure_db
 
 from tests.utils import sample_config, populate_source_data
-from triage.experiments.validate import ExperimentValidator
+from triage.experiments.validate import (
+    ExperimentValidator,
+    FeatureAggregationsValidator,
+)
 
 
 def test_experiment_validator():
@@ -13,3 +17,62 @@ def test_experiment_validator():
         ensure_db(db_engine)
         populate_source_data(db_engine)
         ExperimentValidator(db_engine).run(sample_config())
+
+
+def test_experiment_validator_cached():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        ExperimentValidator(db_engine).run(sample_config())
+        sections = set(
+            row[0]
+            for row in db_engine.execute(
+                "select section from model_metadata.validated_config_sections"
+            )
+        )
+        assert {"feature_aggregations", "cohort_config", "grid_config"} <= sections
+
+        # the feature aggregations are not checked against the database again
+        db_engine.execute("drop table cat_complaints")
+        ExperimentValidator(db_engine).run(sample_config())
+        with pytest.raises(ValueError):
+            ExperimentValidator(db_engine, cache=False).run(sample_config())
+
+        # changed sections are validated again
+        config = sample_config()
+        config["feature_aggregations"][0]["intervals"] = ["1year", "2year"]
+        with pytest.raises(ValueError, match="cat_complaints"):
+            ExperimentValidator(db_engine).run(config)
+
+
+def test_experiment_validator_nonstrict_not_cached():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        populate_source_data(db_engine)
+        config = sample_config()
+        config["label_config"]["query"] = (
+            "select * from no_such_table "
+            "where '{as_of_date}'::date > now() - '{label_timespan}'::interval"
+        )
+        ExperimentValidator(db_engine, strict=False).run(config)
+        sections = set(
+            row[0]
+            for row in db_engine.execute(
+                "select section from model_metadata.validated_config_sections"
+            )
+        )
+        assert "label_config" not in sections
+        assert "feature_aggregations" in sections
+
+
+def test_feature_aggregations_validator_concurrent_probes():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        populate_source_data(db_engine)
+        config = sample_config()["feature_aggregations"]
+        config[1]["from_obj"] = "no_such_table"
+        # the error of the failing probe is raised, whichever order they run in
+        with pytest.raises(ValueError, match="no_such_table"):
+            FeatureAggregationsValidator(db_engine, n_db_threads=4).run(config)
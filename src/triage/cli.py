@@ -10,12 +10,23 @@ from descriptors import cachedproperty
 from argcmdr import RootCommand, Command, main, cmdmethod
 from sqlalchemy.engine.url import URL
 
-from triage.component.architect.feature_generators import FeatureGenerator
+from triage.component.architect.feature_generators import (
+    FEATURE_BACKENDS,
+    FeatureGenerator,
+)
+from triage.component.architect.builders import MATRIX_EXTRACTIONS
+from triage.component.architect.feature_profiling import format_report
 from triage.component.audition import AuditionRunner
 from triage.component.results_schema import upgrade_db, stamp_db, REVISION_MAPPING
 from triage.component.timechop import Timechop
 from triage.component.timechop.plotting import visualize_chops
-from triage.component.catwalk.storage import CSVMatrixStore, HDFMatrixStore
+from triage.component.catwalk.storage import (
+    CSVMatrixStore,
+    FeatherMatrixStore,
+    HDFMatrixStore,
+    NumpyMatrixStore,
+    ParquetMatrixStore,
+)
 from triage.experiments import (
     CONFIG_VERSION,
     MultiCoreExperiment,
@@ -72,9 +83,34 @@ class Triage(RootCommand):
         spec.loader.exec_module(triage_config)
         logging.info(f"Setup module loaded")
 
+    @cachedproperty
+    def dbconfig(self):
+        return yaml.load(self.args.dbfile)
+
     @cachedproperty
     def db_url(self):
-        dbconfig = yaml.load(self.args.dbfile)
+        return self.db_url_from_config(self.dbconfig)
+
+    @cachedproperty
+    def db_engine_kwargs(self):
+        """Read replicas given in the database connection file, as a list of
+        connection settings under 'replicas', with the most seconds they may
+        lag behind under 'max_replica_lag'"""
+        kwargs = {
+            "replica_urls": [
+                self.db_url_from_config(replica)
+                for replica in self.dbconfig.get("replicas", [])
+            ]
+        }
+        if "max_replica_lag" in self.dbconfig:
+            kwargs["max_replica_lag"] = self.dbconfig["max_replica_lag"]
+        return kwargs
+
+    def db_url_from_file(self, dbfile):
+        return self.db_url_from_config(yaml.load(dbfile))
+
+    @staticmethod
+    def db_url_from_config(dbconfig):
         db_url = URL(
             "postgres",
             host=dbconfig["host"],
@@ -127,19 +163,43 @@ class FeatureTest(Command):
         parser.add_argument(
             "as_of_date",
             type=valid_date,
-            help="The date as of which to run features. Format YYYY-MM-DD",
+            nargs="+",
+            help="The date(s) as of which to run features. Format YYYY-MM-DD",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Instead of creating the features, run their queries under "
+            "EXPLAIN ANALYZE and report on them. The query plans are stored in "
+            "the features_test.feature_profiles table",
+        )
+        parser.add_argument(
+            "--profile-sample",
+            type=int,
+            default=None,
+            help="Number of the given dates to profile (default: all)",
         )
 
     def __call__(self, args):
         self.root.setup()  # Loading configuration (if exists)
         db_engine = create_engine(self.root.db_url)
         feature_config = yaml.load(args.feature_config_file)
+        feature_generator = FeatureGenerator(db_engine, "features_test")
+
+        if args.profile:
+            report = feature_generator.profile(
+                feature_aggregation_config=feature_config,
+                feature_dates=args.as_of_date,
+                sample_size=args.profile_sample,
+            )
+            print(format_report(report))
+            return
 
-        FeatureGenerator(db_engine, "features_test").create_features_before_imputation(
-            feature_aggregation_config=feature_config, feature_dates=[args.as_of_date]
+        feature_generator.create_features_before_imputation(
+            feature_aggregation_config=feature_config, feature_dates=args.as_of_date
         )
         logging.info(
-            "Features created for feature_config %s and date %s",
+            "Features created for feature_config %s and dates %s",
             feature_config,
             args.as_of_date,
         )
@@ -152,6 +212,9 @@ class Experiment(Command):
     matrix_storage_map = {
         "csv": CSVMatrixStore,
         "hdf": HDFMatrixStore,
+        "parquet": ParquetMatrixStore,
+        "feather": FeatherMatrixStore,
+        "numpy": NumpyMatrixStore,
     }
     matrix_storage_default = "csv"
 
@@ -182,6 +245,47 @@ class Experiment(Command):
             default=self.matrix_storage_default,
             help=f"The matrix storage format to use. [default: {self.matrix_storage_default}]"
         )
+        parser.add_argument(
+            "--feature-backend",
+            choices=FEATURE_BACKENDS,
+            default="postgres",
+            help="where to evaluate feature aggregations [default: postgres]",
+        )
+        parser.add_argument(
+            "--matrix-extraction",
+            choices=MATRIX_EXTRACTIONS,
+            default="tables",
+            help="how to extract matrices from the database: a query per feature "
+            "table, queries joining them all, or assembled from blocks of feature "
+            "rows per as of date cached in project storage [default: tables]",
+        )
+        parser.add_argument(
+            "--matrix-extraction-connections",
+            type=natural_number,
+            default=1,
+            help="number of feature tables of each matrix to extract concurrently, "
+            "each on its own database connection [default: 1]",
+        )
+        parser.add_argument(
+            "--prune-features",
+            action="store_true",
+            help="leave out of each train matrix, and its test matrices, the "
+            "features that are null or constant in its rows or duplicate another",
+        )
+        parser.add_argument(
+            "--matrix-views",
+            action="store_true",
+            help="build matrices differing only in their feature groups, or train "
+            "matrices only in their max_training_history, as views of one matrix "
+            "with all of their rows and columns",
+        )
+        parser.add_argument(
+            "--shard-dbfile",
+            nargs="+",
+            type=argparse.FileType("r"),
+            help="database connection files of the databases to partition "
+            "entities across; the cohort, labels and features are built in each",
+        )
         parser.add_argument("--replace", dest="replace", action="store_true")
         parser.add_argument(
             "-v",
@@ -208,14 +312,24 @@ class Experiment(Command):
         self.root.setup()  # Loading configuration (if exists)
         db_url = self.root.db_url
         config = yaml.load(self.args.config)
-        db_engine = create_engine(db_url)
+        db_engine = create_engine(db_url, **self.root.db_engine_kwargs)
         common_kwargs = {
             "db_engine": db_engine,
             "project_path": self.args.project_path,
             "config": config,
             "replace": self.args.replace,
             "matrix_storage_class": self.matrix_storage_map[self.args.matrix_format],
+            "feature_backend": self.args.feature_backend,
+            "matrix_extraction": self.args.matrix_extraction,
+            "matrix_views": self.args.matrix_views,
+            "matrix_extraction_connections": self.args.matrix_extraction_connections,
+            "prune_features": self.args.prune_features,
         }
+        if self.args.shard_dbfile:
+            common_kwargs["shard_db_engines"] = [
+                create_engine(self.root.db_url_from_file(dbfile))
+                for dbfile in self.args.shard_dbfile
+            ]
         if self.args.n_db_processes > 1 or self.args.n_processes > 1:
             experiment = MultiCoreExperiment(
                 n_db_processes=self.args.n_db_processes,
@@ -279,7 +393,7 @@ class Audition(Command):
         db_url = self.root.db_url
         dir_plot = self.args.directory
         config = yaml.load(self.args.config)
-        db_engine = create_engine(db_url)
+        db_engine = create_engine(db_url, **self.root.db_engine_kwargs)
         return AuditionRunner(config, db_engine, dir_plot)
 
     def __call__(self, args):
@@ -1,14 +1,40 @@
+import copy
 import io
 import json
 import logging
+import numpy
 import pandas
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
+from triage.component.architect.feature_blocks import FeatureBlocks
+from triage.component.architect.matrix_statistics import (
+    MatrixStatistics,
+    save_view_statistics,
+)
 from triage.component.results_schema import Matrix
 from triage.database_reflection import table_has_data
+from triage.util.binary_copy import UnsupportedColumnTypes, copy_to_arrays, copy_to_df
+from triage.util.db import read_engine
 from triage.util.pandas import downcast_matrix
 
+# how matrices are extracted from the database: with a query for each feature
+# table and the labels, merged in pandas ('tables'), with queries joining them
+# all in the database ('wide'), or assembled from blocks of each feature table's
+# rows for each as of date, cached in project storage ('blocks')
+MATRIX_EXTRACTIONS = ("tables", "wide", "blocks")
+
+# the most values each query of a wide extraction returns, by which the rows of
+# a matrix are split into chunks of entities
+WIDE_EXTRACTION_CHUNK_VALUES = 10000000
+
+# the most columns each query of a wide extraction selects, as Postgres returns
+# at most 1664 columns from a query; wider matrices are read by several queries
+WIDE_EXTRACTION_MAX_COLUMNS = 1600
+
 
 class BuilderBase(object):
     def __init__(
@@ -19,18 +45,82 @@ class BuilderBase(object):
         experiment_hash,
         replace=True,
         include_missing_labels_in_train_as=None,
+        entity_shards=None,
+        extraction="tables",
+        wide_chunk_values=WIDE_EXTRACTION_CHUNK_VALUES,
+        extraction_connections=1,
     ):
+        if extraction not in MATRIX_EXTRACTIONS:
+            raise ValueError(
+                "extraction must be one of {}, not {}".format(
+                    MATRIX_EXTRACTIONS, extraction
+                )
+            )
         self.db_config = db_config
         self.matrix_storage_engine = matrix_storage_engine
         self.db_engine = engine
         self.experiment_hash = experiment_hash
         self.replace = replace
         self.include_missing_labels_in_train_as = include_missing_labels_in_train_as
+        # the databases the cohort, labels and features are partitioned across,
+        # if not the results database (see architect.entity_shards)
+        self.entity_shards = entity_shards
+        self.extraction = extraction
+        self.wide_chunk_values = wide_chunk_values
+        # how many feature tables of a matrix are extracted at once, each on its
+        # own database connection
+        self.extraction_connections = extraction_connections
+        # the engine a matrix's data is read from, once resolved (see
+        # reading_matrix())
+        self.read_db_engine = None
+        self._feature_blocks = None
 
     @property
     def sessionmaker(self):
         return sessionmaker(bind=self.db_engine)
 
+    @property
+    def feature_blocks(self):
+        """The cache of feature blocks in the project's storage"""
+        if self._feature_blocks is None:
+            project_storage = self.matrix_storage_engine.project_storage
+            self._feature_blocks = FeatureBlocks(
+                project_storage.feature_block_storage_engine()
+            )
+        return self._feature_blocks
+
+    @property
+    def data_db_engines(self):
+        """The databases holding the cohort, labels and features"""
+        if self.entity_shards is not None:
+            return self.entity_shards.db_engines
+        return [self.db_engine]
+
+    def for_shard(self, db_engine):
+        """A copy of this builder reading the cohort, labels and features from
+        the given shard database"""
+        builder = copy.copy(self)
+        builder.db_engine = db_engine
+        builder.entity_shards = None
+        builder.read_db_engine = None
+        return builder
+
+    def reading_matrix(self):
+        """A copy of this builder reading a matrix's data from the engine
+        picked once its entity-date table is written (see
+        triage.util.db.read_engine()), rather than picking one for each query"""
+        builder = copy.copy(self)
+        builder.read_db_engine = read_engine(self.db_engine, after_writes=True)
+        return builder
+
+    def _read_engine(self):
+        """The engine to read a matrix's data from, picked for this query unless
+        the builder is reading a matrix (see reading_matrix())"""
+        if self.read_db_engine is not None:
+            return self.read_db_engine
+        # the entity-date table was just created, so a replica must have caught up
+        return read_engine(self.db_engine, after_writes=True)
+
     def validate(self):
         for expected_db_config_val in [
             "features_schema_name",
@@ -243,17 +333,21 @@ class MatrixBuilder(BuilderBase):
         :rtype: none
         """
         logging.info("popped matrix %s build off the queue", matrix_uuid)
-        if not table_has_data(
-            self.db_config["sparse_state_table_name"], self.db_engine
+        if not any(
+            table_has_data(self.db_config["sparse_state_table_name"], db_engine)
+            for db_engine in self.data_db_engines
         ):
             logging.warning("cohort table is not populated, cannot build matrix")
             return
-        if not table_has_data(
-            "{}.{}".format(
-                self.db_config["labels_schema_name"],
-                self.db_config["labels_table_name"],
-            ),
-            self.db_engine,
+        if not any(
+            table_has_data(
+                "{}.{}".format(
+                    self.db_config["labels_schema_name"],
+                    self.db_config["labels_table_name"],
+                ),
+                db_engine,
+            )
+            for db_engine in self.data_db_engines
         ):
             logging.warning("labels table is not populated, cannot build matrix")
             return
@@ -263,34 +357,216 @@ class MatrixBuilder(BuilderBase):
             logging.info("Skipping %s because matrix already exists", matrix_uuid)
             return
 
+        source_matrix_uuid = matrix_metadata.get("source_matrix_uuid")
+        if source_matrix_uuid is not None:
+            if not self.matrix_storage_engine.get_store(source_matrix_uuid).exists:
+                logging.warning(
+                    "Source matrix %s of matrix %s was not built, cannot build "
+                    "matrix",
+                    source_matrix_uuid,
+                    matrix_uuid,
+                )
+                return
+            # only the metadata of a view (see Planner) is saved, as its rows
+            # are read from the source matrix
+            matrix_store.metadata = matrix_metadata
+            matrix_store.save_metadata()
+            if matrix_store.view_as_of_date_range is None:
+                session = self.sessionmaker()
+                num_observations = (
+                    session.query(Matrix.num_observations)
+                    .filter_by(matrix_uuid=source_matrix_uuid)
+                    .scalar()
+                )
+                session.close()
+            else:
+                num_observations = matrix_store.num_rows
+            logging.info(
+                "Matrix %s saved as a view of matrix %s",
+                matrix_uuid,
+                source_matrix_uuid,
+            )
+        else:
+            statistics = MatrixStatistics(label_name)
+            num_observations = self._extract_and_save(
+                matrix_store,
+                as_of_times,
+                label_name,
+                label_type,
+                feature_dictionary,
+                matrix_metadata,
+                matrix_uuid,
+                matrix_type,
+                statistics,
+            )
+            if num_observations is None:
+                return
+        logging.info("Matrix {matrix_uuid} saved")
+        # If completely archived, save its information to matrices table
+        # At this point, existence of matrix already tested, so no need to delete from db
+        if matrix_type == "train":
+            lookback = matrix_metadata["max_training_history"]
+        else:
+            lookback = matrix_metadata["test_duration"]
+
+        matrix = Matrix(
+            matrix_id=matrix_metadata["matrix_id"],
+            matrix_uuid=matrix_uuid,
+            matrix_type=matrix_type,
+            labeling_window=matrix_metadata["label_timespan"],
+            num_observations=num_observations,
+            lookback_duration=lookback,
+            feature_start_time=matrix_metadata["feature_start_time"],
+            matrix_metadata=json.dumps(matrix_metadata, sort_keys=True, default=str),
+            built_by_experiment=self.experiment_hash
+        )
+        session = self.sessionmaker()
+        session.merge(matrix)
+        session.commit()
+        session.close()
+
+        # the statistics of the matrix's columns and labels, for looking up
+        # without loading it (see architect.matrix_statistics)
+        if source_matrix_uuid is not None:
+            save_view_statistics(
+                self.db_engine,
+                matrix_uuid,
+                source_matrix_uuid,
+                matrix_metadata["feature_names"] + [label_name],
+                matrix_store.view_as_of_date_range,
+            )
+        else:
+            statistics.save(self.db_engine, matrix_uuid)
+
+    def _extract_and_save(
+        self,
+        matrix_store,
+        as_of_times,
+        label_name,
+        label_type,
+        feature_dictionary,
+        matrix_metadata,
+        matrix_uuid,
+        matrix_type,
+        statistics=None,
+    ):
+        """ Extract a matrix and save it with its metadata, taking the same
+        arguments as build_matrix() along with the matrix's store
+
+        :param statistics: statistics to add the matrix's rows to
+        :type statistics: triage.component.architect.matrix_statistics.MatrixStatistics
+
+        :return: the number of rows saved, or None if the matrix can't be built
+        :rtype: int
+        """
         logging.info(
             "Creating matrix %s > %s",
             matrix_metadata["matrix_id"],
             matrix_store.matrix_base_store.path,
         )
-        # make the entity time table and query the labels and features tables
-        logging.info("Making entity date table for matrix %s", matrix_uuid)
-        try:
-            entity_date_table_name = self.make_entity_date_table(
+        if self.entity_shards is None and self.extraction == "wide":
+            # the matrix is written to storage as its rows are extracted
+            num_observations = self.stream_matrix_data(
+                matrix_store,
                 as_of_times,
                 label_name,
                 label_type,
-                matrix_metadata["state"],
-                matrix_type,
+                feature_dictionary,
+                matrix_metadata,
                 matrix_uuid,
+                matrix_type,
+                statistics,
+            )
+            if num_observations is None:
+                return None
+        else:
+            if self.entity_shards is not None:
+                output = self.gather_matrix_data(
+                    as_of_times,
+                    label_name,
+                    label_type,
+                    feature_dictionary,
+                    matrix_metadata,
+                    matrix_uuid,
+                    matrix_type,
+                )
+            else:
+                output = self.matrix_data(
+                    as_of_times,
+                    label_name,
+                    label_type,
+                    feature_dictionary,
+                    matrix_metadata,
+                    matrix_uuid,
+                    matrix_type,
+                )
+            if output is None:
+                return None
+            if statistics is not None:
+                statistics.update(output)
+
+            # store the matrix
+            matrix_store.matrix = output
+            matrix_store.metadata = matrix_metadata
+            matrix_store.save()
+            num_observations = len(output)
+        return num_observations
+
+    def matrix_data(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        feature_dictionary,
+        matrix_metadata,
+        matrix_uuid,
+        matrix_type,
+    ):
+        """ Extract the labels and features of a matrix from the database and
+        merge them, taking the same arguments as build_matrix()
+
+        :return: the matrix, or None if its entity-date table can't be built
+        :rtype: pandas.DataFrame
+        """
+        # make the entity time table and query the labels and features tables
+        entity_date_table_name = self._matrix_entity_date_table(
+            as_of_times,
+            label_name,
+            label_type,
+            matrix_metadata,
+            matrix_uuid,
+            matrix_type,
+        )
+        if entity_date_table_name is None:
+            return None
+        builder = self.reading_matrix()
+        if self.extraction == "wide":
+            logging.info("Extracting matrix %s with joined queries", matrix_uuid)
+            output = builder.load_wide_data(
+                label_name,
+                label_type,
                 matrix_metadata["label_timespan"],
+                feature_dictionary,
+                entity_date_table_name,
             )
-        except ValueError as e:
-            logging.warning(
-                "Not able to build entity-date table due to: %s - will not build matrix",
-                exc_info=True,
+            logging.info(f"Matrix data extracted for matrix {matrix_uuid}")
+            return output
+        if self.extraction == "blocks":
+            logging.info("Assembling matrix %s from feature blocks", matrix_uuid)
+            output = builder.load_block_data(
+                label_name,
+                label_type,
+                matrix_metadata["label_timespan"],
+                feature_dictionary,
+                entity_date_table_name,
             )
-            return
+            logging.info(f"Matrix data assembled for matrix {matrix_uuid}")
+            return output
         logging.info(
             "Extracting feature group data from database into file " "for matrix %s",
             matrix_uuid,
         )
-        dataframes = self.load_features_data(
+        features_df = builder.join_features_data(
             as_of_times, feature_dictionary, entity_date_table_name, matrix_uuid
         )
         logging.info(f"Feature data extracted for matrix {matrix_uuid}")
@@ -298,48 +574,125 @@ class MatrixBuilder(BuilderBase):
             "Extracting label data from database into file for " "matrix %s",
             matrix_uuid,
         )
-        labels_df = self.load_labels_data(
+        labels_df = builder.load_labels_data(
             label_name,
             label_type,
             entity_date_table_name,
             matrix_uuid,
             matrix_metadata["label_timespan"],
         )
-        dataframes.insert(0, labels_df)
 
         logging.info(f"Label data extracted for matrix {matrix_uuid}")
         # stitch together the csvs
         logging.info("Merging feature files for matrix %s", matrix_uuid)
-        output = self.merge_feature_csvs(dataframes, matrix_uuid)
+        output = self.merge_feature_csvs([labels_df, features_df], matrix_uuid)
         logging.info(f"Features data merged for matrix {matrix_uuid}")
+        return output
 
-        # store the matrix
-        matrix_store.matrix = output
-        matrix_store.metadata = matrix_metadata
-        matrix_store.save()
-        logging.info("Matrix {matrix_uuid} saved")
-        # If completely archived, save its information to matrices table
-        # At this point, existence of matrix already tested, so no need to delete from db
-        if matrix_type == "train":
-            lookback = matrix_metadata["max_training_history"]
-        else:
-            lookback = matrix_metadata["test_duration"]
+    def stream_matrix_data(
+        self,
+        matrix_store,
+        as_of_times,
+        label_name,
+        label_type,
+        feature_dictionary,
+        matrix_metadata,
+        matrix_uuid,
+        matrix_type,
+        statistics=None,
+    ):
+        """ Extract a matrix with joined queries and save it as its rows are
+        extracted (see wide_data_chunks()), so that at most a chunk of its rows
+        is held in memory, taking the same arguments as build_matrix() along
+        with the matrix's store
 
-        matrix = Matrix(
-            matrix_id=matrix_metadata["matrix_id"],
-            matrix_uuid=matrix_uuid,
-            matrix_type=matrix_type,
-            labeling_window=matrix_metadata["label_timespan"],
-            num_observations=len(output),
-            lookback_duration=lookback,
-            feature_start_time=matrix_metadata["feature_start_time"],
-            matrix_metadata=json.dumps(matrix_metadata, sort_keys=True, default=str),
-            built_by_experiment=self.experiment_hash
+        :param matrix_store: the store to save the matrix and its metadata to
+        :param statistics: statistics to add each chunk of rows to
+        :type matrix_store: triage.component.catwalk.storage.MatrixStore
+        :type statistics: triage.component.architect.matrix_statistics.MatrixStatistics
+
+        :return: the number of rows saved, or None if the matrix's entity-date
+                 table can't be built
+        :rtype: int
+        """
+        entity_date_table_name = self._matrix_entity_date_table(
+            as_of_times,
+            label_name,
+            label_type,
+            matrix_metadata,
+            matrix_uuid,
+            matrix_type,
         )
-        session = self.sessionmaker()
-        session.merge(matrix)
-        session.commit()
-        session.close()
+        if entity_date_table_name is None:
+            return None
+        logging.info("Streaming matrix %s to storage", matrix_uuid)
+        builder = self.reading_matrix()
+        index = builder._wide_index(entity_date_table_name)
+        matrix_store.metadata = matrix_metadata
+        chunks = builder.wide_data_chunks(
+            index,
+            label_name,
+            label_type,
+            matrix_metadata["label_timespan"],
+            feature_dictionary,
+            entity_date_table_name,
+        )
+        if statistics is not None:
+            chunks = statistics.track(chunks)
+        matrix_store.save_chunks(chunks)
+        return len(index)
+
+    def _matrix_entity_date_table(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        matrix_metadata,
+        matrix_uuid,
+        matrix_type,
+    ):
+        """ Make the entity-date table of a matrix
+
+        :return: the table's name, or None if it can't be built
+        :rtype: str
+        """
+        logging.info("Making entity date table for matrix %s", matrix_uuid)
+        try:
+            return self.make_entity_date_table(
+                as_of_times,
+                label_name,
+                label_type,
+                matrix_metadata["state"],
+                matrix_type,
+                matrix_uuid,
+                matrix_metadata["label_timespan"],
+            )
+        except ValueError as e:
+            logging.warning(
+                "Not able to build entity-date table due to: %s - will not build matrix",
+                exc_info=True,
+            )
+            return None
+
+    def gather_matrix_data(self, *args):
+        """ Extract a matrix from every shard database concurrently and stack
+        the shards' rows, taking the same arguments as build_matrix()
+
+        :return: the matrix, ordered by entity_id and as_of_date, or None if no
+                 shard's entity-date table could be built
+        :rtype: pandas.DataFrame
+        """
+        outputs = [
+            output
+            for output in self.entity_shards.run(
+                lambda shard, db_engine: self.for_shard(db_engine).matrix_data(*args)
+            )
+            if output is not None
+        ]
+        if not outputs:
+            return None
+        logging.info("Gathered matrix rows from %s shards", len(outputs))
+        return downcast_matrix(pandas.concat(outputs).sort_index())
 
     def load_labels_data(
         self,
@@ -366,19 +719,6 @@ class MatrixBuilder(BuilderBase):
         :return: name of csv containing labels
         :rtype: str
         """
-        if self.include_missing_labels_in_train_as is None:
-            label_predicate = "r.label"
-        elif self.include_missing_labels_in_train_as is False:
-            label_predicate = "coalesce(r.label, 0)"
-        elif self.include_missing_labels_in_train_as is True:
-            label_predicate = "coalesce(r.label, 1)"
-        else:
-            raise ValueError(
-                'incorrect value "{}" for include_missing_labels_in_train_as'.format(
-                    self.include_missing_labels_in_train_as
-                )
-            )
-
         labels_query = self._outer_join_query(
             right_table_name="{schema}.{table}".format(
                 schema=self.db_config["labels_schema_name"],
@@ -388,18 +728,50 @@ class MatrixBuilder(BuilderBase):
                 schema=self.db_config["features_schema_name"],
                 table=entity_date_table_name,
             ),
-            right_column_selections=", {} as {}".format(label_predicate, label_name),
-            additional_conditions="""AND
+            right_column_selections=", {} as {}".format(
+                self._label_predicate(), label_name
+            ),
+            additional_conditions=self._label_conditions(
+                label_name, label_type, label_timespan
+            ),
+        )
+
+        return self.query_to_df(labels_query)
+
+    def _label_predicate(self):
+        """ The label of each matrix row, selected from the labels table
+        aliased as r
+
+        :return: a SQL expression
+        :rtype: str
+        """
+        if self.include_missing_labels_in_train_as is None:
+            return "r.label"
+        elif self.include_missing_labels_in_train_as is False:
+            return "coalesce(r.label, 0)"
+        elif self.include_missing_labels_in_train_as is True:
+            return "coalesce(r.label, 1)"
+        raise ValueError(
+            'incorrect value "{}" for include_missing_labels_in_train_as'.format(
+                self.include_missing_labels_in_train_as
+            )
+        )
+
+    @staticmethod
+    def _label_conditions(label_name, label_type, label_timespan):
+        """ Conditions joining the labels table, aliased as r, to matrix rows
+
+        :return: SQL conditions, starting with AND
+        :rtype: str
+        """
+        return """AND
                 r.label_name = '{name}' AND
                 r.label_type = '{type}' AND
                 r.label_timespan = '{timespan}'
             """.format(
-                name=label_name, type=label_type, timespan=label_timespan
-            ),
+            name=label_name, type=label_type, timespan=label_timespan
         )
 
-        return self.query_to_df(labels_query)
-
     def load_features_data(
         self, as_of_times, feature_dictionary, entity_date_table_name, matrix_uuid
     ):
@@ -421,9 +793,91 @@ class MatrixBuilder(BuilderBase):
         :return: list of csvs containing feature data
         :rtype: tuple
         """
-        # iterate! for each table, make query, write csv, save feature & file names
-        feature_dfs = []
-        for feature_table_name, feature_names in feature_dictionary.items():
+        dataframes = [None] * len(feature_dictionary)
+        for position, df in self._extract_feature_tables(
+            feature_dictionary, entity_date_table_name
+        ):
+            dataframes[position] = df
+        return dataframes
+
+    def join_features_data(
+        self, as_of_times, feature_dictionary, entity_date_table_name, matrix_uuid
+    ):
+        """ Extract the feature tables of a matrix, as load_features_data()
+        does, joining each to those already extracted as soon as it arrives
+        rather than once every table has.
+
+        :param as_of_times: the times to be included in the matrix
+        :param feature_dictionary: a dictionary of feature tables and features
+            to be included in the matrix
+        :param entity_date_table_name: the name of the entity date table
+            for the matrix
+        :param matrix_uuid: a human-readable id for the matrix
+        :type as_of_times: list
+        :type feature_dictionary: dict
+        :type entity_date_table_name: str
+        :type matrix_uuid: str
+
+        :return: the features of the matrix, in the order of feature_dictionary
+        :rtype: pandas.DataFrame
+        """
+        features_df = None
+        for _, df in self._extract_feature_tables(
+            feature_dictionary, entity_date_table_name
+        ):
+            features_df = df if features_df is None else features_df.join(df)
+        feature_names = [
+            name for names in feature_dictionary.values() for name in names
+        ]
+        if list(features_df.columns) != feature_names:
+            features_df = features_df[feature_names]
+        return features_df
+
+    def _extraction_workers(self, n_tables):
+        """ How many feature tables of a matrix to extract at once: up to
+        extraction_connections, but no more than the read engine's connection
+        pool can hold, as the threads would otherwise wait for connections
+
+        :param n_tables: the number of feature tables
+        :type n_tables: int
+
+        :return: the number of tables to extract at once
+        :rtype: int
+        """
+        n_workers = min(self.extraction_connections, n_tables)
+        pool = self._read_engine().pool
+        # a negative max overflow leaves the pool unbounded
+        if isinstance(pool, QueuePool) and pool._max_overflow >= 0:
+            pool_connections = pool.size() + pool._max_overflow
+            if n_workers > pool_connections:
+                logging.warning(
+                    "Extracting %s feature tables at once rather than %s, as the "
+                    "database engine's pool holds at most %s connections",
+                    pool_connections,
+                    n_workers,
+                    pool_connections,
+                )
+                n_workers = pool_connections
+        return n_workers
+
+    def _extract_feature_tables(self, feature_dictionary, entity_date_table_name):
+        """ Extract each feature table of a matrix, up to extraction_connections
+        of them at once, each on its own database connection
+
+        :param feature_dictionary: a dictionary of feature tables and features
+            to be included in the matrix
+        :param entity_date_table_name: the name of the entity date table
+            for the matrix
+        :type feature_dictionary: dict
+        :type entity_date_table_name: str
+
+        :return: the position of each table in feature_dictionary with its
+                 data, in the order the tables finish extracting
+        :rtype: generator
+        """
+
+        def load_table(feature_table):
+            feature_table_name, feature_names = feature_table
             logging.info("Retrieving feature data from %s", feature_table_name)
             features_query = self._outer_join_query(
                 right_table_name="{schema}.{table}".format(
@@ -440,34 +894,454 @@ class MatrixBuilder(BuilderBase):
                 # database encounters any during the outer join
                 right_column_selections=[', "{0}"'.format(fn) for fn in feature_names],
             )
-            feature_dfs.append(self.query_to_df(features_query))
+            return self.query_to_df(features_query)
 
-        return feature_dfs
+        feature_tables = list(feature_dictionary.items())
+        n_workers = self._extraction_workers(len(feature_tables))
+        if n_workers <= 1:
+            for position, feature_table in enumerate(feature_tables):
+                yield position, load_table(feature_table)
+            return
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            positions = {
+                executor.submit(load_table, feature_table): position
+                for position, feature_table in enumerate(feature_tables)
+            }
+            for future in as_completed(positions):
+                yield positions[future], future.result()
 
-    def query_to_df(self, query_string, header="HEADER"):
-        """ Given a query, write the requested data to csv.
+    def _entity_chunks(self, entity_ids, n_columns):
+        """ Split the rows of a matrix, ordered by entity_id, into chunks of
+        consecutive rows holding at most wide_chunk_values values (unless a
+        single entity's rows hold more), never splitting an entity's rows
+        between chunks
+
+        :param entity_ids: the entity_id of each matrix row, in order
+        :param n_columns: the number of values in each row
+        :type entity_ids: numpy.ndarray
+        :type n_columns: int
+
+        :return: the start and end positions of each chunk's rows
+        :rtype: generator
+        """
+        n_rows = len(entity_ids)
+        # the position of each entity's first row, and the end of the last's
+        boundaries = numpy.append(
+            numpy.flatnonzero(numpy.r_[True, entity_ids[1:] != entity_ids[:-1]]),
+            n_rows,
+        )
+        rows_per_chunk = max(1, self.wide_chunk_values // n_columns)
+        start = 0
+        while start < n_rows:
+            end = boundaries[
+                numpy.searchsorted(boundaries, start + rows_per_chunk, side="right")
+                - 1
+            ]
+            if end <= start:
+                end = boundaries[numpy.searchsorted(boundaries, start, side="right")]
+            yield start, end
+            start = end
+
+    def _wide_index(self, entity_date_table_name):
+        """ The index of a matrix extracted with joined queries: the rows of its
+        entity date table, ordered by entity_id and as_of_date
+
+        :param entity_date_table_name: the name of the entity date table
+            for the matrix
+        :type entity_date_table_name: str
+
+        :return: the index
+        :rtype: pandas.MultiIndex
+        """
+        entity_dates = self._read_frame(
+            'SELECT entity_id, as_of_date FROM {schema}."{table}" '
+            "ORDER BY entity_id, as_of_date".format(
+                schema=self.db_config["features_schema_name"],
+                table=entity_date_table_name,
+            ),
+            parse_dates=["as_of_date"],
+        )
+        return pandas.MultiIndex.from_arrays(
+            [entity_dates["entity_id"], entity_dates["as_of_date"]],
+            names=["entity_id", "as_of_date"],
+        )
+
+    def wide_data_chunks(
+        self,
+        index,
+        label_name,
+        label_type,
+        label_timespan,
+        feature_dictionary,
+        entity_date_table_name,
+    ):
+        """ Extract the features and label of the rows of a matrix in chunks,
+        with queries joining all feature tables and the labels table to the
+        entity date table in the database.
+
+        Each chunk holds the rows of a range of entities (see
+        _entity_chunks()), so the chunks follow each other in the order of the
+        matrix, and can be written to storage as they are extracted.
+
+        :param index: the matrix's index (see _wide_index())
+        :param label_name: name of the label to be used
+        :param label_type: the type of label to be used
+        :param label_timespan: the time timespan that labels in matrix will include
+        :param feature_dictionary: a dictionary of feature tables and features
+            to be included in the matrix
+        :param entity_date_table_name: the name of the entity date table
+            for the matrix
+        :type index: pandas.MultiIndex
+        :type label_name: str
+        :type label_type: str
+        :type label_timespan: str
+        :type feature_dictionary: dict
+        :type entity_date_table_name: str
+
+        :return: chunks of the matrix, with float32 values and the label in the
+                 last column
+        :rtype: generator
+
+        :raises: ValueError if any features are null, once every chunk has
+                 been extracted
+        """
+        # the columns are split into batches of at most
+        # WIDE_EXTRACTION_MAX_COLUMNS, each selected by its own query joining
+        # only the tables its columns are read from
+        batches = [([], OrderedDict())]
+
+        def select(selection, alias, join):
+            selections, joins = batches[-1]
+            if len(selections) == WIDE_EXTRACTION_MAX_COLUMNS:
+                batches.append(([], OrderedDict()))
+                selections, joins = batches[-1]
+            selections.append(selection)
+            joins.setdefault(alias, join)
+
+        feature_names = []
+        for i, (feature_table_name, names) in enumerate(feature_dictionary.items()):
+            alias = "f{}".format(i)
+            feature_names += names
+            join = """LEFT OUTER JOIN {schema}.{table} {alias}
+                ON ed.entity_id = {alias}.entity_id AND
+                   ed.as_of_date = {alias}.as_of_date""".format(
+                schema=self.db_config["features_schema_name"],
+                table=feature_table_name,
+                alias=alias,
+            )
+            for name in names:
+                select('{}."{}"'.format(alias, name), alias, join)
+        select(
+            '{} AS "{}"'.format(self._label_predicate(), label_name),
+            "r",
+            """LEFT OUTER JOIN {schema}.{table} r
+            ON ed.entity_id = r.entity_id AND
+               ed.as_of_date = r.as_of_date
+               {conditions}""".format(
+                schema=self.db_config["labels_schema_name"],
+                table=self.db_config["labels_table_name"],
+                conditions=self._label_conditions(
+                    label_name, label_type, label_timespan
+                ),
+            ),
+        )
+
+        columns = feature_names + [label_name]
+        entity_ids = index.get_level_values("entity_id").values
+        columns_with_nulls = set()
+        for start, end in self._entity_chunks(entity_ids, len(columns)):
+            logging.info(
+                "Extracting matrix rows %s to %s of %s", start, end, len(index)
+            )
+            batch_values = []
+            for selections, joins in batches:
+                query = """
+                    SELECT {selections}
+                    FROM {schema}."{entity_date_table}" ed
+                    {joins}
+                    WHERE ed.entity_id BETWEEN {first} AND {last}
+                    ORDER BY ed.entity_id,
+                             ed.as_of_date
+                """.format(
+                    selections=", ".join(selections),
+                    schema=self.db_config["features_schema_name"],
+                    entity_date_table=entity_date_table_name,
+                    joins="\n".join(joins.values()),
+                    first=entity_ids[start],
+                    last=entity_ids[end - 1],
+                )
+                values = self._read_values(query)
+                if len(values) != end - start:
+                    raise ValueError(
+                        "{} rows extracted for {} matrix rows, the feature or "
+                        "labels tables may have more than one row for an entity "
+                        "and date".format(len(values), end - start)
+                    )
+                batch_values.append(values)
+            if len(batch_values) == 1:
+                chunk_values = batch_values[0]
+            else:
+                chunk_values = numpy.hstack(batch_values)
+            columns_with_nulls.update(
+                feature_names[i]
+                for i in numpy.flatnonzero(
+                    numpy.isnan(chunk_values[:, :-1]).any(axis=0)
+                )
+            )
+            yield pandas.DataFrame(
+                chunk_values, index=index[start:end], columns=columns, copy=False
+            )
+
+        if columns_with_nulls:
+            raise ValueError(
+                "Imputation failed for the following features: %s"
+                % sorted(columns_with_nulls)
+            )
+
+    def load_wide_data(
+        self,
+        label_name,
+        label_type,
+        label_timespan,
+        feature_dictionary,
+        entity_date_table_name,
+    ):
+        """ Extract the features and label of every row of a matrix with
+        queries joining all feature tables and the labels table to the entity
+        date table in the database (see wide_data_chunks()), writing their
+        results directly into the matrix's values.
+
+        :param label_name: name of the label to be used
+        :param label_type: the type of label to be used
+        :param label_timespan: the time timespan that labels in matrix will include
+        :param feature_dictionary: a dictionary of feature tables and features
+            to be included in the matrix
+        :param entity_date_table_name: the name of the entity date table
+            for the matrix
+        :type label_name: str
+        :type label_type: str
+        :type label_timespan: str
+        :type feature_dictionary: dict
+        :type entity_date_table_name: str
+
+        :return: the matrix, with float32 values and the label in the last
+                 column
+        :rtype: pandas.DataFrame
+
+        :raises: ValueError if any features are null
+        """
+        index = self._wide_index(entity_date_table_name)
+        columns = [
+            name for names in feature_dictionary.values() for name in names
+        ] + [label_name]
+        values = numpy.empty((len(index), len(columns)), dtype=numpy.float32)
+        start = 0
+        for chunk in self.wide_data_chunks(
+            index,
+            label_name,
+            label_type,
+            label_timespan,
+            feature_dictionary,
+            entity_date_table_name,
+        ):
+            values[start:start + len(chunk)] = chunk.values
+            start += len(chunk)
+        return pandas.DataFrame(values, index=index, columns=columns, copy=False)
+
+    def load_block_data(
+        self,
+        label_name,
+        label_type,
+        label_timespan,
+        feature_dictionary,
+        entity_date_table_name,
+    ):
+        """ Assemble a matrix from blocks of each feature table's rows for each
+        of its as of dates, cached in project storage (see FeatureBlocks), so
+        that only the blocks no other matrix has used are extracted from the
+        database, along with the matrix's labels.
+
+        :param label_name: name of the label to be used
+        :param label_type: the type of label to be used
+        :param label_timespan: the time timespan that labels in matrix will include
+        :param feature_dictionary: a dictionary of feature tables and features
+            to be included in the matrix
+        :param entity_date_table_name: the name of the entity date table
+            for the matrix
+        :type label_name: str
+        :type label_type: str
+        :type label_timespan: str
+        :type feature_dictionary: dict
+        :type entity_date_table_name: str
+
+        :return: the matrix, with float32 values and the label in the last
+                 column
+        :rtype: pandas.DataFrame
+
+        :raises: ValueError if any features are null
+        """
+        index = self._wide_index(entity_date_table_name)
+        feature_names = [
+            name for names in feature_dictionary.values() for name in names
+        ]
+        values = numpy.empty((len(index), len(feature_names) + 1), dtype=numpy.float32)
+
+        labels = self._read_values(
+            """
+            SELECT {label} FROM {features_schema}."{entity_date_table}" ed
+            LEFT OUTER JOIN {labels_schema}.{labels_table} r
+            ON ed.entity_id = r.entity_id AND
+               ed.as_of_date = r.as_of_date
+               {conditions}
+            ORDER BY ed.entity_id,
+                     ed.as_of_date
+            """.format(
+                label=self._label_predicate(),
+                features_schema=self.db_config["features_schema_name"],
+                entity_date_table=entity_date_table_name,
+                labels_schema=self.db_config["labels_schema_name"],
+                labels_table=self.db_config["labels_table_name"],
+                conditions=self._label_conditions(
+                    label_name, label_type, label_timespan
+                ),
+            )
+        )
+        if len(labels) != len(index):
+            raise ValueError(
+                "{} labels extracted for {} matrix rows, the labels table may "
+                "have more than one row for an entity and date".format(
+                    len(labels), len(index)
+                )
+            )
+        values[:, -1] = labels[:, 0]
+        del labels
+
+        entity_ids = index.get_level_values("entity_id")
+        date_positions = (
+            pandas.Series(numpy.arange(len(index)))
+            .groupby(index.get_level_values("as_of_date"))
+            .indices
+        )
+        column = 0
+        for feature_table_name, names in feature_dictionary.items():
+            logging.info(
+                "Assembling %s as of dates of %s from feature blocks",
+                len(date_positions),
+                feature_table_name,
+            )
+            table_name = "{}.{}".format(
+                self.db_config["features_schema_name"], feature_table_name
+            )
+            blocks = self.feature_blocks.blocks(
+                self._read_engine(),
+                table_name,
+                [pandas.Timestamp(as_of_date) for as_of_date in date_positions],
+                self._read_frame,
+            )
+            for as_of_date, positions in date_positions.items():
+                block = blocks[pandas.Timestamp(as_of_date)]
+                values[positions, column:column + len(names)] = block.reindex(
+                    index=entity_ids[positions], columns=names
+                ).values
+            column += len(names)
+
+        columns_with_nulls = [
+            feature_names[i]
+            for i in numpy.flatnonzero(numpy.isnan(values[:, :-1]).any(axis=0))
+        ]
+        if columns_with_nulls:
+            raise ValueError(
+                "Imputation failed for the following features: %s"
+                % sorted(columns_with_nulls)
+            )
+        return pandas.DataFrame(
+            values, index=index, columns=feature_names + [label_name], copy=False
+        )
+
+    def _copy_csv(self, query_string, header="HEADER"):
+        """ Copy the results of a query into an in-memory CSV.
 
         :param query_string: query to send
-        :param file_name: name to save the file as
         :header: text to include in query indicating if a header should be saved
                  in output
         :type query_string: str
-        :type file_name: str
         :type header: str
 
-        :return: none
-        :rtype: none
+        :return: the CSV, at its start
+        :rtype: io.StringIO
         """
         logging.debug("Copying to CSV query %s", query_string)
         copy_sql = "COPY ({query}) TO STDOUT WITH CSV {head}".format(
             query=query_string, head=header
         )
-        conn = self.db_engine.raw_connection()
+        conn = self._read_engine().raw_connection()
         cur = conn.cursor()
         out = io.StringIO()
         cur.copy_expert(copy_sql, out)
         out.seek(0)
-        df = pandas.read_csv(out, parse_dates=["as_of_date"])
+        return out
+
+    def _read_frame(self, query_string, header="HEADER", **read_csv_kwargs):
+        """ Read the results of a query into a DataFrame, decoding them from
+        a binary COPY (see triage.util.binary_copy), or from a CSV if any of
+        their columns can not be decoded.
+
+        :param query_string: query to send
+        :param header: text to include in query indicating if a header should
+                       be saved in a CSV
+        :param read_csv_kwargs: keyword arguments to read a CSV with
+        :type query_string: str
+        :type header: str
+
+        :return: the results
+        :rtype: pandas.DataFrame
+        """
+        try:
+            return copy_to_df(self._read_engine(), query_string)
+        except UnsupportedColumnTypes as e:
+            logging.debug("Copying to CSV instead of binary: %s", e)
+        return pandas.read_csv(
+            self._copy_csv(query_string, header), **read_csv_kwargs
+        )
+
+    def _read_values(self, query_string):
+        """ Read the results of a query into a float32 array, as _read_frame()
+        does but without building a DataFrame.
+
+        :param query_string: query to send
+        :type query_string: str
+
+        :return: the values, a column for each of the query's columns
+        :rtype: numpy.ndarray
+        """
+        try:
+            arrays = copy_to_arrays(self._read_engine(), query_string)
+        except UnsupportedColumnTypes as e:
+            logging.debug("Copying to CSV instead of binary: %s", e)
+            return pandas.read_csv(
+                self._copy_csv(query_string), dtype=numpy.float32
+            ).values
+        n_rows = len(arrays[0][1]) if arrays else 0
+        values = numpy.empty((n_rows, len(arrays)), dtype=numpy.float32)
+        for i, (_, array) in enumerate(arrays):
+            values[:, i] = array
+        return values
+
+    def query_to_df(self, query_string, header="HEADER"):
+        """ Given a query, write the requested data to csv.
+
+        :param query_string: query to send
+        :param file_name: name to save the file as
+        :header: text to include in query indicating if a header should be saved
+                 in output
+        :type query_string: str
+        :type file_name: str
+        :type header: str
+
+        :return: none
+        :rtype: none
+        """
+        df = self._read_frame(query_string, header, parse_dates=["as_of_date"])
         df.set_index(["entity_id", "as_of_date"], inplace=True)
         return downcast_matrix(df)
 
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+
+from sqlalchemy import text
+
+from triage.database_reflection import query_watermark, table_exists
+
+CHOICE_CACHE_TABLE = "model_metadata.categorical_choices"
+
+
+def _hash(value):
+    return hashlib.md5(value.encode("utf-8")).hexdigest()
+
+
+class ChoiceCache(object):
+    def __init__(self, db_engine):
+        """Caches the results of categorical choice queries in the database,
+        so they are shared between processes and experiments
+
+        Results are keyed by the query and a watermark of the tables it reads
+        from, so they are recomputed once any of those tables change. Queries
+        reading from anything other than tables are never cached.
+
+        Args:
+            db_engine (sqlalchemy.engine)
+        """
+        self.db_engine = db_engine
+        self.hits = 0
+        self.misses = 0
+        self._enabled = None
+
+    @property
+    def enabled(self):
+        """Whether the cache table is available (the results schema may not
+        have been created)"""
+        if self._enabled is None:
+            self._enabled = table_exists(CHOICE_CACHE_TABLE, self.db_engine)
+            if not self._enabled:
+                logging.info(
+                    "%s not found, choice query results will not be cached",
+                    CHOICE_CACHE_TABLE,
+                )
+        return self._enabled
+
+    def source_watermark(self, choice_query):
+        """A hash of the watermarks of all tables read by the query, or None
+        if the query's results can not be tied to tables"""
+        return query_watermark(choice_query, self.db_engine)
+
+    def _run_query(self, choice_query):
+        with self.db_engine.begin() as conn:
+            return [row[0] for row in conn.execute(choice_query)]
+
+    def choices(self, choice_query):
+        """Return the choices (first column of each row) for a choice query,
+        from the cache if its source tables have not changed since it was run
+
+        Args:
+            choice_query (string) A SELECT query
+
+        Returns: (list) The choices
+        """
+        if not self.enabled:
+            self.misses += 1
+            return self._run_query(choice_query)
+
+        watermark = self.source_watermark(choice_query)
+        if watermark is None:
+            logging.info("Not caching choice query with untracked sources")
+            self.misses += 1
+            return self._run_query(choice_query)
+
+        query_hash = _hash(choice_query)
+        cached = self.db_engine.execute(
+            text(
+                "select choices from {} where choice_query_hash = :query_hash "
+                "and source_watermark = :watermark".format(CHOICE_CACHE_TABLE)
+            ),
+            query_hash=query_hash,
+            watermark=watermark,
+        ).first()
+        if cached is not None:
+            self.hits += 1
+            logging.info("Found cached choices for choice query: %s", choice_query)
+            return cached[0]
+
+        self.misses += 1
+        serialized_choices = json.dumps(self._run_query(choice_query), default=str)
+        with self.db_engine.begin() as conn:
+            # results from earlier versions of the source tables are stale
+            conn.execute(
+                text(
+                    "delete from {} where choice_query_hash = :query_hash".format(
+                        CHOICE_CACHE_TABLE
+                    )
+                ),
+                query_hash=query_hash,
+            )
+            conn.execute(
+                text(
+                    "insert into {} (choice_query_hash, source_watermark, "
+                    "choice_query, choices) values (:query_hash, :watermark, "
+                    ":choice_query, cast(:choices as jsonb)) "
+                    "on conflict do nothing".format(CHOICE_CACHE_TABLE)
+                ),
+                query_hash=query_hash,
+                watermark=watermark,
+                choice_query=choice_query,
+                choices=serialized_choices,
+            )
+        # return the choices as they will be read from the cache
+        return json.loads(serialized_choices)
@@ -0,0 +1,145 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+
+class EntityShards(object):
+    def __init__(self, db_engines, entity_id_column="entity_id"):
+        """The databases an experiment's entities are partitioned across
+
+        Each entity belongs to exactly one shard, picked by a hash of its id.
+        Every shard database holds the source tables (either in full, or at
+        least the rows of its own entities and of anything they are grouped
+        with), and builds its own cohort, labels and features, whose queries
+        are restricted to its entities (see predicate()). Matrices are gathered
+        from all shards.
+
+        Args:
+            db_engines (list) of triage.util.db.SerializableDbEngine, one per
+                shard
+            entity_id_column (string, optional) The column holding entity ids
+        """
+        if len(db_engines) < 1:
+            raise ValueError("At least one shard database is needed")
+        self.db_engines = list(db_engines)
+        self.entity_id_column = entity_id_column
+
+    def __len__(self):
+        return len(self.db_engines)
+
+    def predicate(self, shard, column=None):
+        """A SQL condition selecting the entities of a shard, to restrict the
+        queries building a shard's tables. It is written with mod() rather
+        than %, so it can be embedded in statements sent to the driver as is
+
+        Args:
+            shard (int) The index of the shard
+            column (string, optional) The column holding entity ids, if not the
+                default one
+
+        Returns: (string) a boolean SQL expression
+        """
+        return "mod(hashtext(({})::text) & 2147483647, {}) = {}".format(
+            column or self.entity_id_column, len(self), shard
+        )
+
+    def run(self, function):
+        """Run a function against every shard database concurrently
+
+        Args:
+            function (callable) taking the index of the shard and its
+                db_engine
+
+        Returns: (list) the result of each shard's call, in shard order
+
+        Raises: the exception of the first shard, in order, that raised one
+        """
+        with ThreadPoolExecutor(max_workers=len(self)) as executor:
+            futures = [
+                executor.submit(function, shard, db_engine)
+                for shard, db_engine in enumerate(self.db_engines)
+            ]
+            return [future.result() for future in futures]
+
+    def merge_column_stats(self, stats_table, stats_names):
+        """Replace the column statistics each shard computed on its own
+        entities with the statistics over all shards, so every shard imputes
+        (and flags imputed columns) the same way
+
+        Args:
+            stats_table (string) The column statistics table in every shard
+                (see collate.Aggregation.get_column_stats_create())
+            stats_names (list) The aggregations to merge statistics of, by
+                collate.Aggregation.get_column_stats_name()
+        """
+        if not stats_names:
+            return
+        select = text(
+            "select table_name, as_of_date, column_name, row_count, null_count, "
+            "mean_value, min_value, max_value from {} "
+            "where table_name in :names".format(stats_table)
+        )
+
+        def read(shard, db_engine):
+            with db_engine.begin() as conn:
+                return conn.execute(select, names=tuple(stats_names)).fetchall()
+
+        merged = {}
+        for rows in self.run(read):
+            for row in rows:
+                key = (row["table_name"], row["as_of_date"], row["column_name"])
+                stats = merged.setdefault(
+                    key,
+                    {"row_count": 0, "null_count": 0, "total": 0.0, "values": 0},
+                )
+                stats["row_count"] += row["row_count"]
+                stats["null_count"] += row["null_count"]
+                values = row["row_count"] - row["null_count"]
+                if values and row["mean_value"] is not None:
+                    stats["total"] += row["mean_value"] * values
+                    stats["values"] += values
+                for bound, pick in (("min_value", min), ("max_value", max)):
+                    if row[bound] is not None:
+                        stats[bound] = (
+                            row[bound]
+                            if stats.get(bound) is None
+                            else pick(stats[bound], row[bound])
+                        )
+
+        merged_rows = [
+            {
+                "table_name": table_name,
+                "as_of_date": as_of_date,
+                "column_name": column_name,
+                "row_count": stats["row_count"],
+                "null_count": stats["null_count"],
+                "mean_value": stats["total"] / stats["values"]
+                if stats["values"]
+                else None,
+                "min_value": stats.get("min_value"),
+                "max_value": stats.get("max_value"),
+            }
+            for (table_name, as_of_date, column_name), stats in merged.items()
+        ]
+
+        def write(shard, db_engine):
+            with db_engine.begin() as conn:
+                conn.execute(
+                    text("delete from {} where table_name in :names".format(stats_table)),
+                    names=tuple(stats_names),
+                )
+                if merged_rows:
+                    conn.execute(
+                        text(
+                            "insert into {} values (:table_name, :as_of_date, "
+                            ":column_name, :row_count, :null_count, :mean_value, "
+                            ":min_value, :max_value)".format(stats_table)
+                        ),
+                        merged_rows,
+                    )
+
+        self.run(write)
+        logging.info(
+            "Merged column statistics of %s across %s shards", stats_names, len(self)
+        )
@@ -0,0 +1,146 @@
+import hashlib
+import logging
+
+import numpy
+import pandas
+
+from triage.database_reflection import table_watermark
+
+
+class FeatureBlocks(object):
+    def __init__(self, block_storage_engine):
+        """Caches the rows of each feature table for each as of date (a block)
+        in project storage, so that matrices overlapping in as of dates (the
+        train matrices of consecutive splits, or matrices for other label
+        timespans and feature groups) extract each date's features from the
+        database once
+
+        Blocks are keyed by a hash of their contents, computed in the database
+        from the text of each of their rows, so a block is only reused while
+        the rows it was extracted from are unchanged.
+
+        Args:
+            block_storage_engine
+                (triage.component.catwalk.storage.FeatureBlockStorageEngine)
+        """
+        self.block_storage_engine = block_storage_engine
+        self._content_hashes = {}
+
+    def content_hashes(self, db_engine, table_name):
+        """The content hash of the rows of each as of date in a feature table
+
+        The hashes of a table are computed once for each watermark of the table
+        (see triage.database_reflection.table_watermark).
+
+        Args:
+            db_engine (sqlalchemy.engine)
+            table_name (string) The feature table, with its schema
+
+        Returns: (dict) the hash of each as of date, as a pandas.Timestamp
+        """
+        memo_key = (
+            str(db_engine.url),
+            table_name,
+            table_watermark(table_name, db_engine),
+        )
+        if memo_key not in self._content_hashes:
+            columns = db_engine.execute(
+                "select * from {} limit 0".format(table_name)
+            ).keys()
+            # an order-independent hash of each date's rows: the sum of the
+            # first 64 bits of each row's md5
+            rows = db_engine.execute(
+                """select as_of_date, count(*),
+                sum(('x' || substr(md5(f::text), 1, 16))::bit(64)::bigint)
+                from {} f group by as_of_date""".format(table_name)
+            )
+            self._content_hashes[memo_key] = {
+                pandas.Timestamp(as_of_date): hashlib.md5(
+                    "{}:{}:{}:{}:{}".format(
+                        table_name, list(columns), as_of_date, count, total
+                    ).encode("utf-8")
+                ).hexdigest()
+                for as_of_date, count, total in rows
+            }
+        return self._content_hashes[memo_key]
+
+    def blocks(self, db_engine, table_name, as_of_dates, read_frame):
+        """The rows of a feature table for each of some as of dates, extracted
+        from the database and cached unless they already are
+
+        The blocks missing from the cache are extracted together, by one query
+        reading all of their dates, and split by date.
+
+        Args:
+            db_engine (sqlalchemy.engine)
+            table_name (string) The feature table, with its schema
+            as_of_dates (list) of pandas.Timestamp
+            read_frame (callable) Reads the results of a query into a
+                pandas.DataFrame
+
+        Returns: (dict) the block of each as of date: a pandas.DataFrame of the
+            float32 feature values of each entity, indexed by entity_id, empty
+            if the table has no rows for the date
+        """
+        content_hashes = self.content_hashes(db_engine, table_name)
+        blocks = {}
+        missing = {}
+        for as_of_date in as_of_dates:
+            block_key = content_hashes.get(as_of_date)
+            if block_key is None:
+                blocks[as_of_date] = pandas.DataFrame()
+            elif self.block_storage_engine.exists(table_name, block_key):
+                logging.debug(
+                    "Loading cached block of %s for %s", table_name, as_of_date
+                )
+                entity_ids, columns, values = self.block_storage_engine.load(
+                    table_name, block_key
+                )
+                blocks[as_of_date] = pandas.DataFrame(
+                    values, index=entity_ids, columns=columns, copy=False
+                )
+            else:
+                missing[as_of_date] = block_key
+        if not missing:
+            return blocks
+
+        logging.debug(
+            "Extracting %s blocks of %s, from %s to %s",
+            len(missing),
+            table_name,
+            min(missing),
+            max(missing),
+        )
+        rows = read_frame(
+            """select * from {} where as_of_date = any('{{{}}}')
+            order by as_of_date, entity_id""".format(
+                table_name,
+                ",".join('"{}"'.format(as_of_date) for as_of_date in sorted(missing)),
+            )
+        )
+        date_positions = rows.groupby("as_of_date", sort=False).indices
+        entity_ids = rows.pop("entity_id").values
+        del rows["as_of_date"]
+        columns = rows.columns.tolist()
+        values = rows.values.astype(numpy.float32)
+        del rows
+        for as_of_date, positions in date_positions.items():
+            as_of_date = pandas.Timestamp(as_of_date)
+            # the rows of a date are contiguous, as they were read in order
+            block_rows = slice(positions[0], positions[-1] + 1)
+            self.block_storage_engine.write(
+                table_name,
+                missing[as_of_date],
+                entity_ids[block_rows],
+                columns,
+                values[block_rows],
+            )
+            blocks[as_of_date] = pandas.DataFrame(
+                values[block_rows],
+                index=entity_ids[block_rows],
+                columns=columns,
+                copy=False,
+            )
+        for as_of_date in missing:
+            blocks.setdefault(as_of_date, pandas.DataFrame())
+        return blocks
@@ -1,10 +1,16 @@
 import logging
+import os
+import tempfile
+import uuid
 from collections import OrderedDict
 
 import sqlalchemy
 import sqlparse
 
 from triage.util.conf import convert_str_to_relativedelta
+from triage.component.architect.choice_cache import ChoiceCache
+from triage.component.architect.feature_profiling import FeatureProfiler
+from triage.component.architect.source_watermarks import SourceWatermarks
 
 from triage.component.collate import (
     Aggregate,
@@ -12,11 +18,26 @@ from triage.component.collate import (
     Compare,
     SpacetimeAggregation,
 )
+from triage.component.collate.columnar import (
+    ColumnarCleanup,
+    ColumnarExport,
+    get_columnar_inserts,
+)
+from triage.component.collate.sql import Command
+
+FEATURE_BACKENDS = ("postgres", "duckdb")
 
 
 class FeatureGenerator(object):
     def __init__(
-        self, db_engine, features_schema_name, replace=True, feature_start_time=None
+        self,
+        db_engine,
+        features_schema_name,
+        replace=True,
+        feature_start_time=None,
+        debug=False,
+        backend="postgres",
+        entity_filter=None,
     ):
         """Generates aggregate features using collate
 
@@ -25,16 +46,49 @@ class FeatureGenerator(object):
             features_schema_name (string) Name of schema where feature
                 tables should be written to
             replace (boolean, optional) Whether or not existing features
-                should be replaced
+                should be replaced. If not, only those whose source tables
+                changed since they were built are
             feature_start_time (string/datetime, optional) point in time before which
                 should not be included in features
+            debug (boolean, optional) Whether or not to materialize and keep the
+                intermediate group and (pre-imputation) aggregation tables. By
+                default, imputed tables are written directly from the group
+                tables, which are dropped afterwards
+            backend (string, optional) Where to evaluate the aggregations:
+                'postgres' (the default) runs them in the database, 'duckdb'
+                exports each from_obj once to a local DuckDB database, evaluates
+                them there and copies the results back into the group tables
+            entity_filter (string, optional) A SQL condition on entity_id
+                restricting the entities whose entity-level features are
+                aggregated, such as those of a shard (see
+                EntityShards.predicate()). Not supported by the 'duckdb'
+                backend
         """
+        if backend not in FEATURE_BACKENDS:
+            raise ValueError(
+                "Feature backend must be one of {}, not {}".format(
+                    FEATURE_BACKENDS, backend
+                )
+            )
+        if backend == "duckdb" and entity_filter is not None:
+            raise ValueError(
+                "The duckdb feature backend cannot restrict the entities it "
+                "aggregates, so it cannot be used with entity shards"
+            )
         self.db_engine = db_engine
         self.features_schema_name = features_schema_name
         self.categorical_cache = {}
+        self.choice_cache = ChoiceCache(db_engine)
+        self.source_watermarks = SourceWatermarks(db_engine)
+        # watermarks of the aggregations' sources, taken before building them
+        self.aggregation_watermarks = {}
         self.replace = replace
         self.feature_start_time = feature_start_time
+        self.debug = debug
+        self.backend = backend
+        self.entity_filter = entity_filter
         self.entity_id_column = "entity_id"
+        self.column_stats_table = '"{}"."column_stats"'.format(features_schema_name)
 
     def _validate_keys(self, aggregation_config):
         for key in [
@@ -194,10 +248,9 @@ class FeatureGenerator(object):
 
     def _compute_choices(self, choice_query):
         if choice_query not in self.categorical_cache:
-            with self.db_engine.begin() as conn:
-                self.categorical_cache[choice_query] = [
-                    row[0] for row in conn.execute(choice_query)
-                ]
+            self.categorical_cache[choice_query] = self.choice_cache.choices(
+                choice_query
+            )
 
             logging.info(
                 "Computed list of categoricals: %s for choice query: %s",
@@ -327,7 +380,7 @@ class FeatureGenerator(object):
 
         Args:
             aggregations (list) collate.SpacetimeAggregation objects
-            type (str) either 'aggregation' or 'imputation'
+            type (str) one of 'aggregation', 'statistics' or 'imputation'
 
         Returns: (dict) keys are group table names, values are themselves dicts,
             each with keys for different stages of table creation (prepare, inserts, finalize)
@@ -341,11 +394,16 @@ class FeatureGenerator(object):
         if task_type == "aggregation":
             task_generator = self._generate_agg_table_tasks_for
             logging.debug("---------FEATURE GENERATION------------")
+        elif task_type == "statistics":
+            task_generator = self._generate_stats_table_tasks_for
+            logging.debug("---------FEATURE STATISTICS------------")
         elif task_type == "imputation":
             task_generator = self._generate_imp_table_tasks_for
             logging.debug("---------FEATURE IMPUTATION------------")
         else:
-            raise ValueError("Table task type must be aggregation or imputation")
+            raise ValueError(
+                "Table task type must be aggregation, statistics or imputation"
+            )
 
         logging.debug("---------------------")
 
@@ -412,11 +470,42 @@ class FeatureGenerator(object):
                 )
             self.process_table_task(task)
 
+    def profile(self, feature_aggregation_config, feature_dates, sample_size=None):
+        """Profile the inserts populating the feature group tables, without
+        writing any feature tables
+
+        Each insert is run under EXPLAIN ANALYZE, into temporary tables so that
+        no feature table is locked, the plans are stored in the
+        feature_profiles table of the features schema, and a report of the
+        slowest inserts, large sequential scans and index candidates is
+        returned, for the caller to present (see format_report()).
+
+        Args:
+            feature_aggregation_config (list) all values, except for
+                feature date, necessary to instantiate a
+                `collate.SpacetimeAggregation`
+            feature_dates (list) dates to generate features as of
+            sample_size (int, optional) the number of feature dates to profile,
+                evenly spaced; all of them if not given
+
+        Returns: (dict) the report (see FeatureProfiler.report())
+        """
+        aggregations = self.aggregations(
+            feature_aggregation_config, feature_dates, state_table=None
+        )
+        profiler = FeatureProfiler(self.db_engine, self.features_schema_name)
+        profiles = []
+        for aggregation in aggregations:
+            profiles += profiler.profile(aggregation, sample_size)
+        profiler.record(profiles)
+        return profiler.report(profiles, aggregations)
+
     def create_all_tables(self, feature_aggregation_config, feature_dates, state_table):
         """Create all feature tables.
 
-        First builds the aggregation tables, and then performs
-        imputation on any null values, (requiring a two-step process to
+        First builds the aggregation tables, then computes the column
+        statistics of each aggregation in a single scan, and then performs
+        imputation on any null values, (requiring a multi-step process to
         determine which columns contain nulls after the initial
         aggregation tables are built).
 
@@ -439,8 +528,14 @@ class FeatureGenerator(object):
         )
         self.process_table_tasks(table_tasks_aggregate)
 
-        # second, perform the imputations (this will query the tables
-        # constructed above to identify features containing nulls)
+        # second, compute the null counts and means of every column
+        table_tasks_statistics = self.generate_all_table_tasks(
+            aggs, task_type="statistics"
+        )
+        self.process_table_tasks(table_tasks_statistics)
+
+        # third, perform the imputations (this will use the statistics
+        # computed above to identify features containing nulls)
         table_tasks_impute = self.generate_all_table_tasks(aggs, task_type="imputation")
         impute_keys = self.process_table_tasks(table_tasks_impute)
 
@@ -449,9 +544,10 @@ class FeatureGenerator(object):
         nullcols = []
         with self.db_engine.begin() as conn:
             for agg in aggs:
-                results = conn.execute(agg.find_nulls(imputed=True))
-                null_counts = results.first().items()
-                nullcols += [col for (col, val) in null_counts if val > 0]
+                for shard in range(len(agg.get_shards())):
+                    results = conn.execute(agg.find_nulls(imputed=True, shard=shard))
+                    null_counts = results.first().items()
+                    nullcols += [col for (col, val) in null_counts if val > 0]
 
         if len(nullcols) > 0:
             raise ValueError(
@@ -504,11 +600,14 @@ class FeatureGenerator(object):
         with self.db_engine.begin() as conn:
             for command in command_list:
                 logging.debug("Executing feature generation query: %s", command)
-                conn.execute(command)
+                if isinstance(command, Command):
+                    command.execute(conn)
+                else:
+                    conn.execute(command)
 
-    def _aggregation_index_query(self, aggregation, imputed=False):
+    def _aggregation_index_query(self, aggregation, imputed=False, shard=0):
         return "CREATE INDEX ON {} ({}, {})".format(
-            aggregation.get_table_name(imputed=imputed),
+            aggregation.get_table_name(imputed=imputed, shard=shard),
             self.entity_id_column,
             aggregation.output_date_column,
         )
@@ -522,12 +621,48 @@ class FeatureGenerator(object):
     def index_column_lookup(self, aggregations, imputed=True):
         return dict(
             (
-                self._clean_table_name(aggregation.get_table_name(imputed=imputed)),
+                self._clean_table_name(table_name),
                 self._aggregation_index_columns(aggregation),
             )
             for aggregation in aggregations
+            for table_name in aggregation.get_table_names(imputed=imputed)
+        )
+
+    def _watermark_table_name(self, aggregation):
+        return "{}.{}".format(
+            self.features_schema_name,
+            self._clean_table_name(aggregation.get_table_name(imputed=True)),
+        )
+
+    def _aggregation_watermark(self, aggregation):
+        """The watermark of the tables read by the aggregation's from_obj, as
+        of the first time it was asked for since the aggregation was last built
+        """
+        table_name = self._watermark_table_name(aggregation)
+        if table_name not in self.aggregation_watermarks:
+            self.aggregation_watermarks[table_name] = self.source_watermarks.current(
+                "select * from {}".format(aggregation.from_obj)
+            )
+        return self.aggregation_watermarks[table_name]
+
+    def _replace(self, aggregation):
+        """Whether existing tables of the aggregation should be rebuilt: always
+        if replacing, and otherwise only if its source tables have changed
+        """
+        # take the watermark even if replacing, before the sources are read
+        watermark = self._aggregation_watermark(aggregation)
+        return self.replace or self.source_watermarks.changed(
+            self._watermark_table_name(aggregation), watermark
         )
 
+    def _materialize_aggregation_table(self, aggregation):
+        """Whether the pre-imputation aggregation table should be written
+
+        The aggregation table is only needed if it is the final output (there is
+        no state table to impute against) or if debugging
+        """
+        return self.debug or not aggregation.state_table
+
     def _generate_agg_table_tasks_for(self, aggregation):
         """Generates SQL commands for preparing, populating, and finalizing
         each feature group table in the given aggregation
@@ -541,17 +676,47 @@ class FeatureGenerator(object):
             'finalize': list of commands to finalize table after population
         }
         """
+        if self.entity_filter is not None:
+            aggregation = aggregation.restricted(self.entity_filter)
         create_schema = aggregation.get_create_schema()
         creates = aggregation.get_creates()
         drops = aggregation.get_drops()
         indexes = aggregation.get_indexes()
-        inserts = aggregation.get_inserts()
+        if self.backend == "duckdb":
+            # the directory is only created by the export, so none is left
+            # behind if every group table is skipped
+            database_path = os.path.join(
+                tempfile.gettempdir(),
+                "triage_features_{}".format(uuid.uuid4().hex),
+                "from_obj.duckdb",
+            )
+            inserts = get_columnar_inserts(aggregation, database_path)
+            # every group table's preparation carries the export, which only does
+            # any work the first time
+            exports = [ColumnarExport(aggregation.from_obj, database_path)]
+        else:
+            # one prepared statement per group, executed for each date
+            inserts = aggregation.get_prepared_inserts()
+            exports = []
 
         if create_schema is not None:
             with self.db_engine.begin() as conn:
                 conn.execute(create_schema)
 
+        # any column statistics of the tables about to be rebuilt go stale
+        stats_deletes = []
+        if aggregation.state_table:
+            with self.db_engine.begin() as conn:
+                conn.execute(
+                    aggregation.get_column_stats_create(self.column_stats_table)
+                )
+            stats_deletes = [
+                aggregation.get_column_stats_delete(self.column_stats_table)
+            ]
+
         table_tasks = OrderedDict()
+        last_group_table = None
+        replace = self._replace(aggregation)
         for group in aggregation.groups:
             group_table = self._clean_table_name(
                 aggregation.get_table_name(group=group)
@@ -559,48 +724,151 @@ class FeatureGenerator(object):
             imputed_table = self._clean_table_name(
                 aggregation.get_table_name(imputed=True)
             )
-            if self.replace or (
+            if replace or (
                 not self._table_exists(group_table)
                 and not self._table_exists(imputed_table)
             ):
                 table_tasks[group_table] = {
-                    "prepare": [drops[group], creates[group]],
+                    "prepare": [drops[group], creates[group]] + stats_deletes + exports,
                     "inserts": inserts[group],
                     "finalize": [indexes[group]],
                 }
+                last_group_table = group_table
                 logging.info("Created table tasks for %s", group_table)
             else:
                 logging.info("Skipping feature table creation for %s", group_table)
                 table_tasks[group_table] = {}
+        if exports and last_group_table is not None:
+            table_tasks[last_group_table]["finalize"].append(
+                ColumnarCleanup(exports[0].database_path)
+            )
         logging.info("Created table tasks for aggregation")
-        if self.replace or (
-            not self._table_exists(self._clean_table_name(aggregation.get_table_name()))
-            and not self._table_exists(
-                self._clean_table_name(aggregation.get_table_name(imputed=True))
+        if not self._materialize_aggregation_table(aggregation):
+            # the imputed table will be created directly from the group tables
+            logging.info(
+                "Skipping creation of intermediate aggregation table %s",
+                aggregation.get_table_name(),
             )
-        ):
-            table_tasks[self._clean_table_name(aggregation.get_table_name())] = {
-                "prepare": [aggregation.get_drop(), aggregation.get_create()],
-                "inserts": [],
-                "finalize": [self._aggregation_index_query(aggregation)],
+            return table_tasks
+        # aggregations too wide for a single table are split into shards, each
+        # read from the group tables built above
+        for shard in range(len(aggregation.get_shards())):
+            agg_tbl_name = self._clean_table_name(
+                aggregation.get_table_name(shard=shard)
+            )
+            if replace or (
+                not self._table_exists(agg_tbl_name)
+                and not self._table_exists(
+                    self._clean_table_name(
+                        aggregation.get_table_name(imputed=True, shard=shard)
+                    )
+                )
+            ):
+                table_tasks[agg_tbl_name] = {
+                    "prepare": [
+                        aggregation.get_drop(shard=shard),
+                        aggregation.get_create(shard=shard),
+                    ],
+                    "inserts": [],
+                    "finalize": [
+                        self._aggregation_index_query(aggregation, shard=shard)
+                    ],
+                }
+            else:
+                table_tasks[agg_tbl_name] = {}
+
+        return table_tasks
+
+    def _generate_stats_table_tasks_for(self, aggregation):
+        """Generate SQL statements for computing the column statistics
+        (row and null counts, mean, min and max of each column, by date) of the
+        given aggregation, which the imputation reads instead of scanning the
+        feature tables itself.
+
+        Requires the existance of the underlying feature tables (and,
+        in debug mode, the aggregation table) defined in
+        `_generate_agg_table_tasks_for()`.
+
+        Args:
+            aggregation (collate.SpacetimeAggregation)
+
+        Returns: (dict) of structure {
+                'prepare': list of commands to prepare table for population
+                'inserts': list of commands to populate table
+                'finalize': list of commands to finalize table after population
             }
-        else:
-            table_tasks[self._clean_table_name(aggregation.get_table_name())] = {}
+        """
+        table_tasks = OrderedDict()
+        agg_tbl_name = self._clean_table_name(aggregation.get_table_name())
+
+        if not aggregation.state_table:
+            logging.warning(
+                "No state table available to aggregation, cannot compute statistics for %s",
+                agg_tbl_name,
+            )
+            return table_tasks
+
+        if not self._replace(aggregation) and all(
+            self._table_exists(self._clean_table_name(table_name))
+            for table_name in aggregation.get_table_names(imputed=True)
+        ):
+            logging.info("Skipping column statistics for %s", agg_tbl_name)
+            return table_tasks
 
+        with self.db_engine.begin() as conn:
+            conn.execute(aggregation.get_column_stats_create(self.column_stats_table))
+
+        table_tasks[agg_tbl_name] = {
+            "prepare": [aggregation.get_column_stats_delete(self.column_stats_table)],
+            "inserts": aggregation.get_column_stats_inserts(
+                self.column_stats_table,
+                from_groups=not self._materialize_aggregation_table(aggregation),
+            ),
+            "finalize": [],
+        }
+        logging.info("Created table tasks for column statistics: %s", agg_tbl_name)
         return table_tasks
 
-    def _generate_imp_table_tasks_for(self, aggregation, drop_preagg=True):
+    def column_stats(self, aggregation):
+        """Read the column statistics of an aggregation, summarized over all dates
+
+        Args:
+            aggregation (collate.SpacetimeAggregation)
+
+        Returns: (dict) column name -> dict of row_count, null_count, min_value,
+            max_value and is_constant; or None if statistics for all of the
+            aggregation's columns have not been computed
+        """
+        try:
+            with self.db_engine.begin() as conn:
+                results = conn.execute(
+                    aggregation.get_column_stats_summary(self.column_stats_table)
+                )
+                stats = dict((row["column_name"], dict(row)) for row in results)
+        except sqlalchemy.exc.ProgrammingError:
+            return None
+        if set(stats.keys()) != set(aggregation.get_imputation_rules().keys()):
+            if stats:
+                logging.warning(
+                    "Column statistics for %s are incomplete, ignoring them",
+                    aggregation.get_table_name(),
+                )
+            return None
+        return stats
+
+    def _generate_imp_table_tasks_for(self, aggregation, drop_preagg=None):
         """Generate SQL statements for preparing, populating, and
         finalizing imputations, for each feature group table in the
         given aggregation.
 
-        Requires the existance of the underlying feature and aggregation
-        tables defined in `_generate_agg_table_tasks_for()`.
+        Requires the existance of the underlying feature tables (and,
+        in debug mode, the aggregation table) defined in
+        `_generate_agg_table_tasks_for()`.
 
         Args:
             aggregation (collate.SpacetimeAggregation)
             drop_preagg: boolean to specify dropping pre-imputation
-                tables
+                tables, defaults to True unless in debug mode
 
         Returns: (dict) of structure {
                 'prepare': list of commands to prepare table for population
@@ -610,51 +878,98 @@ class FeatureGenerator(object):
 
         """
         table_tasks = OrderedDict()
-        imp_tbl_name = self._clean_table_name(aggregation.get_table_name(imputed=True))
+        imp_tbl_names = [
+            self._clean_table_name(table_name)
+            for table_name in aggregation.get_table_names(imputed=True)
+        ]
 
-        if not self.replace and self._table_exists(imp_tbl_name):
-            logging.info("Skipping imputation table creation for %s", imp_tbl_name)
-            table_tasks[imp_tbl_name] = {}
+        replace = self._replace(aggregation)
+        # the sources are read again the next time the aggregation is built
+        watermark = self.aggregation_watermarks.pop(
+            self._watermark_table_name(aggregation), None
+        )
+        if not replace and all(
+            self._table_exists(imp_tbl_name) for imp_tbl_name in imp_tbl_names
+        ):
+            for imp_tbl_name in imp_tbl_names:
+                logging.info("Skipping imputation table creation for %s", imp_tbl_name)
+                table_tasks[imp_tbl_name] = {}
             return table_tasks
 
         if not aggregation.state_table:
-            logging.warning(
-                "No state table available to aggregation, cannot create imputation table for %s",
-                imp_tbl_name,
-            )
-            table_tasks[imp_tbl_name] = {}
+            for imp_tbl_name in imp_tbl_names:
+                logging.warning(
+                    "No state table available to aggregation, cannot create imputation table for %s",
+                    imp_tbl_name,
+                )
+                table_tasks[imp_tbl_name] = {}
             return table_tasks
 
-        # excute query to find columns with null values and create lists of columns
-        # that do and do not need imputation when creating the imputation table
-        with self.db_engine.begin() as conn:
-            results = conn.execute(aggregation.find_nulls())
-            null_counts = results.first().items()
+        if drop_preagg is None:
+            drop_preagg = not self.debug
+
+        # unless the aggregation table was materialized, read straight from the
+        # group tables so the imputed table is the only full rewrite of the data
+        from_groups = not self._materialize_aggregation_table(aggregation)
+
+        # find columns with null values and create lists of columns that do and
+        # do not need imputation when creating the imputation table, using the
+        # column statistics if they were computed and scanning the table otherwise
+        stats = self.column_stats(aggregation)
+        if stats is not None:
+            null_counts = [(col, stats[col]["null_count"]) for col in sorted(stats)]
+        else:
+            null_counts = []
+            with self.db_engine.begin() as conn:
+                for shard in range(len(imp_tbl_names)):
+                    results = conn.execute(
+                        aggregation.find_nulls(from_groups=from_groups, shard=shard)
+                    )
+                    null_counts += results.first().items()
         impute_cols = [col for (col, val) in null_counts if val > 0]
         nonimpute_cols = [col for (col, val) in null_counts if val == 0]
 
-        # table tasks for imputed aggregation table, most of the work is done here
-        # by collate's get_impute_create()
-        table_tasks[imp_tbl_name] = {
-            "prepare": [
-                aggregation.get_drop(imputed=True),
-                aggregation.get_impute_create(
-                    impute_cols=impute_cols, nonimpute_cols=nonimpute_cols
-                ),
-            ],
-            "inserts": [],
-            "finalize": [self._aggregation_index_query(aggregation, imputed=True)],
-        }
-        logging.info("Created table tasks for imputation: %s", imp_tbl_name)
+        # table tasks for imputed aggregation tables (one per shard), most of the
+        # work is done here by collate's get_impute_create()
+        for shard, imp_tbl_name in enumerate(imp_tbl_names):
+            table_tasks[imp_tbl_name] = {
+                "prepare": [
+                    aggregation.get_drop(imputed=True, shard=shard),
+                    aggregation.get_impute_create(
+                        impute_cols=impute_cols,
+                        nonimpute_cols=nonimpute_cols,
+                        from_groups=from_groups,
+                        stats_table=self.column_stats_table if stats else None,
+                        shard=shard,
+                    ),
+                ],
+                "inserts": [],
+                "finalize": [
+                    self._aggregation_index_query(
+                        aggregation, imputed=True, shard=shard
+                    )
+                ],
+            }
+            logging.info("Created table tasks for imputation: %s", imp_tbl_name)
 
         # do some cleanup:
         # drop the group-level and aggregation tables, just leaving the
-        # imputation table if drop_preagg=True
+        # imputation tables if drop_preagg=True, once every shard is imputed
         if drop_preagg:
             drops = aggregation.get_drops()
-            table_tasks[imp_tbl_name]["finalize"] += list(drops.values()) + [
-                aggregation.get_drop()
+            table_tasks[imp_tbl_names[-1]]["finalize"] += list(drops.values()) + [
+                aggregation.get_drop(shard=shard)
+                for shard in range(len(imp_tbl_names))
             ]
-            logging.info("Added drop table cleanup tasks: %s", imp_tbl_name)
+            logging.info("Added drop table cleanup tasks: %s", imp_tbl_names[-1])
+
+        # remember what the sources looked like when the tables were built
+        record_watermark = self.source_watermarks.record_command(
+            self._watermark_table_name(aggregation),
+            watermark,
+            "select * from {}".format(aggregation.from_obj),
+        )
+        if record_watermark is not None:
+            table_tasks[imp_tbl_names[-1]]["finalize"].append(record_watermark)
 
         return table_tasks
@@ -1,4 +1,5 @@
 import logging
+import re
 
 
 class FeatureGroup(dict):
@@ -23,8 +24,8 @@ class FeatureGroup(dict):
 
 
 def table_subsetter(config_item, table, features):
-    "Return features matching a given table"
-    if table == config_item:
+    "Return features matching a given table, or any of its numbered shards"
+    if re.fullmatch(re.escape(config_item) + r"(_\d+)?", table):
         return features
     else:
         return []
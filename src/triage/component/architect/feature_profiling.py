@@ -0,0 +1,351 @@
+"""Profile the queries populating feature group tables
+
+Each statement populating a feature group table, as it is run when features
+are generated (the group's prepared insert, executed for each date), is run
+under EXPLAIN (ANALYZE, BUFFERS, VERBOSE, FORMAT JSON), inserting into a
+temporary table in a transaction that is rolled back, so that no lock is taken
+on the feature tables themselves and they are left untouched. The plans are
+stored in a
+profiling table and summarized in a report of the slowest inserts, the
+sequential scans reading many rows, and the columns of the scanned tables that
+could be indexed to avoid them.
+"""
+import hashlib
+import json
+import logging
+import re
+
+from sqlalchemy import text
+
+from triage.component.collate.sql import (
+    CreateTableAs,
+    ExecutePrepared,
+    InsertFromSelect,
+    PreparedStatement,
+)
+
+# sequential scans reading fewer rows than this are not reported
+LARGE_SCAN_ROWS = 10000
+
+
+def sample_dates(dates, sample_size=None):
+    """Pick evenly spaced dates, always including the first and last
+
+    Args:
+        dates (list) The dates to sample from
+        sample_size (int, optional) How many dates to pick. All dates are picked
+            if not given
+
+    Returns: (list) The sampled dates, in their original order
+    """
+    if not sample_size or sample_size >= len(dates):
+        return list(dates)
+    if sample_size == 1:
+        return [dates[-1]]
+    step = (len(dates) - 1) / (sample_size - 1)
+    return [dates[round(i * step)] for i in range(sample_size)]
+
+
+def explain_analyze(conn, query):
+    """Run a query under EXPLAIN (ANALYZE, BUFFERS, VERBOSE, FORMAT JSON)
+
+    Returns: (dict) The plan, with 'Plan', 'Planning Time' and 'Execution Time'
+    """
+    # passed to the driver as is, as the query may hold a %
+    plan = (
+        conn.execution_options(no_parameters=True)
+        .execute("EXPLAIN (ANALYZE, BUFFERS, VERBOSE, FORMAT JSON) {}".format(query))
+        .scalar()
+    )
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]
+
+
+def plan_nodes(plan):
+    """All nodes of a plan produced by explain_analyze()"""
+    nodes = [plan["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        yield node
+        nodes.extend(node.get("Plans", []))
+
+
+def sequential_scans(plan, min_rows=LARGE_SCAN_ROWS):
+    """Find the sequential scans in a plan reading at least min_rows rows
+
+    Returns: (list) dicts of relation (qualified by its schema), rows_read,
+        filter and time (in ms)
+    """
+    scans = []
+    for node in plan_nodes(plan):
+        if node["Node Type"] != "Seq Scan":
+            continue
+        loops = node.get("Actual Loops", 1)
+        rows_read = (
+            node.get("Actual Rows", 0) + node.get("Rows Removed by Filter", 0)
+        ) * loops
+        if rows_read >= min_rows:
+            scans.append(
+                {
+                    "relation": '"{}"."{}"'.format(
+                        node["Schema"], node["Relation Name"]
+                    ),
+                    "rows_read": rows_read,
+                    "filter": node.get("Filter"),
+                    "time": node.get("Actual Total Time", 0) * loops,
+                }
+            )
+    return scans
+
+
+class FeatureProfiler(object):
+    def __init__(self, db_engine, schema, large_scan_rows=LARGE_SCAN_ROWS):
+        """Profiles the inserts of feature aggregations
+
+        Args:
+            db_engine (sqlalchemy.engine)
+            schema (string) The schema to keep the profiling table in
+            large_scan_rows (int, optional) The number of rows read by a
+                sequential scan for it to be reported
+        """
+        self.db_engine = db_engine
+        self.schema = schema
+        self.profile_table = '"{}"."feature_profiles"'.format(schema)
+        self.large_scan_rows = large_scan_rows
+
+    def profile(self, aggregation, sample_size=None):
+        """Run each of an aggregation's inserts under EXPLAIN ANALYZE, into a
+        temporary table for each group, and roll back afterwards
+
+        The inserts are the statements run when features are generated: for
+        groups whose select can be parameterized (see
+        SpacetimeAggregation.get_select_templates()), a prepared statement
+        executed for each date, and otherwise an insert of each date's select.
+
+        Args:
+            aggregation (collate.SpacetimeAggregation)
+            sample_size (int, optional) The number of the aggregation's dates to
+                profile, all of them if not given
+
+        Returns: (list) dicts of aggregation, table_name, as_of_date, query and
+            plan, one for each insert profiled
+        """
+        dates = getattr(aggregation, "dates", [None])
+        profiled_dates = set(sample_dates(dates, sample_size))
+        creates = aggregation.get_creates()
+        inserts = aggregation.get_inserts()
+        templates = (
+            aggregation.get_select_templates()
+            if hasattr(aggregation, "get_select_templates")
+            else {}
+        )
+
+        profiles = []
+        prepared_statements = []
+        with self.db_engine.connect() as conn:
+            raw_conn = conn.execution_options(no_parameters=True)
+            trans = conn.begin()
+            try:
+                for group in aggregation.groups:
+                    table_name = aggregation.get_table_name(group)
+                    # the group's columns, in a table of its own in pg_temp,
+                    # which is dropped on rollback
+                    profile_table = 'pg_temp."feature_profile_{}"'.format(
+                        hashlib.md5(table_name.encode("utf-8")).hexdigest()
+                    )
+                    conn.execute(CreateTableAs(profile_table, creates[group].query))
+                    template = templates.get(group)
+                    if template is not None:
+                        statement = PreparedStatement(
+                            "INSERT INTO {} ({})".format(profile_table, template),
+                            ["date"],
+                        )
+                        raw_conn.execute(statement.get_prepare())
+                        prepared_statements.append(statement)
+                    for as_of_date, insert in zip(dates, inserts[group]):
+                        if as_of_date not in profiled_dates:
+                            continue
+                        if template is None:
+                            query = str(InsertFromSelect(profile_table, insert.query))
+                            recorded_query = query
+                        else:
+                            execute = ExecutePrepared(statement, [as_of_date])
+                            query = execute.get_execute()
+                            # with the statement that is executed
+                            recorded_query = str(execute)
+                        logging.info(
+                            "Profiling insert into %s as of %s", table_name, as_of_date
+                        )
+                        profiles.append(
+                            {
+                                "aggregation": aggregation.get_table_name(),
+                                "table_name": table_name,
+                                "as_of_date": as_of_date,
+                                "query": recorded_query,
+                                "plan": explain_analyze(conn, query),
+                            }
+                        )
+            finally:
+                trans.rollback()
+                # prepared statements outlive transactions
+                for statement in prepared_statements:
+                    raw_conn.execute("DEALLOCATE {}".format(statement.name))
+        return profiles
+
+    def record(self, profiles):
+        """Store profiles in the profiling table, creating it if needed"""
+        with self.db_engine.begin() as conn:
+            conn.execute('CREATE SCHEMA IF NOT EXISTS "{}"'.format(self.schema))
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS {} (
+                    profile_time timestamptz DEFAULT now(),
+                    aggregation text,
+                    table_name text,
+                    as_of_date date,
+                    query text,
+                    planning_time double precision,
+                    execution_time double precision,
+                    plan jsonb
+                )""".format(
+                    self.profile_table
+                )
+            )
+            for profile in profiles:
+                conn.execute(
+                    text(
+                        "INSERT INTO {} (aggregation, table_name, as_of_date, query, "
+                        "planning_time, execution_time, plan) VALUES (:aggregation, "
+                        ":table_name, :as_of_date, :query, :planning_time, "
+                        ":execution_time, cast(:plan as jsonb))".format(
+                            self.profile_table
+                        )
+                    ),
+                    aggregation=profile["aggregation"],
+                    table_name=profile["table_name"],
+                    as_of_date=profile["as_of_date"],
+                    query=profile["query"],
+                    planning_time=profile["plan"].get("Planning Time"),
+                    execution_time=profile["plan"].get("Execution Time"),
+                    plan=json.dumps(profile["plan"]),
+                )
+        logging.info("Stored %s profiles in %s", len(profiles), self.profile_table)
+
+    def _indexed_columns(self, relation):
+        """The columns leading any index of a table"""
+        return set(
+            row[0]
+            for row in self.db_engine.execute(
+                text(
+                    """select a.attname from pg_index i
+                    join pg_attribute a
+                    on a.attrelid = i.indrelid and a.attnum = i.indkey[0]
+                    where i.indrelid = to_regclass(:relation)"""
+                ),
+                relation=relation,
+            )
+        )
+
+    def _index_candidates(self, aggregation, scans):
+        """Columns the aggregation filters its sources on, which are read by
+        large sequential scans and not indexed"""
+        columns = [getattr(aggregation, "date_column", None)] + [
+            str(groupby) for groupby in aggregation.groups.values()
+        ]
+        columns = [
+            column.replace('"', "")
+            for column in columns
+            if column and re.fullmatch(r'"?\w+"?', column)
+        ]
+        candidates = []
+        for scan in scans:
+            indexed = self._indexed_columns(scan["relation"])
+            for column in columns:
+                if (
+                    column not in indexed
+                    and re.search(r"\b%s\b" % re.escape(column), scan["filter"] or "")
+                    and (scan["relation"], column) not in candidates
+                ):
+                    candidates.append((scan["relation"], column))
+        return candidates
+
+    def report(self, profiles, aggregations, top=10):
+        """Summarize profiles of the given aggregations
+
+        Args:
+            profiles (list) Profiles produced by profile()
+            aggregations (list) The profiled aggregations
+            top (int, optional) The number of slowest inserts to report
+
+        Returns: (dict) with keys
+            'slowest': the slowest inserts, as dicts of table_name, as_of_date
+                and execution_time (in ms)
+            'sequential_scans': dicts of aggregation, table_name, as_of_date
+                and the scan (see sequential_scans())
+            'index_candidates': statements creating indexes on the columns
+                filtered on by the large sequential scans
+        """
+        slowest = sorted(
+            profiles,
+            key=lambda profile: profile["plan"]["Execution Time"],
+            reverse=True,
+        )[:top]
+        scans = []
+        for profile in profiles:
+            for scan in sequential_scans(profile["plan"], self.large_scan_rows):
+                scans.append(
+                    dict(
+                        scan,
+                        aggregation=profile["aggregation"],
+                        table_name=profile["table_name"],
+                        as_of_date=profile["as_of_date"],
+                    )
+                )
+        index_candidates = []
+        for aggregation in aggregations:
+            for relation, column in self._index_candidates(
+                aggregation,
+                [
+                    scan
+                    for scan in scans
+                    if scan["aggregation"] == aggregation.get_table_name()
+                ],
+            ):
+                statement = "CREATE INDEX ON {} ({})".format(relation, column)
+                if statement not in index_candidates:
+                    index_candidates.append(statement)
+
+        return {
+            "slowest": [
+                {
+                    "table_name": profile["table_name"],
+                    "as_of_date": profile["as_of_date"],
+                    "execution_time": profile["plan"]["Execution Time"],
+                }
+                for profile in slowest
+            ],
+            "sequential_scans": sorted(
+                scans, key=lambda scan: scan["rows_read"], reverse=True
+            ),
+            "index_candidates": index_candidates,
+        }
+
+
+def format_report(report):
+    """Render a report produced by FeatureProfiler.report() as text"""
+    lines = ["Slowest feature inserts:"]
+    lines += [
+        "  {execution_time:.1f} ms: {table_name} as of {as_of_date}".format(**insert)
+        for insert in report["slowest"]
+    ]
+    lines.append("Large sequential scans:")
+    lines += [
+        "  {relation}: {rows_read} rows in {time:.1f} ms, for {table_name} as of "
+        "{as_of_date} (filter: {filter})".format(**scan)
+        for scan in report["sequential_scans"]
+    ] or ["  none"]
+    lines.append("Index candidates:")
+    lines += ["  " + statement for statement in report["index_candidates"]] or [
+        "  none"
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,193 @@
+import logging
+
+from sqlalchemy import text
+
+from .feature_group_creator import FeatureGroup
+
+# the most aggregates selected by a query, well below Postgres' limit of 1664
+# columns in a select list, by which the columns of wide tables are scanned in
+# batches
+MAX_AGGREGATES_PER_QUERY = 1500
+
+# the aggregates of each column compared to find duplicate columns: rows with
+# a value, minimum, maximum, sum, and sum weighted by a hash of the row's key
+COLUMN_AGGREGATES = (
+    "count({column})",
+    "min({column}::float8)",
+    "max({column}::float8)",
+    "sum({column}::float8)",
+    "sum({column}::float8 * pruning_weight)",
+)
+
+ALL_NULL = "all null"
+CONSTANT = "constant"
+DUPLICATE = "duplicate of {}"
+
+
+class FeaturePruner(object):
+    def __init__(self, db_engines, features_schema_name):
+        """Finds feature columns that carry no information in the rows of a
+        train matrix, so that they can be left out of it and of its test
+        matrices: columns that are NULL in every row, that have the same value
+        in every row, or that are exact duplicates of another column of their
+        table (such as a short and an 'all' interval of entities with no
+        history)
+
+        Only the rows of the train matrix's as of dates are looked at, with one
+        scan of each feature table (for every MAX_AGGREGATES_PER_QUERY
+        aggregates) for each set of as of dates, and one more to confirm any
+        duplicates found.
+
+        Args:
+            db_engines (list) of sqlalchemy.engine, the databases holding the
+                features, which are all scanned if the entities are sharded
+                across them (see EntityShards)
+            features_schema_name (string) The schema of the feature tables
+        """
+        self.db_engines = db_engines
+        self.features_schema_name = features_schema_name
+        self._pruned = {}
+
+    def _table(self, table_name):
+        return '"{}"."{}"'.format(self.features_schema_name, table_name)
+
+    @staticmethod
+    def _rows_query(table, selections):
+        return text(
+            """select {selections} from (
+                select *,
+                (hashtext(entity_id::text || as_of_date::text) % 1009)::float8
+                    as pruning_weight
+                from {table} where as_of_date = any(:as_of_dates)
+            ) rows""".format(selections=", ".join(selections), table=table)
+        )
+
+    def _select(self, table, selections, as_of_dates):
+        """The results of aggregates over the rows of the as of dates, in every
+        database"""
+        return [
+            list(
+                db_engine.execute(
+                    self._rows_query(table, selections), as_of_dates=as_of_dates
+                ).first()
+            )
+            for db_engine in self.db_engines
+        ]
+
+    def _column_aggregates(self, table, columns, as_of_dates):
+        """The aggregates of each column (see COLUMN_AGGREGATES) and the number
+        of rows, combined across the databases"""
+        per_column = len(COLUMN_AGGREGATES)
+        batch_size = max(1, MAX_AGGREGATES_PER_QUERY // per_column)
+        n_rows = 0
+        aggregates = {}
+        for start in range(0, len(columns), batch_size):
+            batch = columns[start:start + batch_size]
+            selections = ["count(*)"] + [
+                aggregate.format(column='"{}"'.format(column))
+                for column in batch
+                for aggregate in COLUMN_AGGREGATES
+            ]
+            shard_results = self._select(table, selections, as_of_dates)
+            n_rows = sum(result[0] for result in shard_results)
+            for i, column in enumerate(batch):
+                offset = 1 + i * per_column
+                shard_values = [
+                    result[offset:offset + per_column] for result in shard_results
+                ]
+                present = [values for values in shard_values if values[0]]
+                aggregates[column] = (
+                    sum(values[0] for values in shard_values),
+                    min((values[1] for values in present), default=None),
+                    max((values[2] for values in present), default=None),
+                    sum(values[3] for values in present),
+                    sum(values[4] for values in present),
+                )
+        return n_rows, aggregates
+
+    def _identical(self, table, pairs, as_of_dates):
+        """Whether each pair of columns holds the same value in every row"""
+        identical = []
+        for start in range(0, len(pairs), MAX_AGGREGATES_PER_QUERY):
+            batch = pairs[start:start + MAX_AGGREGATES_PER_QUERY]
+            selections = [
+                'coalesce(bool_and("{}" is not distinct from "{}"), true)'.format(
+                    column, other
+                )
+                for column, other in batch
+            ]
+            shard_results = self._select(table, selections, as_of_dates)
+            identical += [all(results) for results in zip(*shard_results)]
+        return identical
+
+    def table_pruning(self, table_name, columns, as_of_dates):
+        """The columns of a feature table to prune for a set of as of dates
+
+        Args:
+            table_name (string) The feature table, in the features schema
+            columns (list) The table's feature columns
+            as_of_dates (list) The as of dates of the train matrix
+
+        Returns: (dict) the reason each pruned column is pruned for
+        """
+        memo_key = (table_name, tuple(columns), tuple(sorted(as_of_dates)))
+        if memo_key in self._pruned:
+            return self._pruned[memo_key]
+        table = self._table(table_name)
+        n_rows, aggregates = self._column_aggregates(table, columns, as_of_dates)
+        pruned = {}
+        kept = {}
+        candidates = []
+        for column in columns:
+            count, minimum, maximum = aggregates[column][:3]
+            if count == 0:
+                pruned[column] = ALL_NULL
+            elif count == n_rows and minimum == maximum:
+                pruned[column] = CONSTANT
+            elif aggregates[column] in kept:
+                candidates.append((column, kept[aggregates[column]]))
+            else:
+                kept[aggregates[column]] = column
+        # columns alike in all of their aggregates are compared row by row
+        if candidates:
+            for (column, other), identical in zip(
+                candidates, self._identical(table, candidates, as_of_dates)
+            ):
+                if identical:
+                    pruned[column] = DUPLICATE.format(other)
+        logging.info(
+            "%s of %s columns of %s pruned for %s as of dates",
+            len(pruned),
+            len(columns),
+            table_name,
+            len(as_of_dates),
+        )
+        self._pruned[memo_key] = pruned
+        return pruned
+
+    def prune(self, feature_dictionary, as_of_dates):
+        """Prune a feature dictionary for the rows of a train matrix
+
+        Args:
+            feature_dictionary (FeatureGroup) The features of the matrix
+            as_of_dates (list) The as of dates of the train matrix
+
+        Returns: (tuple) the pruned feature dictionary, and the reason each
+            pruned feature was pruned for
+        """
+        pruned_features = {}
+        pruned_dictionary = FeatureGroup()
+        pruned_dictionary.names.extend(feature_dictionary.names)
+        for table_name, columns in feature_dictionary.items():
+            pruned = self.table_pruning(table_name, columns, as_of_dates)
+            pruned_features.update(pruned)
+            kept = [column for column in columns if column not in pruned]
+            if kept:
+                pruned_dictionary[table_name] = kept
+        if not pruned_dictionary:
+            logging.warning(
+                "Every feature of %s would be pruned, so none are",
+                feature_dictionary.names,
+            )
+            return feature_dictionary, {}
+        return pruned_dictionary, pruned_features
@@ -1,10 +1,30 @@
 import logging
+import re
 import textwrap
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from triage.component.architect.row_cache import RowCache
+from triage.component.architect.source_watermarks import SourceWatermarks
 from triage.database_reflection import table_exists
 
 
 DEFAULT_LABEL_NAME = "outcome"
 
+# the number of (as of date, label timespan) pairs labelled by each statement in
+# set-based label generation
+DEFAULT_LABEL_CHUNK_SIZE = 100
+
+# the ways the query parameters may be written as SQL literals, and the columns
+# of the label_dates relation replacing each in set-based label generation
+LIFTED_PARAMETERS = [
+    (r"\btimestamp\s+'\{as_of_date\}'", "(label_dates.as_of_date)"),
+    (r"\bdate\s+'\{as_of_date\}'", "(label_dates.as_of_date)::date"),
+    (r"'\{as_of_date\}'", "(label_dates.as_of_date)"),
+    (r"\binterval\s+'\{label_timespan\}'", "(label_dates.label_timespan)"),
+    (r"'\{label_timespan\}'", "(label_dates.label_timespan)"),
+]
+
 
 class LabelGeneratorNoOp(object):
     def generate_all_labels(self, labels_table, as_of_dates, label_timespans):
@@ -22,16 +42,72 @@ class LabelGeneratorNoOp(object):
 
 
 class LabelGenerator(object):
-    def __init__(self, db_engine, query, label_name=None, replace=True):
+    def __init__(
+        self,
+        db_engine,
+        query,
+        label_name=None,
+        replace=True,
+        set_based=True,
+        chunk_size=DEFAULT_LABEL_CHUNK_SIZE,
+        shared_cache=True,
+        entity_filter=None,
+    ):
+        """Generates labels by running a query for each as of date and label
+        timespan
+
+        Args:
+            db_engine (sqlalchemy.engine)
+            query (string) A query selecting entity ids and an outcome for each,
+                given an {as_of_date} and {label_timespan}
+            label_name (string, optional) The name of the label
+            replace (boolean, optional) Whether to replace existing labels
+            set_based (boolean, optional) Whether to label many as of dates and
+                label timespans in each statement, by evaluating the query
+                against a relation of them (see lifted_query()). Queries that
+                can not be lifted this way are run for each as of date and label
+                timespan
+            chunk_size (int, optional) The number of as of dates and label
+                timespans labelled by each set-based statement
+            shared_cache (boolean, optional) Whether to share the labels of
+                each as of date and label timespan with other experiments using
+                the same query (see RowCache)
+            entity_filter (string, optional) A SQL condition on entity_id
+                restricting the labels to some entities, such as those of a
+                shard (see EntityShards.predicate())
+        """
         self.db_engine = db_engine
         self.replace = replace
         # query is expected to select a number of entity ids
         # and an outcome for each given an as-of-date
+        if entity_filter is not None:
+            # filtering the query's result lets the database push the condition
+            # down into the query's own scans
+            query = "select * from ({}) labels where {}".format(query, entity_filter)
         self.query = query
         self.label_name = label_name or DEFAULT_LABEL_NAME
+        self.set_based = set_based
+        self.chunk_size = chunk_size
+        self.source_watermarks = SourceWatermarks(db_engine)
+        self.row_cache = (
+            RowCache(db_engine, "labels", timespan_column="label_timespan")
+            if shared_cache
+            else None
+        )
+
+    def _source_query(self, as_of_dates, label_timespans):
+        """The label query for one of the as of dates and label timespans,
+        to find the tables labels are generated from"""
+        if not as_of_dates or not label_timespans:
+            return None
+        return self.query.format(
+            as_of_date=as_of_dates[0], label_timespan=label_timespans[0]
+        )
 
-    def _create_labels_table(self, labels_table_name):
-        if self.replace or not table_exists(labels_table_name, self.db_engine):
+    def _create_labels_table(self, labels_table_name, replace=None):
+        if replace is None:
+            replace = self.replace
+        if replace or not table_exists(labels_table_name, self.db_engine):
             self.db_engine.execute("drop table if exists {}".format(labels_table_name))
             self.db_engine.execute(
                 """
@@ -50,48 +126,211 @@ class LabelGenerator(object):
             logging.info("Not dropping and recreating table because "
                          "replace flag was set to False and table was found to exist")
 
+    def _index_labels_table(self, labels_table_name):
+        """Index the labels table for joining to matrix rows by entity and as of
+        date, and for finding the as of dates and label timespans labelled"""
+        base_name = labels_table_name.split(".")[-1].strip('"')
+        for suffix, columns in (
+            ("entity_date_idx", "entity_id, as_of_date"),
+            ("date_timespan_idx", "as_of_date, label_timespan"),
+        ):
+            self.db_engine.execute(
+                "create index if not exists {}_{} on {} ({})".format(
+                    base_name, suffix, labels_table_name, columns
+                )
+            )
+
+    @staticmethod
+    def _dates_relation(pairs):
+        """SQL for a relation of (as of date, label timespan) pairs, with each
+        pair's position in the list"""
+        return """unnest(
+            array[{as_of_dates}]::timestamp[],
+            array[{label_timespans}]::interval[]
+        ) with ordinality as label_dates(as_of_date, label_timespan, position)
+        """.format(
+            as_of_dates=", ".join("'{}'".format(as_of_date) for as_of_date, _ in pairs),
+            label_timespans=", ".join(
+                "'{}'".format(label_timespan) for _, label_timespan in pairs
+            ),
+        )
+
+    def _unlabelled(self, labels_table, pairs):
+        """The (as of date, label timespan) pairs without existing labels"""
+        if not pairs:
+            return []
+        positions = [
+            row[0]
+            for row in self.db_engine.execute(
+                """select label_dates.position from {dates_relation}
+                where not exists (
+                    select 1 from {labels_table}
+                    where as_of_date = label_dates.as_of_date
+                    and label_timespan = label_dates.label_timespan
+                    and label_name = '{label_name}'
+                )
+                order by label_dates.position
+                """.format(
+                    dates_relation=self._dates_relation(pairs),
+                    labels_table=labels_table,
+                    label_name=self.label_name,
+                )
+            )
+        ]
+        return [pairs[position - 1] for position in positions]
+
+    def lifted_query(self):
+        """The label query evaluated against a label_dates relation of as of
+        dates and label timespans, rather than a single one of each
+
+        Each quoted '{as_of_date}' and '{label_timespan}' (including typed
+        literals, like interval '{label_timespan}') is replaced by the matching
+        column of label_dates.
+
+        Returns: (string) the lifted query, or None if the parameters are used
+            in any other way (such as within a longer string)
+        """
+        lifted = self.query
+        for pattern, column in LIFTED_PARAMETERS:
+            lifted = re.sub(pattern, column, lifted)
+        if "{as_of_date}" in lifted or "{label_timespan}" in lifted:
+            return None
+        try:
+            # unescape any doubled braces, as formatting the query would
+            return lifted.format()
+        except (IndexError, KeyError, ValueError):
+            return None
+
+    def generate_set_based(self, pairs, labels_table):
+        """Generate labels for many as of dates and label timespans with one
+        statement, in a transaction
+
+        The lifted query is joined laterally to the as of dates and label
+        timespans, so unless Postgres can flatten it (a query without
+        aggregation, for instance), it is still evaluated once per as of date
+        and label timespan, scanning the outcomes each time. This saves a
+        round trip and a commit per date rather than any of those scans.
+
+        Args:
+            pairs (list) of (as of date, label timespan) tuples
+            labels_table (string) name of labels table
+
+        Raises: (ValueError) if the query can not be lifted (see lifted_query())
+        """
+        lifted_query = self.lifted_query()
+        if lifted_query is None:
+            raise ValueError("The label query can not be evaluated set-based")
+        full_insert_query = textwrap.dedent(
+            """
+            insert into {labels_table}
+            select
+                entities_and_outcomes.entity_id,
+                label_dates.as_of_date as as_of_date,
+                label_dates.label_timespan as label_timespan,
+                '{label_name}' as label_name,
+                'binary' as label_type,
+                entities_and_outcomes.outcome as label
+            from {dates_relation}
+            cross join lateral ({user_query}) entities_and_outcomes
+        """
+        ).format(
+            labels_table=labels_table,
+            label_name=self.label_name,
+            dates_relation=self._dates_relation(pairs),
+            user_query=lifted_query,
+        )
+        logging.debug("Running set-based label creation query")
+        logging.debug(full_insert_query)
+        with self.db_engine.begin() as conn:
+            conn.execute(full_insert_query)
+
+    def _generate_pairs(self, pairs, labels_table):
+        """Generate labels for (as of date, label timespan) pairs, in chunks of
+        set-based statements if possible and falling back to a statement per
+        pair otherwise"""
+        if self.set_based and self.lifted_query() is None:
+            logging.info(
+                "Label query can not be evaluated set-based, so labels will be "
+                "generated for each as of date and label timespan"
+            )
+        elif self.set_based:
+            for start in range(0, len(pairs), self.chunk_size):
+                chunk = pairs[start:start + self.chunk_size]
+                logging.info(
+                    "Generating labels for %s as of dates and label timespans, "
+                    "starting at as of date %s",
+                    len(chunk),
+                    chunk[0][0],
+                )
+                try:
+                    self.generate_set_based(chunk, labels_table)
+                except SQLAlchemyError as e:
+                    logging.warning(
+                        "Set-based label query failed, so labels will be "
+                        "generated for each as of date and label timespan: %s",
+                        e,
+                    )
+                    pairs = pairs[start:]
+                    break
+            else:
+                return
+        for as_of_date, label_timespan in pairs:
+            logging.info(
+                "Generating labels for as of date %s and label timespan %s",
+                as_of_date,
+                label_timespan,
+            )
+            self.generate(
+                start_date=as_of_date,
+                label_timespan=label_timespan,
+                labels_table=labels_table,
+            )
+
     def generate_all_labels(self, labels_table, as_of_dates, label_timespans):
-        self._create_labels_table(labels_table)
+        # existing labels are kept only if the tables they were generated from
+        # have not changed since
+        source_query = self._source_query(as_of_dates, label_timespans)
+        watermark = (
+            self.source_watermarks.current(source_query) if source_query else None
+        )
+        replace = self.replace or self.source_watermarks.changed(
+            labels_table, watermark
+        )
+        self._create_labels_table(labels_table, replace)
         logging.info(
             "Creating labels for %s as of dates and %s label timespans",
             len(as_of_dates),
             len(label_timespans),
         )
-        for as_of_date in as_of_dates:
-            for label_timespan in label_timespans:
-                if not self.replace:
-                    logging.info(
-                        "Looking for existing labels for as of date %s and label timespan %s",
-                        as_of_date,
-                        label_timespan,
-                    )
-                    any_existing_labels = list(self.db_engine.execute(
-                        """select 1 from {labels_table}
-                        where as_of_date = '{as_of_date}'
-                        and label_timespan = '{label_timespan}'::interval
-                        and label_name = '{label_name}'
-                        limit 1
-                        """.format(
-                            labels_table=labels_table,
-                            as_of_date=as_of_date,
-                            label_timespan=label_timespan,
-                            label_name=self.label_name
-                        )
-                    ))
-                    if len(any_existing_labels) == 1:
-                        logging.info("Since nonzero existing labels found, skipping")
-                        continue
-
-                logging.info(
-                    "Generating labels for as of date %s and label timespan %s",
-                    as_of_date,
-                    label_timespan,
-                )
-                self.generate(
-                    start_date=as_of_date,
-                    label_timespan=label_timespan,
-                    labels_table=labels_table,
-                )
+        pairs = [
+            (as_of_date, label_timespan)
+            for as_of_date in as_of_dates
+            for label_timespan in label_timespans
+        ]
+        if not replace:
+            logging.info("Looking for existing labels")
+            unlabelled = self._unlabelled(labels_table, pairs)
+            logging.info(
+                "Existing labels found for %s of %s as of dates and label "
+                "timespans, skipping them",
+                len(pairs) - len(unlabelled),
+                len(pairs),
+            )
+            pairs = unlabelled
+        if self.row_cache is not None:
+            cached = self.row_cache.cached(self.query, watermark, pairs)
+            self.row_cache.load(
+                self.query,
+                cached,
+                labels_table,
+                columns="cached.entity_id, cached.as_of_date, cached.label_timespan, "
+                "'{}', cached.label_type, cached.label".format(self.label_name),
+            )
+            pairs = [pair for pair in pairs if pair not in cached]
+        self._generate_pairs(pairs, labels_table)
+        if self.row_cache is not None:
+            self.row_cache.store(self.query, watermark, pairs, labels_table)
+        self._index_labels_table(labels_table)
         nrows = [
             row[0]
             for row in self.db_engine.execute(
@@ -102,6 +341,7 @@ class LabelGenerator(object):
             logging.warning("Done creating labels, but no rows in labels table!")
         else:
             logging.info("Done creating labels table %s: rows: %s", labels_table, nrows)
+        self.source_watermarks.record(labels_table, watermark, source_query)
 
     def generate(self, start_date, label_timespan, labels_table):
         """Generate labels table using a query
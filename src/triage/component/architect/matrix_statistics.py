@@ -0,0 +1,295 @@
+import logging
+
+import numpy
+import pandas
+from sqlalchemy import text
+
+from triage.component.results_schema import MatrixColumnStatistics, MatrixLabelBaseRate
+
+# how many distinct values of a column are kept track of, beyond which it is
+# only known to have more
+DISTINCT_VALUES_CAP = 100
+
+
+class MatrixStatistics(object):
+    def __init__(self, label_name, distinct_values_cap=DISTINCT_VALUES_CAP):
+        """Statistics of each column of a matrix, and the base rate of its
+        label for each as of date, computed from its rows as they are built so
+        that they can be looked up later without loading the matrix
+
+        The rows can be given in any number of chunks, each a DataFrame indexed
+        by entity_id and as_of_date (see update()).
+
+        Args:
+            label_name (string) The matrix's label column
+            distinct_values_cap (int, optional) How many distinct values of
+                each column to count, beyond which the column's count is
+                recorded as unknown (NULL)
+        """
+        self.label_name = label_name
+        self.distinct_values_cap = distinct_values_cap
+        self.columns = None
+        self.label_counts = {}
+
+    def _start(self, columns):
+        self.columns = list(columns)
+        n = len(self.columns)
+        self.row_count = 0
+        self.null_counts = numpy.zeros(n, dtype=numpy.int64)
+        self.zero_counts = numpy.zeros(n, dtype=numpy.int64)
+        self.minimums = numpy.full(n, numpy.inf)
+        self.maximums = numpy.full(n, -numpy.inf)
+        # the count, mean and sum of squared differences from the mean of each
+        # column's values, combined across chunks
+        self.counts = numpy.zeros(n, dtype=numpy.int64)
+        self.means = numpy.zeros(n)
+        self.squared_differences = numpy.zeros(n)
+        self.distinct_values = [numpy.empty(0) for _ in self.columns]
+
+    def update(self, chunk):
+        """Add the rows of a chunk of the matrix to the statistics
+
+        Args:
+            chunk (pandas.DataFrame) Rows of the matrix, with the label, indexed
+                by entity_id and as_of_date
+        """
+        if self.columns is None:
+            self._start(chunk.columns)
+        elif list(chunk.columns) != self.columns:
+            raise ValueError("Matrix chunks have different columns")
+        self.row_count += len(chunk)
+        for i, column in enumerate(self.columns):
+            values = chunk[column].values.astype(numpy.float64, copy=False)
+            present = values[~numpy.isnan(values)]
+            self.null_counts[i] += len(values) - len(present)
+            if not len(present):
+                continue
+            self.zero_counts[i] += numpy.count_nonzero(present == 0)
+            self.minimums[i] = min(self.minimums[i], present.min())
+            self.maximums[i] = max(self.maximums[i], present.max())
+            # combine the chunk's moments with those of the rows before it
+            count, mean = len(present), present.mean()
+            total = self.counts[i] + count
+            delta = mean - self.means[i]
+            self.squared_differences[i] += ((present - mean) ** 2).sum()
+            self.squared_differences[i] += delta ** 2 * self.counts[i] * count / total
+            self.means[i] += delta * count / total
+            self.counts[i] = total
+            if self.distinct_values[i] is not None:
+                distinct = numpy.union1d(self.distinct_values[i], present)
+                self.distinct_values[i] = (
+                    distinct if len(distinct) <= self.distinct_values_cap else None
+                )
+        if self.label_name in chunk.columns and "as_of_date" in chunk.index.names:
+            grouped = chunk[self.label_name].groupby(level="as_of_date")
+            date_counts = pandas.concat(
+                [grouped.size(), grouped.count(), grouped.sum()], axis=1
+            )
+            for as_of_date, rows, labeled, label_sum in date_counts.itertuples():
+                counts = self.label_counts.setdefault(
+                    pandas.Timestamp(as_of_date), [0, 0, 0.0]
+                )
+                counts[0] += int(rows)
+                counts[1] += int(labeled)
+                counts[2] += float(label_sum)
+
+    def track(self, chunks):
+        """Add the rows of chunks of the matrix to the statistics as they are
+        iterated over
+
+        Args:
+            chunks (iterable) of pandas.DataFrame chunks (see update())
+
+        Returns: (generator) the chunks
+        """
+        for chunk in chunks:
+            self.update(chunk)
+            yield chunk
+
+    def column_rows(self, matrix_uuid):
+        """The statistics of each column, as rows of the
+        model_metadata.matrix_column_statistics table"""
+        rows = []
+        for i, column in enumerate(self.columns or []):
+            counted = self.counts[i] > 0
+            rows.append(
+                {
+                    "matrix_uuid": matrix_uuid,
+                    "column_name": column,
+                    "null_count": int(self.null_counts[i]),
+                    "zero_count": int(self.zero_counts[i]),
+                    "min_value": float(self.minimums[i]) if counted else None,
+                    "max_value": float(self.maximums[i]) if counted else None,
+                    "mean": float(self.means[i]) if counted else None,
+                    "std": float(
+                        numpy.sqrt(self.squared_differences[i] / self.counts[i])
+                    )
+                    if counted
+                    else None,
+                    "distinct_count": None
+                    if self.distinct_values[i] is None
+                    else len(self.distinct_values[i]),
+                }
+            )
+        return rows
+
+    def label_rows(self, matrix_uuid):
+        """The base rate of the label for each as of date, as rows of the
+        model_metadata.matrix_label_base_rates table"""
+        return [
+            {
+                "matrix_uuid": matrix_uuid,
+                "as_of_date": as_of_date.to_pydatetime(),
+                "num_rows": num_rows,
+                "num_labeled": num_labeled,
+                "base_rate": label_sum / num_labeled if num_labeled else None,
+            }
+            for as_of_date, (num_rows, num_labeled, label_sum) in sorted(
+                self.label_counts.items()
+            )
+        ]
+
+    def save(self, db_engine, matrix_uuid):
+        """Replace the statistics stored for a matrix with these
+
+        Args:
+            db_engine (sqlalchemy.engine)
+            matrix_uuid (string)
+        """
+        with db_engine.begin() as conn:
+            delete_matrix_statistics(conn, matrix_uuid)
+            column_rows = self.column_rows(matrix_uuid)
+            if column_rows:
+                conn.execute(MatrixColumnStatistics.__table__.insert(), column_rows)
+            label_rows = self.label_rows(matrix_uuid)
+            if label_rows:
+                conn.execute(MatrixLabelBaseRate.__table__.insert(), label_rows)
+        logging.info(
+            "Saved statistics of %s columns and %s as of dates of matrix %s",
+            len(column_rows),
+            len(label_rows),
+            matrix_uuid,
+        )
+
+
+def delete_matrix_statistics(conn, matrix_uuid):
+    for table in (MatrixColumnStatistics.__table__, MatrixLabelBaseRate.__table__):
+        conn.execute(table.delete().where(table.c.matrix_uuid == matrix_uuid))
+
+
+def save_view_statistics(
+    db_engine, matrix_uuid, source_matrix_uuid, columns, as_of_date_range=None
+):
+    """Store the statistics of a view of a matrix (see architect.Planner) from
+    those of its source matrix
+
+    The label base rates of the view's as of dates are those of the source
+    matrix. Its columns have the same statistics only if it has all of the
+    source matrix's rows, so none are stored otherwise.
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        matrix_uuid (string) The view
+        source_matrix_uuid (string) The matrix it is a view of
+        columns (list) The view's columns, with its label
+        as_of_date_range (tuple, optional) The first and last as of dates of
+            the source matrix's rows in the view, if not all of them
+    """
+    with db_engine.begin() as conn:
+        delete_matrix_statistics(conn, matrix_uuid)
+        if as_of_date_range is None:
+            conn.execute(
+                text(
+                    """insert into {table} select :matrix_uuid, column_name,
+                    null_count, zero_count, min_value, max_value, mean, std,
+                    distinct_count from {table}
+                    where matrix_uuid = :source_matrix_uuid
+                    and column_name = any(:columns)""".format(
+                        table="model_metadata.matrix_column_statistics"
+                    )
+                ),
+                matrix_uuid=matrix_uuid,
+                source_matrix_uuid=source_matrix_uuid,
+                columns=list(columns),
+            )
+            first, last = None, None
+        else:
+            first, last = as_of_date_range
+        conn.execute(
+            text(
+                """insert into model_metadata.matrix_label_base_rates
+                select :matrix_uuid, as_of_date, num_rows, num_labeled, base_rate
+                from model_metadata.matrix_label_base_rates
+                where matrix_uuid = :source_matrix_uuid
+                and as_of_date between coalesce(:first, as_of_date)
+                and coalesce(:last, as_of_date)"""
+            ),
+            matrix_uuid=matrix_uuid,
+            source_matrix_uuid=source_matrix_uuid,
+            first=first,
+            last=last,
+        )
+
+
+def column_statistics(db_engine, matrix_uuid):
+    """The statistics of each column of a matrix, computed when it was built
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        matrix_uuid (string)
+
+    Returns: (pandas.DataFrame) the statistics, indexed by column name, empty
+        if none were stored for the matrix
+    """
+    return pandas.read_sql(
+        text(
+            """select column_name, null_count, zero_count, min_value, max_value,
+            mean, std, distinct_count
+            from model_metadata.matrix_column_statistics
+            where matrix_uuid = :matrix_uuid order by column_name"""
+        ),
+        db_engine,
+        params={"matrix_uuid": matrix_uuid},
+        index_col="column_name",
+    )
+
+
+def label_base_rates(db_engine, matrix_uuid):
+    """The base rate of a matrix's label for each of its as of dates, computed
+    when it was built
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        matrix_uuid (string)
+
+    Returns: (pandas.DataFrame) the number of rows, the number of them that
+        are labeled and the mean of their labels, indexed by as of date
+    """
+    return pandas.read_sql(
+        text(
+            """select as_of_date, num_rows, num_labeled, base_rate
+            from model_metadata.matrix_label_base_rates
+            where matrix_uuid = :matrix_uuid order by as_of_date"""
+        ),
+        db_engine,
+        params={"matrix_uuid": matrix_uuid},
+        index_col="as_of_date",
+    )
+
+
+def label_value_count(base_rates):
+    """The number of distinct values of a matrix's binary label, counting
+    missing labels as one, as pandas.Series.unique() would find
+
+    Args:
+        base_rates (pandas.DataFrame) The matrix's label base rates (see
+            label_base_rates())
+
+    Returns: (int)
+    """
+    rates = base_rates.loc[base_rates["num_labeled"] > 0, "base_rate"]
+    return (
+        int((rates > 0).any())
+        + int((rates < 1).any())
+        + int(base_rates["num_labeled"].sum() < base_rates["num_rows"].sum())
+    )
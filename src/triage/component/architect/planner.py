@@ -1,10 +1,19 @@
 import copy
 import itertools
 import logging
+from collections import OrderedDict
 
 from triage.component import metta
 
 from . import utils, state_table_generators
+from .feature_group_creator import FeatureGroup
+
+# metadata that only describes a matrix's columns, so that matrices alike in
+# everything else can be views of the same matrix
+COLUMN_METADATA = ("feature_names", "feature_groups", "pruned_features")
+# metadata that only describes a train matrix's rows, of which a matrix with a
+# shorter max_training_history has the latest
+ROW_METADATA = ("first_as_of_time", "as_of_times", "max_training_history", "matrix_id")
 
 
 class Planner(object):
@@ -16,7 +25,19 @@ class Planner(object):
         states,
         user_metadata,
         cohort_name="default",
+        matrix_views=False,
+        feature_pruner=None,
     ):
+        """
+        :param matrix_views: whether matrices differing only in their feature
+            groups, or train matrices only in their max_training_history, are
+            planned as views of one matrix with all of their rows and columns,
+            which is the only one of them built from the database
+        :param feature_pruner: prunes the features of each train matrix that
+            carry no information in its rows, and of its test matrices alike
+        :type matrix_views: bool
+        :type feature_pruner: triage.component.architect.feature_pruning.FeaturePruner
+        """
         self.feature_start_time = (
             feature_start_time
         )  # earliest time included in features
@@ -25,6 +46,8 @@ class Planner(object):
         self.cohort_name = cohort_name
         self.states = states or [state_table_generators.DEFAULT_ACTIVE_STATE]
         self.user_metadata = user_metadata
+        self.matrix_views = matrix_views
+        self.feature_pruner = feature_pruner
 
     def _generate_build_task(
         self, matrix_metadata, matrix_uuid, train_matrix, feature_dictionary
@@ -47,6 +70,7 @@ class Planner(object):
         label_type,
         state,
         matrix_type,
+        pruned_features=None,
     ):
         """ Generate dictionary of matrix metadata.
 
@@ -56,12 +80,15 @@ class Planner(object):
         :param label_type: type of label
         :param state: the entity state to be included in the matrix
         :param matrix_type: type (train/test) of matrix
+        :param pruned_features: the reason each feature pruned from the
+            feature dictionary was pruned for, if any were
         :type matrix_definition: dict
         :type feature dictionary: dict
         :type label_name: str
         :type label_type: str
         :type state: str
         :type matrix_type: str
+        :type pruned_features: dict
 
         :return: metadata needed for matrix identification and modeling
         :rtype: dict
@@ -100,6 +127,8 @@ class Planner(object):
             "matrix_id": matrix_id,
             "matrix_type": matrix_type,
         }
+        if pruned_features is not None:
+            matrix_metadata["pruned_features"] = pruned_features
         matrix_metadata.update(matrix_definition)
         matrix_metadata.update(self.user_metadata)
 
@@ -138,6 +167,13 @@ class Planner(object):
                 self.label_names, self.label_types, self.states, feature_dictionaries
             ):
                 matrix_set_clone = copy.deepcopy(matrix_set)
+                # the features are pruned for the train matrix's rows, and its
+                # test matrices have the same features
+                pruned_features = None
+                if self.feature_pruner is not None:
+                    feature_dictionary, pruned_features = self.feature_pruner.prune(
+                        feature_dictionary, train_matrix["as_of_times"]
+                    )
                 # get a uuid
                 train_metadata = self._make_metadata(
                     train_matrix,
@@ -146,6 +182,7 @@ class Planner(object):
                     label_type,
                     state,
                     "train",
+                    pruned_features,
                 )
                 train_uuid = metta.generate_uuid(train_metadata)
                 logging.info(
@@ -176,6 +213,7 @@ class Planner(object):
                         label_type,
                         state,
                         "test",
+                        pruned_features,
                     )
                     test_uuid = metta.generate_uuid(test_metadata)
                     logging.info(
@@ -200,6 +238,9 @@ class Planner(object):
                 matrix_set_clone["test_uuids"] = test_uuids
                 updated_definitions.append(matrix_set_clone)
 
+        if self.matrix_views:
+            build_tasks = self._plan_views(build_tasks)
+
         logging.info(
             "Planner is finished generating matrix plans. "
             "%s matrix definitions and %s unique build tasks found",
@@ -208,3 +249,179 @@ class Planner(object):
         )
         logging.info("Associated all tasks with experiment in database")
         return updated_definitions, build_tasks
+
+    @staticmethod
+    def _group_matrices(build_tasks, varying_metadata):
+        """Group the matrices of build tasks whose metadata is the same but for
+        the given keys
+
+        :return: lists of the matrix uuids of each group
+        :rtype: list
+        """
+        groups = OrderedDict()
+        for matrix_uuid, build_task in build_tasks.items():
+            key_metadata = {
+                key: value
+                for key, value in build_task["matrix_metadata"].items()
+                if key not in varying_metadata
+            }
+            groups.setdefault(metta.generate_uuid(key_metadata), []).append(
+                matrix_uuid
+            )
+        return list(groups.values())
+
+    def _plan_views(self, build_tasks):
+        """Make matrices of build tasks into views of others, which have all of
+        their rows and columns (source matrices), by adding the source matrix's
+        uuid to their metadata as 'source_matrix_uuid'
+
+        Matrices differing only in their feature groups become views of a
+        matrix with all of their features, and train matrices differing only in
+        their max_training_history views of the one with the longest history.
+        The uuids of the views are left as they were, so they identify the same
+        matrices as when built in full.
+
+        :param build_tasks: build tasks by matrix uuid
+        :type build_tasks: dict
+
+        :return: the build tasks, with those of source matrices first
+        :rtype: OrderedDict
+        """
+        sources, column_views = self._plan_column_views(build_tasks)
+        sources, row_views = self._plan_row_views(sources)
+        # views read from source matrices that are not views themselves
+        for view_task in column_views.values():
+            view_metadata = view_task["matrix_metadata"]
+            source_task = row_views.get(view_metadata["source_matrix_uuid"])
+            if source_task is not None:
+                view_metadata["source_matrix_uuid"] = source_task["matrix_metadata"][
+                    "source_matrix_uuid"
+                ]
+        planned = OrderedDict(sources)
+        for matrix_uuid, build_task in row_views.items():
+            # matrices planned only as sources of other matrices are dropped
+            # once they are views
+            if matrix_uuid in build_tasks:
+                planned[matrix_uuid] = build_task
+        planned.update(column_views)
+        return planned
+
+    def _plan_column_views(self, build_tasks):
+        """Plan the matrices of build tasks that differ only in their feature
+        groups as views of a matrix with all of their features, which is one of
+        them if it already has every feature and is planned along with them
+        otherwise
+
+        :return: the build tasks of the source matrices and of the views
+        :rtype: tuple (OrderedDict, OrderedDict)
+        """
+        sources = OrderedDict()
+        views = OrderedDict()
+        for matrix_uuids in self._group_matrices(build_tasks, COLUMN_METADATA):
+            if len(matrix_uuids) == 1:
+                sources[matrix_uuids[0]] = build_tasks[matrix_uuids[0]]
+                continue
+            all_features = FeatureGroup()
+            for matrix_uuid in matrix_uuids:
+                feature_dictionary = build_tasks[matrix_uuid]["feature_dictionary"]
+                for table, features in feature_dictionary.items():
+                    table_features = all_features.setdefault(table, [])
+                    table_features.extend(
+                        feature
+                        for feature in features
+                        if feature not in table_features
+                    )
+                all_features.names.extend(
+                    name
+                    for name in feature_dictionary.names
+                    if name not in all_features.names
+                )
+            feature_names = utils.feature_list(all_features)
+            source_uuid = next(
+                (
+                    matrix_uuid
+                    for matrix_uuid in matrix_uuids
+                    if build_tasks[matrix_uuid]["matrix_metadata"]["feature_names"]
+                    == feature_names
+                ),
+                None,
+            )
+            if source_uuid is None:
+                source_task = build_tasks[matrix_uuids[0]]
+                source_metadata = copy.deepcopy(source_task["matrix_metadata"])
+                source_metadata["feature_names"] = feature_names
+                source_metadata["feature_groups"] = all_features.names
+                if "pruned_features" in source_metadata:
+                    # the features pruned from every matrix of the group
+                    source_metadata["pruned_features"] = {
+                        feature: reason
+                        for matrix_uuid in matrix_uuids
+                        for feature, reason in build_tasks[matrix_uuid][
+                            "matrix_metadata"
+                        ]["pruned_features"].items()
+                        if feature not in feature_names
+                    }
+                source_uuid = metta.generate_uuid(source_metadata)
+                sources[source_uuid] = self._generate_build_task(
+                    source_metadata, source_uuid, source_task, all_features
+                )
+                logging.info(
+                    "Planned matrix %s with the features of matrices %s",
+                    source_uuid,
+                    matrix_uuids,
+                )
+            else:
+                sources[source_uuid] = build_tasks[source_uuid]
+            self._add_views(build_tasks, matrix_uuids, source_uuid, views)
+        return sources, views
+
+    def _plan_row_views(self, build_tasks):
+        """Plan the train matrices of build tasks that differ only in their
+        max_training_history as views of the one with the longest history,
+        when their as of times are the latest of its as of times
+
+        :return: the build tasks of the source matrices and of the views
+        :rtype: tuple (OrderedDict, OrderedDict)
+        """
+        sources = OrderedDict()
+        views = OrderedDict()
+        for matrix_uuids in self._group_matrices(build_tasks, ROW_METADATA):
+            source_uuid = max(
+                matrix_uuids,
+                key=lambda matrix_uuid: len(build_tasks[matrix_uuid]["as_of_times"]),
+            )
+            sources[source_uuid] = build_tasks[source_uuid]
+            source_as_of_times = sorted(build_tasks[source_uuid]["as_of_times"])
+            view_uuids = []
+            for matrix_uuid in matrix_uuids:
+                if matrix_uuid == source_uuid:
+                    continue
+                as_of_times = sorted(build_tasks[matrix_uuid]["as_of_times"])
+                if (
+                    build_tasks[matrix_uuid]["matrix_type"] == "train"
+                    and as_of_times
+                    and source_as_of_times[-len(as_of_times):] == as_of_times
+                ):
+                    view_uuids.append(matrix_uuid)
+                else:
+                    sources[matrix_uuid] = build_tasks[matrix_uuid]
+            self._add_views(build_tasks, view_uuids, source_uuid, views)
+        return sources, views
+
+    @staticmethod
+    def _add_views(build_tasks, matrix_uuids, source_uuid, views):
+        """Make the matrices of build tasks views of a source matrix"""
+        view_uuids = [
+            matrix_uuid
+            for matrix_uuid in matrix_uuids
+            if matrix_uuid != source_uuid
+        ]
+        for matrix_uuid in view_uuids:
+            build_tasks[matrix_uuid]["matrix_metadata"][
+                "source_matrix_uuid"
+            ] = source_uuid
+            views[matrix_uuid] = build_tasks[matrix_uuid]
+        if view_uuids:
+            logging.info(
+                "Matrices %s planned as views of matrix %s", view_uuids, source_uuid
+            )
@@ -0,0 +1,267 @@
+import hashlib
+import logging
+import re
+
+from sqlalchemy import text
+
+from triage.database_reflection import table_exists
+
+ROW_CACHE_CATALOG_TABLE = "model_metadata.cached_rows"
+ROW_CACHE_SCHEMA = "row_cache"
+
+# the label timespan cohort rows are cataloged under, as they have none
+NO_TIMESPAN = "0"
+
+
+def normalize_query(query):
+    """A query with insignificant differences (surrounding and repeated
+    whitespace, and a trailing semicolon) removed, so that the same query
+    written in different experiment configs is cached once"""
+    return re.sub(r"\s+", " ", query).strip().rstrip(";").strip()
+
+
+class RowCache(object):
+    def __init__(self, db_engine, kind, timespan_column=None):
+        """Shares the rows generated for each as of date (and label timespan)
+        by a query between experiments
+
+        Rows are kept in a cache table for each query, and cataloged by the
+        hash of the normalized query, the as of date and the label timespan,
+        along with the watermark of the query's source tables and the table
+        they were first generated into. Once the source tables change, all
+        of a query's cached rows are dropped. Queries reading from anything
+        other than tables are never cached.
+
+        Args:
+            db_engine (sqlalchemy.engine)
+            kind (string) The kind of rows cached, such as 'labels' or
+                'cohort'
+            timespan_column (string, optional) The column holding label
+                timespans, if rows are generated for them as well as as of dates
+        """
+        self.db_engine = db_engine
+        self.kind = kind
+        self.timespan_column = timespan_column
+        self._enabled = None
+
+    @property
+    def enabled(self):
+        """Whether the catalog table is available (the results schema may not
+        have been created)"""
+        if self._enabled is None:
+            self._enabled = table_exists(ROW_CACHE_CATALOG_TABLE, self.db_engine)
+            if not self._enabled:
+                logging.info(
+                    "%s not found, %s will not be shared between experiments",
+                    ROW_CACHE_CATALOG_TABLE,
+                    self.kind,
+                )
+        return self._enabled
+
+    def query_hash(self, query):
+        return hashlib.md5(
+            "{}:{}".format(self.kind, normalize_query(query)).encode("utf-8")
+        ).hexdigest()
+
+    def cache_table(self, query_hash):
+        return '"{}"."{}_{}"'.format(ROW_CACHE_SCHEMA, self.kind, query_hash)
+
+    @staticmethod
+    def _keys_relation(keys):
+        """SQL for a relation of (as of date, label timespan) keys, with each
+        key's position in the list"""
+        return """unnest(
+            array[{as_of_dates}]::timestamp[],
+            array[{label_timespans}]::interval[]
+        ) with ordinality as cache_keys(as_of_date, label_timespan, position)
+        """.format(
+            as_of_dates=", ".join("'{}'".format(as_of_date) for as_of_date, _ in keys),
+            label_timespans=", ".join(
+                "'{}'".format(label_timespan or NO_TIMESPAN)
+                for _, label_timespan in keys
+            ),
+        )
+
+    def _key_condition(self, alias):
+        """SQL matching rows of a table to the keys relation"""
+        condition = "{}.as_of_date = cache_keys.as_of_date".format(alias)
+        if self.timespan_column:
+            condition += " and {}.{} = cache_keys.label_timespan".format(
+                alias, self.timespan_column
+            )
+        return condition
+
+    def _invalidate(self, query_hash, watermark):
+        """Drop the cached rows of a query if its sources have changed"""
+        with self.db_engine.begin() as conn:
+            stale = conn.execute(
+                text(
+                    "delete from {} where query_hash = :query_hash "
+                    "and source_watermark <> :watermark".format(
+                        ROW_CACHE_CATALOG_TABLE
+                    )
+                ),
+                query_hash=query_hash,
+                watermark=watermark,
+            ).rowcount
+            if stale:
+                logging.info(
+                    "Sources of cached %s changed, dropping %s cached as of dates",
+                    self.kind,
+                    stale,
+                )
+                conn.execute(
+                    text(
+                        "delete from {} where query_hash = :query_hash".format(
+                            ROW_CACHE_CATALOG_TABLE
+                        )
+                    ),
+                    query_hash=query_hash,
+                )
+                conn.execute(
+                    "drop table if exists {}".format(self.cache_table(query_hash))
+                )
+
+    def cached(self, query, watermark, keys):
+        """Find the keys whose rows are cached
+
+        Args:
+            query (string) The query generating the rows
+            watermark (string) The current watermark of the query's sources
+            keys (list) of (as of date, label timespan) tuples, the label
+                timespan being None if rows are only generated for as of dates
+
+        Returns: (list) the keys with cached rows, in their original order
+        """
+        if not self.enabled or watermark is None or not keys:
+            return []
+        query_hash = self.query_hash(query)
+        self._invalidate(query_hash, watermark)
+        positions = [
+            row[0]
+            for row in self.db_engine.execute(
+                text(
+                    """select cache_keys.position from {keys_relation}
+                    join {catalog} catalog
+                    on catalog.query_hash = :query_hash
+                    and catalog.as_of_date = cache_keys.as_of_date
+                    and catalog.label_timespan = cache_keys.label_timespan
+                    order by cache_keys.position""".format(
+                        keys_relation=self._keys_relation(keys),
+                        catalog=ROW_CACHE_CATALOG_TABLE,
+                    )
+                ),
+                query_hash=query_hash,
+            )
+        ]
+        return [keys[position - 1] for position in positions]
+
+    def create_like(self, query, table_name):
+        """Create an empty table with the columns of a query's cache table"""
+        self.db_engine.execute(
+            "create table {} (like {})".format(
+                table_name, self.cache_table(self.query_hash(query))
+            )
+        )
+
+    def load(self, query, keys, table_name, columns="cached.*"):
+        """Copy the cached rows of keys into a table
+
+        Args:
+            query (string) The query generating the rows
+            keys (list) of cached (as of date, label timespan) tuples
+            table_name (string) The table to insert the rows into
+            columns (string, optional) The columns to insert, selected from the
+                cache table aliased as 'cached'
+        """
+        if not keys:
+            return
+        with self.db_engine.begin() as conn:
+            loaded = conn.execute(
+                "insert into {table_name} select {columns} "
+                "from {cache_table} cached join {keys_relation} on {condition}".format(
+                    table_name=table_name,
+                    columns=columns,
+                    cache_table=self.cache_table(self.query_hash(query)),
+                    keys_relation=self._keys_relation(keys),
+                    condition=self._key_condition("cached"),
+                )
+            ).rowcount
+        logging.info(
+            "Loaded %s cached %s rows for %s as of dates into %s",
+            loaded,
+            self.kind,
+            len(keys),
+            table_name,
+        )
+
+    def store(self, query, watermark, keys, table_name):
+        """Cache the rows of keys generated into a table
+
+        Args:
+            query (string) The query generating the rows
+            watermark (string) The watermark of the query's sources when the
+                rows were generated
+            keys (list) of (as of date, label timespan) tuples
+            table_name (string) The table the rows were generated into
+        """
+        if not self.enabled or watermark is None or not keys:
+            return
+        query_hash = self.query_hash(query)
+        cache_table = self.cache_table(query_hash)
+        keys_relation = self._keys_relation(keys)
+        with self.db_engine.begin() as conn:
+            conn.execute("create schema if not exists {}".format(ROW_CACHE_SCHEMA))
+            conn.execute(
+                "create table if not exists {} (like {})".format(
+                    cache_table, table_name
+                )
+            )
+            conn.execute(
+                "create index if not exists {kind}_{query_hash}_as_of_date_idx "
+                "on {cache_table} (as_of_date)".format(
+                    kind=self.kind, query_hash=query_hash, cache_table=cache_table
+                )
+            )
+            # only the keys this insert catalogs have their rows copied, so
+            # keys already stored by another experiment aren't cached twice
+            stored = conn.execute(
+                text(
+                    """with stored as (
+                        insert into {catalog} (query_hash, as_of_date,
+                            label_timespan, kind, query, cache_table,
+                            source_watermark, source_table, row_count)
+                        select :query_hash, cache_keys.as_of_date,
+                            cache_keys.label_timespan, :kind, :query, :cache_table,
+                            :watermark, :source_table, count(generated.as_of_date)
+                        from {keys_relation}
+                        left join {table_name} generated on {condition}
+                        group by cache_keys.as_of_date, cache_keys.label_timespan
+                        on conflict (query_hash, as_of_date, label_timespan)
+                        do nothing
+                        returning as_of_date, label_timespan
+                    )
+                    insert into {cache_table} select generated.* from {table_name}
+                    generated join stored cache_keys on {condition}
+                    """.format(
+                        catalog=ROW_CACHE_CATALOG_TABLE,
+                        keys_relation=keys_relation,
+                        table_name=table_name,
+                        cache_table=cache_table,
+                        condition=self._key_condition("generated"),
+                    )
+                ),
+                query_hash=query_hash,
+                kind=self.kind,
+                query=query,
+                cache_table=cache_table,
+                watermark=watermark,
+                source_table=table_name,
+            ).rowcount
+        logging.info(
+            "Cached %s %s rows for %s as of dates generated into %s",
+            stored,
+            self.kind,
+            len(keys),
+            table_name,
+        )
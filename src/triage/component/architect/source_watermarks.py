@@ -0,0 +1,133 @@
+import logging
+
+from sqlalchemy import text
+
+from triage.component.collate.sql import Command
+from triage.database_reflection import query_watermark, table_exists
+
+SOURCE_WATERMARKS_TABLE = "model_metadata.source_watermarks"
+
+
+class RecordSourceWatermark(Command):
+    """Records the watermark of the sources a table was built from, replacing
+    any earlier record for the table
+
+    Args:
+        table_name: the name of the table built
+        watermark: the watermark of its sources (see SourceWatermarks.current())
+        source_query: the query the watermark was taken of, for reference
+    """
+
+    def __init__(self, table_name, watermark, source_query=None):
+        self.table_name = table_name
+        self.watermark = watermark
+        self.source_query = source_query
+
+    def __str__(self):
+        return "-- record source watermark %s of %s" % (
+            self.watermark,
+            self.table_name,
+        )
+
+    def execute(self, conn):
+        conn.execute(
+            text(
+                "insert into {} (table_name, source_watermark, source_query) "
+                "values (:table_name, :watermark, :source_query) "
+                "on conflict (table_name) do update set "
+                "source_watermark = excluded.source_watermark, "
+                "source_query = excluded.source_query, "
+                "recording_time = now()".format(SOURCE_WATERMARKS_TABLE)
+            ),
+            table_name=self.table_name,
+            watermark=self.watermark,
+            source_query=self.source_query,
+        )
+
+
+class SourceWatermarks(object):
+    def __init__(self, db_engine):
+        """Tracks whether the source tables of derived tables (features, labels
+        and cohorts) have changed since the derived tables were built
+
+        Each derived table is recorded along with a watermark of the tables read
+        by the query that produced it, so that when existing tables are kept
+        (replace=False) the ones whose sources changed can still be rebuilt.
+        Tables without a recorded watermark, and queries reading from anything
+        other than tables, are assumed unchanged.
+
+        Args:
+            db_engine (sqlalchemy.engine)
+        """
+        self.db_engine = db_engine
+        self._enabled = None
+
+    @property
+    def enabled(self):
+        """Whether the watermarks table is available (the results schema may
+        not have been created)"""
+        if self._enabled is None:
+            self._enabled = table_exists(SOURCE_WATERMARKS_TABLE, self.db_engine)
+            if not self._enabled:
+                logging.info(
+                    "%s not found, changes to source tables will not be tracked",
+                    SOURCE_WATERMARKS_TABLE,
+                )
+        return self._enabled
+
+    def current(self, source_query):
+        """The current watermark of the tables read by a query
+
+        Args:
+            source_query (string) A SELECT query
+
+        Returns: (string) The watermark, or None if it can not be tracked
+        """
+        if not self.enabled:
+            return None
+        return query_watermark(source_query, self.db_engine)
+
+    def recorded(self, table_name):
+        """The watermark recorded when a table was last built, if any"""
+        if not self.enabled:
+            return None
+        return self.db_engine.execute(
+            text(
+                "select source_watermark from {} where table_name = :table_name".format(
+                    SOURCE_WATERMARKS_TABLE
+                )
+            ),
+            table_name=table_name,
+        ).scalar()
+
+    def changed(self, table_name, watermark):
+        """Whether the sources of a table have changed since it was built
+
+        Args:
+            table_name (string) The name of the derived table
+            watermark (string) The current watermark of its sources
+
+        Returns: (boolean) True if a different watermark was recorded for the
+            table
+        """
+        if watermark is None:
+            return False
+        recorded = self.recorded(table_name)
+        if recorded is None or recorded == watermark:
+            return False
+        logging.info("Source tables of %s changed since it was built", table_name)
+        return True
+
+    def record_command(self, table_name, watermark, source_query=None):
+        """A command recording the watermark of a table's sources, to run once
+        the table is built, or None if watermarks are not tracked"""
+        if not self.enabled:
+            return None
+        return RecordSourceWatermark(table_name, watermark, source_query)
+
+    def record(self, table_name, watermark, source_query=None):
+        """Record the watermark of the sources a table was built from"""
+        command = self.record_command(table_name, watermark, source_query)
+        if command is not None:
+            with self.db_engine.begin() as conn:
+                command.execute(conn)
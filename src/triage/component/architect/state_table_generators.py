@@ -1,12 +1,37 @@
 import logging
+import re
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time
+
+from sqlalchemy.exc import SQLAlchemyError
 
 from triage.component.architect.database_reflection import table_has_data
+from triage.component.architect.row_cache import RowCache
+from triage.component.architect.source_watermarks import SourceWatermarks
 from triage.database_reflection import table_row_count
 
 
 DEFAULT_ACTIVE_STATE = "active"
 
+# the number of as of dates whose cohort is generated by each set-based statement
+DEFAULT_COHORT_CHUNK_SIZE = 50
+
+# the ways the as of date may be written as an SQL literal, and the column of the
+# cohort_dates relation replacing each in set-based cohort generation
+LIFTED_AS_OF_DATES = [
+    (r"\btimestamp\s+'\{as_of_date\}'", "(cohort_dates.as_of_date)"),
+    (r"\bdate\s+'\{as_of_date\}'", "(cohort_dates.as_of_date)::date"),
+    (r"'\{as_of_date\}'", "(cohort_dates.as_of_date)"),
+]
+
+
+def _as_timestamp(as_of_date):
+    """An as of date as the datetime stored in sparse states tables"""
+    if isinstance(as_of_date, datetime):
+        return as_of_date
+    return datetime.combine(as_of_date, time())
+
 
 class StateTableGeneratorBase(ABC):
     """Create a table containing the state of entities on different dates
@@ -27,6 +52,14 @@ class StateTableGeneratorBase(ABC):
         '_empty_table_message' to provide a helpful message to the user
             if no rows are found in the resultant table
 
+    Subclasses may implement '_source_query' to return a query reading the
+        tables the cohort is built from, so that an existing table is
+        rebuilt when they change
+
+    Subclasses may implement '_cache_query' to return the query (or another
+        description) the rows of each date are generated by, so that they are
+        shared with other experiments generating the same cohort
+
     The main interface of StateTableGenerator objects is the
     `generate_sparse_table` method, which produces the latter
     'sparse'-style table.
@@ -34,12 +67,32 @@ class StateTableGeneratorBase(ABC):
     Args:
         db_engine (sqlalchemy.engine)
         experiment_hash (string) unique identifier for the experiment
+        replace (boolean, optional) Whether or not an existing sparse states
+            table should be replaced. If not, it is only replaced if its source
+            tables changed since it was built
+        shared_cache (boolean, optional) Whether to share the rows of each
+            as of date with other experiments generating the same cohort (see
+            RowCache)
+        entity_filter (string, optional) A SQL condition on entity_id
+            restricting the cohort to some entities, such as those of a shard
+            (see EntityShards.predicate())
 
     """
 
-    def __init__(self, db_engine, experiment_hash):
+    def __init__(
+        self,
+        db_engine,
+        experiment_hash,
+        replace=True,
+        shared_cache=True,
+        entity_filter=None,
+    ):
         self.db_engine = db_engine
         self.experiment_hash = experiment_hash
+        self.replace = replace
+        self.entity_filter = entity_filter
+        self.source_watermarks = SourceWatermarks(db_engine)
+        self.row_cache = RowCache(db_engine, "cohort") if shared_cache else None
 
     @abstractmethod
     def _create_and_populate_sparse_table(self, as_of_dates):
@@ -49,10 +102,23 @@ class StateTableGeneratorBase(ABC):
     def _empty_table_message(self, as_of_dates):
         pass
 
+    def _source_query(self, as_of_dates):
+        return None
+
+    def _cache_query(self):
+        return None
+
     @property
     def sparse_table_name(self):
         return "tmp_sparse_states_{}".format(self.experiment_hash)
 
+    @property
+    def _entity_where(self):
+        """A where clause applying the entity filter, if any"""
+        if self.entity_filter is None:
+            return ""
+        return "where {}".format(self.entity_filter)
+
     def generate_sparse_table(self, as_of_dates):
         """Convert the object's input table
         into a sparse states table for the given as_of_dates
@@ -61,11 +127,51 @@ class StateTableGeneratorBase(ABC):
             as_of_dates (list of datetime.dates) Dates to include in the sparse
                 state table
         """
-        logging.debug("Generating sparse table using as_of_dates: %s", as_of_dates)
-        self._create_and_populate_sparse_table(as_of_dates)
-        self.db_engine.execute(
-            "create index on {} (entity_id, as_of_date)".format(self.sparse_table_name)
+        source_query = self._source_query(as_of_dates)
+        watermark = (
+            self.source_watermarks.current(source_query) if source_query else None
         )
+        if (
+            not self.replace
+            and table_has_data(self.sparse_table_name, self.db_engine)
+            and not self.source_watermarks.changed(self.sparse_table_name, watermark)
+        ):
+            logging.info(
+                "Not regenerating sparse states table %s because replace flag was "
+                "set to False and its source tables have not changed",
+                self.sparse_table_name,
+            )
+            return
+
+        logging.debug("Generating sparse table using as_of_dates: %s", as_of_dates)
+        cache_query = self._cache_query() if self.row_cache is not None else None
+        cached_dates = []
+        if cache_query is not None:
+            cached_dates = [
+                as_of_date
+                for as_of_date, _ in self.row_cache.cached(
+                    cache_query, watermark, [(date, None) for date in as_of_dates]
+                )
+            ]
+        missing_dates = [date for date in as_of_dates if date not in cached_dates]
+        self.clean_up()
+        if missing_dates:
+            self._create_and_populate_sparse_table(missing_dates)
+        else:
+            self.row_cache.create_like(cache_query, self.sparse_table_name)
+        if cached_dates:
+            self.row_cache.load(
+                cache_query,
+                [(date, None) for date in cached_dates],
+                self.sparse_table_name,
+            )
+        with self.db_engine.begin() as conn:
+            conn.execute(
+                "create index on {} (entity_id, as_of_date)".format(
+                    self.sparse_table_name
+                )
+            )
+            conn.execute("analyze {}".format(self.sparse_table_name))
         logging.info(
             "Indices created on entity_id and as_of_date for sparse state table"
         )
@@ -79,6 +185,14 @@ class StateTableGeneratorBase(ABC):
             self.sparse_table_name,
             table_row_count(self.sparse_table_name, self.db_engine),
         )
+        if cache_query is not None:
+            self.row_cache.store(
+                cache_query,
+                watermark,
+                [(date, None) for date in missing_dates],
+                self.sparse_table_name,
+            )
+        self.source_watermarks.record(self.sparse_table_name, watermark, source_query)
 
     def clean_up(self):
         self.db_engine.execute("drop table if exists {}".format(self.sparse_table_name))
@@ -114,17 +228,27 @@ class StateTableGeneratorFromEntities(StateTableGeneratorBase):
             select e.entity_id, a.as_of_date::timestamp, true {active_state}
                 from {entities_table} e
                 cross join (select unnest(ARRAY{as_of_dates}) as as_of_date) a
+                {entity_where}
                 group by e.entity_id, a.as_of_date
             )
         """.format(
             sparse_state_table=self.sparse_table_name,
             entities_table=self.entities_table,
+            entity_where=self._entity_where,
             as_of_dates=[date.isoformat() for date in as_of_dates],
             active_state=DEFAULT_ACTIVE_STATE,
         )
         logging.debug("Assembled sparse state table query: %s", query)
         self.db_engine.execute(query)
 
+    def _source_query(self, as_of_dates):
+        return "select * from {}".format(self.entities_table)
+
+    def _cache_query(self):
+        return "select distinct entity_id from {} {}".format(
+            self.entities_table, self._entity_where
+        ).rstrip()
+
     def _empty_table_message(self, as_of_dates):
         return "No entities in entities table '{input_table}'".format(
             input_table=self.entities_table
@@ -134,19 +258,123 @@ class StateTableGeneratorFromEntities(StateTableGeneratorBase):
 class StateTableGeneratorFromQuery(StateTableGeneratorBase):
     """Generates a 'sparse'-style states table from a given query
 
+    The cohorts of many as of dates are generated by each statement, by
+    evaluating the query against a relation of them (see lifted_query()), and
+    chunks of as of dates are generated concurrently. Queries that can not be
+    lifted this way are run for each as of date.
+
     Args:
     query (string) SQL query string to select entities for a given as_of_date
         The as_of_date should be parameterized with brackets: {as_of_date}
+    set_based (boolean, optional) Whether to generate the cohorts of many as of
+        dates in each statement
+    chunk_size (int, optional) The number of as of dates generated together
+    n_workers (int, optional) The number of chunks generated concurrently
     """
 
-    def __init__(self, query, *args, **kwargs):
+    def __init__(
+        self,
+        query,
+        *args,
+        set_based=True,
+        chunk_size=DEFAULT_COHORT_CHUNK_SIZE,
+        n_workers=1,
+        **kwargs
+    ):
 
         super(StateTableGeneratorFromQuery, self).__init__(*args, **kwargs)
+        if self.entity_filter is not None:
+            # filtering the query's result lets the database push the condition
+            # down into the query's own scans
+            query = "select * from ({}) cohort {}".format(query, self._entity_where)
         self.query = query
+        self.set_based = set_based
+        self.chunk_size = chunk_size
+        self.n_workers = n_workers
+        # the number of entities in the cohort of each as of date generated
+        self.entity_counts = {}
+
+    def lifted_query(self):
+        """The cohort query evaluated against a cohort_dates relation of as of
+        dates, rather than a single one
+
+        Each quoted '{as_of_date}' (including typed literals, like
+        date '{as_of_date}') is replaced by the as_of_date column of
+        cohort_dates.
+
+        Returns: (string) the lifted query, or None if the as of date is used
+            in any other way (such as within a longer string)
+        """
+        lifted = self.query
+        for pattern, column in LIFTED_AS_OF_DATES:
+            lifted = re.sub(pattern, column, lifted)
+        if "{as_of_date}" in lifted:
+            return None
+        return lifted
+
+    def _insert_date(self, as_of_date):
+        """Insert the cohort of one as of date, returning its size"""
+        formatted_date = f"{as_of_date.isoformat()}"
+        dated_query = self.query.replace("{as_of_date}", formatted_date)
+        full_query = f"""insert into {self.sparse_table_name}
+            select q.entity_id, '{formatted_date}'::timestamp, true
+            from ({dated_query}) q
+            group by 1, 2, 3
+        """
+        logging.info(f"Running state query for date: {as_of_date}, {full_query}")
+        return self.db_engine.execute(full_query).rowcount
+
+    def _insert_dates(self, as_of_dates):
+        """Insert the cohorts of as of dates with one statement, returning the
+        size of each
+
+        The lifted query is joined laterally to the as of dates. Postgres
+        flattens a plain select into an ordinary join, but one that
+        aggregates, or uses distinct or limit, is still evaluated once per as
+        of date, so such a query only saves the statements, not the scans of
+        its sources."""
+        formatted_dates = ", ".join(
+            f"'{as_of_date.isoformat()}'" for as_of_date in as_of_dates
+        )
+        full_query = f"""with inserted as (
+                insert into {self.sparse_table_name}
+                select distinct q.entity_id, cohort_dates.as_of_date, true
+                from unnest(array[{formatted_dates}]::timestamp[])
+                    as cohort_dates(as_of_date)
+                cross join lateral ({self.lifted_query()}) q
+                returning as_of_date
+            )
+            select as_of_date, count(*) from inserted group by as_of_date
+        """
+        logging.info(
+            f"Running state query for {len(as_of_dates)} dates from "
+            f"{as_of_dates[0]}"
+        )
+        logging.debug(full_query)
+        with self.db_engine.begin() as conn:
+            counts = dict(conn.execute(full_query).fetchall())
+        return [counts.get(_as_timestamp(as_of_date), 0) for as_of_date in as_of_dates]
+
+    def _populate_dates(self, as_of_dates, set_based):
+        """Insert the cohorts of a chunk of as of dates, falling back to a
+        statement per date if the set-based statement fails
+
+        Returns: (list) the number of entities of each date
+        """
+        if set_based:
+            try:
+                return self._insert_dates(as_of_dates)
+            except SQLAlchemyError as e:
+                logging.warning(
+                    "Set-based state query failed, so it will be run for each "
+                    "as of date: %s",
+                    e,
+                )
+        return [self._insert_date(as_of_date) for as_of_date in as_of_dates]
 
     def _create_and_populate_sparse_table(self, as_of_dates):
-        """Create a 'sparse'-style states table by sequentially running a
-            given date-parameterized query for all known dates.
+        """Create a 'sparse'-style states table by running a given
+            date-parameterized query for all known dates, in concurrent chunks.
 
         Args:
         as_of_dates (list of datetime.date): Dates to calculate entity states as of
@@ -162,16 +390,53 @@ class StateTableGeneratorFromQuery(StateTableGeneratorBase):
         )
         logging.info("Created sparse state table, now inserting rows")
 
-        for as_of_date in as_of_dates:
-            formatted_date = f"{as_of_date.isoformat()}"
-            dated_query = self.query.replace("{as_of_date}", formatted_date)
-            full_query = f"""insert into {self.sparse_table_name}
-                select q.entity_id, '{formatted_date}'::timestamp, true
-                from ({dated_query}) q
-                group by 1, 2, 3
-            """
-            logging.info(f"Running state query for date: {as_of_date}, {full_query}")
-            self.db_engine.execute(full_query)
+        set_based = self.set_based and self.lifted_query() is not None
+        if self.set_based and not set_based:
+            logging.info(
+                "State query can not be evaluated set-based, so it will be run "
+                "for each as of date"
+            )
+        chunks = [
+            as_of_dates[start:start + self.chunk_size]
+            for start in range(0, len(as_of_dates), self.chunk_size)
+        ]
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            chunk_counts = list(
+                executor.map(
+                    lambda chunk: self._populate_dates(chunk, set_based), chunks
+                )
+            )
+
+        self.entity_counts = {}
+        for chunk, counts in zip(chunks, chunk_counts):
+            self.entity_counts.update(zip(chunk, counts))
+        for as_of_date, count in self.entity_counts.items():
+            logging.debug("Cohort as of %s: %s entities", as_of_date, count)
+        empty_dates = [
+            as_of_date for as_of_date, count in self.entity_counts.items() if not count
+        ]
+        if empty_dates and len(empty_dates) < len(as_of_dates):
+            logging.warning(
+                "Cohort is empty as of %s of %s dates, including %s",
+                len(empty_dates),
+                len(as_of_dates),
+                empty_dates[0],
+            )
+        if self.entity_counts:
+            logging.info(
+                "Cohort sizes range from %s to %s entities across %s as of dates",
+                min(self.entity_counts.values()),
+                max(self.entity_counts.values()),
+                len(self.entity_counts),
+            )
+
+    def _source_query(self, as_of_dates):
+        if not as_of_dates:
+            return None
+        return self.query.replace("{as_of_date}", as_of_dates[0].isoformat())
+
+    def _cache_query(self):
+        return self.query
 
     def _empty_table_message(self, as_of_dates):
         return """Query does not return any rows for the given as_of_dates:
@@ -250,6 +515,7 @@ class StateTableGeneratorFromDense(StateTableGeneratorBase):
                     d.start_time <= a.as_of_date::timestamp and
                     d.end_time > a.as_of_date::timestamp
                 )
+                {entity_where}
                 group by d.entity_id, a.as_of_date
             )
         """.format(
@@ -257,10 +523,19 @@ class StateTableGeneratorFromDense(StateTableGeneratorBase):
             dense_state_table=self.dense_state_table,
             as_of_dates=[date.isoformat() for date in as_of_dates],
             state_column_string=", ".join(self.state_columns()),
+            entity_where=self._entity_where,
         )
         logging.debug("Assembled sparse state table query: %s", query)
         self.db_engine.execute(query)
 
+    def _source_query(self, as_of_dates):
+        return "select * from {}".format(self.dense_state_table)
+
+    def _cache_query(self):
+        return "select entity_id, state, start_time, end_time from {} {}".format(
+            self.dense_state_table, self._entity_where
+        ).rstrip()
+
     def _empty_table_message(self, as_of_dates):
         return (
             "No entities in dense state table '{input_table}' define time ranges "
@@ -1,15 +1,20 @@
 import pandas as pd
 
+from triage.util.db import read_engine
+
 
 class PreAudition(object):
     def __init__(self, db_engine):
         """Prepare the model_groups and train_end_times for Auditioner to use
 
+        Only reads from the database, so queries a read replica of db_engine if
+        one is configured and current (see triage.util.db.read_engine)
+
         Args:
             db_engine: (sqlalchemy.engine)
             query: (string): cuztomized SQL query to pull model groups
         """
-        self.db_engine = db_engine
+        self.db_engine = read_engine(db_engine)
         self.model_groups = None
 
     def get_model_groups_from_label(self, label_def):
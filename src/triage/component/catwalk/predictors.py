@@ -9,6 +9,7 @@ import postgres_copy
 from sqlalchemy.orm import sessionmaker
 
 from triage.component.results_schema import Model
+from triage.util.db import read_engine
 
 from .utils import db_retry
 
@@ -37,6 +38,12 @@ class Predictor(object):
     def sessionmaker(self):
         return sessionmaker(bind=self.db_engine)
 
+    @property
+    def read_sessionmaker(self):
+        """Sessions for looking up saved results, on a read replica if one is
+        available"""
+        return sessionmaker(bind=read_engine(self.db_engine))
+
     @db_retry
     def _retrieve_model_hash(self, model_id):
         """Retrieves the model hash associated with a given model id
@@ -88,15 +95,15 @@ class Predictor(object):
         )
 
     def _as_of_dates(self, matrix_store):
-        matrix = matrix_store.matrix
-        if "as_of_date" in matrix.index.names:
-            return matrix.index.levels[matrix.index.names.index("as_of_date")].tolist()
+        index = matrix_store.index
+        if "as_of_date" in index.names:
+            return index.levels[index.names.index("as_of_date")].tolist()
         else:
             return [matrix_store.metadata["end_time"]]
 
     @db_retry
     def _load_saved_predictions(self, existing_predictions, matrix_store):
-        index = matrix_store.matrix.index
+        index = matrix_store.index
         score_lookup = {}
         for prediction in existing_predictions:
             score_lookup[
@@ -148,7 +155,7 @@ class Predictor(object):
         test_label_timespan = matrix_store.metadata["label_timespan"]
         logging.warning(test_label_timespan)
 
-        if "as_of_date" in matrix_store.matrix.index.names:
+        if "as_of_date" in matrix_store.index.names:
             logging.info(
                 "as_of_date found as part of matrix index, using "
                 "index for table as_of_dates"
@@ -156,7 +163,7 @@ class Predictor(object):
             with tempfile.TemporaryFile(mode="w+") as f:
                 writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
                 for index, score, label in zip(
-                    matrix_store.matrix.index, predictions, labels
+                    matrix_store.index, predictions, labels
                 ):
                     entity_id, as_of_date = index
                     prediction = Prediction_obj(
@@ -195,7 +202,7 @@ class Predictor(object):
                 method="dense", ascending=False, pct=True
             )
             for entity_id, score, label, rank_abs, rank_pct in zip(
-                matrix_store.matrix.index,
+                matrix_store.index,
                 predictions,
                 labels,
                 rankings_abs,
@@ -248,11 +255,11 @@ class Predictor(object):
                 matrix_store.uuid,
             )
             try:
-                session = self.sessionmaker()
+                session = self.read_sessionmaker()
                 existing_predictions = self._existing_predictions(
                     prediction_obj, session, model_id, matrix_store
                 )
-                index = matrix_store.matrix.index
+                index = matrix_store.index
                 if existing_predictions.count() == len(index):
                     logging.info(
                         "Found predictions for model id %s, matrix %s, returning saved versions",
@@ -1,9 +1,11 @@
 # coding: utf-8
 
+import io
 import os
 from os.path import dirname
 import pathlib
 import logging
+import struct
 from sklearn.externals import joblib
 from urllib.parse import urlparse
 from triage.component.results_schema import (
@@ -14,10 +16,34 @@ from triage.component.results_schema import (
 )
 from triage.util.pandas import downcast_matrix
 
+import numpy as np
 import pandas as pd
 import s3fs
 import yaml
 
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# how many rows of a matrix are converted to CSV at a time when it is saved
+CSV_WRITE_CHUNK_ROWS = 100000
+# how many rows of a CSV matrix are read at once when filtering its rows
+CSV_READ_CHUNK_ROWS = 100000
+# how many rows of a matrix saved as a whole are written to each Parquet row
+# group, the unit in which rows are skipped when reading a range of as of dates
+PARQUET_ROW_GROUP_ROWS = 100000
+# the key of a matrix's metadata in the schema metadata of an Arrow format file
+ARROW_METADATA_KEY = b"triage_matrix_metadata"
+# how many rows of a matrix are converted to float32 at a time when it is saved
+# as numpy
+NUMPY_WRITE_CHUNK_ROWS = 100000
+# the length of the header of a numpy matrix's .npy file, which is written
+# once its number of rows is known, enough for any shape of a 2-d array
+NPY_HEADER_LENGTH = 128
+
 
 class Store(object):
     """Base class for classes which know how to access a file in a preset medium.
@@ -176,6 +202,16 @@ class ProjectStorage(object):
         """
         return ModelStorageEngine(self, model_directory)
 
+    def feature_block_storage_engine(self, block_directory=None):
+        """Return a feature block storage engine bound to this project's storage
+
+        Args:
+            block_directory (string, optional) A directory to store feature blocks
+                If not passed will allow the FeatureBlockStorageEngine to decide
+        Returns: triage.component.catwalk.storage.FeatureBlockStorageEngine
+        """
+        return FeatureBlockStorageEngine(self, block_directory)
+
 
 class ModelStorageEngine(object):
     """Store arbitrary models in a given project storage using joblib
@@ -233,6 +269,80 @@ class ModelStorageEngine(object):
         return self.project_storage.get_store(self.directories, model_hash)
 
 
+class FeatureBlockStorageEngine(object):
+    """Store the feature values of each entity in a block of a feature table's
+    rows (see triage.component.architect.feature_blocks) as uncompressed numpy
+    arrays in a given project storage
+
+    Args:
+        project_storage (triage.component.catwalk.storage.ProjectStorage)
+            A project file storage engine
+        block_directory (string, optional) A directory name for feature blocks.
+            Defaults to 'feature_blocks'
+    """
+
+    def __init__(self, project_storage, block_directory=None):
+        self.project_storage = project_storage
+        self.directories = [block_directory or "feature_blocks"]
+
+    def write(self, table_name, block_key, entity_ids, columns, values):
+        """Persist a block
+
+        Args:
+            table_name (string) The feature table of the block
+            block_key (string) An identifier, unique within the table, for the block
+            entity_ids (numpy.ndarray) The entity of each of the block's rows
+            columns (list) The names of the block's features
+            values (numpy.ndarray) The feature values of each row
+        """
+        data = io.BytesIO()
+        np.savez(
+            data,
+            entity_ids=entity_ids,
+            columns=np.array(columns, dtype=str),
+            values=values,
+        )
+        store = self._get_store(table_name, block_key)
+        if isinstance(store, FSStore):
+            # written under another name and then renamed, so that other
+            # processes never read a partly written block
+            partial = FSStore(f"{store.path}.{os.getpid()}.partial")
+            partial.write(data.getvalue())
+            os.replace(partial.path, store.path)
+        else:
+            store.write(data.getvalue())
+
+    def load(self, table_name, block_key):
+        """Load a block
+
+        Args:
+            table_name (string) The feature table of the block
+            block_key (string) An identifier, unique within the table, for the block
+
+        Returns: (tuple) the entity ids, feature names and feature values of the
+            block, as passed to write()
+        """
+        data = self._get_store(table_name, block_key).load()
+        with np.load(io.BytesIO(data)) as block:
+            return block["entity_ids"], block["columns"].tolist(), block["values"]
+
+    def exists(self, table_name, block_key):
+        """Check whether a block is persisted
+
+        Args:
+            table_name (string) The feature table of the block
+            block_key (string) An identifier, unique within the table, for the block
+
+        Returns: (bool) Whether or not the block exists in project storage
+        """
+        return self._get_store(table_name, block_key).exists()
+
+    def _get_store(self, table_name, block_key):
+        return self.project_storage.get_store(
+            self.directories + [table_name], f"{block_key}.npz"
+        )
+
+
 class MatrixStorageEngine(object):
     """Store matrices in a given project storage
 
@@ -267,7 +377,19 @@ class MatrixStore(object):
     """Base class for classes that allow access of a matrix and its metadata.
 
     Subclasses should be scoped to a storage format (e.g. CSV, HDF)
-        and implement the _load, save, and head_of_matrix methods for that storage format
+        and implement the _load, save, and _head_of_matrix methods for that format
+
+    A matrix may be a view of another matrix holding all of its rows and
+    columns, named by the 'source_matrix_uuid' in its metadata (see
+    architect.Planner). Only the metadata of a view is stored, and its matrix is
+    loaded from the source matrix's store, reading only the view's columns, and
+    the source's rows in the range of the view's as of times, when the storage
+    format allows it.
+
+    In a columnar storage format, some columns of a matrix can be read without
+    the others, so until the whole matrix is loaded, its labels, index and the
+    columns asked for by matrix_with_sorted_columns() are each read on their
+    own, and its column names from the format's schema.
 
     Args:
         project_storage (triage.component.catwalk.storage.ProjectStorage)
@@ -281,11 +403,16 @@ class MatrixStore(object):
     """
 
     _labels = None
+    # whether the storage format can read some of a matrix's columns at no more
+    # cost than those columns
+    columnar = False
 
     def __init__(
         self, project_storage, directories, matrix_uuid, matrix=None, metadata=None
     ):
         self.matrix_uuid = matrix_uuid
+        self.project_storage = project_storage
+        self.directories = directories
         self.matrix_base_store = project_storage.get_store(
             directories, f"{matrix_uuid}.{self.suffix}"
         )
@@ -300,17 +427,36 @@ class MatrixStore(object):
     def matrix(self):
         """The raw matrix. Will load from storage into memory if not already loaded"""
         if self.__matrix is None:
-            self.__matrix = self._load()
-            # Is the index already in place?
-            if self.__matrix.index.names != self.metadata['indices']:
-                self.__matrix.set_index(self.metadata['indices'], inplace=True)
-
-            self.__matrix = downcast_matrix(self.__matrix)
+            matrix = self._load_matrix()
+            if self._labels is not None:
+                # the labels were already read on their own (see labels())
+                del matrix[self.metadata["label_name"]]
+            self.__matrix = self._downcast(self._with_index(matrix))
         return self.__matrix
 
     @matrix.setter
     def matrix(self, matrix):
         self.__matrix = matrix
+        self.__index = None
+
+    def _downcast(self, matrix):
+        return downcast_matrix(matrix)
+
+    def _with_index(self, matrix):
+        # Is the index already in place?
+        if matrix.index.names != self.metadata["indices"]:
+            matrix.set_index(self.metadata["indices"], inplace=True)
+        return matrix
+
+    @property
+    def index(self):
+        """The matrix's index, read on its own if the matrix isn't loaded and
+        the storage format is columnar"""
+        if self.__matrix is not None or not self.columnar:
+            return self.matrix.index
+        if self.__index is None:
+            self.__index = self._with_index(self._load_matrix(columns=[])).index
+        return self.__index
 
     @property
     def metadata(self):
@@ -323,19 +469,92 @@ class MatrixStore(object):
     def metadata(self, metadata):
         self.__metadata = metadata
 
+    @property
+    def source_store(self):
+        """The store of the matrix this one is a view of, or None if it isn't a
+        view (or has no metadata yet)"""
+        if self.__metadata is None and not self.metadata_base_store.exists():
+            return None
+        source_matrix_uuid = self.metadata.get("source_matrix_uuid")
+        if source_matrix_uuid is None:
+            return None
+        return self.__class__(
+            self.project_storage, self.directories, source_matrix_uuid
+        )
+
+    def _view_columns(self, columns):
+        """The columns of the source matrix that are in this view, in order"""
+        view_columns = set(self.metadata["feature_names"])
+        view_columns.add(self.metadata["label_name"])
+        return [column for column in columns if column in view_columns]
+
+    def _view_as_of_date_range(self, source_store):
+        as_of_times = self.metadata.get("as_of_times")
+        if not as_of_times or as_of_times == source_store.metadata.get("as_of_times"):
+            return None
+        return (pd.Timestamp(min(as_of_times)), pd.Timestamp(max(as_of_times)))
+
+    @property
+    def view_as_of_date_range(self):
+        """The first and last as of dates of the source matrix's rows in this
+        view, or None if it isn't a view or has all of them"""
+        source_store = self.source_store
+        if source_store is None:
+            return None
+        return self._view_as_of_date_range(source_store)
+
+    def _load_matrix(self, columns=None):
+        source_store = self.source_store
+        if source_store is None:
+            return self._load(columns=columns)
+        logging.info(
+            "Loading matrix %s as a view of matrix %s",
+            self.matrix_uuid,
+            source_store.matrix_uuid,
+        )
+        if columns is None:
+            columns = self._view_columns(source_store.columns(include_label=True))
+        return source_store._load(
+            columns=columns,
+            as_of_date_range=self._view_as_of_date_range(source_store),
+        )
+
+    @property
+    def num_rows(self):
+        """The number of rows in the matrix, read along with only its label if
+        it isn't loaded"""
+        if self.__matrix is not None:
+            return len(self.__matrix)
+        return len(self._load_matrix(columns=[self.metadata["label_name"]]))
+
     @property
     def head_of_matrix(self):
         """The first line of the matrix"""
+        source_store = self.source_store
+        if source_store is not None:
+            head_of_matrix = source_store.head_of_matrix
+            return head_of_matrix[self._view_columns(head_of_matrix.columns)]
+        return self._head_of_matrix()
+
+    def _head_of_matrix(self):
         return self.matrix.head(1)
 
     @property
     def exists(self):
         """Whether or not the matrix and metadata exist in storage"""
-        return self.matrix_base_store.exists() and self.metadata_base_store.exists()
+        if not self.metadata_base_store.exists():
+            return False
+        source_store = self.source_store
+        if source_store is not None:
+            return source_store.exists
+        return self.matrix_base_store.exists()
 
     @property
     def empty(self):
         """Whether or not the matrix has at least one row"""
+        source_store = self.source_store
+        if source_store is not None:
+            return source_store.empty
         if not self.matrix_base_store.exists():
             return True
         else:
@@ -344,18 +563,32 @@ class MatrixStore(object):
 
     def columns(self, include_label=False):
         """The matrix's column list"""
-        head_of_matrix = self.head_of_matrix
-        columns = head_of_matrix.columns.tolist()
+        columns = self._column_names()
         if include_label:
             return columns
         else:
             return [col for col in columns if col != self.metadata["label_name"]]
 
+    def _column_names(self):
+        source_store = self.source_store
+        if source_store is not None:
+            return self._view_columns(source_store._column_names())
+        return self._stored_column_names()
+
+    def _stored_column_names(self):
+        return self._head_of_matrix().columns.tolist()
+
     def labels(self):
         """The matrix's label column."""
         if self._labels is not None:
             logging.debug("using stored labels")
             return self._labels
+        elif self.__matrix is None and self.columnar:
+            logging.debug("reading labels from storage")
+            label_name = self.metadata["label_name"]
+            labels = self._with_index(self._load_matrix(columns=[label_name]))
+            self._labels = self._downcast(labels)[label_name]
+            return self._labels
         else:
             logging.debug("popping labels from matrix")
             self._labels = self.matrix.pop(self.metadata["label_name"])
@@ -369,22 +602,20 @@ class MatrixStore(object):
     @property
     def as_of_dates(self):
         """The list of as-of-dates in the matrix"""
-        if "as_of_date" in self.matrix.index.names:
-            return sorted(
-                list(set([as_of_date for entity_id, as_of_date in self.matrix.index]))
-            )
+        index = self.index
+        if "as_of_date" in index.names:
+            return sorted(list(set([as_of_date for entity_id, as_of_date in index])))
         else:
             return [self.metadata["end_time"]]
 
     @property
     def num_entities(self):
         """The number of entities in the matrix"""
-        if self.matrix.index.names == ["entity_id"]:
-            return len(self.matrix.index.values)
-        elif "entity_id" in self.matrix.index.names:
-            return len(
-                self.matrix.index.levels[self.matrix.index.names.index("entity_id")]
-            )
+        index = self.index
+        if index.names == ["entity_id"]:
+            return len(index.values)
+        elif "entity_id" in index.names:
+            return len(index.levels[index.names.index("entity_id")])
 
     @property
     def matrix_type(self):
@@ -409,6 +640,9 @@ class MatrixStore(object):
     def matrix_with_sorted_columns(self, columns):
         """Return the matrix with columns sorted in the given column order
 
+        If the matrix isn't loaded and the storage format is columnar, only
+        these columns are read.
+
         Args:
             columns (list) The order of column names to return.
                 Will error if this list does not contain the same elements as the matrix's columns
@@ -418,6 +652,13 @@ class MatrixStore(object):
         if columnset == desired_columnset:
             if self.columns() != columns:
                 logging.warning("Column orders not the same, re-ordering")
+            if self.__matrix is None and self.columnar:
+                matrix = self._with_index(self._load_matrix(columns=list(columns)))
+                matrix = self._downcast(matrix)
+                # only reordered (and so copied) if not read in this order
+                if matrix.columns.tolist() != list(columns):
+                    matrix = matrix[columns]
+                return matrix
             return self.matrix[columns]
         else:
             if columnset.issuperset(desired_columnset):
@@ -447,9 +688,59 @@ class MatrixStore(object):
         with self.metadata_base_store.open("rb") as fd:
             return yaml.load(fd)
 
+    def save_metadata(self):
+        """Save metadata to storage"""
+        with self.metadata_base_store.open("wb") as fd:
+            yaml.dump(self.metadata, fd, encoding="utf-8")
+
+    def _load(self, columns=None, as_of_date_range=None):
+        """Load the matrix from storage
+
+        Args:
+            columns (list, optional) The columns to load, besides the indices,
+                if not all of them
+            as_of_date_range (tuple, optional) The first and last as of dates
+                of the rows to load, if not all of them
+        """
+        raise NotImplementedError
+
     def save(self):
         raise NotImplementedError
 
+    def _sorted_by_as_of_date(self, matrix):
+        """The rows of a matrix sorted by as of date, if it has them, and
+        otherwise kept in order"""
+        if "as_of_date" not in self.metadata["indices"]:
+            return matrix
+        as_of_dates = matrix.index.get_level_values("as_of_date")
+        return matrix.iloc[np.argsort(as_of_dates.values, kind="mergesort")]
+
+    def save_chunks(self, chunks):
+        """Save a matrix from chunks of its rows, and then its metadata
+
+        The matrix is never held in memory, so that it can be saved as its rows
+        are extracted. Stores that can't write a matrix incrementally gather
+        the chunks first.
+
+        If the chunks raise an exception, whatever was written of the matrix is
+        deleted, and the metadata is not saved.
+
+        Args:
+            chunks (iterable) of pandas.DataFrame, each holding consecutive rows
+                of the matrix (with its index and columns), in order
+        """
+        self.matrix = pd.concat(list(chunks))
+        self.save()
+        self.matrix = None
+
+    def _discard_partial_matrix(self):
+        """Delete a matrix whose saving failed part way"""
+        if self.matrix_base_store.exists():
+            logging.warning(
+                "Deleting partially saved matrix %s", self.matrix_base_store
+            )
+            self.matrix_base_store.delete()
+
     def __getstate__(self):
         """Remove object of a large size upon serialization.
 
@@ -471,8 +762,7 @@ class HDFMatrixStore(MatrixStore):
         if isinstance(self.matrix_base_store, S3Store):
             raise ValueError("HDFMatrixStore cannot be used with S3")
 
-    @property
-    def head_of_matrix(self):
+    def _head_of_matrix(self):
         try:
             head_of_matrix = pd.read_hdf(self.matrix_base_store.path, start=0, stop=1)
             # Is the index already in place?
@@ -483,8 +773,15 @@ class HDFMatrixStore(MatrixStore):
 
         return head_of_matrix
 
-    def _load(self):
-        return pd.read_hdf(self.matrix_base_store.path)
+    def _load(self, columns=None, as_of_date_range=None):
+        where = None
+        if as_of_date_range is not None:
+            # the rows are selected with the table's index of as of dates
+            where = [
+                "as_of_date >= {!r}".format(str(as_of_date_range[0])),
+                "as_of_date <= {!r}".format(str(as_of_date_range[1])),
+            ]
+        return pd.read_hdf(self.matrix_base_store.path, columns=columns, where=where)
 
     def save(self):
         hdf = pd.HDFStore(
@@ -496,18 +793,40 @@ class HDFMatrixStore(MatrixStore):
         )
         hdf.put(self.matrix_uuid, self.matrix.apply(pd.to_numeric), data_columns=True)
         hdf.close()
+        self.save_metadata()
 
-        with self.metadata_base_store.open("wb") as fd:
-            yaml.dump(self.metadata, fd, encoding="utf-8")
+    def save_chunks(self, chunks):
+        hdf = pd.HDFStore(
+            self.matrix_base_store.path,
+            mode="w",
+            complevel=4,
+            complib="zlib",
+            format="table",
+        )
+        try:
+            for chunk in chunks:
+                hdf.append(
+                    self.matrix_uuid, chunk.apply(pd.to_numeric), data_columns=True
+                )
+        except Exception:
+            hdf.close()
+            self._discard_partial_matrix()
+            raise
+        hdf.close()
+        self.save_metadata()
 
 
 class CSVMatrixStore(MatrixStore):
-    """Store and access matrices using CSV"""
+    """Store and access matrices using CSV
+
+    Matrices are written to storage a chunk of rows at a time, rather than
+    converted to CSV as a whole. In S3, s3fs uploads the file in parts as they
+    are written (a multipart upload).
+    """
 
     suffix = "csv"
 
-    @property
-    def head_of_matrix(self):
+    def _head_of_matrix(self):
         try:
             with self.matrix_base_store.open("rb") as fd:
                 head_of_matrix = pd.read_csv(fd, nrows=1)
@@ -519,17 +838,441 @@ class CSVMatrixStore(MatrixStore):
 
         return head_of_matrix
 
-    def _load(self):
+    def _load(self, columns=None, as_of_date_range=None):
         parse_dates_argument = (
             ["as_of_date"] if "as_of_date" in self.metadata["indices"] else False
         )
+        usecols = None if columns is None else self.metadata["indices"] + columns
         with self.matrix_base_store.open("rb") as fd:
-            return pd.read_csv(fd, parse_dates=parse_dates_argument)
+            if as_of_date_range is None:
+                return pd.read_csv(
+                    fd, parse_dates=parse_dates_argument, usecols=usecols
+                )
+            # rows can't be skipped in a CSV, but only those in the range are
+            # kept as it is read
+            first, last = as_of_date_range
+            chunks = [
+                chunk[(chunk["as_of_date"] >= first) & (chunk["as_of_date"] <= last)]
+                for chunk in pd.read_csv(
+                    fd,
+                    parse_dates=parse_dates_argument,
+                    usecols=usecols,
+                    chunksize=CSV_READ_CHUNK_ROWS,
+                )
+            ]
+            return pd.concat(chunks)
 
     def save(self):
-        self.matrix_base_store.write(self.matrix.to_csv(None).encode("utf-8"))
-        with self.metadata_base_store.open("wb") as fd:
-            yaml.dump(self.metadata, fd, encoding="utf-8")
+        # an empty matrix is still one (empty) chunk, so its header is written
+        self.save_chunks(
+            self.matrix.iloc[start:start + CSV_WRITE_CHUNK_ROWS]
+            for start in range(0, max(len(self.matrix), 1), CSV_WRITE_CHUNK_ROWS)
+        )
+
+    def save_chunks(self, chunks):
+        try:
+            with self.matrix_base_store.open("wb") as fd:
+                for i, chunk in enumerate(chunks):
+                    fd.write(chunk.to_csv(None, header=i == 0).encode("utf-8"))
+        except Exception:
+            self._discard_partial_matrix()
+            raise
+        self.save_metadata()
+
+
+class ArrowMatrixStore(MatrixStore):
+    """Base class for matrix stores using a columnar Apache Arrow format
+
+    The matrix's indices, features and label are typed columns (with float64
+    values stored as float32), so that columns are read without the others and
+    converted to pandas without parsing. The metadata is embedded in the file's
+    schema as well as saved beside it, so the file describes itself.
+
+    Subclasses implement _read_schema, _read_head, _read_table and _writer for
+    their format.
+    """
+
+    columnar = True
+
+    def __init__(self, *args, **kwargs):
+        if pyarrow is None:
+            raise ImportError(
+                "pyarrow not available. To use an Arrow matrix format, install "
+                "triage with the Arrow extension: pip install triage[arrow]"
+            )
+        super().__init__(*args, **kwargs)
+
+    def _arrow_table(self, frame, schema=None):
+        """A table of a matrix's rows, with its indices as columns and its
+        metadata in the table's schema"""
+        frame = frame.reset_index()
+        indices = self.metadata["indices"]
+        for column in frame.columns:
+            if column not in indices and frame[column].dtype == np.float64:
+                frame[column] = frame[column].astype(np.float32)
+        if schema is not None:
+            table = pyarrow.Table.from_pandas(
+                frame, schema=schema, preserve_index=False
+            )
+            return table.replace_schema_metadata(schema.metadata)
+        table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata[ARROW_METADATA_KEY] = yaml.dump(self.metadata).encode("utf-8")
+        return table.replace_schema_metadata(schema_metadata)
+
+    def _read_schema(self, fd):
+        raise NotImplementedError
+
+    def _read_head(self, fd):
+        raise NotImplementedError
+
+    def _read_table(self, fd, columns, as_of_date_range):
+        """Read a table of the rows of a matrix, which must include those in
+        the range of as of dates, if given, and may include others"""
+        raise NotImplementedError
+
+    def _writer(self, fd, schema):
+        raise NotImplementedError
+
+    def load_metadata(self):
+        """Load metadata from storage, or from the matrix file if it was only
+        copied without its metadata"""
+        if self.metadata_base_store.exists() or not self.matrix_base_store.exists():
+            return super().load_metadata()
+        with self.matrix_base_store.open("rb") as fd:
+            schema = self._read_schema(fd)
+        return yaml.load(schema.metadata[ARROW_METADATA_KEY].decode("utf-8"))
+
+    def _stored_column_names(self):
+        with self.matrix_base_store.open("rb") as fd:
+            names = self._read_schema(fd).names
+        indices = self.metadata["indices"]
+        return [name for name in names if name not in indices]
+
+    def _head_of_matrix(self):
+        try:
+            with self.matrix_base_store.open("rb") as fd:
+                head_of_matrix = self._read_head(fd).to_pandas()
+                head_of_matrix.set_index(self.metadata["indices"], inplace=True)
+        except FileNotFoundError as fnfe:
+            logging.exception(f"Matrix isn't there: {fnfe}")
+            logging.exception("Returning Empty data frame")
+            head_of_matrix = pd.DataFrame()
+
+        return head_of_matrix
+
+    def _load(self, columns=None, as_of_date_range=None):
+        read_columns = None if columns is None else self.metadata["indices"] + columns
+        with self.matrix_base_store.open("rb") as fd:
+            matrix = self._read_table(fd, read_columns, as_of_date_range).to_pandas()
+        if as_of_date_range is not None:
+            first, last = as_of_date_range
+            matrix = matrix[
+                (matrix["as_of_date"] >= first) & (matrix["as_of_date"] <= last)
+            ]
+        return matrix
+
+    def save(self):
+        self.save_chunks([self.matrix])
+
+    def save_chunks(self, chunks):
+        writer = None
+        try:
+            with self.matrix_base_store.open("wb") as fd:
+                for chunk in chunks:
+                    if writer is None:
+                        table = self._arrow_table(chunk)
+                        schema = table.schema
+                        writer = self._writer(fd, schema)
+                    else:
+                        # later chunks are given the types of the first
+                        table = self._arrow_table(chunk, schema)
+                    writer.write_table(table)
+                if writer is not None:
+                    writer.close()
+        except Exception:
+            self._discard_partial_matrix()
+            raise
+        self.save_metadata()
+
+
+class ParquetMatrixStore(ArrowMatrixStore):
+    """Store and access matrices using Parquet
+
+    A matrix saved as a whole is sorted by as of date and written in row groups
+    of PARQUET_ROW_GROUP_ROWS rows, so that reading a range of as of dates (for
+    a view of the matrix, see architect.Planner) skips the row groups outside
+    of it, finding them by their as of date column alone. A matrix saved in
+    chunks has a row group for each chunk, in the order they are given.
+
+    Requires pyarrow (pip install triage[arrow]).
+    """
+
+    suffix = "parquet"
+
+    def _read_schema(self, fd):
+        return pyarrow.parquet.ParquetFile(fd).schema.to_arrow_schema()
+
+    def _read_head(self, fd):
+        parquet_file = pyarrow.parquet.ParquetFile(fd)
+        if not parquet_file.num_row_groups:
+            return parquet_file.read()
+        return parquet_file.read_row_group(0).slice(0, 1)
+
+    def _read_table(self, fd, columns, as_of_date_range):
+        parquet_file = pyarrow.parquet.ParquetFile(fd)
+        if as_of_date_range is None or not parquet_file.num_row_groups:
+            return parquet_file.read(columns=columns)
+        first, last = as_of_date_range
+        row_groups = []
+        for i in range(parquet_file.num_row_groups):
+            as_of_dates = (
+                parquet_file.read_row_group(i, columns=["as_of_date"])
+                .to_pandas()["as_of_date"]
+            )
+            if len(as_of_dates) and (
+                as_of_dates.max() >= first and as_of_dates.min() <= last
+            ):
+                row_groups.append(parquet_file.read_row_group(i, columns=columns))
+        if not row_groups:
+            return parquet_file.read_row_group(0, columns=columns).slice(0, 0)
+        return pyarrow.concat_tables(row_groups)
+
+    def _writer(self, fd, schema):
+        return pyarrow.parquet.ParquetWriter(fd, schema)
+
+    def save(self):
+        matrix = self._sorted_by_as_of_date(self.matrix)
+        self.save_chunks(
+            matrix.iloc[start:start + PARQUET_ROW_GROUP_ROWS]
+            for start in range(0, max(len(matrix), 1), PARQUET_ROW_GROUP_ROWS)
+        )
+
+
+class FeatherMatrixStore(ArrowMatrixStore):
+    """Store and access matrices using Feather (the uncompressed Arrow IPC file
+    format)
+
+    Feather files are larger than Parquet files, but are read without decoding.
+    Rows can't be skipped, so those outside of a range of as of dates are
+    dropped once read.
+
+    Requires pyarrow (pip install triage[arrow]).
+    """
+
+    suffix = "feather"
+
+    def _read_schema(self, fd):
+        return pyarrow.RecordBatchFileReader(fd).schema
+
+    def _read_head(self, fd):
+        reader = pyarrow.RecordBatchFileReader(fd)
+        if not reader.num_record_batches:
+            return pyarrow.Table.from_batches([], schema=reader.schema)
+        return pyarrow.Table.from_batches([reader.get_batch(0).slice(0, 1)])
+
+    def _read_table(self, fd, columns, as_of_date_range):
+        return pyarrow.feather.read_table(fd, columns=columns)
+
+    def _writer(self, fd, schema):
+        return pyarrow.RecordBatchFileWriter(fd, schema)
+
+
+def _npy_header(shape, dtype):
+    """A .npy format header for a C-ordered array, padded to NPY_HEADER_LENGTH
+    bytes"""
+    header = repr(
+        {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            "fortran_order": False,
+            "shape": tuple(int(length) for length in shape),
+        }
+    )
+    # the magic string and version, and the header's length, take 10 bytes
+    header = header.ljust(NPY_HEADER_LENGTH - 11) + "\n"
+    return (
+        np.lib.format.magic(1, 0)
+        + struct.pack("<H", len(header))
+        + header.encode("latin1")
+    )
+
+
+def _as_slice(positions):
+    """A slice of the given positions if they are consecutive, so that
+    selecting them from an array is a view rather than a copy"""
+    if not len(positions):
+        return slice(0, 0)
+    if positions[-1] - positions[0] + 1 == len(positions) and (
+        np.all(np.diff(positions) == 1)
+    ):
+        return slice(int(positions[0]), int(positions[-1]) + 1)
+    return positions
+
+
+class NumpyMatrixStore(MatrixStore):
+    """Store and access matrices as memory-mapped numpy arrays
+
+    The features of a matrix are saved as a C-ordered float32 .npy file, and
+    its index, label and feature names beside it, in a .rows.npz file. The
+    features are loaded with numpy.load(mmap_mode='r'), so loading takes no
+    time, only the pages of the file that are used are read, and processes
+    on the same host share them through the page cache.
+
+    Until the matrix is loaded as a whole, its labels and index are read from
+    the .rows.npz file alone, and matrix_with_sorted_columns() returns a
+    read-only DataFrame backed by the memory-mapped file, without a copy, if
+    the columns asked for are consecutive and in the stored order (as those of
+    a model's train matrix are) and the rows are all of the matrix's or a
+    consecutive range of them. Matrices saved as a whole are sorted by as of
+    date, so that the rows of a range of as of dates are consecutive.
+
+    The matrix and its .rows.npz file are written to temporary files and then
+    renamed, so that matrices already loaded from the file are unaffected by it
+    being replaced, and a matrix that fails to be saved leaves the one saved
+    before it in place. Can't be used with S3.
+    """
+
+    suffix = "npy"
+    columnar = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if isinstance(self.matrix_base_store, S3Store):
+            raise ValueError("NumpyMatrixStore cannot be used with S3")
+        self.rows_base_store = self.project_storage.get_store(
+            self.directories, f"{self.matrix_uuid}.rows.npz"
+        )
+
+    @property
+    def exists(self):
+        """Whether or not the matrix, its rows and metadata exist in storage"""
+        if not super().exists:
+            return False
+        return self.source_store is not None or self.rows_base_store.exists()
+
+    def _downcast(self, matrix):
+        # the features are stored as float32, and aren't copied to be downcast
+        return matrix
+
+    def _load_rows(self):
+        with np.load(io.BytesIO(self.rows_base_store.load())) as rows:
+            return {name: rows[name] for name in rows.files}
+
+    def _stored_column_names(self):
+        columns = self._load_rows()["columns"].tolist()
+        return columns + [self.metadata["label_name"]]
+
+    def _head_of_matrix(self):
+        try:
+            head_of_matrix = self._load().head(1)
+        except FileNotFoundError as fnfe:
+            logging.exception(f"Matrix isn't there: {fnfe}")
+            logging.exception("Returning Empty data frame")
+            head_of_matrix = pd.DataFrame()
+
+        return head_of_matrix
+
+    def _load(self, columns=None, as_of_date_range=None):
+        rows = self._load_rows()
+        indices = self.metadata["indices"]
+        label_name = self.metadata["label_name"]
+        feature_names = rows["columns"].tolist()
+        if columns is None:
+            columns = feature_names + [label_name]
+        selection = slice(None)
+        if as_of_date_range is not None:
+            as_of_dates = rows["index_as_of_date"]
+            first, last = (
+                pd.Timestamp(as_of_date).to_datetime64()
+                for as_of_date in as_of_date_range
+            )
+            selection = _as_slice(
+                np.flatnonzero((as_of_dates >= first) & (as_of_dates <= last))
+            )
+        index_values = [rows[f"index_{name}"][selection] for name in indices]
+        if len(indices) == 1:
+            index = pd.Index(index_values[0], name=indices[0])
+        else:
+            index = pd.MultiIndex.from_arrays(index_values, names=indices)
+
+        feature_positions = {name: i for i, name in enumerate(feature_names)}
+        features = [column for column in columns if column != label_name]
+        values = np.load(self.matrix_base_store.path, mmap_mode="r")[selection]
+        values = values[
+            :, _as_slice(np.array([feature_positions[name] for name in features]))
+        ]
+        matrix = pd.DataFrame(values, index=index, columns=features, copy=False)
+        if label_name in columns:
+            matrix[label_name] = rows["label"][selection]
+            if matrix.columns.tolist() != list(columns):
+                matrix = matrix[columns]
+        return matrix
+
+    def save(self):
+        matrix = self._sorted_by_as_of_date(self.matrix)
+        # an empty matrix is still one (empty) chunk, so its columns are saved
+        self.save_chunks(
+            matrix.iloc[start:start + NUMPY_WRITE_CHUNK_ROWS]
+            for start in range(0, max(len(matrix), 1), NUMPY_WRITE_CHUNK_ROWS)
+        )
+
+    def save_chunks(self, chunks):
+        indices = self.metadata["indices"]
+        label_name = self.metadata["label_name"]
+        columns = None
+        index_values = {name: [] for name in indices}
+        labels = []
+        num_rows = 0
+        partial = FSStore(f"{self.matrix_base_store.path}.{os.getpid()}.partial")
+        partial_rows = FSStore(f"{self.rows_base_store.path}.{os.getpid()}.partial")
+        try:
+            with partial.open("wb") as fd:
+                # written over once the number of rows is known
+                fd.write(b"\0" * NPY_HEADER_LENGTH)
+                for chunk in chunks:
+                    chunk_columns = [
+                        column for column in chunk.columns if column != label_name
+                    ]
+                    if columns is None:
+                        columns = chunk_columns
+                    elif chunk_columns != columns:
+                        raise ValueError("Matrix chunks have different columns")
+                    fd.write(
+                        np.ascontiguousarray(
+                            chunk[columns].values, dtype=np.float32
+                        ).tobytes()
+                    )
+                    labels.append(chunk[label_name].values)
+                    for name in indices:
+                        index_values[name].append(
+                            chunk.index.get_level_values(name).values
+                        )
+                    num_rows += len(chunk)
+                fd.seek(0)
+                fd.write(_npy_header((num_rows, len(columns or [])), np.float32))
+
+            rows = io.BytesIO()
+            np.savez(
+                rows,
+                columns=np.array(columns or [], dtype=str),
+                label=np.concatenate(labels) if labels else np.empty(0),
+                **{
+                    f"index_{name}": np.concatenate(values)
+                    if values
+                    else np.empty(0, dtype=np.int64)
+                    for name, values in index_values.items()
+                },
+            )
+            partial_rows.write(rows.getvalue())
+        except Exception:
+            # any matrix saved before is left as it was
+            for store in (partial, partial_rows):
+                if store.exists():
+                    store.delete()
+            raise
+        os.replace(partial_rows.path, self.rows_base_store.path)
+        os.replace(partial.path, self.matrix_base_store.path)
+        self.save_metadata()
 
 
 class TestMatrixType(object):
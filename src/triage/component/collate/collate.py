@@ -424,6 +424,10 @@ class Categorical(Compare):
 
 
 class Aggregation(object):
+    # Postgres does not allow tables with more columns than this, so wider
+    # aggregations are split into several tables (see get_shards())
+    max_table_columns = 1600
+
     def __init__(
         self,
         aggregates,
@@ -515,14 +519,76 @@ class Aggregation(object):
                 imprules.update(a.column_imputation_lookup(prefix=prefix))
         return imprules
 
-    def get_table_name(self, group=None, imputed=False):
+    def _get_key_columns(self):
+        """
+        The columns identifying a row of the aggregation table
+        """
+        return [str(groupby) for groupby in self.groups.values()]
+
+    def get_shards(self):
+        """
+        Splits the aggregate columns into shards, each stored in its own
+        aggregation (and imputed) table keyed by the same columns, so that no
+        table exceeds max_table_columns once an imputation flag is added for
+        every column. Columns are assigned in sorted order, so the same
+        aggregation is always sharded the same way.
+
+        Returns: a list of lists of column names, with one list per shard
+        """
+        columns = sorted(self.get_imputation_rules().keys())
+        shard_size = max(
+            (self.max_table_columns - len(self._get_key_columns())) // 2, 1
+        )
+        return [
+            columns[i : i + shard_size] for i in range(0, len(columns), shard_size)
+        ] or [columns]
+
+    def _check_group_width(self, group, select):
+        """
+        Only the aggregation and imputed tables are sharded by column, so a
+        single group table must fit in max_table_columns on its own. Raises a
+        ValueError naming the limit before any table is created otherwise.
+
+        Returns: the select query, unchanged
+        """
+        if len(select.c) > self.max_table_columns:
+            raise ValueError(
+                "The {} table for group {} would have {} columns, more than the "
+                "{} columns a postgres table can hold. Split its aggregates or "
+                "intervals across several feature aggregations.".format(
+                    self.prefix, group, len(select.c), self.max_table_columns
+                )
+            )
+        return select
+
+    def _get_shard_columns(self, shard):
         """
-        Returns name for table for the given group
+        Helper to find the columns of a shard, or None if the aggregation has a
+        single shard holding every column
         """
+        shards = self.get_shards()
+        return shards[shard] if len(shards) > 1 else None
+
+    def get_table_names(self, imputed=False):
+        """
+        Returns the names of the aggregation (or imputed) tables of every shard
+        """
+        return [
+            self.get_table_name(imputed=imputed, shard=shard)
+            for shard in range(len(self.get_shards()))
+        ]
+
+    def get_table_name(self, group=None, imputed=False, shard=0):
+        """
+        Returns name for table for the given group, or for the given shard of
+        the aggregation table if no group is given. The first shard keeps the
+        unsharded name, and later shards are suffixed with their number.
+        """
+        shard_suffix = "_%s" % (shard + 1) if shard else ""
         if group is None and not imputed:
-            name = '"%s_%s"' % (self.prefix, self.suffix)
+            name = '"%s_%s%s"' % (self.prefix, self.suffix, shard_suffix)
         elif group is None and imputed:
-            name = '"%s_%s_%s"' % (self.prefix, self.suffix, "imputed")
+            name = '"%s_%s_%s%s"' % (self.prefix, self.suffix, "imputed", shard_suffix)
         elif imputed:
             name = '"%s"' % to_sql_name("%s_%s_%s" % (self.prefix, group, "imputed"))
         else:
@@ -544,7 +610,10 @@ class Aggregation(object):
                 create is a CreateTableAs object
         """
         return {
-            group: CreateTableAs(self.get_table_name(group), next(iter(sels)).limit(0))
+            group: CreateTableAs(
+                self.get_table_name(group),
+                self._check_group_width(group, next(iter(sels))).limit(0),
+            )
             for group, sels in self.get_selects().items()
         }
 
@@ -566,6 +635,19 @@ class Aggregation(object):
             for group, sels in self.get_selects().items()
         }
 
+    def get_prepared_inserts(self):
+        """
+        Construct insert commands from this aggregation for executing as
+        prepared statements. An Aggregation runs a single query per group, so
+        there is nothing to parameterize and these are just get_inserts()
+
+        Returns:
+            a dictionary of group : inserts pairs where
+                group are the same keys as groups
+                inserts is a list of InsertFromSelect objects
+        """
+        return self.get_inserts()
+
     def get_drops(self):
         """
         Generate drop queries for this aggregation
@@ -600,27 +682,77 @@ class Aggregation(object):
             *self.groups.values()
         )
 
-    def get_create(self, join_table=None):
+    def _get_create_select(self, join_table=None, columns=None):
         """
-        Generate a single aggregation table creation query by joining
-            together the results of get_creates()
-        Returns: a CREATE TABLE AS query
+        Generate the query joining together the group tables
+        Args:
+            join_table: the relation of all key values to join the group tables to
+            columns: the aggregate columns to select, along with the key columns.
+                Selects every column if None.
+
+        Returns: a SELECT query
         """
         if not join_table:
             join_table = "(%s) t1" % self.get_join_table()
 
-        query = "SELECT * FROM %s\n" % join_table
+        if columns is None:
+            select = "*"
+        else:
+            select = ", ".join(
+                self._get_key_columns() + ['"%s"' % column for column in columns]
+            )
+        query = "SELECT %s FROM %s\n" % (select, join_table)
         for group, groupby in self.groups.items():
             query += "LEFT JOIN %s USING (%s)" % (self.get_table_name(group), groupby)
 
-        return "CREATE TABLE %s AS (%s);" % (self.get_table_name(), query)
+        return query
 
-    def get_drop(self, imputed=False):
+    def get_create(self, join_table=None, shard=0):
+        """
+        Generate a single aggregation table creation query by joining
+            together the results of get_creates()
+        Args:
+            join_table: the relation of all key values to join the group tables to
+            shard: the index of the shard (see get_shards()) to create
+
+        Returns: a CREATE TABLE AS query
+        """
+        return "CREATE TABLE %s AS (%s);" % (
+            self.get_table_name(shard=shard),
+            self._get_create_select(
+                join_table=join_table, columns=self._get_shard_columns(shard)
+            ),
+        )
+
+    def _get_preimputation_source(self, from_groups=False, shard=0):
+        """
+        The relation holding the aggregated (but not yet imputed) values
+
+        Args:
+            from_groups: if True, read directly from the group tables instead
+                of from the aggregation table. When the only group is the state
+                group the group table can be used as is, otherwise the group
+                tables are joined in a subquery (see get_create()).
+            shard: the index of the shard (see get_shards()) to read
+
+        Returns: a table name or parenthesized subquery
+        """
+        if not from_groups:
+            return self.get_table_name(shard=shard)
+        if len(self.groups) == 1:
+            group, groupby = next(iter(self.groups.items()))
+            if str(groupby) == self.state_group:
+                return self.get_table_name(group)
+        return "(%s)" % self._get_create_select(columns=self._get_shard_columns(shard))
+
+    def get_drop(self, imputed=False, shard=0):
         """
         Generate a drop table statement for the aggregation table
         Returns: string sql query
         """
-        return "DROP TABLE IF EXISTS %s" % self.get_table_name(imputed=imputed)
+        return "DROP TABLE IF EXISTS %s" % self.get_table_name(
+            imputed=imputed, shard=shard
+        )
 
     def get_create_schema(self):
         """
@@ -629,10 +761,16 @@ class Aggregation(object):
         if self.schema is not None:
             return "CREATE SCHEMA IF NOT EXISTS %s" % self.schema
 
-    def find_nulls(self, imputed=False):
+    def find_nulls(self, imputed=False, from_groups=False, shard=0):
         """
         Generate query to count number of nulls in each column in the aggregation table
 
+        Args:
+            imputed: whether to look in the imputed table
+            from_groups: whether to read the group tables directly rather than the
+                aggregation table (ignored if imputed is True)
+            shard: the index of the shard (see get_shards()) whose columns to count
+
         Returns: a SQL SELECT statement
         """
         query_template = """
@@ -645,24 +783,187 @@ class Aggregation(object):
                 """SUM(CASE WHEN "{col}" IS NULL THEN 1 ELSE 0 END) AS "{col}" """.format(
                     col=column
                 )
-                for column in self.get_imputation_rules().keys()
+                for column in (
+                    self._get_shard_columns(shard)
+                    or self.get_imputation_rules().keys()
+                )
             ]
         )
 
         return query_template.format(
             cols=cols_sql,
             state_tbl=self.state_table,
-            aggs_tbl=self.get_table_name(imputed=imputed),
+            aggs_tbl=self.get_table_name(imputed=True, shard=shard)
+            if imputed
+            else self._get_preimputation_source(from_groups, shard),
             group=self.state_group,
         )
 
-    def _get_impute_select(self, impute_cols, nonimpute_cols, partitionby=None):
+    def get_column_stats_name(self):
+        """
+        The name under which this aggregation's columns are recorded in a column
+        statistics table: the unquoted aggregation table name, without schema
+        """
+        return to_sql_name("%s_%s" % (self.prefix, self.suffix))
+
+    def get_column_stats_create(self, stats_table):
+        """
+        Generate a create statement for a column statistics table, which can
+        hold the statistics of many aggregations
+
+        Returns: a CREATE TABLE IF NOT EXISTS query
+        """
+        return """CREATE TABLE IF NOT EXISTS {stats_table} (
+            table_name text,
+            as_of_date date,
+            column_name text,
+            row_count bigint,
+            null_count bigint,
+            mean_value double precision,
+            min_value double precision,
+            max_value double precision
+        )""".format(
+            stats_table=stats_table
+        )
+
+    def get_column_stats_delete(self, stats_table):
+        """
+        Generate a statement removing this aggregation's column statistics
+        """
+        return "DELETE FROM %s WHERE table_name = '%s'" % (
+            stats_table,
+            self.get_column_stats_name(),
+        )
+
+    def _get_column_stats_values(self, columns):
+        """
+        Helper to unpivot aggregate columns into (column_name, value) rows,
+        so that the statistics of all columns are computed in one scan
+        """
+        return ",\n".join(
+            """('{name}', t2."{col}"::float)""".format(
+                name=column.replace("'", "''"), col=column
+            )
+            for column in columns
+        )
+
+    def get_column_stats_inserts(self, stats_table, from_groups=False):
+        """
+        Generate queries computing the row count, null count, mean, min and max
+        of every aggregate column, as found after joining to the state table
+
+        Args:
+            stats_table: the column statistics table to insert into
+            from_groups: whether to read the group tables directly rather than the
+                aggregation table
+
+        Returns: a list of INSERT queries (one per shard), which may be run in
+            parallel
+        """
+        query = """
+            INSERT INTO {stats_table}
+            SELECT '{name}', NULL::date, v.column_name, count(*),
+                count(*) - count(v.value), avg(v.value), min(v.value), max(v.value)
+            FROM {state_tbl} t1
+            LEFT JOIN {aggs_tbl} t2 USING({group})
+            CROSS JOIN LATERAL (VALUES {values}) v(column_name, value)
+            GROUP BY v.column_name
+            """
+        return [
+            query.format(
+                stats_table=stats_table,
+                name=self.get_column_stats_name(),
+                state_tbl=self.state_table,
+                aggs_tbl=self._get_preimputation_source(from_groups, shard),
+                group=self.state_group,
+                values=self._get_column_stats_values(columns),
+            )
+            for shard, columns in enumerate(self.get_shards())
+        ]
+
+    def get_column_stats_summary(self, stats_table):
+        """
+        Generate a query summarizing the column statistics over all dates,
+        with one row per column: column_name, row_count, null_count,
+        min_value, max_value and whether the column is constant (it never takes
+        more than one value, counting null as a value)
+
+        Returns: a SQL SELECT statement
+        """
+        return """
+            SELECT column_name,
+                sum(row_count) AS row_count,
+                sum(null_count) AS null_count,
+                min(min_value) AS min_value,
+                max(max_value) AS max_value,
+                coalesce(min(min_value) = max(max_value), true)
+                    AND (sum(null_count) = 0 OR sum(null_count) = sum(row_count))
+                    AS is_constant
+            FROM {stats_table}
+            WHERE table_name = '{name}'
+            GROUP BY column_name
+            """.format(
+            stats_table=stats_table, name=self.get_column_stats_name()
+        )
+
+    def _get_mean_imputed_cols(self, impute_cols):
+        """
+        Helper to find the columns to be imputed with a rule based on the mean
+        """
+        imprules = self.get_imputation_rules()
+        return [
+            col
+            for col in impute_cols
+            if getattr(
+                available_imputations.get(imprules.get(col, {}).get("type")),
+                "requires_mean",
+                False,
+            )
+        ]
+
+    def _get_column_stats_means_join(self, stats_table, columns):
+        """
+        Helper to join the column means from a column statistics table
+        Args:
+            stats_table: the column statistics table
+            columns: the columns whose means are needed
+
+        Returns: a tuple of the join clause and a dictionary of
+            column : mean expression pairs
+        """
+        if not columns:
+            return "", {}
+        mean_sqls = {}
+        means = []
+        for i, col in enumerate(columns):
+            alias = "_imp_mean_%s" % i
+            means.append(
+                "max(mean_value) FILTER (WHERE column_name = '%s') AS %s"
+                % (col.replace("'", "''"), alias)
+            )
+            mean_sqls[col] = "imp.%s" % alias
+        join = "\nCROSS JOIN (SELECT %s FROM %s WHERE table_name = '%s') imp" % (
+            ", ".join(means),
+            stats_table,
+            self.get_column_stats_name(),
+        )
+        return join, mean_sqls
+
+    def _get_impute_select(
+        self,
+        impute_cols,
+        nonimpute_cols,
+        partitionby=None,
+        mean_sqls=None,
+        columns=None,
+    ):
 
         imprules = self.get_imputation_rules()
 
-        # check if we're missing any columns relative to the full set and raise an
-        # exception if we are
-        missing_cols = set(imprules.keys()) - set(nonimpute_cols + impute_cols)
+        # check if we're missing any columns relative to the full set (or the
+        # given columns of a shard) and raise an exception if we are
+        expected_cols = set(imprules.keys()) if columns is None else set(columns)
+        missing_cols = expected_cols - set(nonimpute_cols + impute_cols)
         if len(missing_cols) > 0:
             raise ValueError("Missing columns in get_impute_create: %s" % missing_cols)
 
@@ -689,7 +990,12 @@ class Aggregation(object):
                         % (impute_rule.get("type", ""), col)
                     ) from err
 
-                imputer = imputer(column=col, partitionby=partitionby, **impute_rule)
+                imputer = imputer(
+                    column=col,
+                    partitionby=partitionby,
+                    mean_sql=(mean_sqls or {}).get(col),
+                    **impute_rule
+                )
 
                 query += "\n,%s" % imputer.to_sql()
                 if not imputer.noflag:
@@ -699,31 +1005,74 @@ class Aggregation(object):
 
         return query
 
-    def get_impute_create(self, impute_cols, nonimpute_cols):
+    def _get_shard_imputation_columns(self, impute_cols, nonimpute_cols, shard):
+        """
+        Helper to restrict lists of columns with and without nulls to a shard
+        """
+        columns = self._get_shard_columns(shard)
+        if columns is None:
+            return impute_cols, nonimpute_cols
+        columns = set(columns)
+        return (
+            [col for col in impute_cols if col in columns],
+            [col for col in nonimpute_cols if col in columns],
+        )
+
+    def get_impute_create(
+        self,
+        impute_cols,
+        nonimpute_cols,
+        from_groups=False,
+        stats_table=None,
+        shard=0,
+    ):
         """
         Generates the CREATE TABLE query for the aggregation table with imputation.
 
         Args:
             impute_cols: a list of column names with null values
             nonimpute_cols: a list of column names without null values
+            from_groups: whether to build the imputed table directly from the
+                group tables, skipping the intermediate aggregation table
+            stats_table: a column statistics table populated by
+                get_column_stats_inserts(), to read column means from instead of
+                computing them with window functions
+            shard: the index of the shard (see get_shards()) to create. Columns
+                from other shards are ignored.
 
         Returns: a CREATE TABLE AS query
         """
+        impute_cols, nonimpute_cols = self._get_shard_imputation_columns(
+            impute_cols, nonimpute_cols, shard
+        )
+        stats_join, mean_sqls = self._get_column_stats_means_join(
+            stats_table,
+            self._get_mean_imputed_cols(impute_cols) if stats_table else [],
+        )
 
         # key columns and date column
         query = "SELECT %s" % ", ".join(map(str, self.groups.values()))
 
         # columns with imputation filling as needed
-        query += self._get_impute_select(impute_cols, nonimpute_cols)
+        query += self._get_impute_select(
+            impute_cols,
+            nonimpute_cols,
+            mean_sqls=mean_sqls,
+            columns=self._get_shard_columns(shard),
+        )
 
         # imputation starts from the state table and left joins into the aggregation table
         query += "\nFROM %s t1" % self.state_table
         query += "\nLEFT JOIN %s t2 USING(%s)" % (
-            self.get_table_name(),
+            self._get_preimputation_source(from_groups, shard),
             self.state_group,
         )
+        query += stats_join
 
-        return "CREATE TABLE %s AS (%s)" % (self.get_table_name(imputed=True), query)
+        return "CREATE TABLE %s AS (%s)" % (
+            self.get_table_name(imputed=True, shard=shard),
+            query,
+        )
 
     def execute(self, conn, join_table=None):
         """
@@ -737,8 +1086,6 @@ class Aggregation(object):
         drops = self.get_drops()
         indexes = self.get_indexes()
         inserts = self.get_inserts()
-        drop = self.get_drop()
-        create = self.get_create(join_table=join_table)
 
         trans = conn.begin()
 
@@ -752,27 +1099,29 @@ class Aggregation(object):
                 conn.execute(insert)
             conn.execute(indexes[group])
 
-        # create the aggregation table
-        conn.execute(drop)
-        conn.execute(create)
-
-        # excute query to find columns with null values and create lists of columns
-        # that do and do not need imputation when creating the imputation table
-        res = conn.execute(self.find_nulls())
-        null_counts = list(zip(res.keys(), res.fetchone()))
-        impute_cols = [col for col, val in null_counts if val > 0]
-        nonimpute_cols = [col for col, val in null_counts if val == 0]
-        res.close()
-
-        # sql to drop and create the imputation table
-        drop_imp = self.get_drop(imputed=True)
-        create_imp = self.get_impute_create(
-            impute_cols=impute_cols, nonimpute_cols=nonimpute_cols
-        )
+        for shard in range(len(self.get_shards())):
+            # create the aggregation table
+            conn.execute(self.get_drop(shard=shard))
+            conn.execute(self.get_create(join_table=join_table, shard=shard))
+
+            # excute query to find columns with null values and create lists of
+            # columns that do and do not need imputation when creating the
+            # imputation table
+            res = conn.execute(self.find_nulls(shard=shard))
+            null_counts = list(zip(res.keys(), res.fetchone()))
+            impute_cols = [col for col, val in null_counts if val > 0]
+            nonimpute_cols = [col for col, val in null_counts if val == 0]
+            res.close()
+
+            # sql to drop and create the imputation table
+            drop_imp = self.get_drop(imputed=True, shard=shard)
+            create_imp = self.get_impute_create(
+                impute_cols=impute_cols, nonimpute_cols=nonimpute_cols, shard=shard
+            )
 
-        # create the imputation table
-        conn.execute(drop_imp)
-        conn.execute(create_imp)
+            # create the imputation table
+            conn.execute(drop_imp)
+            conn.execute(create_imp)
 
         trans.commit()
 
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Evaluate collate aggregations with an embedded columnar engine (DuckDB)
+
+Postgres remains the system of record: each aggregation's from_obj is exported
+once to a local DuckDB database, the aggregation's group-by queries are run
+against that copy, and their results are bulk-loaded back into the usual group
+tables with COPY. Everything downstream of the group tables is unchanged.
+
+The commands here stand in for SQL strings in feature table tasks, and are run
+with their execute() method on the SQLAlchemy connection the SQL would have
+been executed on. They only hold strings, so they can be sent to other
+processes, which need access to the same local filesystem.
+"""
+import copy
+import logging
+import os
+import tempfile
+
+import sqlalchemy.sql.expression as ex
+
+from .sql import Command
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+LOCAL_TABLE_NAME = "from_obj"
+
+PG_TO_DUCKDB_TYPES = {
+    "bool": "BOOLEAN",
+    "int2": "SMALLINT",
+    "int4": "INTEGER",
+    "int8": "BIGINT",
+    "float4": "REAL",
+    "float8": "DOUBLE",
+    "numeric": "DOUBLE",
+    "date": "DATE",
+    "timestamp": "TIMESTAMP",
+    "timestamptz": "TIMESTAMPTZ",
+    "interval": "INTERVAL",
+}
+
+
+def _connect(database_path, read_only=False):
+    if duckdb is None:
+        raise ImportError(
+            "duckdb not available. To use the columnar feature backend, install "
+            "triage with the DuckDB extension: pip install triage[duckdb]"
+        )
+    return duckdb.connect(database_path, read_only=read_only)
+
+
+def _quote_literal(value):
+    return "'%s'" % value.replace("'", "''")
+
+
+class ColumnarCommand(Command):
+    """A feature table task command run outside of Postgres"""
+
+
+class ColumnarExport(ColumnarCommand):
+    """Copies a from_obj out of Postgres into a local DuckDB table, unless a
+    previous command already did so
+
+    Args:
+        from_obj: the from clause to export, e.g. the name of a table
+        database_path: path of the DuckDB database file to create, along with
+            its directory
+    """
+
+    def __init__(self, from_obj, database_path):
+        self.from_obj = str(from_obj)
+        self.database_path = database_path
+
+    def __str__(self):
+        return "-- export %s to %s" % (self.from_obj, self.database_path)
+
+    def _column_types(self, cursor):
+        cursor.execute("SELECT * FROM %s LIMIT 0" % self.from_obj)
+        columns = [(column[0], column[1]) for column in cursor.description]
+        cursor.execute(
+            "SELECT oid, typname FROM pg_type WHERE oid IN %s",
+            (tuple(set(oid for _, oid in columns)),),
+        )
+        type_names = dict(cursor.fetchall())
+        return [
+            (name, PG_TO_DUCKDB_TYPES.get(type_names.get(oid), "VARCHAR"))
+            for name, oid in columns
+        ]
+
+    def execute(self, conn):
+        if os.path.exists(self.database_path):
+            logging.info(
+                "%s already exported to %s", self.from_obj, self.database_path
+            )
+            return
+        os.makedirs(os.path.dirname(self.database_path), mode=0o700, exist_ok=True)
+        cursor = conn.connection.cursor()
+        columns = self._column_types(cursor)
+        partial_path = self.database_path + ".partial"
+        with tempfile.NamedTemporaryFile(
+            suffix=".csv", dir=os.path.dirname(self.database_path)
+        ) as csvfile:
+            cursor.copy_expert(
+                "COPY (SELECT * FROM %s) TO STDOUT WITH CSV HEADER" % self.from_obj,
+                csvfile,
+            )
+            csvfile.flush()
+            local_db = _connect(partial_path)
+            try:
+                local_db.execute(
+                    "CREATE TABLE {table} AS SELECT * FROM read_csv({path}, "
+                    "header=true, auto_detect=false, columns={{{columns}}})".format(
+                        table=LOCAL_TABLE_NAME,
+                        path=_quote_literal(csvfile.name),
+                        columns=", ".join(
+                            "%s: %s" % (_quote_literal(name), _quote_literal(coltype))
+                            for name, coltype in columns
+                        ),
+                    )
+                )
+            finally:
+                local_db.close()
+        # only expose the database once it is complete
+        os.rename(partial_path, self.database_path)
+        logging.info("Exported %s to %s", self.from_obj, self.database_path)
+
+
+class ColumnarInsert(ColumnarCommand):
+    """Evaluates a select query in a local DuckDB database, and copies the
+    results into a Postgres table with the same columns
+
+    Args:
+        select: the select query to evaluate, against the exported from_obj
+        table_name: the Postgres table to copy the results into
+        database_path: path of the DuckDB database file holding the from_obj
+    """
+
+    def __init__(self, select, table_name, database_path):
+        self.select = str(select)
+        self.table_name = table_name
+        self.database_path = database_path
+
+    def __str__(self):
+        return "-- columnar insert into %s:\n%s" % (self.table_name, self.select)
+
+    def execute(self, conn):
+        with tempfile.NamedTemporaryFile(
+            suffix=".csv", dir=os.path.dirname(self.database_path)
+        ) as csvfile:
+            local_db = _connect(self.database_path, read_only=True)
+            try:
+                local_db.execute(
+                    "COPY (%s) TO %s (FORMAT csv, HEADER)"
+                    % (self.select, _quote_literal(csvfile.name))
+                )
+            finally:
+                local_db.close()
+            with open(csvfile.name) as results:
+                conn.connection.cursor().copy_expert(
+                    "COPY %s FROM STDIN WITH CSV HEADER" % self.table_name, results
+                )
+
+
+class ColumnarCleanup(ColumnarCommand):
+    """Removes a local DuckDB database, and its directory if it is otherwise
+    empty, once it is no longer needed
+
+    Args:
+        database_path: path of the DuckDB database file to remove
+    """
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+
+    def __str__(self):
+        return "-- remove %s" % self.database_path
+
+    def execute(self, conn):
+        if os.path.exists(self.database_path):
+            os.remove(self.database_path)
+        try:
+            os.rmdir(os.path.dirname(self.database_path))
+        except OSError:
+            logging.warning("Could not remove directory of %s", self.database_path)
+
+
+def get_columnar_inserts(aggregation, database_path):
+    """
+    Construct columnar inserts for an aggregation, evaluating the same select
+    queries as aggregation.get_inserts() against a local copy of the from_obj
+    Args:
+        aggregation: the collate Aggregation or SpacetimeAggregation
+        database_path: path of the DuckDB database file created by a
+            ColumnarExport of the aggregation's from_obj
+
+    Returns:
+        a dictionary of group : inserts pairs where
+            group are the same keys as groups
+            inserts is a list of ColumnarInsert objects
+    """
+    local_aggregation = copy.copy(aggregation)
+    local_aggregation.from_obj = ex.text(LOCAL_TABLE_NAME)
+    return {
+        group: [
+            ColumnarInsert(sel, aggregation.get_table_name(group), database_path)
+            for sel in sels
+        ]
+        for group, sels in local_aggregation.get_selects().items()
+    }
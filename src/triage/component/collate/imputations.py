@@ -2,8 +2,17 @@ class BaseImputation(object):
     """Base class for various imputation methods
     """
 
+    # whether the imputation is computed from the column's mean within a partition
+    requires_mean = False
+
     def __init__(
-        self, column, coltype, partitionby=None, null_cat_pattern=None, noflag=False
+        self,
+        column,
+        coltype,
+        partitionby=None,
+        null_cat_pattern=None,
+        noflag=False,
+        mean_sql=None,
     ):
         self.column = column
         self.coltype = coltype
@@ -18,6 +27,15 @@ class BaseImputation(object):
         self.null_cat_pattern = (
             "__NULL_" if null_cat_pattern is None else null_cat_pattern
         )
+        # SQL expression for the column's mean within the partition, such as a
+        # reference to precomputed column statistics. If not given, the mean is
+        # computed with a window function over the partition
+        self.mean_sql = mean_sql
+
+    def _mean_sql(self):
+        if self.mean_sql is not None:
+            return self.mean_sql
+        return """AVG("%s") OVER (%s)""" % (self.column, self.partitionby)
 
     def _base_sql(self):
         return """COALESCE("{col}", {{imp}}) AS "{col}" """.format(col=self.column)
@@ -44,8 +62,16 @@ class ImputeMean(BaseImputation):
     columns with the mean, again falling back to 0 as necessary
     """
 
+    requires_mean = True
+
     def __init__(
-        self, column, coltype, partitionby=None, null_cat_pattern=None, **kwargs
+        self,
+        column,
+        coltype,
+        partitionby=None,
+        null_cat_pattern=None,
+        mean_sql=None,
+        **kwargs
     ):
         BaseImputation.__init__(
             self,
@@ -53,6 +79,7 @@ class ImputeMean(BaseImputation):
             coltype=coltype,
             partitionby=partitionby,
             null_cat_pattern=null_cat_pattern,
+            mean_sql=mean_sql,
         )
 
     def to_sql(self):
@@ -60,17 +87,13 @@ class ImputeMean(BaseImputation):
 
         if not self.catcol:
             # aggregate columm
-            return sql.format(
-                imp="""AVG("%s") OVER (%s), 0""" % (self.column, self.partitionby)
-            )
+            return sql.format(imp="%s, 0" % self._mean_sql())
         elif self.null_cat_pattern in self.column:
             # categorical NULL category
             return sql.format(imp=1)
         else:
             # categorical
-            return sql.format(
-                imp="""AVG("%s") OVER (%s), 0""" % (self.column, self.partitionby)
-            )
+            return sql.format(imp="%s, 0" % self._mean_sql())
 
 
 class ImputeConstant(BaseImputation):
@@ -187,9 +210,15 @@ class ImputeBinaryMode(BaseImputation):
     as it does not determine the modal category, just whether a binary is over 50%.
     """
 
-    def __init__(self, column, coltype, partitionby=None, **kwargs):
+    requires_mean = True
+
+    def __init__(self, column, coltype, partitionby=None, mean_sql=None, **kwargs):
         BaseImputation.__init__(
-            self, column=column, coltype=coltype, partitionby=partitionby
+            self,
+            column=column,
+            coltype=coltype,
+            partitionby=partitionby,
+            mean_sql=mean_sql,
         )
         if self.catcol:
             raise ValueError(
@@ -199,8 +228,7 @@ class ImputeBinaryMode(BaseImputation):
     def to_sql(self):
         sql = self._base_sql()
         return sql.format(
-            imp="""CASE WHEN AVG("%s") OVER (%s) > 0.5 THEN 1 ELSE 0 END, 0"""
-            % (self.column, self.partitionby)
+            imp="""CASE WHEN %s > 0.5 THEN 1 ELSE 0 END, 0""" % self._mean_sql()
         )
 
 
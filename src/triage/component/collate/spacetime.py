@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
+import copy
 from itertools import chain
 import sqlalchemy.sql.expression as ex
 
-from .sql import make_sql_clause
+from .sql import (
+    make_sql_clause,
+    CreateTableAs,
+    InsertFromSelect,
+    PreparedStatement,
+    ExecutePrepared,
+)
 from .collate import Aggregation
 
+# stands in for the as_of_date when generating parameterized statements
+DATE_PLACEHOLDER = "__collate_date__"
+
 
 class SpacetimeAggregation(Aggregation):
     def __init__(
@@ -22,6 +32,7 @@ class SpacetimeAggregation(Aggregation):
         date_column=None,
         output_date_column=None,
         input_min_date=None,
+        entity_filter=None,
     ):
         """
         Args:
@@ -38,6 +49,9 @@ class SpacetimeAggregation(Aggregation):
             output_date_column: name of date column in aggregated output, defaults to "date"
             input_min_date: minimum date for which rows shall be included, defaults
                 to no absolute time restrictions on the minimum date of included rows
+            entity_filter: SQL condition on the state_group column restricting the
+                rows aggregated by the state_group, e.g. to the entities of a shard.
+                Other groups aggregate all rows, defaults to no restriction
 
         For all other arguments see collate.Aggregation
         """
@@ -61,12 +75,30 @@ class SpacetimeAggregation(Aggregation):
         self.date_column = date_column if date_column else "date"
         self.output_date_column = output_date_column if output_date_column else "date"
         self.input_min_date = input_min_date
+        self.entity_filter = entity_filter
+        self._select_templates = None
+
+    def restricted(self, entity_filter):
+        """
+        A copy of this aggregation with the given entity_filter
+        Args:
+            entity_filter: SQL condition on the state_group column
+
+        Returns: a SpacetimeAggregation
+        """
+        aggregation = copy.copy(self)
+        aggregation.entity_filter = entity_filter
+        aggregation._select_templates = None
+        return aggregation
 
-    def _state_table_sub(self):
+    def _state_table_sub(self, dates=None):
         """Helper function to ensure we only include state table records
-        in our set of input dates and after the input_min_date.
+        in our set of input dates (or the given subset) and after the
+        input_min_date.
         """
-        datestr = ", ".join(["'%s'::date" % dt for dt in self.dates])
+        if dates is None:
+            dates = self.dates
+        datestr = ", ".join(["'%s'::date" % dt for dt in dates])
         mindtstr = (
             " AND %s >= '%s'::date" % (self.output_date_column, self.input_min_date)
             if self.input_min_date is not None
@@ -114,6 +146,32 @@ class SpacetimeAggregation(Aggregation):
             ]
         )
 
+    def _get_select(self, group, date):
+        """
+        Helper for constructing the select query of a group for a date
+        Args:
+            group: a group in groups
+            date: SQL date string
+
+        Returns: a Select query
+        """
+        groupby = self.groups[group]
+        intervals = self.intervals[group]
+        columns = [
+            groupby,
+            ex.literal_column("'%s'::date" % date).label(self.output_date_column),
+        ]
+        columns += list(
+            chain(*[self._get_aggregates_sql(i, date, group) for i in intervals])
+        )
+
+        gb_clause = make_sql_clause(groupby, ex.literal_column)
+        query = ex.select(columns=columns, from_obj=self.from_obj).group_by(gb_clause)
+        query = query.where(self.where(date, intervals))
+        if self.entity_filter is not None and str(groupby) == self.state_group:
+            query = query.where(ex.text(self.entity_filter))
+        return query
+
     def get_selects(self):
         """
         Constructs select queries for this aggregation
@@ -122,33 +180,81 @@ class SpacetimeAggregation(Aggregation):
             group are the same keys as groups
             queries is a list of Select queries, one for each date in dates
         """
-        queries = {}
+        return {
+            group: [self._get_select(group, date) for date in self.dates]
+            for group in self.groups
+        }
 
-        for group, groupby in self.groups.items():
-            intervals = self.intervals[group]
-            queries[group] = []
-            for date in self.dates:
-                columns = [
-                    groupby,
-                    ex.literal_column("'%s'::date" % date).label(
-                        self.output_date_column
-                    ),
-                ]
-                columns += list(
-                    chain(
-                        *[self._get_aggregates_sql(i, date, group) for i in intervals]
-                    )
-                )
+    def get_select_templates(self):
+        """
+        Constructs one select query for each group, with the date as its only
+        parameter ($1, of type date), instead of one query for each date.
+        Templates are only generated once for each aggregation.
 
-                gb_clause = make_sql_clause(groupby, ex.literal_column)
-                query = ex.select(columns=columns, from_obj=self.from_obj).group_by(
-                    gb_clause
+        Returns: a dictionary of group : template pairs where
+            group are the same keys as groups
+            template is a SQL string, or None if the date could not be
+            parameterized (an aggregate uses {collate_date} other than as a
+            quoted string)
+        """
+        if self._select_templates is None:
+            self._select_templates = {}
+            for group in self.groups:
+                template = str(self._get_select(group, DATE_PLACEHOLDER)).replace(
+                    "'%s'" % DATE_PLACEHOLDER, "$1"
                 )
-                query = query.where(self.where(date, intervals))
+                self._select_templates[group] = (
+                    template if DATE_PLACEHOLDER not in template else None
+                )
+        return self._select_templates
 
-                queries[group].append(query)
+    def get_creates(self):
+        """
+        Construct create queries for this aggregation, from the select query of
+        the first date only
 
-        return queries
+        Returns:
+            a dictionary of group : create pairs where
+                group are the same keys as groups
+                create is a CreateTableAs object
+        """
+        return {
+            group: CreateTableAs(
+                self.get_table_name(group),
+                self._check_group_width(
+                    group, self._get_select(group, self.dates[0])
+                ).limit(0),
+            )
+            for group in self.groups
+        }
+
+    def get_prepared_inserts(self):
+        """
+        Construct insert commands for this aggregation that execute a single
+        server-side prepared statement per group, once for each date. Groups
+        whose select query cannot be parameterized fall back to get_inserts().
+
+        Returns:
+            a dictionary of group : inserts pairs where
+                group are the same keys as groups
+                inserts is a list of ExecutePrepared (or InsertFromSelect) objects
+        """
+        inserts = {}
+        for group, template in self.get_select_templates().items():
+            if template is None:
+                inserts[group] = [
+                    InsertFromSelect(
+                        self.get_table_name(group), self._get_select(group, date)
+                    )
+                    for date in self.dates
+                ]
+                continue
+            statement = PreparedStatement(
+                "INSERT INTO %s (%s)" % (self.get_table_name(group), template),
+                ["date"],
+            )
+            inserts[group] = [ExecutePrepared(statement, [date]) for date in self.dates]
+        return inserts
 
     def get_imputation_rules(self):
         """
@@ -232,15 +338,31 @@ class SpacetimeAggregation(Aggregation):
 
         return str.join("\nUNION ALL\n", map(str, queries))
 
-    def get_create(self, join_table=None):
+    def _get_key_columns(self):
         """
-        Generate a single aggregation table creation query by joining
-            together the results of get_creates()
-        Returns: a CREATE TABLE AS query
+        The columns identifying a row of the aggregation table
+        """
+        return super()._get_key_columns() + [self.output_date_column]
+
+    def _get_create_select(self, join_table=None, columns=None):
+        """
+        Generate the query joining together the group tables
+        Args:
+            join_table: the relation of all key values to join the group tables to
+            columns: the aggregate columns to select, along with the key columns.
+                Selects every column if None.
+
+        Returns: a SELECT query
         """
         if not join_table:
             join_table = "(%s) t1" % self.get_join_table()
-        query = "SELECT * FROM %s\n" % join_table
+        if columns is None:
+            select = "*"
+        else:
+            select = ", ".join(
+                self._get_key_columns() + ['"%s"' % column for column in columns]
+            )
+        query = "SELECT %s FROM %s\n" % (select, join_table)
         for group, groupby in self.groups.items():
             query += " LEFT JOIN %s USING (%s, %s)" % (
                 self.get_table_name(group),
@@ -248,47 +370,61 @@ class SpacetimeAggregation(Aggregation):
                 self.output_date_column,
             )
 
-        return "CREATE TABLE %s AS (%s);" % (self.get_table_name(), query)
+        return query
 
     def validate(self, conn):
         """
         SpacetimeAggregations ensure that no intervals extend beyond the absolute
         minimum time.
+
+        All dates are checked at once, reporting the first offending date.
         """
+        if not self.dates:
+            return
+        dates = "array[%s]::date[]" % ", ".join("'%s'" % date for date in self.dates)
         if self.input_min_date is not None:
             all_intervals = set(*self.intervals.values())
-            for date in self.dates:
-                for interval in all_intervals:
-                    if interval == "all":
-                        continue
-                    # This could be done more efficiently all at once, but doing
-                    # it this way allows for nicer error messages.
-                    r = conn.execute(
-                        "select ('%s'::date - '%s'::interval) < '%s'::date"
-                        % (date, interval, self.input_min_date)
+            intervals = [interval for interval in all_intervals if interval != "all"]
+            if intervals:
+                r = conn.execute(
+                    "select d, i from unnest(%s) d, unnest(array[%s]) i "
+                    "where (d - i::interval) < '%s'::date order by d limit 1"
+                    % (
+                        dates,
+                        ", ".join("'%s'" % interval for interval in intervals),
+                        self.input_min_date,
                     )
-                    if r.fetchone()[0]:
-                        raise ValueError(
-                            "date '%s' - '%s' is before input_min_date ('%s')"
-                            % (date, interval, self.input_min_date)
-                        )
-                    r.close()
-        for date in self.dates:
-            r = conn.execute(
-                "select count(*) from %s where %s = '%s'::date"
-                % (self.state_table, self.output_date_column, date)
-            )
-            if r.fetchone()[0] == 0:
-                raise ValueError(
-                    "date '%s' is not present in states table ('%s')"
-                    % (date, self.state_table)
                 )
-            r.close()
+                row = r.fetchone()
+                r.close()
+                if row is not None:
+                    raise ValueError(
+                        "date '%s' - '%s' is before input_min_date ('%s')"
+                        % (row[0], row[1], self.input_min_date)
+                    )
+        r = conn.execute(
+            "select d from unnest(%s) d where not exists "
+            "(select 1 from %s where %s = d) order by d limit 1"
+            % (dates, self.state_table, self.output_date_column)
+        )
+        row = r.fetchone()
+        r.close()
+        if row is not None:
+            raise ValueError(
+                "date '%s' is not present in states table ('%s')"
+                % (row[0], self.state_table)
+            )
 
-    def find_nulls(self, imputed=False):
+    def find_nulls(self, imputed=False, from_groups=False, shard=0):
         """
         Generate query to count number of nulls in each column in the aggregation table
 
+        Args:
+            imputed: whether to look in the imputed table
+            from_groups: whether to read the group tables directly rather than the
+                aggregation table (ignored if imputed is True)
+            shard: the index of the shard (see get_shards()) whose columns to count
+
         Returns: a SQL SELECT statement
         """
         query_template = """
@@ -301,28 +437,131 @@ class SpacetimeAggregation(Aggregation):
                 """SUM(CASE WHEN "{col}" IS NULL THEN 1 ELSE 0 END) AS "{col}" """.format(
                     col=column
                 )
-                for column in self.get_imputation_rules().keys()
+                for column in (
+                    self._get_shard_columns(shard)
+                    or self.get_imputation_rules().keys()
+                )
             ]
         )
 
         return query_template.format(
             cols=cols_sql,
             state_tbl=self._state_table_sub(),
-            aggs_tbl=self.get_table_name(imputed=imputed),
+            aggs_tbl=self.get_table_name(imputed=True, shard=shard)
+            if imputed
+            else self._get_preimputation_source(from_groups, shard),
             group=self.state_group,
             date_col=self.output_date_column,
         )
 
-    def get_impute_create(self, impute_cols, nonimpute_cols):
+    def get_column_stats_inserts(self, stats_table, from_groups=False):
+        """
+        Generate queries computing the row count, null count, mean, min and max
+        of every aggregate column for each date, as found after joining to the
+        state table
+
+        Args:
+            stats_table: the column statistics table to insert into
+            from_groups: whether to read the group tables directly rather than the
+                aggregation table
+
+        Returns: a list of INSERT queries, one for each date in dates (and
+            shard), which may be run in parallel
+        """
+        query_template = """
+            INSERT INTO {stats_table}
+            SELECT '{name}', t1.{date_col}, v.column_name, count(*),
+                count(*) - count(v.value), avg(v.value), min(v.value), max(v.value)
+            FROM {state_tbl} t1
+            LEFT JOIN {aggs_tbl} t2 USING({group}, {date_col})
+            CROSS JOIN LATERAL (VALUES {values}) v(column_name, value)
+            GROUP BY t1.{date_col}, v.column_name
+            """
+        shard_sources = [
+            (self._get_preimputation_source(from_groups, shard), columns)
+            for shard, columns in enumerate(self.get_shards())
+        ]
+
+        return [
+            query_template.format(
+                stats_table=stats_table,
+                name=self.get_column_stats_name(),
+                state_tbl=self._state_table_sub([date]),
+                aggs_tbl=aggs_tbl,
+                group=self.state_group,
+                date_col=self.output_date_column,
+                values=self._get_column_stats_values(columns),
+            )
+            for aggs_tbl, columns in shard_sources
+            for date in self.dates
+        ]
+
+    def _get_column_stats_means_join(self, stats_table, columns):
+        """
+        Helper to join the per-date column means from a column statistics table
+        Args:
+            stats_table: the column statistics table
+            columns: the columns whose means are needed
+
+        Returns: a tuple of the join clause and a dictionary of
+            column : mean expression pairs
+        """
+        if not columns:
+            return "", {}
+        mean_sqls = {}
+        means = []
+        for i, col in enumerate(columns):
+            alias = "_imp_mean_%s" % i
+            means.append(
+                "max(mean_value) FILTER (WHERE column_name = '%s') AS %s"
+                % (col.replace("'", "''"), alias)
+            )
+            mean_sqls[col] = "imp.%s" % alias
+        join = """
+            LEFT JOIN (
+                SELECT as_of_date AS _imp_date, {means}
+                FROM {stats_table}
+                WHERE table_name = '{name}'
+                GROUP BY as_of_date
+            ) imp ON imp._imp_date = t1.{date_col}""".format(
+            means=", ".join(means),
+            stats_table=stats_table,
+            name=self.get_column_stats_name(),
+            date_col=self.output_date_column,
+        )
+        return join, mean_sqls
+
+    def get_impute_create(
+        self,
+        impute_cols,
+        nonimpute_cols,
+        from_groups=False,
+        stats_table=None,
+        shard=0,
+    ):
         """
         Generates the CREATE TABLE query for the aggregation table with imputation.
 
         Args:
             impute_cols: a list of column names with null values
             nonimpute_cols: a list of column names without null values
+            from_groups: whether to build the imputed table directly from the
+                group tables, skipping the intermediate aggregation table
+            stats_table: a column statistics table populated by
+                get_column_stats_inserts(), to read per-date column means from
+                instead of computing them with window functions
+            shard: the index of the shard (see get_shards()) to create. Columns
+                from other shards are ignored.
 
         Returns: a CREATE TABLE AS query
         """
+        impute_cols, nonimpute_cols = self._get_shard_imputation_columns(
+            impute_cols, nonimpute_cols, shard
+        )
+        stats_join, mean_sqls = self._get_column_stats_means_join(
+            stats_table,
+            self._get_mean_imputed_cols(impute_cols) if stats_table else [],
+        )
 
         # key columns and date column
         query = "SELECT %s, %s" % (
@@ -332,15 +571,23 @@ class SpacetimeAggregation(Aggregation):
 
         # columns with imputation filling as needed
         query += self._get_impute_select(
-            impute_cols, nonimpute_cols, partitionby=self.output_date_column
+            impute_cols,
+            nonimpute_cols,
+            partitionby=self.output_date_column,
+            mean_sqls=mean_sqls,
+            columns=self._get_shard_columns(shard),
         )
 
         # imputation starts from the state table and left joins into the aggregation table
         query += "\nFROM %s t1" % self._state_table_sub()
         query += "\nLEFT JOIN %s t2 USING(%s, %s)" % (
-            self.get_table_name(),
+            self._get_preimputation_source(from_groups, shard),
             self.state_group,
             self.output_date_column,
         )
+        query += stats_join
 
-        return "CREATE TABLE %s AS (%s)" % (self.get_table_name(imputed=True), query)
+        return "CREATE TABLE %s AS (%s)" % (
+            self.get_table_name(imputed=True, shard=shard),
+            query,
+        )
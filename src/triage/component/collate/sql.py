@@ -1,3 +1,5 @@
+import hashlib
+
 import sqlalchemy.sql.expression as ex
 from sqlalchemy.ext.compiler import compiles
 
@@ -33,3 +35,72 @@ def _insert_from_select(element, compiler, **kw):
 
 def to_sql_name(name):
     return name.replace('"', "")
+
+
+class Command(object):
+    """A step of a table task that is run with a connection, rather than being
+    a single SQL statement to execute on it"""
+
+    def execute(self, conn):
+        raise NotImplementedError
+
+
+class PreparedStatement(object):
+    """A server-side prepared statement, named after its SQL so that sessions
+    can share and reuse it
+
+    Args:
+        sql: the statement, with parameters as $1, $2, ...
+        parameter_types: a list of SQL types of the parameters
+    """
+
+    def __init__(self, sql, parameter_types):
+        self.sql = sql
+        self.parameter_types = parameter_types
+        signature = "%s %s" % (parameter_types, sql)
+        self.name = "collate_" + hashlib.md5(signature.encode("utf-8")).hexdigest()
+
+    def get_prepare(self):
+        return "PREPARE %s (%s) AS %s" % (
+            self.name,
+            ", ".join(self.parameter_types),
+            self.sql,
+        )
+
+
+class ExecutePrepared(Command):
+    """Executes a prepared statement with the given parameters, first preparing
+    it if the session has not yet done so
+
+    Args:
+        statement: the PreparedStatement
+        parameters: a list of parameter values, passed as SQL string literals
+    """
+
+    def __init__(self, statement, parameters):
+        self.statement = statement
+        self.parameters = parameters
+
+    def __str__(self):
+        return "%s\n-- %s" % (self.get_execute(), self.statement.sql)
+
+    def get_execute(self):
+        return "EXECUTE %s(%s)" % (
+            self.statement.name,
+            ", ".join(
+                "'%s'" % str(parameter).replace("'", "''")
+                for parameter in self.parameters
+            ),
+        )
+
+    def execute(self, conn):
+        prepared = conn.execute(
+            ex.text("SELECT 1 FROM pg_prepared_statements WHERE name = :name"),
+            name=self.statement.name,
+        ).first()
+        # the statements are plain SQL, passed to the driver without parameters
+        # so that any % in them (as in LIKE 'A%' or a modulo) is left as is
+        raw_conn = conn.execution_options(no_parameters=True)
+        if not prepared:
+            raw_conn.execute(self.statement.get_prepare())
+        raw_conn.execute(self.get_execute())
@@ -2,6 +2,8 @@ from sqlalchemy import create_engine
 from sqlalchemy.pool import NullPool
 import pandas as pd
 
+from triage.util.binary_copy import read_sql
+
 
 def get_engine(dbname, user, host, port, password):
     """
@@ -39,7 +41,7 @@ def get_prediction_score(conn, model_id, as_of_date):
     WHERE model_id IN %(model_id)s AND as_of_date = %(as_of_date)s
     """
 
-    df_score_label = pd.read_sql(
+    df_score_label = read_sql(
         query_score_label,
         con=conn,
         params={'model_id': model_id,
@@ -14,6 +14,9 @@ import logging
 from scipy import stats
 from sqlalchemy import create_engine
 
+from triage.util.binary_copy import read_sql
+from triage.util.db import read_engine
+
 #from postmodel.utils import get_engine
 #from postmodel.bias.bias import get_predictions_query, thresholds
 
@@ -320,12 +323,12 @@ def populate_crosstabs_table(model_id, as_of_date,
                    features_query=fquery)
     
         # grab the data
-        df = pd.read_sql(query, engine) 
+        df = read_sql(query, read_engine(engine))
 
     # otherwise, the features must be presented as a dataframe
     elif get_features_df:
         query = get_predictions_query(model_id, as_of_date, entity_id_list)
-        predictions_df = pd.read_sql(query, engine).set_index(['model_id','as_of_date','entity_id'])
+        predictions_df = read_sql(query, read_engine(engine)).set_index(['model_id','as_of_date','entity_id'])
 
         df = predictions_df.join(get_features_df(model_id, as_of_date, 
                                                   entity_id_list),
@@ -8,37 +8,49 @@ from sqlalchemy.engine.url import URL
 
 from .schema import (
     Base,
+    CachedRows,
+    CategoricalChoices,
     Experiment,
     FeatureImportance,
     IndividualImportance,
     ListPrediction,
     ExperimentMatrix,
     Matrix,
+    MatrixColumnStatistics,
+    MatrixLabelBaseRate,
     ExperimentModel,
     Model,
     ModelGroup,
+    SourceWatermark,
     TestEvaluation,
     TrainEvaluation,
     TestPrediction,
     TrainPrediction,
+    ValidatedConfigSection,
 )
 
 
 __all__ = (
     "Base",
+    "CachedRows",
+    "CategoricalChoices",
     "Experiment",
     "FeatureImportance",
     "IndividualImportance",
     "ListPrediction",
     "ExperimentMatrix",
     "Matrix",
+    "MatrixColumnStatistics",
+    "MatrixLabelBaseRate",
     "ExperimentModel",
     "Model",
     "ModelGroup",
+    "SourceWatermark",
     "TestEvaluation",
     "TrainEvaluation",
     "TestPrediction",
     "TrainPrediction",
+    "ValidatedConfigSection",
     "mark_db_as_upgraded",
     "upgrade_db",
 )
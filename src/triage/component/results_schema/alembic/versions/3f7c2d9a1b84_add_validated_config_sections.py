@@ -0,0 +1,29 @@
+"""Add validated config sections
+
+Revision ID: 3f7c2d9a1b84
+Revises: 5d3c6e0b9f21
+Create Date: 2026-10-18 09:14:03.518220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3f7c2d9a1b84'
+down_revision = '5d3c6e0b9f21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('validated_config_sections',
+    sa.Column('section_hash', sa.String(), nullable=False),
+    sa.Column('section', sa.String(), nullable=True),
+    sa.Column('validation_time', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('section_hash'),
+    schema='model_metadata'
+    )
+
+
+def downgrade():
+    op.drop_table('validated_config_sections', schema='model_metadata')
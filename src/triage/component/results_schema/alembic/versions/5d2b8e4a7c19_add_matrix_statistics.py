@@ -0,0 +1,45 @@
+"""Add matrix column statistics and label base rates
+
+Revision ID: 5d2b8e4a7c19
+Revises: 8a1e4f6c2b57
+Create Date: 2026-10-18 15:26:09.531842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5d2b8e4a7c19'
+down_revision = '8a1e4f6c2b57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('matrix_column_statistics',
+    sa.Column('matrix_uuid', sa.String(), nullable=False),
+    sa.Column('column_name', sa.String(), nullable=False),
+    sa.Column('null_count', sa.BigInteger(), nullable=True),
+    sa.Column('zero_count', sa.BigInteger(), nullable=True),
+    sa.Column('min_value', sa.Float(), nullable=True),
+    sa.Column('max_value', sa.Float(), nullable=True),
+    sa.Column('mean', sa.Float(), nullable=True),
+    sa.Column('std', sa.Float(), nullable=True),
+    sa.Column('distinct_count', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('matrix_uuid', 'column_name'),
+    schema='model_metadata'
+    )
+    op.create_table('matrix_label_base_rates',
+    sa.Column('matrix_uuid', sa.String(), nullable=False),
+    sa.Column('as_of_date', sa.DateTime(), nullable=False),
+    sa.Column('num_rows', sa.BigInteger(), nullable=True),
+    sa.Column('num_labeled', sa.BigInteger(), nullable=True),
+    sa.Column('base_rate', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('matrix_uuid', 'as_of_date'),
+    schema='model_metadata'
+    )
+
+
+def downgrade():
+    op.drop_table('matrix_label_base_rates', schema='model_metadata')
+    op.drop_table('matrix_column_statistics', schema='model_metadata')
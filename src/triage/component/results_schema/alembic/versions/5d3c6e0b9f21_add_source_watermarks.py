@@ -0,0 +1,30 @@
+"""Add source watermarks
+
+Revision ID: 5d3c6e0b9f21
+Revises: a98acf92fd48
+Create Date: 2026-10-18 23:52:41.204377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5d3c6e0b9f21'
+down_revision = 'a98acf92fd48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('source_watermarks',
+    sa.Column('table_name', sa.String(), nullable=False),
+    sa.Column('source_watermark', sa.String(), nullable=True),
+    sa.Column('source_query', sa.Text(), nullable=True),
+    sa.Column('recording_time', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('table_name'),
+    schema='model_metadata'
+    )
+
+
+def downgrade():
+    op.drop_table('source_watermarks', schema='model_metadata')
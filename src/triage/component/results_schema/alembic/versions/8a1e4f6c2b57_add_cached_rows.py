@@ -0,0 +1,36 @@
+"""Add cached rows catalog
+
+Revision ID: 8a1e4f6c2b57
+Revises: 3f7c2d9a1b84
+Create Date: 2026-10-18 11:02:47.184305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8a1e4f6c2b57'
+down_revision = '3f7c2d9a1b84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cached_rows',
+    sa.Column('query_hash', sa.String(), nullable=False),
+    sa.Column('as_of_date', sa.DateTime(), nullable=False),
+    sa.Column('label_timespan', sa.Interval(), nullable=False),
+    sa.Column('kind', sa.String(), nullable=True),
+    sa.Column('query', sa.Text(), nullable=True),
+    sa.Column('cache_table', sa.String(), nullable=True),
+    sa.Column('source_watermark', sa.String(), nullable=True),
+    sa.Column('source_table', sa.String(), nullable=True),
+    sa.Column('row_count', sa.Integer(), nullable=True),
+    sa.Column('creation_time', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('query_hash', 'as_of_date', 'label_timespan'),
+    schema='model_metadata'
+    )
+
+
+def downgrade():
+    op.drop_table('cached_rows', schema='model_metadata')
@@ -0,0 +1,32 @@
+"""Add categorical choices cache
+
+Revision ID: a98acf92fd48
+Revises: 38f37d013686
+Create Date: 2026-10-18 22:41:07.512094
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'a98acf92fd48'
+down_revision = '38f37d013686'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('categorical_choices',
+    sa.Column('choice_query_hash', sa.String(), nullable=False),
+    sa.Column('source_watermark', sa.String(), nullable=False),
+    sa.Column('choice_query', sa.Text(), nullable=True),
+    sa.Column('choices', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('creation_time', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('choice_query_hash', 'source_watermark'),
+    schema='model_metadata'
+    )
+
+
+def downgrade():
+    op.drop_table('categorical_choices', schema='model_metadata')
@@ -51,6 +51,56 @@ class Experiment(Base):
     config = Column(JSONB)
 
 
+class CategoricalChoices(Base):
+
+    __tablename__ = "categorical_choices"
+    __table_args__ = {"schema": "model_metadata"}
+
+    choice_query_hash = Column(String, primary_key=True)
+    source_watermark = Column(String, primary_key=True)
+    choice_query = Column(Text)
+    choices = Column(JSONB)
+    creation_time = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class SourceWatermark(Base):
+
+    __tablename__ = "source_watermarks"
+    __table_args__ = {"schema": "model_metadata"}
+
+    table_name = Column(String, primary_key=True)
+    source_watermark = Column(String)
+    source_query = Column(Text)
+    recording_time = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class CachedRows(Base):
+
+    __tablename__ = "cached_rows"
+    __table_args__ = {"schema": "model_metadata"}
+
+    query_hash = Column(String, primary_key=True)
+    as_of_date = Column(DateTime, primary_key=True)
+    label_timespan = Column(Interval, primary_key=True)
+    kind = Column(String)
+    query = Column(Text)
+    cache_table = Column(String)
+    source_watermark = Column(String)
+    source_table = Column(String)
+    row_count = Column(Integer)
+    creation_time = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ValidatedConfigSection(Base):
+
+    __tablename__ = "validated_config_sections"
+    __table_args__ = {"schema": "model_metadata"}
+
+    section_hash = Column(String, primary_key=True)
+    section = Column(String)
+    validation_time = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class ModelGroup(Base):
 
     __tablename__ = "model_groups"
@@ -114,6 +164,34 @@ class Matrix(Base):
     )
 
 
+class MatrixColumnStatistics(Base):
+
+    __tablename__ = "matrix_column_statistics"
+    __table_args__ = {"schema": "model_metadata"}
+
+    matrix_uuid = Column(String, primary_key=True)
+    column_name = Column(String, primary_key=True)
+    null_count = Column(BigInteger)
+    zero_count = Column(BigInteger)
+    min_value = Column(Float)
+    max_value = Column(Float)
+    mean = Column(Float)
+    std = Column(Float)
+    distinct_count = Column(Integer)  # null if more than were counted
+
+
+class MatrixLabelBaseRate(Base):
+
+    __tablename__ = "matrix_label_base_rates"
+    __table_args__ = {"schema": "model_metadata"}
+
+    matrix_uuid = Column(String, primary_key=True)
+    as_of_date = Column(DateTime, primary_key=True)
+    num_rows = Column(BigInteger)
+    num_labeled = Column(BigInteger)
+    base_rate = Column(Float)
+
+
 class Model(Base):
 
     __tablename__ = "models"
@@ -1,5 +1,29 @@
 """Functions to retrieve basic information about tables in a Postgres database"""
-from sqlalchemy import MetaData, Table
+import hashlib
+import json
+import re
+
+from sqlalchemy import MetaData, Table, text
+
+# plan nodes reading data whose changes can not be tracked through tables
+UNTRACKED_SCAN_TYPES = ("Function Scan", "Table Function Scan", "Foreign Scan")
+
+# identifiers that read the same unquoted, as Postgres folds them to lower case
+PLAIN_IDENTIFIER = re.compile(r"^[a-z_][a-z0-9_$]*$")
+
+
+def quote_identifier(identifier):
+    """Quote an identifier if it would otherwise be read differently, as
+    Postgres' quote_ident() does for the purpose of naming a table
+
+    Args:
+        identifier (string) A schema or table name, as stored in the catalog
+
+    Returns: (string) the identifier, quoted if necessary
+    """
+    if PLAIN_IDENTIFIER.match(identifier):
+        return identifier
+    return '"{}"'.format(identifier.replace('"', '""'))
 
 
 def split_table(table_name):
@@ -135,3 +159,86 @@ def schema_tables(schema_name, db_engine):
     meta = MetaData(schema=schema_name, bind=db_engine)
     meta.reflect()
     return meta.tables
+
+
+def query_source_tables(query, db_engine):
+    """Find the tables that a query reads from, using its query plan
+
+    Args:
+        query (string) A SELECT query
+        db_engine (sqlalchemy.engine)
+
+    Returns: (list) The sorted names (with schema, quoted where necessary) of
+        the tables scanned by the query, or None if the query also reads from
+        sources other than tables, such as functions, so its results can't be
+        tied to table contents
+    """
+    plan = db_engine.execute("EXPLAIN (VERBOSE, FORMAT JSON) {}".format(query)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    tables = set()
+    nodes = [entry["Plan"] for entry in plan]
+    while nodes:
+        node = nodes.pop()
+        if node["Node Type"] in UNTRACKED_SCAN_TYPES:
+            return None
+        if "Relation Name" in node:
+            tables.add(
+                "{}.{}".format(
+                    quote_identifier(node["Schema"]),
+                    quote_identifier(node["Relation Name"]),
+                )
+            )
+        nodes.extend(node.get("Plans", []))
+    return sorted(tables)
+
+
+def table_watermark(table_name, db_engine):
+    """Produce a value that changes whenever the table's contents do
+
+    Combines the table's storage file (changed by TRUNCATE and table rewrites)
+    with Postgres' cumulative counts of inserted, updated and deleted rows.
+    These counts are reported by the statistics collector, so a write is only
+    reflected shortly after its transaction ends.
+
+    Args:
+        table_name (string) A table name (with schema), quoted as in SQL where
+            necessary
+        db_engine (sqlalchemy.engine)
+
+    Returns: (string) The table's watermark
+    """
+    row = db_engine.execute(
+        text(
+            """select c.relfilenode, s.n_tup_ins, s.n_tup_upd, s.n_tup_del
+            from pg_class c
+            left join pg_stat_user_tables s on s.relid = c.oid
+            where c.oid = cast(:table_name as regclass)"""
+        ),
+        table_name=table_name,
+    ).first()
+    return ":".join(str(value) for value in row)
+
+
+def query_watermark(query, db_engine):
+    """Produce a value that changes whenever the contents of any table read by
+    the query do
+
+    Args:
+        query (string) A SELECT query
+        db_engine (sqlalchemy.engine)
+
+    Returns: (string) A hash of the watermarks of the query's source tables, or
+        None if the query's results can't be tied to tables
+        (see query_source_tables)
+    """
+    tables = query_source_tables(query, db_engine)
+    if tables is None:
+        return None
+    return hashlib.md5(
+        json.dumps(
+            {table: table_watermark(table, db_engine) for table in tables},
+            sort_keys=True,
+        ).encode("utf-8")
+    ).hexdigest()
@@ -1,5 +1,6 @@
 import logging
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 
 from descriptors import cachedproperty
 from timeout import timeout
@@ -17,7 +18,13 @@ from triage.component.architect.features import (
     FeatureGroupCreator,
     FeatureGroupMixer,
 )
+from triage.component.architect.entity_shards import EntityShards
+from triage.component.architect.matrix_statistics import (
+    label_base_rates,
+    label_value_count,
+)
 from triage.component.architect.planner import Planner
+from triage.component.architect.feature_pruning import FeaturePruner
 from triage.component.architect.builders import MatrixBuilder
 from triage.component.architect.state_table_generators import (
     StateTableGeneratorFromDense,
@@ -69,9 +76,29 @@ class ExperimentBase(ABC):
         project_path (string)
         replace (bool)
         cleanup_timeout (int)
+        feature_backend (string) where to evaluate feature aggregations,
+            'postgres' or 'duckdb' (see FeatureGenerator)
+        shard_db_engines (list, optional) databases to partition entities
+            across (see EntityShards). The cohort, labels and features are then
+            built in each of them, while db_engine keeps the results schema
+            and runs the categorical choice queries
+        matrix_extraction (string) how matrices are extracted from the
+            database, 'tables', 'wide' or 'blocks' (see MatrixBuilder)
+        matrix_views (bool) whether matrices differing only in their feature
+            groups or max_training_history are built as views of one matrix
+            (see Planner)
+        matrix_extraction_connections (int) how many feature tables of each
+            matrix are extracted concurrently, each on its own connection, so
+            each matrix build uses up to this many database connections
+        prune_features (bool) whether the features of each train matrix that
+            are NULL or constant in its rows, or duplicate another feature of
+            their table, are left out of it and its test matrices (see
+            FeaturePruner)
     """
 
     cleanup_timeout = 60  # seconds
+    # how many concurrent database connections subclasses may use for queries
+    n_db_processes = 1
 
     def __init__(
         self,
@@ -82,6 +109,12 @@ class ExperimentBase(ABC):
         replace=True,
         cleanup=False,
         cleanup_timeout=None,
+        feature_backend="postgres",
+        shard_db_engines=None,
+        matrix_extraction="tables",
+        matrix_views=False,
+        matrix_extraction_connections=1,
+        prune_features=False,
     ):
         self._check_config_version(config)
         self.config = config
@@ -102,6 +135,13 @@ class ExperimentBase(ABC):
         )
         self.project_path = project_path
         self.replace = replace
+        self.feature_backend = feature_backend
+        self.matrix_views = matrix_views
+        self.matrix_extraction_connections = matrix_extraction_connections
+        self.prune_features = prune_features
+        self.entity_shards = (
+            EntityShards(shard_db_engines) if shard_db_engines else None
+        )
         upgrade_db(db_engine=self.db_engine)
 
         self.features_schema_name = "features"
@@ -145,55 +185,47 @@ class ExperimentBase(ABC):
 
         self.chopper = Timechop(**split_config)
 
-        cohort_config = self.config.get("cohort_config", {})
-        if "query" in cohort_config:
-            self.state_table_generator = StateTableGeneratorFromQuery(
-                experiment_hash=self.experiment_hash,
-                db_engine=self.db_engine,
-                query=cohort_config["query"],
-            )
-        elif "entities_table" in cohort_config:
-            self.state_table_generator = StateTableGeneratorFromEntities(
-                experiment_hash=self.experiment_hash,
-                db_engine=self.db_engine,
-                entities_table=cohort_config["entities_table"],
-            )
-        elif "dense_states" in cohort_config:
-            self.state_table_generator = StateTableGeneratorFromDense(
-                experiment_hash=self.experiment_hash,
-                db_engine=self.db_engine,
-                dense_state_table=cohort_config["dense_states"]["table_name"],
-            )
-        else:
+        if not any(
+            key in self.config.get("cohort_config", {})
+            for key in ("query", "entities_table", "dense_states")
+        ):
             logging.warning(
                 "cohort_config missing or unrecognized. Without a cohort, "
                 "you will not be able to make matrices or perform feature imputation."
             )
-            self.state_table_generator = StateTableGeneratorNoOp()
-
-        if "label_config" in self.config:
-            self.label_generator = LabelGenerator(
-                label_name=self.config["label_config"].get("name", None),
-                query=self.config["label_config"]["query"],
-                replace=self.replace,
-                db_engine=self.db_engine,
-            )
-        else:
-            self.label_generator = LabelGeneratorNoOp()
+        if "label_config" not in self.config:
             logging.warning(
                 "label_config missing or unrecognized. Without labels, "
                 "you will not be able to make matrices."
             )
+        self.state_table_generator = self._state_table_generator(self.db_engine)
+        self.label_generator = self._label_generator(self.db_engine)
+        self.feature_generator = self._feature_generator(self.db_engine)
+
+        # in an entity-sharded experiment, the cohort, labels and features are
+        # built in every shard database instead, by queries restricted to the
+        # shard's entities
+        if self.entity_shards is not None:
+            shard_filters = [
+                (db_engine, self.entity_shards.predicate(shard))
+                for shard, db_engine in enumerate(self.entity_shards.db_engines)
+            ]
+            self.shard_state_table_generators = [
+                self._state_table_generator(db_engine, entity_filter)
+                for db_engine, entity_filter in shard_filters
+            ]
+            self.shard_label_generators = [
+                self._label_generator(db_engine, entity_filter)
+                for db_engine, entity_filter in shard_filters
+            ]
+            self.shard_feature_generators = [
+                self._feature_generator(db_engine, entity_filter)
+                for db_engine, entity_filter in shard_filters
+            ]
 
         self.feature_dictionary_creator = FeatureDictionaryCreator(
-            features_schema_name=self.features_schema_name, db_engine=self.db_engine
-        )
-
-        self.feature_generator = FeatureGenerator(
             features_schema_name=self.features_schema_name,
-            replace=self.replace,
-            db_engine=self.db_engine,
-            feature_start_time=split_config["feature_start_time"],
+            db_engine=self.feature_db_engines[0],
         )
 
         self.feature_group_creator = FeatureGroupCreator(
@@ -215,6 +247,15 @@ class ExperimentBase(ABC):
             .get("dense_states", {})
             .get("state_filters", []),
             user_metadata=self.config.get("user_metadata", {}),
+            matrix_views=self.matrix_views,
+            feature_pruner=FeaturePruner(
+                db_engines=self.entity_shards.db_engines
+                if self.entity_shards is not None
+                else [self.db_engine],
+                features_schema_name=self.features_schema_name,
+            )
+            if self.prune_features
+            else None,
         )
 
         self.matrix_builder = MatrixBuilder(
@@ -234,6 +275,9 @@ class ExperimentBase(ABC):
             ),
             engine=self.db_engine,
             replace=self.replace,
+            entity_shards=self.entity_shards,
+            extraction=matrix_extraction,
+            extraction_connections=self.matrix_extraction_connections,
         )
 
         self.trainer = ModelTrainer(
@@ -253,6 +297,72 @@ class ExperimentBase(ABC):
             evaluator_config=self.config.get("scoring", {}),
         )
 
+    def _state_table_generator(self, db_engine, entity_filter=None):
+        cohort_config = self.config.get("cohort_config", {})
+        if "query" in cohort_config:
+            return StateTableGeneratorFromQuery(
+                experiment_hash=self.experiment_hash,
+                db_engine=db_engine,
+                replace=self.replace,
+                query=cohort_config["query"],
+                n_workers=self.n_db_processes,
+                entity_filter=entity_filter,
+            )
+        elif "entities_table" in cohort_config:
+            return StateTableGeneratorFromEntities(
+                experiment_hash=self.experiment_hash,
+                db_engine=db_engine,
+                replace=self.replace,
+                entities_table=cohort_config["entities_table"],
+                entity_filter=entity_filter,
+            )
+        elif "dense_states" in cohort_config:
+            return StateTableGeneratorFromDense(
+                experiment_hash=self.experiment_hash,
+                db_engine=db_engine,
+                replace=self.replace,
+                dense_state_table=cohort_config["dense_states"]["table_name"],
+                entity_filter=entity_filter,
+            )
+        return StateTableGeneratorNoOp()
+
+    def _label_generator(self, db_engine, entity_filter=None):
+        if "label_config" in self.config:
+            return LabelGenerator(
+                label_name=self.config["label_config"].get("name", None),
+                query=self.config["label_config"]["query"],
+                replace=self.replace,
+                set_based=self.config["label_config"].get("set_based", True),
+                db_engine=db_engine,
+                entity_filter=entity_filter,
+            )
+        return LabelGeneratorNoOp()
+
+    def _feature_generator(self, db_engine, entity_filter=None):
+        return FeatureGenerator(
+            features_schema_name=self.features_schema_name,
+            replace=self.replace,
+            db_engine=db_engine,
+            feature_start_time=self.config["temporal_config"]["feature_start_time"],
+            backend=self.feature_backend,
+            entity_filter=entity_filter,
+        )
+
+    @property
+    def feature_db_engines(self):
+        """The databases holding the cohort, labels and features: the shard
+        databases if entities are sharded, otherwise the experiment's database
+        """
+        if self.entity_shards is not None:
+            return self.entity_shards.db_engines
+        return [self.db_engine]
+
+    def _tables_have_data(self, table_name):
+        return any(
+            table_has_data(table_name, db_engine)
+            for db_engine in self.feature_db_engines
+        )
+
     @property
     def sparse_states_table_name(self):
         return "tmp_sparse_states_{}".format(self.experiment_hash)
@@ -387,6 +497,25 @@ class ExperimentBase(ABC):
             self.collate_aggregations, task_type="aggregation"
         )
 
+    @cachedproperty
+    def feature_statistics_table_tasks(self):
+        """All feature column statistics query tasks specified by this
+        ``Experiment``.
+
+        Returns: (dict) keys are aggregation table names, values are
+            themselves dicts, each with keys for different stages of
+            computation (prepare, inserts, finalize) and with values
+            being lists of SQL commands
+
+        """
+        logging.info(
+            "Calculating feature statistics tasks for %s as_of_times",
+            len(self.all_as_of_times),
+        )
+        return self.feature_generator.generate_all_table_tasks(
+            self.collate_aggregations, task_type="statistics"
+        )
+
     @cachedproperty
     def feature_imputation_table_tasks(self):
         """All feature imputation query tasks specified by this
@@ -414,8 +543,17 @@ class ExperimentBase(ABC):
         values being lists of feature names
 
         """
+        if self.entity_shards is not None:
+            # the imputed tables are in the shard databases
+            feature_table_names = [
+                self.feature_generator._clean_table_name(table_name)
+                for aggregation in self.collate_aggregations
+                for table_name in aggregation.get_table_names(imputed=True)
+            ]
+        else:
+            feature_table_names = self.feature_imputation_table_tasks.keys()
         result = self.feature_dictionary_creator.feature_dictionary(
-            feature_table_names=self.feature_imputation_table_tasks.keys(),
+            feature_table_names=feature_table_names,
             index_column_lookup=self.feature_generator.index_column_lookup(
                 self.collate_aggregations
             ),
@@ -448,10 +586,10 @@ class ExperimentBase(ABC):
         Returns: (list) of dicts
 
         """
-        if not table_has_data(self.sparse_states_table_name, self.db_engine):
+        if not self._tables_have_data(self.sparse_states_table_name):
             logging.warning("cohort table is not populated, cannot build any matrices")
             return {}
-        if not table_has_data(self.labels_table_name, self.db_engine):
+        if not self._tables_have_data(self.labels_table_name):
             logging.warning("labels table is not populated, cannot build any matrices")
             return {}
         (updated_split_definitions, matrix_build_tasks) = self.planner.generate_plans(
@@ -492,11 +630,29 @@ class ExperimentBase(ABC):
 
         Results are stored in the database, not returned
         """
+        if self.entity_shards is not None:
+            self.entity_shards.run(
+                lambda shard, db_engine: self.shard_label_generators[
+                    shard
+                ].generate_all_labels(
+                    self.labels_table_name,
+                    self.all_as_of_times,
+                    self.all_label_timespans,
+                )
+            )
+            return
         self.label_generator.generate_all_labels(
             self.labels_table_name, self.all_as_of_times, self.all_label_timespans
         )
 
     def generate_cohort(self):
+        if self.entity_shards is not None:
+            self.entity_shards.run(
+                lambda shard, db_engine: self.shard_state_table_generators[
+                    shard
+                ].generate_sparse_table(as_of_dates=self.all_as_of_times)
+            )
+            return
         self.state_table_generator.generate_sparse_table(
             as_of_dates=self.all_as_of_times
         )
@@ -515,26 +671,90 @@ class ExperimentBase(ABC):
         pass
 
     @abstractmethod
-    def process_query_tasks(self, query_tasks):
+    def process_query_tasks(self, query_tasks, feature_generator=None):
         pass
 
     @abstractmethod
     def process_matrix_build_tasks(self, matrix_build_tasks):
         pass
 
+    def process_sharded_feature_tasks(self, task_type):
+        """Generate and run feature table tasks in every shard database
+        concurrently, each shard's tasks run like those of an unsharded
+        experiment (see process_query_tasks())
+
+        Args:
+            task_type (string) one of 'aggregation', 'statistics' or 'imputation'
+
+        Returns: (list) the table tasks run in each shard
+        """
+
+        # read once here, as the shard threads would race to fill the cache
+        collate_aggregations = self.collate_aggregations
+
+        def process(shard, db_engine):
+            feature_generator = self.shard_feature_generators[shard]
+            table_tasks = feature_generator.generate_all_table_tasks(
+                collate_aggregations, task_type=task_type
+            )
+            self.process_query_tasks(table_tasks, feature_generator=feature_generator)
+            return table_tasks
+
+        return self.entity_shards.run(process)
+
     def generate_preimputation_features(self):
-        self.process_query_tasks(self.feature_aggregation_table_tasks)
+        if self.entity_shards is not None:
+            self.process_sharded_feature_tasks("aggregation")
+        else:
+            self.process_query_tasks(self.feature_aggregation_table_tasks)
         logging.info(
             "Finished running preimputation feature queries. The final results are in tables: %s",
             ",".join(agg.get_table_name() for agg in self.collate_aggregations),
         )
 
+    def compute_feature_statistics(self):
+        if self.entity_shards is not None:
+            self._compute_sharded_feature_statistics()
+        else:
+            self.process_query_tasks(self.feature_statistics_table_tasks)
+        logging.info(
+            "Finished computing feature column statistics. The results are in table: %s",
+            self.feature_generator.column_stats_table,
+        )
+
+    def _compute_sharded_feature_statistics(self):
+        """Compute column statistics in every shard, and merge them so the
+        features are imputed the same way everywhere"""
+        shard_table_tasks = self.process_sharded_feature_tasks("statistics")
+        merged = []
+        for aggregation in self.collate_aggregations:
+            table_name = self.feature_generator._clean_table_name(
+                aggregation.get_table_name()
+            )
+            computed = [table_name in table_tasks for table_tasks in shard_table_tasks]
+            if all(computed):
+                merged.append(aggregation.get_column_stats_name())
+            elif any(computed):
+                raise ValueError(
+                    "Column statistics of {} were computed in some shards but "
+                    "not others, so the shards' features are out of step. Run "
+                    "the experiment with replace to rebuild them".format(table_name)
+                )
+        self.entity_shards.merge_column_stats(
+            self.feature_generator.column_stats_table, merged
+        )
+
     def impute_missing_features(self):
-        self.process_query_tasks(self.feature_imputation_table_tasks)
+        if self.entity_shards is not None:
+            self.process_sharded_feature_tasks("imputation")
+        else:
+            self.process_query_tasks(self.feature_imputation_table_tasks)
         logging.info(
             "Finished running postimputation feature queries. The final results are in tables: %s",
             ",".join(
-                agg.get_table_name(imputed=True) for agg in self.collate_aggregations
+                table_name
+                for agg in self.collate_aggregations
+                for table_name in agg.get_table_names(imputed=True)
             ),
         )
 
@@ -544,7 +764,17 @@ class ExperimentBase(ABC):
             self.matrix_build_tasks.keys(),
             self.db_engine
         )
-        self.process_matrix_build_tasks(self.matrix_build_tasks)
+        # views are saved once the matrices they read from are built
+        source_tasks = OrderedDict()
+        view_tasks = OrderedDict()
+        for matrix_uuid, build_task in self.matrix_build_tasks.items():
+            if "source_matrix_uuid" in build_task["matrix_metadata"]:
+                view_tasks[matrix_uuid] = build_task
+            else:
+                source_tasks[matrix_uuid] = build_task
+        self.process_matrix_build_tasks(source_tasks)
+        if view_tasks:
+            self.process_matrix_build_tasks(view_tasks)
 
     def generate_matrices(self):
         logging.info("Creating cohort")
@@ -553,6 +783,8 @@ class ExperimentBase(ABC):
         self.generate_labels()
         logging.info("Creating feature aggregation tables")
         self.generate_preimputation_features()
+        logging.info("Computing feature column statistics")
+        self.compute_feature_statistics()
         logging.info("Creating feature imputation tables")
         self.impute_missing_features()
         logging.info("Building all matrices")
@@ -568,7 +800,17 @@ class ExperimentBase(ABC):
         for split_num, split in enumerate(self.full_matrix_definitions):
             self.log_split(split_num, split)
             train_store = self.matrix_storage_engine.get_store(split["train_uuid"])
-            if train_store.empty:
+            # the label base rates recorded when the matrix was built tell
+            # whether it is worth training on without loading it, unless it
+            # was built before they were recorded
+            base_rates = label_base_rates(self.db_engine, split["train_uuid"])
+            if len(base_rates):
+                empty = not base_rates["num_rows"].sum()
+                n_label_values = label_value_count(base_rates)
+            else:
+                empty = train_store.empty
+                n_label_values = None if empty else len(train_store.labels().unique())
+            if empty:
                 logging.warning(
                     """Train matrix for split %s was empty,
                 no point in training this model. Skipping
@@ -576,7 +818,7 @@ class ExperimentBase(ABC):
                     split["train_uuid"],
                 )
                 continue
-            if len(train_store.labels().unique()) == 1:
+            if n_label_values == 1:
                 logging.warning(
                     """Train Matrix for split %s had only one
                 unique value, no point in training this model. Skipping
@@ -615,8 +857,10 @@ class ExperimentBase(ABC):
 
             self.process_model_test_tasks(test_tasks)
 
-    def validate(self, strict=True):
-        ExperimentValidator(self.db_engine, strict=strict).run(self.config)
+    def validate(self, strict=True, cache=True):
+        ExperimentValidator(self.db_engine, strict=strict, cache=cache).run(
+            self.config
+        )
 
     def _run(self):
         try:
@@ -631,6 +875,11 @@ class ExperimentBase(ABC):
         self._log_end_of_run_report()
 
     def _log_end_of_run_report(self):
+        logging.info(
+            "Categorical choice cache: %s hits, %s misses",
+            self.feature_generator.choice_cache.hits,
+            self.feature_generator.choice_cache.misses,
+        )
         missing_models = missing_model_hashes(self.experiment_hash, self.db_engine)
         if len(missing_models) > 0:
             logging.info("Found %s missing model hashes."
@@ -658,8 +907,15 @@ class ExperimentBase(ABC):
     def clean_up_tables(self):
         logging.info("Cleaning up state and labels tables")
         with timeout(self.cleanup_timeout):
-            self.state_table_generator.clean_up()
-            self.label_generator.clean_up(self.labels_table_name)
+            if self.entity_shards is not None:
+                for state_table_generator, label_generator in zip(
+                    self.shard_state_table_generators, self.shard_label_generators
+                ):
+                    state_table_generator.clean_up()
+                    label_generator.clean_up(self.labels_table_name)
+            else:
+                self.state_table_generator.clean_up()
+                self.label_generator.clean_up(self.labels_table_name)
 
     def run(self):
         try:
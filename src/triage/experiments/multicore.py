@@ -10,7 +10,6 @@ from triage.experiments import ExperimentBase
 
 class MultiCoreExperiment(ExperimentBase):
     def __init__(self, n_processes=1, n_db_processes=1, *args, **kwargs):
-        super(MultiCoreExperiment, self).__init__(*args, **kwargs)
         if n_processes < 1:
             raise ValueError("n_processes must be 1 or greater")
         if n_db_processes < 1:
@@ -22,7 +21,9 @@ class MultiCoreExperiment(ExperimentBase):
                 "consider using the SingleThreadedExperiment class instead"
             )
         self.n_processes = n_processes
+        # set before the components using them are created
         self.n_db_processes = n_db_processes
+        super(MultiCoreExperiment, self).__init__(*args, **kwargs)
 
     def generated_chunked_parallelized_results(
         self, partially_bound_function, tasks, n_processes, chunksize=1
@@ -66,20 +67,21 @@ class MultiCoreExperiment(ExperimentBase):
         parallelize(partial_test, test_tasks, self.n_db_processes)
         logging.info("Cleaned up concurrent pool")
 
-    def process_query_tasks(self, query_tasks):
+    def process_query_tasks(self, query_tasks, feature_generator=None):
+        feature_generator = feature_generator or self.feature_generator
         logging.info("Processing query tasks with %s processes", self.n_db_processes)
         for table_name, tasks in query_tasks.items():
             logging.info("Processing features for %s", table_name)
-            self.feature_generator.run_commands(tasks.get("prepare", []))
+            feature_generator.run_commands(tasks.get("prepare", []))
             partial_insert = partial(
-                insert_into_table, feature_generator=self.feature_generator
+                insert_into_table, feature_generator=feature_generator
             )
 
             insert_batches = [
                 list(task_batch) for task_batch in Batch(tasks.get("inserts", []), 25)
             ]
             parallelize(partial_insert, insert_batches, n_processes=self.n_db_processes)
-            self.feature_generator.run_commands(tasks.get("finalize", []))
+            feature_generator.run_commands(tasks.get("finalize", []))
             logging.info("%s completed", table_name)
 
     def process_matrix_build_tasks(self, matrix_build_tasks):
@@ -88,12 +90,10 @@ class MultiCoreExperiment(ExperimentBase):
         )
         logging.info(
             "Starting parallel matrix building: %s matrices, %s processes",
-            len(self.matrix_build_tasks.keys()),
+            len(matrix_build_tasks.keys()),
             self.n_processes,
         )
-        parallelize(
-            partial_build_matrix, self.matrix_build_tasks.values(), self.n_processes
-        )
+        parallelize(partial_build_matrix, matrix_build_tasks.values(), self.n_processes)
 
 
 def insert_into_table(insert_statements, feature_generator):
@@ -39,6 +39,10 @@ class RQExperiment(ExperimentBase):
         self, redis_connection, sleep_time=5, queue_kwargs=None, *args, **kwargs
     ):
         super().__init__(*args, **kwargs)
+        if self.feature_backend == "duckdb":
+            # the from_obj is exported to the experiment's machine, where the
+            # workers running the inserts may not be able to read it
+            raise ValueError("The duckdb feature backend can not be used with RQ")
         self.redis_connection = redis_connection
         if queue_kwargs is None:
             queue_kwargs = {}
@@ -74,7 +78,7 @@ class RQExperiment(ExperimentBase):
                 logging.info("Sleeping for %s seconds", self.sleep_time)
                 time.sleep(self.sleep_time)
 
-    def process_query_tasks(self, query_tasks):
+    def process_query_tasks(self, query_tasks, feature_generator=None):
         """Run queries by table
 
         Will run preparation (e.g. create table) and finalize (e.g. create index) tasks
@@ -97,17 +101,21 @@ class RQExperiment(ExperimentBase):
                     'finalize': ['create index on table_one (col1)']
                 }
             }
+            feature_generator (FeatureGenerator, optional) - the feature generator
+                of the database the queries run in (such as a shard's), if not the
+                experiment's
         """
+        feature_generator = feature_generator or self.feature_generator
         for table_name, tasks in query_tasks.items():
             logging.info("Processing features for %s", table_name)
-            self.feature_generator.run_commands(tasks.get("prepare", []))
+            feature_generator.run_commands(tasks.get("prepare", []))
 
             insert_batches = [
                 list(task_batch) for task_batch in Batch(tasks.get("inserts", []), 25)
             ]
             jobs = [
                 self.queue.enqueue(
-                    self.feature_generator.run_commands,
+                    feature_generator.run_commands,
                     insert_batch,
                     timeout=DEFAULT_TIMEOUT,
                     result_ttl=DEFAULT_TIMEOUT,
@@ -117,7 +125,7 @@ class RQExperiment(ExperimentBase):
             ]
             self.wait_for(jobs)
 
-            self.feature_generator.run_commands(tasks.get("finalize", []))
+            feature_generator.run_commands(tasks.get("finalize", []))
             logging.info("%s completed", table_name)
 
     def process_matrix_build_tasks(self, matrix_build_tasks):
@@ -2,8 +2,9 @@ from triage.experiments import ExperimentBase
 
 
 class SingleThreadedExperiment(ExperimentBase):
-    def process_query_tasks(self, query_tasks):
-        self.feature_generator.process_table_tasks(query_tasks)
+    def process_query_tasks(self, query_tasks, feature_generator=None):
+        feature_generator = feature_generator or self.feature_generator
+        feature_generator.process_table_tasks(query_tasks)
 
     def process_matrix_build_tasks(self, matrix_build_tasks):
         self.matrix_builder.build_all_matrices(matrix_build_tasks)
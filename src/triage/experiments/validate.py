@@ -1,14 +1,21 @@
+import hashlib
 import importlib
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from textwrap import dedent
 
 from sklearn.model_selection import ParameterGrid
+from sqlalchemy import text
 
+from triage import __version__
 from triage.component import architect
 from triage.component import catwalk
 from triage.component.timechop import Timechop
 
+from triage.database_reflection import table_exists
 from triage.util.conf import convert_str_to_relativedelta
 from triage.validation_primitives import (
     table_should_have_data,
@@ -18,12 +25,39 @@ from triage.validation_primitives import (
 )
 
 
+VALIDATION_CACHE_TABLE = "model_metadata.validated_config_sections"
+
+
+def run_concurrently(calls, n_threads):
+    """Run independent calls on a pool of threads
+
+    Args:
+        calls (list) Callables taking no arguments
+        n_threads (int) The most calls to run at once
+
+    Returns: (list) The results of the calls, in order
+
+    Raises: the exception of the first call, in order, that raised one
+    """
+    if n_threads <= 1 or len(calls) <= 1:
+        return [call() for call in calls]
+    with ThreadPoolExecutor(max_workers=min(n_threads, len(calls))) as executor:
+        futures = [executor.submit(call) for call in calls]
+        return [future.result() for future in futures]
+
+
 class Validator(object):
-    def __init__(self, db_engine=None, strict=True):
+    def __init__(self, db_engine=None, strict=True, n_db_threads=1):
         self.db_engine = db_engine
         self.strict = strict
+        self.n_db_threads = n_db_threads
 
     def run(self, *args, **kwargs):
+        """Validate a config section
+
+        Returns: (boolean) Whether the section is valid. Only returns False when
+            not running in strict mode, as the error is raised otherwise
+        """
         try:
             self._run(*args, **kwargs)
         except ValueError as e:
@@ -34,6 +68,12 @@ class Validator(object):
                     "Validation error hit, not running in strict mode so continuing on: %s",
                     str(e),
                 )
+                return False
+        return True
+
+    def _run_probes(self, probes):
+        """Run independent database checks concurrently"""
+        run_concurrently(probes, self.n_db_threads)
 
 
 class TemporalValidator(Validator):
@@ -169,7 +209,6 @@ class FeatureAggregationsValidator(Validator):
             )
 
     def _validate_categoricals(self, categoricals):
-        conn = self.db_engine.connect()
         for categorical in categoricals:
             if "choice_query" in categorical and "choices" in categorical:
                 raise ValueError(
@@ -193,29 +232,30 @@ class FeatureAggregationsValidator(Validator):
                         )
                     )
                 )
-            if "choice_query" in categorical:
-                logging.info("Validating choice query")
-                choice_query = categorical["choice_query"]
-                try:
-                    conn.execute("explain {}".format(choice_query))
-                except Exception as e:
-                    raise ValueError(
-                        dedent(
-                            """
-                    Section: feature_aggregations -
-                    choice query does not run.
-                    choice query: "{}"
-                    Full error: {}""".format(
-                                choice_query, e
-                            )
-                        )
+
+    def _validate_choice_query(self, choice_query):
+        logging.info("Validating choice query")
+        try:
+            with self.db_engine.connect() as conn:
+                conn.execute("explain {}".format(choice_query))
+        except Exception as e:
+            raise ValueError(
+                dedent(
+                    """
+                Section: feature_aggregations -
+                choice query does not run.
+                choice query: "{}"
+                Full error: {}""".format(
+                        choice_query, e
                     )
+                )
+            )
 
     def _validate_from_obj(self, from_obj):
-        conn = self.db_engine.connect()
         logging.info("Validating from_obj")
         try:
-            conn.execute("explain select * from {}".format(from_obj))
+            with self.db_engine.connect() as conn:
+                conn.execute("explain select * from {}".format(from_obj))
         except Exception as e:
             raise ValueError(
                 dedent(
@@ -346,14 +386,25 @@ class FeatureAggregationsValidator(Validator):
                     self._validate_imputation_rule(agg_type, impute_rule)
 
     def _validate_aggregation(self, aggregation_config):
+        """Check an aggregation config, deferring the checks that query the
+        database
+
+        Returns: (list) The database checks, as callables
+        """
         logging.info("Validating aggregation config %s", aggregation_config)
         self._validate_keys(aggregation_config)
         self._validate_aggregates(aggregation_config)
         self._validate_categoricals(aggregation_config.get("categoricals", []))
-        self._validate_from_obj(aggregation_config["from_obj"])
         self._validate_time_intervals(aggregation_config["intervals"])
         self._validate_groups(aggregation_config["groups"])
         self._validate_imputations(aggregation_config)
+        probes = [partial(self._validate_from_obj, aggregation_config["from_obj"])]
+        for categorical in aggregation_config.get("categoricals", []):
+            if "choice_query" in categorical:
+                probes.append(
+                    partial(self._validate_choice_query, categorical["choice_query"])
+                )
+        return probes
 
     def _run(self, feature_aggregation_config):
         """Validate a feature aggregation config applied to this object
@@ -375,8 +426,12 @@ class FeatureAggregationsValidator(Validator):
             Section not found. You must define feature aggregations."""
                 )
             )
+        probes = {}
         for aggregation in feature_aggregation_config:
-            self._validate_aggregation(aggregation)
+            for probe in self._validate_aggregation(aggregation):
+                # aggregations often share their from_obj and choice queries
+                probes.setdefault((probe.func.__name__, probe.args), probe)
+        self._run_probes(list(probes.values()))
 
 
 class LabelConfigValidator(Validator):
@@ -402,10 +457,10 @@ class LabelConfigValidator(Validator):
         bound_query = query.replace("{as_of_date}", "2016-01-01").replace(
             "{label_timespan}", "6month"
         )
-        conn = self.db_engine.connect()
         logging.info("Validating label query via EXPLAIN")
         try:
-            conn.execute("explain {}".format(bound_query))
+            with self.db_engine.connect() as conn:
+                conn.execute("explain {}".format(bound_query))
         except Exception as e:
             raise ValueError(
                 dedent(
@@ -502,11 +557,35 @@ class CohortConfigValidator(Validator):
                     )
                 )
             dense_state_table = state_config["table_name"]
-            table_should_have_data(dense_state_table, self.db_engine)
-            column_should_be_intlike(dense_state_table, "entity_id", self.db_engine)
-            column_should_be_stringlike(dense_state_table, "state", self.db_engine)
-            column_should_be_timelike(dense_state_table, "start_time", self.db_engine)
-            column_should_be_timelike(dense_state_table, "end_time", self.db_engine)
+            self._run_probes(
+                [
+                    partial(table_should_have_data, dense_state_table, self.db_engine),
+                    partial(
+                        column_should_be_intlike,
+                        dense_state_table,
+                        "entity_id",
+                        self.db_engine,
+                    ),
+                    partial(
+                        column_should_be_stringlike,
+                        dense_state_table,
+                        "state",
+                        self.db_engine,
+                    ),
+                    partial(
+                        column_should_be_timelike,
+                        dense_state_table,
+                        "start_time",
+                        self.db_engine,
+                    ),
+                    partial(
+                        column_should_be_timelike,
+                        dense_state_table,
+                        "end_time",
+                        self.db_engine,
+                    ),
+                ]
+            )
             if (
                 "state_filters" not in state_config
                 or len(state_config["state_filters"]) < 1
@@ -535,10 +614,10 @@ class CohortConfigValidator(Validator):
                     )
                 )
             dated_query = query.replace("{as_of_date}", "2016-01-01")
-            conn = self.db_engine.connect()
             logging.info("Validating cohort query")
             try:
-                conn.execute(f"explain {dated_query}")
+                with self.db_engine.connect() as conn:
+                    conn.execute(f"explain {dated_query}")
             except Exception as e:
                 raise ValueError(
                     dedent(
@@ -815,40 +894,181 @@ class ScoringConfigValidator(Validator):
                         )
 
 
+class ValidationCache(object):
+    def __init__(self, db_engine):
+        """Remembers the config sections that passed validation, so that
+        validating them again (such as when running an experiment that was just
+        validated) can be skipped
+
+        Sections are keyed by a hash of their contents and the triage version.
+        Changes to the database since a section was validated are not detected,
+        so the cache can be bypassed with ExperimentValidator(cache=False).
+
+        Args:
+            db_engine (sqlalchemy.engine)
+        """
+        self.db_engine = db_engine
+        self._enabled = None
+
+    @property
+    def enabled(self):
+        """Whether the cache table is available (the results schema may not
+        have been created)"""
+        if self._enabled is None:
+            self._enabled = self.db_engine is not None and table_exists(
+                VALIDATION_CACHE_TABLE, self.db_engine
+            )
+        return self._enabled
+
+    @staticmethod
+    def section_hash(section, *args):
+        """A hash of a config section's name and the values it is validated
+        with"""
+        serialized = json.dumps([__version__, section, args], sort_keys=True, default=str)
+        return hashlib.md5(serialized.encode("utf-8")).hexdigest()
+
+    def validated(self, section_hashes):
+        """The given section hashes that passed validation before"""
+        if not self.enabled or not section_hashes:
+            return set()
+        return set(
+            row[0]
+            for row in self.db_engine.execute(
+                text(
+                    "select section_hash from {} where section_hash in :hashes".format(
+                        VALIDATION_CACHE_TABLE
+                    )
+                ),
+                hashes=tuple(section_hashes),
+            )
+        )
+
+    def record(self, section, section_hash):
+        """Remember that a config section passed validation"""
+        if not self.enabled:
+            return
+        with self.db_engine.begin() as conn:
+            conn.execute(
+                text(
+                    "insert into {} (section_hash, section) values "
+                    "(:section_hash, :section) on conflict (section_hash) do update "
+                    "set validation_time = now()".format(VALIDATION_CACHE_TABLE)
+                ),
+                section_hash=section_hash,
+                section=section,
+            )
+
+
 class ExperimentValidator(Validator):
+    def __init__(self, db_engine=None, strict=True, n_db_threads=4, cache=True):
+        """Validates every section of an experiment config
+
+        Sections are validated concurrently, as are the database checks within
+        them. Sections that passed validation before, with the same contents,
+        are skipped.
+
+        Args:
+            db_engine (sqlalchemy.engine)
+            strict (boolean, optional) Whether to raise the first validation
+                error found, rather than log all of them as warnings
+            n_db_threads (int, optional) The most validations (and database
+                checks within them) to run at once
+            cache (boolean, optional) Whether to skip sections that passed
+                validation before
+        """
+        super().__init__(db_engine, strict=strict, n_db_threads=n_db_threads)
+        self.cache = ValidationCache(db_engine) if cache else None
+
+    def _sections(self, experiment_config):
+        """The validator of each config section, with the values it is run
+        with"""
+        feature_aggregations = experiment_config.get("feature_aggregations", {})
+        user_metadata = experiment_config.get("user_metadata", {})
+        db_kwargs = dict(strict=self.strict, n_db_threads=self.n_db_threads)
+        return [
+            (
+                "temporal_config",
+                TemporalValidator(strict=self.strict),
+                (experiment_config.get("temporal_config", {}),),
+            ),
+            (
+                "feature_aggregations",
+                FeatureAggregationsValidator(self.db_engine, **db_kwargs),
+                (feature_aggregations,),
+            ),
+            (
+                "label_config",
+                LabelConfigValidator(self.db_engine, **db_kwargs),
+                (experiment_config.get("label_config", None),),
+            ),
+            (
+                "cohort_config",
+                CohortConfigValidator(self.db_engine, **db_kwargs),
+                (experiment_config.get("cohort_config", {}),),
+            ),
+            (
+                "feature_group_definition",
+                FeatureGroupDefinitionValidator(strict=self.strict),
+                (
+                    experiment_config.get("feature_group_definition", {}),
+                    feature_aggregations,
+                ),
+            ),
+            (
+                "feature_group_strategies",
+                FeatureGroupStrategyValidator(strict=self.strict),
+                (experiment_config.get("feature_group_strategies", []),),
+            ),
+            (
+                "user_metadata",
+                UserMetadataValidator(strict=self.strict),
+                (user_metadata,),
+            ),
+            (
+                "model_group_keys",
+                ModelGroupKeysValidator(strict=self.strict),
+                (experiment_config.get("model_group_keys", []), user_metadata),
+            ),
+            (
+                "grid_config",
+                GridConfigValidator(strict=self.strict),
+                (experiment_config.get("grid_config", {}),),
+            ),
+            (
+                "scoring",
+                ScoringConfigValidator(strict=self.strict),
+                (experiment_config.get("scoring", {}),),
+            ),
+        ]
+
     def run(self, experiment_config):
-        TemporalValidator(strict=self.strict).run(
-            experiment_config.get("temporal_config", {})
-        )
-        FeatureAggregationsValidator(self.db_engine, strict=self.strict).run(
-            experiment_config.get("feature_aggregations", {})
-        )
-        LabelConfigValidator(self.db_engine, strict=self.strict).run(
-            experiment_config.get("label_config", None)
-        )
-        CohortConfigValidator(self.db_engine, strict=self.strict).run(
-            experiment_config.get("cohort_config", {})
-        )
-        FeatureGroupDefinitionValidator(strict=self.strict).run(
-            experiment_config.get("feature_group_definition", {}),
-            experiment_config.get("feature_aggregations", {}),
-        )
-        FeatureGroupStrategyValidator(strict=self.strict).run(
-            experiment_config.get("feature_group_strategies", [])
-        )
-        UserMetadataValidator(strict=self.strict).run(
-            experiment_config.get("user_metadata", {})
-        )
-        ModelGroupKeysValidator(strict=self.strict).run(
-            experiment_config.get("model_group_keys", []),
-            experiment_config.get("user_metadata", {}),
-        )
-        GridConfigValidator(strict=self.strict).run(
-            experiment_config.get("grid_config", {})
-        )
-        ScoringConfigValidator(strict=self.strict).run(
-            experiment_config.get("scoring", {})
-        )
+        sections = [
+            (name, validator, args, ValidationCache.section_hash(name, *args))
+            for name, validator, args in self._sections(experiment_config)
+        ]
+        validated = set()
+        if self.cache is not None:
+            validated = self.cache.validated([section[3] for section in sections])
+        for name, _, _, section_hash in sections:
+            if section_hash in validated:
+                logging.info("Section %s validated before, skipping", name)
+        pending = [section for section in sections if section[3] not in validated]
+
+        def validate(section):
+            name, validator, args, section_hash = section
+            try:
+                passed = validator.run(*args)
+            except ValueError as e:
+                return e
+            if passed and self.cache is not None:
+                self.cache.record(name, section_hash)
+
+        # the first error, in config order, is raised once all sections are done
+        for error in run_concurrently(
+            [partial(validate, section) for section in pending], self.n_db_threads
+        ):
+            if error is not None:
+                raise error
 
         # show the success message in the console as well as the logger
         # as we don't really know how they have configured logging
@@ -0,0 +1,305 @@
+"""Read query results with COPY ... TO STDOUT (FORMAT binary) into numpy arrays
+
+In Postgres' binary COPY format each row starts with its number of fields, and
+each field with its length in bytes (-1 for NULL) followed by its value in
+network byte order. Rows of fixed-width values, none of them NULL, are therefore
+all laid out the same way, so they can be decoded in bulk with a numpy
+structured dtype rather than value by value. To get such rows, the query is
+wrapped to select each column as a value that is never NULL, followed by a flag
+for whether it was. Rows are decoded in chunks as the COPY streams in, into
+typed arrays allocated up front when the number of rows is known.
+
+Queries returning columns of variable-width types (such as text) can not be
+read this way, and read_sql() reads them with pandas instead.
+"""
+import logging
+import struct
+
+import numpy
+import pandas
+
+SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+TRAILER = b"\xff\xff"
+
+# how many bytes of rows are buffered before they are decoded
+DECODE_BUFFER_BYTES = 1 << 20
+
+# the types decoded, by oid: the binary format of their values, the value
+# selected in place of NULL (untyped, so it takes the type of the column), and
+# the dtype they are decoded to
+BOOL, INT8, INT2, INT4 = 16, 20, 21, 23
+FLOAT4, FLOAT8, DATE, TIMESTAMP, NUMERIC = 700, 701, 1082, 1114, 1700
+FIXED_WIDTH_TYPES = {
+    BOOL: ("u1", "false", "bool"),
+    INT8: (">i8", "'0'", "int64"),
+    INT2: (">i2", "'0'", "int16"),
+    INT4: (">i4", "'0'", "int32"),
+    FLOAT4: (">f4", "'0'", "float32"),
+    FLOAT8: (">f8", "'0'", "float64"),
+    # days since 2000-01-01
+    DATE: (">i4", "'2000-01-01'", "datetime64[ns]"),
+    # microseconds since 2000-01-01
+    TIMESTAMP: (">i8", "'2000-01-01'", "datetime64[ns]"),
+}
+# types cast to a decoded type before they are copied
+CAST_TYPES = {NUMERIC: ("float8", FLOAT8)}
+
+EPOCHS = {
+    DATE: (numpy.datetime64("2000-01-01", "D"), "timedelta64[D]"),
+    TIMESTAMP: (numpy.datetime64("2000-01-01", "us"), "timedelta64[us]"),
+}
+
+
+class UnsupportedColumnTypes(ValueError):
+    """Raised for queries returning columns that can not be decoded"""
+
+
+def _strip(query):
+    return query.strip().rstrip(";")
+
+
+def describe(cursor, query):
+    """The names and type oids of the columns a query returns
+
+    Args:
+        cursor (DBAPI cursor)
+        query (string) A SELECT query
+
+    Returns: (list) of (name, type oid) tuples
+    """
+    cursor.execute("SELECT * FROM ({}) q LIMIT 0".format(_strip(query)))
+    return [(column[0], column[1]) for column in cursor.description]
+
+
+def _copy_query(query, type_oids):
+    """Wrap a query to select each column as a never-NULL value of a decoded
+    type, followed by whether it was NULL"""
+    aliases = ["c{}".format(i) for i in range(len(type_oids))]
+    selections = []
+    for alias, type_oid in zip(aliases, type_oids):
+        if type_oid in CAST_TYPES:
+            cast, type_oid = CAST_TYPES[type_oid]
+            column = "q.{}::{}".format(alias, cast)
+        else:
+            column = "q.{}".format(alias)
+        selections.append(
+            "coalesce({}, {}), q.{} IS NULL".format(
+                column, FIXED_WIDTH_TYPES[type_oid][1], alias
+            )
+        )
+    return "COPY (SELECT {} FROM ({}) q({})) TO STDOUT WITH (FORMAT binary)".format(
+        ", ".join(selections), _strip(query), ", ".join(aliases)
+    )
+
+
+class RowDecoder(object):
+    def __init__(self, type_oids, n_rows=None):
+        """Decodes the rows of a binary COPY of a query wrapped by
+        _copy_query(), written to it as by a file
+
+        Args:
+            type_oids (list) The type oid of each column, after any casts
+            n_rows (int, optional) The number of rows, if known, to allocate
+                the arrays for up front
+        """
+        self.type_oids = type_oids
+        self.n_rows = n_rows
+        fields = [("field_count", ">i2")]
+        for i, type_oid in enumerate(type_oids):
+            fields += [
+                ("length{}".format(i), ">i4"),
+                ("value{}".format(i), FIXED_WIDTH_TYPES[type_oid][0]),
+                ("null_length{}".format(i), ">i4"),
+                ("null{}".format(i), "u1"),
+            ]
+        self.row_dtype = numpy.dtype(fields)
+        self.buffer = bytearray()
+        self.header_read = False
+        self.rows_decoded = 0
+        if n_rows is None:
+            self.value_chunks = [[] for _ in type_oids]
+            self.null_chunks = [[] for _ in type_oids]
+        else:
+            self.values = [
+                numpy.empty(n_rows, dtype=FIXED_WIDTH_TYPES[type_oid][2])
+                for type_oid in type_oids
+            ]
+            self.nulls = [numpy.empty(n_rows, dtype=bool) for _ in type_oids]
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= DECODE_BUFFER_BYTES:
+            self._decode()
+
+    def _read_header(self):
+        if len(self.buffer) < 19:
+            return False
+        if bytes(self.buffer[:11]) != SIGNATURE:
+            raise ValueError("Not a binary COPY")
+        (extension_length,) = struct.unpack(">i", self.buffer[15:19])
+        if len(self.buffer) < 19 + extension_length:
+            return False
+        del self.buffer[: 19 + extension_length]
+        self.header_read = True
+        return True
+
+    def _decode_values(self, rows, i):
+        values = rows["value{}".format(i)]
+        type_oid = self.type_oids[i]
+        if type_oid in EPOCHS:
+            epoch, unit = EPOCHS[type_oid]
+            return epoch + values.astype(unit)
+        return values
+
+    def _decode(self, final=False):
+        if not self.header_read and not self._read_header():
+            return
+        available = len(self.buffer) - (len(TRAILER) if final else 0)
+        n = available // self.row_dtype.itemsize
+        if n:
+            self._store(numpy.frombuffer(self.buffer, dtype=self.row_dtype, count=n))
+            # nothing refers to the decoded rows any more, so the buffer can
+            # be resized
+            del self.buffer[: n * self.row_dtype.itemsize]
+            self.rows_decoded += n
+
+    def _store(self, rows):
+        """Copy the values and null flags of decoded rows into the arrays"""
+        if (rows["field_count"] != 2 * len(self.type_oids)).any():
+            raise ValueError("Unexpected number of fields in binary COPY rows")
+        start, end = self.rows_decoded, self.rows_decoded + len(rows)
+        if self.n_rows is not None and end > self.n_rows:
+            raise ValueError(
+                "More than the expected {} rows copied".format(self.n_rows)
+            )
+        for i, type_oid in enumerate(self.type_oids):
+            width = rows.dtype["value{}".format(i)].itemsize
+            if (rows["length{}".format(i)] != width).any():
+                raise ValueError("Unexpected field length in binary COPY rows")
+            values = self._decode_values(rows, i)
+            nulls = rows["null{}".format(i)].astype(bool)
+            if self.n_rows is None:
+                self.value_chunks[i].append(
+                    values.astype(FIXED_WIDTH_TYPES[type_oid][2])
+                )
+                self.null_chunks[i].append(nulls)
+            else:
+                self.values[i][start:end] = values
+                self.nulls[i][start:end] = nulls
+
+    def finish(self):
+        """Decode the rest of the rows, once the COPY is done
+
+        Returns: (list) an array of the values of each column, with NaN (or
+            NaT) for NULL. Integer and boolean columns with NULLs are
+            converted to floats
+        """
+        self._decode(final=True)
+        if bytes(self.buffer) != TRAILER:
+            raise ValueError("Binary COPY ended unexpectedly")
+        if self.n_rows is None:
+            values = [
+                numpy.concatenate(chunks)
+                if chunks
+                else numpy.empty(0, dtype=FIXED_WIDTH_TYPES[type_oid][2])
+                for chunks, type_oid in zip(self.value_chunks, self.type_oids)
+            ]
+            nulls = [
+                numpy.concatenate(chunks) if chunks else numpy.empty(0, dtype=bool)
+                for chunks in self.null_chunks
+            ]
+        else:
+            if self.rows_decoded != self.n_rows:
+                raise ValueError(
+                    "{} rows copied, not the expected {}".format(
+                        self.rows_decoded, self.n_rows
+                    )
+                )
+            values, nulls = self.values, self.nulls
+        columns = []
+        for column, column_nulls in zip(values, nulls):
+            if column_nulls.any():
+                if column.dtype.kind == "M":
+                    column[column_nulls] = numpy.datetime64("NaT")
+                else:
+                    if column.dtype.kind != "f":
+                        column = column.astype(numpy.float64)
+                    column[column_nulls] = numpy.nan
+            columns.append(column)
+        return columns
+
+
+def copy_to_arrays(db_engine, query, n_rows=None, params=None):
+    """Run a query, decoding its results from a binary COPY into arrays
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        query (string) A SELECT query
+        params (dict or tuple, optional) Parameters to bind to the query, in
+            the psycopg2 paramstyle
+        n_rows (int, optional) The number of rows the query returns, if known,
+            so that arrays of that size can be allocated up front
+
+    Returns: (list) of (name, numpy.ndarray) tuples for each column
+
+    Raises: (UnsupportedColumnTypes) if any column is not of a numeric, boolean,
+        date or timestamp type
+    """
+    conn = db_engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        if params is not None:
+            query = cursor.mogrify(query, params).decode("utf-8")
+        columns = describe(cursor, query)
+        type_oids = [CAST_TYPES.get(oid, (None, oid))[1] for _, oid in columns]
+        unsupported = [
+            name
+            for (name, _), type_oid in zip(columns, type_oids)
+            if type_oid not in FIXED_WIDTH_TYPES
+        ]
+        if unsupported:
+            raise UnsupportedColumnTypes(
+                "Columns {} can not be decoded from a binary COPY".format(unsupported)
+            )
+        decoder = RowDecoder(type_oids, n_rows)
+        cursor.copy_expert(_copy_query(query, [oid for _, oid in columns]), decoder)
+        arrays = decoder.finish()
+        conn.rollback()
+    finally:
+        conn.close()
+    return [(name, array) for (name, _), array in zip(columns, arrays)]
+
+
+def copy_to_df(db_engine, query, n_rows=None, params=None):
+    """Run a query, decoding its results from a binary COPY into a DataFrame
+    (see copy_to_arrays())"""
+    arrays = copy_to_arrays(db_engine, query, n_rows, params)
+    df = pandas.DataFrame({i: array for i, (_, array) in enumerate(arrays)})
+    df.columns = [name for name, _ in arrays]
+    return df
+
+
+def read_sql(query, con, index_col=None, params=None):
+    """Read the results of a query into a DataFrame, from a binary COPY if
+    they can be decoded (see copy_to_arrays()) and with pandas.read_sql
+    otherwise
+
+    Args:
+        query (string) A SELECT query
+        con (sqlalchemy.engine) The database, or any connection
+            pandas.read_sql takes, which is read with it
+        index_col (string or list, optional) Columns to set as the index
+        params (dict or tuple, optional) Parameters to bind to the query
+
+    Returns: (pandas.DataFrame)
+    """
+    if not hasattr(con, "raw_connection"):
+        return pandas.read_sql(query, con, index_col=index_col, params=params)
+    try:
+        df = copy_to_df(con, query, params=params)
+    except UnsupportedColumnTypes as e:
+        logging.debug("Reading query results with pandas: %s", e)
+        return pandas.read_sql(query, con, index_col=index_col, params=params)
+    if index_col is not None:
+        df = df.set_index(index_col)
+    return df
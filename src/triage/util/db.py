@@ -1,5 +1,7 @@
 # coding: utf-8
 
+import logging
+
 import sqlalchemy
 import wrapt
 
@@ -9,24 +11,161 @@ class SerializableDbEngine(wrapt.ObjectProxy):
 
     Works by saving all kwargs used to create the engine and reconstructs them later.
     As a result, the state won't be saved upon serialization/deserialization.
+
+    Read-only workloads can be routed to read replicas with for_reads(), while
+    the engine itself always connects to the primary.
+
+    Args:
+        url (string or sqlalchemy.engine.url.URL) The primary database
+        creator (callable, optional) Creates the underlying engines
+        replica_urls (list, optional) Read replicas of the primary, in order
+            of preference
+        max_replica_lag (float, optional) The most seconds a replica may be
+            behind the primary to be read from
     """
 
-    __slots__ = ("url", "creator", "kwargs")
+    __slots__ = (
+        "url",
+        "creator",
+        "kwargs",
+        "replica_urls",
+        "max_replica_lag",
+        "_replicas",
+    )
 
-    def __init__(self, url, *, creator=sqlalchemy.create_engine, **kwargs):
+    def __init__(
+        self,
+        url,
+        *,
+        creator=sqlalchemy.create_engine,
+        replica_urls=(),
+        max_replica_lag=60,
+        **kwargs
+    ):
         self.url = url
         self.creator = creator
         self.kwargs = kwargs
+        self.replica_urls = list(replica_urls)
+        self.max_replica_lag = max_replica_lag
+        self._replicas = None
 
         engine = creator(url, **kwargs)
         super().__init__(engine)
 
     def __reduce__(self):
-        return (self.__reconstruct__, (self.url, self.creator, self.kwargs))
+        return (
+            self.__reconstruct__,
+            (
+                self.url,
+                self.creator,
+                dict(
+                    self.kwargs,
+                    replica_urls=self.replica_urls,
+                    max_replica_lag=self.max_replica_lag,
+                ),
+            ),
+        )
 
     @classmethod
     def __reconstruct__(cls, url, creator, kwargs):
         return cls(url, creator=creator, **kwargs)
 
+    @property
+    def replicas(self):
+        """Engines connecting to each of the read replicas"""
+        if self._replicas is None:
+            self._replicas = [
+                SerializableDbEngine(url, creator=self.creator, **self.kwargs)
+                for url in self.replica_urls
+            ]
+        return self._replicas
+
+    def _replica_lag(self, replica, primary_lsn=None):
+        """How many seconds a replica is behind the primary
+
+        A replica that is not a streaming standby (such as a copy of the
+        database, or a logical replica) has no measurable lag. It is taken to be
+        current, unless it must have replayed primary_lsn, which can't be
+        checked on it.
+
+        Args:
+            replica (SerializableDbEngine)
+            primary_lsn (string, optional) A WAL position of the primary the
+                replica must have replayed to be current
+
+        Returns: (float) the lag, infinite if the replica has not yet replayed
+            primary_lsn
+        """
+        with replica.connect() as conn:
+            in_recovery, lag, caught_up = conn.execute(
+                sqlalchemy.text(
+                    """select pg_is_in_recovery(),
+                    case when pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                        then 0
+                        else extract(epoch from now() - pg_last_xact_replay_timestamp())
+                    end,
+                    pg_last_wal_replay_lsn() >= cast(:primary_lsn as pg_lsn)"""
+                ),
+                primary_lsn=primary_lsn,
+            ).first()
+        if not in_recovery:
+            return 0 if primary_lsn is None else float("inf")
+        if primary_lsn is not None and not caught_up:
+            return float("inf")
+        return lag or 0
+
+    def for_reads(self, after_writes=False):
+        """The engine to run a read-only workload on
+
+        Picks the first replica that can be reached and is no more than
+        max_replica_lag seconds behind, falling back to the primary.
+
+        Args:
+            after_writes (boolean, optional) Whether the workload reads what was
+                just written to the primary, in which case replicas must have
+                replayed everything written so far
+
+        Returns: (SerializableDbEngine) a replica, or this engine
+        """
+        if not self.replica_urls:
+            return self
+        primary_lsn = None
+        if after_writes:
+            primary_lsn = self.execute("select pg_current_wal_lsn()::text").scalar()
+        for replica in self.replicas:
+            try:
+                lag = self._replica_lag(replica, primary_lsn)
+            except sqlalchemy.exc.SQLAlchemyError:
+                logging.warning(
+                    "Read replica %s could not be reached", repr(replica.engine.url)
+                )
+                continue
+            if lag <= self.max_replica_lag:
+                return replica
+            logging.warning(
+                "Read replica %s is %s seconds behind, not reading from it",
+                repr(replica.engine.url),
+                lag,
+            )
+        logging.info("No read replica is available, reading from the primary")
+        return self
+
 
 create_engine = SerializableDbEngine
+
+
+def read_engine(db_engine, after_writes=False):
+    """The engine to run a read-only workload on: a read replica if one is
+    configured and current (see SerializableDbEngine.for_reads()), otherwise the
+    given engine
+
+    Args:
+        db_engine (SerializableDbEngine or sqlalchemy.engine.Engine)
+        after_writes (boolean, optional) Whether the workload reads what was
+            just written
+
+    Returns: (sqlalchemy.engine.Engine)
+    """
+    if isinstance(db_engine, SerializableDbEngine):
+        return db_engine.for_reads(after_writes=after_writes)
+    return db_engine